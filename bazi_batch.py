@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""
+批量八字排盘 - 处理合作方上传的出生记录（CSV 或 NDJSON）
+"""
+
+import argparse
+import json
+import sys
+import time
+
+from src.core.bazi_batch import DEFAULT_CHUNK_SIZE, DEFAULT_LLM_CONCURRENCY, engine_interpreter, run_batch_file
+
+
+def main():
+    parser = argparse.ArgumentParser(description='批量八字排盘（支持断点续跑）')
+    parser.add_argument('input', type=str, help='输入文件: .csv（带表头）或 .ndjson')
+    parser.add_argument('output', type=str, help='输出 NDJSON 文件')
+    parser.add_argument('--workers', type=int, default=None, help='进程数，默认为CPU核数')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='每批记录数')
+    parser.add_argument('--interpret', action='store_true', help='调用大模型生成命理解读')
+    parser.add_argument('--llm-concurrency', type=int, default=DEFAULT_LLM_CONCURRENCY, help='大模型并发数')
+    
+    args = parser.parse_args()
+    
+    interpret = None
+    if args.interpret:
+        from src.core.independent_qji_cnlunar import IndependentQjiCnlunarEngine
+        interpret = engine_interpreter(IndependentQjiCnlunarEngine())
+    
+    start = time.time()
+    try:
+        result = run_batch_file(args.input, args.output, args.workers, args.chunk_size, interpret,
+                                args.llm_concurrency,
+                                progress=lambda done: print(f"已完成 {done} 条", file=sys.stderr))
+    except (OSError, ValueError) as e:
+        print(json.dumps({"error": str(e)}, ensure_ascii=False))
+        sys.exit(1)
+    
+    result['seconds'] = round(time.time() - start, 2)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+if __name__ == '__main__':
+    main()
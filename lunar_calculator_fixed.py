@@ -11,7 +11,7 @@ from typing import Dict, Any, Optional
 
 try:
     from lunardate import LunarDate
-    from cnlunar import Lunar
+    from src.core.calendar_table import get_calendar_table
 except ImportError:
     print("错误：请先安装依赖库：pip install lunardate cnlunar")
     sys.exit(1)
@@ -75,27 +75,23 @@ class LunarCalculator:
     def solar_to_lunar(self, solar_date: str) -> Dict[str, Any]:
         """公历转农历"""
         try:
-            year, month, day = map(int, solar_date.split('-'))
-            
-            # 使用lunardate库进行转换
-            lunar_date = LunarDate.fromSolarDate(year, month, day)
-            
-            # 使用cnlunar获取更详细信息 - 需要完整日期时间
-            dt = datetime(year, month, day)
-            lunar_info = Lunar(dt)
+            # 预计算日历表，一次下标运算即可完成查询
+            info = get_calendar_table().lookup(solar_date)
+            if not info["lunar_year"]:
+                return {"error": f"日期转换失败: {solar_date} 超出农历数据范围"}
             
             result = {
                 "solar_date": solar_date,
-                "lunar_year": lunar_date.year,
-                "lunar_month": lunar_date.month,
-                "lunar_day": lunar_date.day,
-                "is_leap": lunar_date.isLeap,
-                "lunar_month_name": self.get_lunar_month_name(lunar_date.month, lunar_date.isLeap),
-                "lunar_day_name": self.get_lunar_day_name(lunar_date.day),
-                "ganzhi_year": self.get_ganzhi_year(lunar_date.year),
-                "zodiac": self.get_zodiac(lunar_date.year),
-                "festival": self.get_festival(lunar_date.month, lunar_date.day),
-                "lunar_full": str(lunar_info)
+                "lunar_year": info["lunar_year"],
+                "lunar_month": info["lunar_month"],
+                "lunar_day": info["lunar_day"],
+                "is_leap": info["is_leap"],
+                "lunar_month_name": info["lunar_month_name"],
+                "lunar_day_name": info["lunar_day_name"],
+                "ganzhi_year": info["ganzhi_year"],
+                "zodiac": info["zodiac"],
+                "festival": info["festival"],
+                "lunar_full": f"{info['ganzhi_year']}年{info['lunar_month_name']}{info['lunar_day_name']}"
             }
             
             return result
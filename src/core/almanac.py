@@ -0,0 +1,296 @@
+"""
+Qianji Almanac (黄历)
+
+Per-day 黄历 facts without asking the model:
+
+- 建除十二神 and the day's 黄道/黑道 god;
+- 宜/忌 lists and the day's grade (上/上次/中/中次/下/下下) by the
+  协纪辨方书 rules;
+- hour-level 吉凶 for the twelve 时辰;
+- 冲煞 and 彭祖百忌 from fixed tables on the day pillar.
+
+The rule-based fields are evaluated once per day for the whole 1901-2100
+range (with cnlunar's implementation of the 协纪辨方书 tables) and stored as
+fixed-width records in a memory-mapped file next to the calendar table:
+宜 and 忌 are bitmasks over a vocabulary kept at the end of the file, the
+hour 吉凶 a 12-bit mask. A lookup is one struct unpack and a few table
+reads, memoized per day.
+
+Build it before starting the server (about half a minute):
+    python -m src.core.almanac --build
+Almanac does not build a missing file itself, since the first request would
+hold every almanac lookup for that long; it raises FileNotFoundError instead.
+"""
+import argparse
+import json
+import mmap
+import os
+import struct
+import tempfile
+import threading
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+from src.core.bazi_pillars import TIAN_GAN, DI_ZHI, JIA_ZI, ganzhi_index
+from src.core.calendar_table import ZODIAC, get_calendar_table
+
+DEFAULT_ALMANAC_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(__file__)), "data", "almanac_1901_2100.bin"
+)
+
+OFFICERS = ["建", "除", "满", "平", "定", "执", "破", "危", "成", "收", "开", "闭"]
+DAY_GODS = ["青龙", "明堂", "天刑", "朱雀", "金匮", "天德", "白虎", "玉堂", "天牢", "玄武", "司命", "勾陈"]
+# 黄道 gods; the other six are 黑道
+YELLOW_PATH_GODS = {"青龙", "明堂", "金匮", "天德", "玉堂", "司命"}
+# Grade 0-5 of the day by its 吉神/凶神
+DAY_LEVELS = ["上", "上次", "中", "中次", "下", "下下"]
+
+PENGZU_STEMS = ["甲不开仓 财物耗散", "乙不栽植 千株不长", "丙不修灶 必见灾殃", "丁不剃头 头必生疮",
+                "戊不受田 田主不祥", "己不破券 二比并亡", "庚不经络 织机虚张", "辛不合酱 主人不尝",
+                "壬不泱水 更难提防", "癸不词讼 理弱敌强"]
+PENGZU_BRANCHES = ["子不问卜 自惹祸殃", "丑不冠带 主不还乡", "寅不祭祀 神鬼不尝", "卯不穿井 水泉不香",
+                   "辰不哭泣 必主重丧", "巳不远行 财物伏藏", "午不苫盖 屋主更张", "未不服药 毒气入肠",
+                   "申不安床 鬼祟入房", "酉不会客 醉坐颠狂", "戌不吃犬 作怪上床", "亥不嫁娶 不利新郎"]
+
+# 煞方 by the day branch's 三合 group: 申子辰煞南, 巳酉丑煞东, 寅午戌煞北, 亥卯未煞西
+SHA_DIRECTIONS = ["南", "东", "北", "西"]
+
+HOUR_RANGES = ["23:00-00:59"] + [f"{h:02d}:00-{h + 1:02d}:59" for h in range(1, 23, 2)]
+
+ALMANAC_KEYWORDS = ("黄历", "宜忌", "冲煞", "吉时", "彭祖", "建除", "宜什么", "忌什么")
+
+# magic, version, ordinal of the first day, number of records, vocabulary bytes
+HEADER = struct.Struct("<6sHIII")
+MAGIC = b"QJALM\x00"
+VERSION = 1
+# level + 2 (1 = ungraded, 0 = no data), officer, day god, padding, hour 吉 mask, 宜 mask (2×64), 忌 mask (2×64)
+RECORD = struct.Struct("<BBBxHQQQQ")
+_MASK_BITS = 128
+
+
+def day_clash(day_pillar: str) -> Dict[str, str]:
+    """日冲 (天克地冲 pillar and zodiac) and 煞方 of a day pillar"""
+    stem, branch = TIAN_GAN.index(day_pillar[0]), DI_ZHI.index(day_pillar[1])
+    clash_branch = (branch + 6) % 12
+    return {
+        "clash_pillar": JIA_ZI[ganzhi_index((stem + 4) % 10, clash_branch)],
+        "clash_zodiac": ZODIAC[clash_branch],
+        "sha_direction": SHA_DIRECTIONS[branch % 4],
+    }
+
+
+def pengzu_taboos(day_pillar: str) -> List[str]:
+    """彭祖百忌 of the day stem and day branch"""
+    return [PENGZU_STEMS[TIAN_GAN.index(day_pillar[0])], PENGZU_BRANCHES[DI_ZHI.index(day_pillar[1])]]
+
+
+def hour_pillars(day_pillar: str) -> List[str]:
+    """The twelve 时辰 pillars of a day by 五鼠遁"""
+    first_stem = TIAN_GAN.index(day_pillar[0]) % 5 * 2
+    return [JIA_ZI[ganzhi_index((first_stem + h) % 10, h)] for h in range(12)]
+
+
+def _to_mask(items: List[str], vocabulary: Dict[str, int]) -> Tuple[int, int]:
+    mask = 0
+    for item in items:
+        if item not in vocabulary:
+            vocabulary[item] = len(vocabulary)
+            if len(vocabulary) > _MASK_BITS:
+                raise ValueError(f"宜忌词表超过{_MASK_BITS}项")
+        mask |= 1 << vocabulary[item]
+    return mask & (2 ** 64 - 1), mask >> 64
+
+
+def build_almanac_table(path: str = DEFAULT_ALMANAC_PATH, start: Optional[date] = None,
+                        end: Optional[date] = None) -> str:
+    """Evaluate the 协纪辨方书 rules for every day and write the table; returns the path"""
+    from cnlunar import Lunar
+    from src.core.bazi_pillars import MIN_YEAR, MAX_YEAR
+
+    start = start or date(MIN_YEAR, 1, 1)
+    end = end or date(MAX_YEAR, 12, 31)
+    count = (end - start).days + 1
+    vocabulary: Dict[str, int] = {}
+    records = bytearray(RECORD.size * count)
+    for i in range(count):
+        day = start + timedelta(days=i)
+        try:
+            lunar = Lunar(datetime(day.year, day.month, day.day, 12))
+            officer, god, _ = lunar.get_today12DayOfficer()
+            luck = lunar.get_twohourLuckyList()[:12]
+            good, bad = lunar.goodThing, lunar.badThing
+            level = lunar.todayLevel
+        except IndexError:
+            # Past the end of cnlunar's lunar data (after the 2100 lunar new year)
+            continue
+        hour_mask = sum(1 << h for h, mark in enumerate(luck) if mark == "吉")
+        RECORD.pack_into(records, i * RECORD.size, level + 2 if level >= 0 else 1,
+                         OFFICERS.index(officer), DAY_GODS.index(god.replace("金贵", "金匮")),
+                         hour_mask, *_to_mask(good, vocabulary), *_to_mask(bad, vocabulary))
+
+    vocabulary_bytes = json.dumps(list(vocabulary), ensure_ascii=False).encode("utf-8")
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    # A unique name, so workers building at the same time never share a file
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path) + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(HEADER.pack(MAGIC, VERSION, start.toordinal(), count, len(vocabulary_bytes)))
+            f.write(records)
+            f.write(vocabulary_bytes)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return path
+
+
+class Almanac:
+    """Memory-mapped per-day 黄历 lookup"""
+
+    def __init__(self, path: str = DEFAULT_ALMANAC_PATH, calendar_table=None):
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"黄历数据文件不存在: {path}，请先运行 python -m src.core.almanac --build")
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.first_ordinal, self.count, vocabulary_size = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"黄历数据文件格式不正确: {path}")
+        offset = HEADER.size + self.count * RECORD.size
+        self.vocabulary = json.loads(self._map[offset:offset + vocabulary_size].decode("utf-8"))
+        self.calendar_table = calendar_table or get_calendar_table()
+        self._lookup = lru_cache(maxsize=1024)(self._lookup_ordinal)
+
+    def _things(self, low: int, high: int) -> List[str]:
+        mask = low | (high << 64)
+        return [item for i, item in enumerate(self.vocabulary) if mask >> i & 1]
+
+    def lookup(self, day) -> Dict[str, Any]:
+        """黄历 of a date, datetime or YYYY-MM-DD string. Shared, do not mutate"""
+        if isinstance(day, str):
+            day = date.fromisoformat(day)
+        elif isinstance(day, datetime):
+            day = day.date()
+        return self._lookup(day.toordinal())
+
+    def _lookup_ordinal(self, ordinal: int) -> Dict[str, Any]:
+        index = ordinal - self.first_ordinal
+        record = RECORD.unpack_from(self._map, HEADER.size + index * RECORD.size) \
+            if 0 <= index < self.count else None
+        if record is None or record[0] == 0:
+            raise ValueError(f"日期超出黄历范围: {date.fromordinal(ordinal)}")
+        level, officer, god, hour_mask, good_low, good_high, bad_low, bad_high = record
+
+        day = date.fromordinal(ordinal)
+        calendar = self.calendar_table.lookup(day)
+        day_pillar = calendar["ganzhi_day"]
+        lunar = None
+        if calendar["lunar_year"]:
+            lunar = f"{calendar['ganzhi_year']}年{calendar['lunar_month_name']}{calendar['lunar_day_name']}"
+        hours = [{
+            "branch": DI_ZHI[h],
+            "range": HOUR_RANGES[h],
+            "pillar": pillar,
+            "luck": "吉" if hour_mask >> h & 1 else "凶",
+        } for h, pillar in enumerate(hour_pillars(day_pillar))]
+        return {
+            "date": day.isoformat(),
+            "lunar": lunar,
+            "ganzhi_year": calendar["ganzhi_year"],
+            "ganzhi_month": calendar["ganzhi_month"],
+            "ganzhi_day": day_pillar,
+            "zodiac": calendar["zodiac"],
+            "solar_term": calendar["solar_term"],
+            "officer": OFFICERS[officer],
+            "day_god": DAY_GODS[god],
+            "day_kind": "黄道日" if DAY_GODS[god] in YELLOW_PATH_GODS else "黑道日",
+            "level": DAY_LEVELS[level - 2] if level >= 2 else None,
+            "yi": self._things(good_low, good_high),
+            "ji": self._things(bad_low, bad_high),
+            **day_clash(day_pillar),
+            "pengzu": pengzu_taboos(day_pillar),
+            "hours": hours,
+            "lucky_hours": [hour["branch"] for hour in hours if hour["luck"] == "吉"],
+        }
+
+    def close(self):
+        self._map.close()
+
+
+def is_almanac_query(message: str) -> bool:
+    return any(keyword in message for keyword in ALMANAC_KEYWORDS)
+
+
+def format_almanac(info: Dict[str, Any], max_items: int = 12) -> str:
+    """Render a day's 黄历 as a compact text block"""
+    def items(things):
+        shown = "、".join(things[:max_items])
+        return f"{shown}等{len(things)}项" if len(things) > max_items else (shown or "无")
+
+    lucky = "、".join(f"{h['branch']}时（{h['range']}）" for h in info["hours"] if h["luck"] == "吉")
+    lines = [
+        f"【{info['date']} 黄历】",
+        f"- 农历：{info['lunar'] or '超出农历范围'}，{info['ganzhi_year']}年 "
+        f"{info['ganzhi_month']}月 {info['ganzhi_day']}日",
+        f"- 建除：{info['officer']}日，值神{info['day_god']}（{info['day_kind']}）"
+        + (f"，等级{info['level']}" if info["level"] else ""),
+        f"- 宜：{items(info['yi'])}",
+        f"- 忌：{items(info['ji'])}",
+        f"- 冲煞：冲{info['clash_zodiac']}（{info['clash_pillar']}）煞{info['sha_direction']}",
+        f"- 彭祖百忌：{'，'.join(info['pengzu'])}",
+        f"- 吉时：{lucky or '无'}",
+    ]
+    return "\n".join(lines)
+
+
+def almanac_date_answer(message: str, now: Optional[datetime] = None) -> str:
+    """Date answer for the day the message refers to, followed by its 黄历"""
+    from src.core.date_context import get_date_context_provider, relative_day_offset
+
+    now = now or datetime.now()
+    answer = get_date_context_provider().answer(message, now)
+    try:
+        info = get_almanac().lookup(now.date() + timedelta(days=relative_day_offset(message)))
+    except FileNotFoundError as e:
+        print(f"黄历不可用: {e}")
+        return answer
+    except ValueError:
+        return answer
+    return f"{answer}\n\n{format_almanac(info)}"
+
+
+_almanac = None
+_almanac_lock = threading.Lock()
+
+
+def get_almanac() -> Almanac:
+    """Process-wide Almanac, mapped on first use; FileNotFoundError until the table is built"""
+    global _almanac
+    with _almanac_lock:
+        if _almanac is None:
+            _almanac = Almanac()
+    return _almanac
+
+
+def main():
+    parser = argparse.ArgumentParser(description='千机黄历数据构建与查询')
+    parser.add_argument('--build', action='store_true', help='重新生成黄历数据文件')
+    parser.add_argument('--path', type=str, default=DEFAULT_ALMANAC_PATH, help='黄历数据文件路径')
+    parser.add_argument('--date', type=str, help='查询公历日期: 2026-02-24')
+
+    args = parser.parse_args()
+
+    if args.build:
+        path = build_almanac_table(args.path)
+        print(f"✅ 黄历数据文件已生成: {path}")
+
+    if args.date:
+        print(format_almanac(Almanac(args.path).lookup(args.date)))
+
+    if not args.build and not args.date:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,283 @@
+"""
+Qianji Batch Bazi Computation
+
+Bulk chart computation for partner uploads: pillars (true solar time when
+the location is known), luck pillars and chart features for every record,
+without any LLM call unless asked for.
+
+- Records are processed in chunks; each chunk is one vectorized pass
+  through PillarCalculator, LuckCalculator and analyze_batch in a worker of
+  a ProcessPoolExecutor. Only a bounded number of chunks is in flight, so
+  memory stays flat for any input size and results come out in input
+  order.
+- Optional LLM interpretation goes through a bounded asyncio queue with a
+  fixed number of concurrent calls per chunk, and reuses the bazi response
+  cache via the engine's analyze_bazi. A failed call's apology
+  (APIErrorMessage) goes to row["error"], never to row["analysis"].
+- run_batch_file() writes NDJSON and a checkpoint after every chunk; a
+  restarted job truncates the output to the last checkpoint and skips the
+  rows already done.
+
+Record fields: id (optional), birth_date/birthDate (YYYY-MM-DD),
+birth_time/birthTime (HH:MM), gender, location (optional).
+"""
+import asyncio
+import csv
+import json
+import os
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from itertools import islice
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+import numpy as np
+
+from src.core.bazi_pillars import JIA_ZI
+from src.core.chart_analyzer import summarize_batch
+from src.core.independent_qwen import is_api_error
+from src.core.luck_pillars import luck_calculator
+from src.core.response_cache import normalize_gender
+from src.core.true_solar_time import true_solar_time
+
+DEFAULT_CHUNK_SIZE = 2000
+DEFAULT_LLM_CONCURRENCY = 4
+DEFAULT_LLM_QUEUE_SIZE = 16
+# Rows one /bazi/batch?interpret=1 request may send to the LLM
+MAX_INTERPRET_ROWS = 200
+CHECKPOINT_SUFFIX = ".checkpoint.json"
+
+
+def _field(record: Dict[str, Any], *names: str) -> Optional[str]:
+    for name in names:
+        value = record.get(name)
+        if value not in (None, ""):
+            return str(value).strip()
+    return None
+
+
+def _parse_record(record: Dict[str, Any]):
+    """(wall-clock datetime, is_male, location) or raise ValueError"""
+    birth_date = _field(record, "birth_date", "birthDate")
+    birth_time = _field(record, "birth_time", "birthTime") or "12:00"
+    gender = normalize_gender(_field(record, "gender") or "")
+    if not birth_date:
+        raise ValueError("缺少出生日期")
+    if gender not in ("男", "女"):
+        raise ValueError("性别需为男或女")
+    birth_datetime = datetime.strptime(f"{birth_date} {birth_time}", "%Y-%m-%d %H:%M")
+    return birth_datetime, gender == "男", _field(record, "location")
+
+
+def compute_chunk(records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Pillars, 大运 and chart features for a list of records.
+
+    Runs in a worker process. Bad records produce {"id", "error"} rows
+    instead of failing the chunk.
+    """
+    results: List[Optional[Dict[str, Any]]] = [None] * len(records)
+    valid, moments, is_male = [], [], []
+    for i, record in enumerate(records):
+        try:
+            birth_datetime, male, location = _parse_record(record)
+            solar = true_solar_time(birth_datetime, location) if location else None
+            results[i] = {"id": record.get("id"), "input": record}
+            if solar:
+                birth_datetime = solar["datetime"]
+                results[i]["solar_time"] = birth_datetime.strftime("%Y-%m-%d %H:%M")
+                results[i]["solar_correction"] = solar["correction_minutes"]
+            valid.append(i)
+            moments.append(np.datetime64(birth_datetime, "m"))
+            is_male.append(male)
+        except Exception as e:
+            results[i] = {"id": record.get("id"), "input": record, "error": str(e)}
+
+    if valid:
+        try:
+            luck = luck_calculator.compute(np.array(moments), np.array(is_male))
+        except ValueError as e:
+            # A date outside 1901-2100 somewhere in the chunk; fall back to one by one
+            if len(records) == 1:
+                results[valid[0]]["error"] = str(e)
+                return results
+            return [row for record in records for row in compute_chunk([record])]
+
+        features = summarize_batch(luck["pillars"])
+        for row, i in enumerate(valid):
+            pillars = [JIA_ZI[p] for p in luck["pillars"][row]]
+            start_months = int(round(float(luck["start_days"][row]) * 4))
+            results[i].update({
+                "full_bazi": " ".join(pillars),
+                "luck": {
+                    "direction": "顺行" if luck["direction"][row] > 0 else "逆行",
+                    "start_age": [start_months // 12, start_months % 12],
+                    "start_date": str(luck["start_date"][row]),
+                    "pillars": [JIA_ZI[p] for p in luck["luck"][row]],
+                },
+                "features": features[row],
+            })
+    return results
+
+
+def iter_chunks(records: Iterable[Dict[str, Any]], chunk_size: int) -> Iterator[List[Dict[str, Any]]]:
+    iterator = iter(records)
+    while True:
+        chunk = list(islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def iter_batch_results(records: Iterable[Dict[str, Any]], chunk_size: int = DEFAULT_CHUNK_SIZE,
+                       executor: Optional[ProcessPoolExecutor] = None,
+                       max_in_flight: Optional[int] = None) -> Iterator[List[Dict[str, Any]]]:
+    """
+    Yield computed chunks in input order.
+
+    At most max_in_flight chunks (default: twice the CPU count) are
+    submitted ahead of the one being yielded. Without an executor the
+    chunks are computed inline.
+    """
+    chunks = iter_chunks(records, chunk_size)
+    if executor is None:
+        for chunk in chunks:
+            yield compute_chunk(chunk)
+        return
+
+    max_in_flight = max_in_flight or 2 * (os.cpu_count() or 1)
+    pending = deque()
+    for chunk in chunks:
+        pending.append(executor.submit(compute_chunk, chunk))
+        if len(pending) >= max_in_flight:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+async def _interpret_rows(rows: List[Dict[str, Any]], interpret: Callable[[Dict[str, Any]], str],
+                          concurrency: int, queue_size: int):
+    """Fill row["analysis"] (or row["error"]) through a bounded queue drained by `concurrency` workers"""
+    queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+
+    async def worker():
+        while True:
+            row = await queue.get()
+            try:
+                if row is None:
+                    return
+                analysis = await asyncio.to_thread(interpret, row)
+                if is_api_error(analysis):
+                    row["error"] = str(analysis)
+                else:
+                    row["analysis"] = analysis
+            except Exception as e:
+                row["analysis_error"] = str(e)
+            finally:
+                queue.task_done()
+
+    workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+    for row in rows:
+        if "error" not in row:
+            await queue.put(row)
+    for _ in workers:
+        await queue.put(None)
+    await asyncio.gather(*workers)
+
+
+def interpret_rows(rows: List[Dict[str, Any]], interpret: Callable[[Dict[str, Any]], str],
+                   concurrency: int = DEFAULT_LLM_CONCURRENCY,
+                   queue_size: int = DEFAULT_LLM_QUEUE_SIZE) -> List[Dict[str, Any]]:
+    """Run LLM interpretation over computed rows with bounded concurrency"""
+    asyncio.run(_interpret_rows(rows, interpret, concurrency, queue_size))
+    return rows
+
+
+def engine_interpreter(engine) -> Callable[[Dict[str, Any]], str]:
+    """Interpret a row with an engine's cached analyze_bazi"""
+    def interpret(row):
+        record = row["input"]
+        return engine.analyze_bazi(_field(record, "birth_date", "birthDate"),
+                                   _field(record, "birth_time", "birthTime") or "12:00",
+                                   _field(record, "gender"),
+                                   _field(record, "location") or "未知")
+    return interpret
+
+
+def read_records(path: str) -> Iterator[Dict[str, Any]]:
+    """Records from a .csv file (header row) or an NDJSON file"""
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        if path.lower().endswith(".csv"):
+            yield from csv.DictReader(f)
+            return
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def load_checkpoint(output_path: str) -> Dict[str, Any]:
+    try:
+        with open(output_path + CHECKPOINT_SUFFIX, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"rows_done": 0, "output_bytes": 0}
+
+
+def _save_checkpoint(output_path: str, checkpoint: Dict[str, Any]):
+    tmp_path = output_path + CHECKPOINT_SUFFIX + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, output_path + CHECKPOINT_SUFFIX)
+
+
+def run_batch_file(input_path: str, output_path: str, workers: Optional[int] = None,
+                   chunk_size: int = DEFAULT_CHUNK_SIZE,
+                   interpret: Optional[Callable[[Dict[str, Any]], str]] = None,
+                   llm_concurrency: int = DEFAULT_LLM_CONCURRENCY,
+                   progress: Optional[Callable[[int], None]] = None) -> Dict[str, Any]:
+    """
+    Process input_path into NDJSON at output_path, resuming from a checkpoint.
+
+    The checkpoint records how many input rows are done and the output size
+    at that point; anything written after it (a chunk cut short by a crash)
+    is truncated away before resuming.
+    """
+    checkpoint = load_checkpoint(output_path)
+    if checkpoint.get("input") not in (None, os.path.abspath(input_path)):
+        raise ValueError(f"检查点属于另一个输入文件: {checkpoint['input']}")
+    rows_done = checkpoint["rows_done"]
+
+    with open(output_path, "a+b") as out:
+        out.truncate(checkpoint["output_bytes"])
+        out.seek(0, os.SEEK_END)
+        records = islice(read_records(input_path), rows_done, None)
+        errors = 0
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for rows in iter_batch_results(records, chunk_size, executor):
+                if interpret is not None:
+                    interpret_rows(rows, interpret, llm_concurrency)
+                out.write("".join(json.dumps(row, ensure_ascii=False) + "\n" for row in rows).encode("utf-8"))
+                out.flush()
+                os.fsync(out.fileno())
+                rows_done += len(rows)
+                errors += sum(1 for row in rows if "error" in row)
+                _save_checkpoint(output_path, {"input": os.path.abspath(input_path),
+                                               "rows_done": rows_done, "output_bytes": out.tell()})
+                if progress:
+                    progress(rows_done)
+    return {"rows_done": rows_done, "resumed_from": checkpoint["rows_done"], "errors": errors}
+
+
+_batch_executor = None
+_batch_executor_lock = threading.Lock()
+
+
+def get_batch_executor() -> ProcessPoolExecutor:
+    """Process pool shared by batch requests in a web worker"""
+    global _batch_executor
+    with _batch_executor_lock:
+        if _batch_executor is None:
+            _batch_executor = ProcessPoolExecutor(
+                max_workers=int(os.environ.get("QJI_BATCH_WORKERS", os.cpu_count() or 1)))
+    return _batch_executor
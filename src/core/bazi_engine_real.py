@@ -3,7 +3,8 @@ Real Bazi Engine with Qwen Max integration
 """
 import json
 import os
-from pathlib import Path
+
+from ..utils.classical_stream import get_classical_text_store
 
 class BaziEngine:
     def __init__(self):
@@ -12,14 +13,13 @@ class BaziEngine:
         self.classical_texts = self._load_classical_texts()
         
     def _load_classical_texts(self):
-        """Load the 10 classical texts for reference"""
-        texts = {}
-        classics_dir = Path(__file__).parent.parent / "raw_books" / "bazi_classics"
-        if classics_dir.exists():
-            for file_path in classics_dir.glob("*.md"):
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    texts[file_path.stem] = f.read()
-        return texts
+        """
+        The 10 classical texts for reference, as a name -> text mapping
+        
+        Passages are read with pread on access, so engine instances and
+        workers share the page cache instead of each holding a copy.
+        """
+        return get_classical_text_store()
     
     def chat_response(self, message):
         """Generate real AI response using trained knowledge"""
@@ -0,0 +1,198 @@
+"""
+Qianji Native Four-Pillar Calculator
+
+Vectorized replacement for building a full cnlunar.Lunar object just to read
+year8Char/month8Char/day8Char. Solar-term and lunar new year boundaries are
+decoded once from cnlunar's packed tables into per-day NumPy lookup arrays,
+the day pillar comes from the Julian day number and the hour pillar from
+五鼠遁, so any number of birth times can be converted with array arithmetic.
+
+Pillars are returned as sexagenary indices (0=甲子 ... 59=癸亥). The results
+follow cnlunar's conventions exactly: the year pillar changes at the lunar
+new year, the month pillar at the day of each 节, and 23:00 already belongs
+to the next day's 子时.
+"""
+from datetime import datetime, date
+from typing import Dict, Any, List
+
+import numpy as np
+from cnlunar.config import START_YEAR, lunarMonthData, lunarNewYearList
+from cnlunar.solar24 import getTheYearAllSolarTermsList
+
+# 天干地支
+TIAN_GAN = ["甲", "乙", "丙", "丁", "戊", "己", "庚", "辛", "壬", "癸"]
+DI_ZHI = ["子", "丑", "寅", "卯", "辰", "巳", "午", "未", "申", "酉", "戌", "亥"]
+JIA_ZI = [TIAN_GAN[i % 10] + DI_ZHI[i % 12] for i in range(60)]
+
+MIN_YEAR = START_YEAR
+MAX_YEAR = START_YEAR + len(lunarNewYearList) - 1
+
+# Julian day number of 1970-01-01; (JDN + 49) % 60 is the day's 干支 index
+_UNIX_EPOCH_JDN = 2440588
+_DAY_GANZHI_OFFSET = 49
+
+# cnlunar's month pillar counts months from 2019 (小寒 2019 = 乙丑月)
+_MONTH_BASE_YEAR = 2019
+
+
+def ganzhi_index(stem: int, branch: int) -> int:
+    """Sexagenary index from stem index (0-9) and branch index (0-11)"""
+    return (6 * stem - 5 * branch) % 60
+
+
+def _lunar_months(lunar_year: int) -> List[tuple]:
+    """(month, is_leap, days) for every month of a lunar year, in order"""
+    data = lunarMonthData[lunar_year - START_YEAR]
+    leap_month = (data >> 13) & 0xF
+    months = []
+    for month in range(1, 13):
+        months.append((month, False, 30 if data & (1 << (month - 1)) else 29))
+        if month == leap_month:
+            months.append((month, True, 30 if data & (1 << 12) else 29))
+    return months
+
+
+def _build_tables():
+    """Precompute per-day year/month pillars and lunar dates for the whole range"""
+    first_day = np.datetime64(f"{MIN_YEAR}-01-01", "D")
+    last_day = np.datetime64(f"{MAX_YEAR}-12-31", "D")
+    total_days = int((last_day - first_day).astype(int)) + 1
+
+    year_pillar = np.empty(total_days, dtype=np.uint8)
+    month_pillar = np.empty(total_days, dtype=np.uint8)
+    # 0 marks days outside cnlunar's lunar month data
+    lunar_year = np.zeros(total_days, dtype=np.int16)
+    lunar_month = np.zeros(total_days, dtype=np.int8)
+    lunar_day = np.zeros(total_days, dtype=np.int8)
+    lunar_leap = np.zeros(total_days, dtype=bool)
+
+    for year in range(MIN_YEAR, MAX_YEAR + 1):
+        year_start = np.datetime64(f"{year}-01-01", "D")
+        start = int((year_start - first_day).astype(int))
+        length = 366 if (year % 4 == 0 and (year % 100 != 0 or year % 400 == 0)) else 365
+        doy = np.arange(length)
+
+        # 年柱：以农历正月初一为界
+        code = lunarNewYearList[year - START_YEAR]
+        new_year = date(year, (code >> 5) & 0x3, code & 0x1F)
+        new_year_doy = new_year.timetuple().tm_yday - 1
+        pillar_year = np.where(doy < new_year_doy, year - 1, year)
+        year_pillar[start:start + length] = (pillar_year - 4) % 60
+
+        # 月柱：统计当天及之前已交的节气数（按日比较）
+        terms = getTheYearAllSolarTermsList(year)
+        term_doy = np.array([
+            date(year, i // 2 + 1, day).timetuple().tm_yday - 1
+            for i, day in enumerate(terms)
+        ])
+        passed = np.searchsorted(term_doy, doy, side="right") % 24
+        december = doy >= date(year, 12, 1).timetuple().tm_yday - 1
+        passed = np.where((passed == 0) & december, 24, passed)
+        month_pillar[start:start + length] = (
+            (year - _MONTH_BASE_YEAR) * 12 + (passed + 1) // 2
+        ) % 60
+
+        # 农历日期：从正月初一顺推
+        if year - START_YEAR < len(lunarMonthData):
+            offset = start + new_year_doy
+            for month, is_leap, days in _lunar_months(year):
+                end = min(offset + days, total_days)
+                lunar_year[offset:end] = year
+                lunar_month[offset:end] = month
+                lunar_day[offset:end] = np.arange(1, end - offset + 1)
+                lunar_leap[offset:end] = is_leap
+                offset = end
+
+    return {
+        "first_day": first_day,
+        "total_days": total_days,
+        "year_pillar": year_pillar,
+        "month_pillar": month_pillar,
+        "lunar_year": lunar_year,
+        "lunar_month": lunar_month,
+        "lunar_day": lunar_day,
+        "lunar_leap": lunar_leap,
+    }
+
+
+class PillarCalculator:
+    """Vectorized four-pillar calculator for 1901-2100"""
+
+    def __init__(self):
+        tables = _build_tables()
+        self.first_day = tables["first_day"]
+        self.total_days = tables["total_days"]
+        self.year_table = tables["year_pillar"]
+        self.month_table = tables["month_pillar"]
+        self.lunar_year_table = tables["lunar_year"]
+        self.lunar_month_table = tables["lunar_month"]
+        self.lunar_day_table = tables["lunar_day"]
+        self.lunar_leap_table = tables["lunar_leap"]
+
+    def _split(self, datetimes):
+        """Convert input to (day offset into tables, days since epoch, hour)"""
+        moments = np.asarray(datetimes, dtype="datetime64[m]")
+        days = moments.astype("datetime64[D]")
+        hours = ((moments - days).astype(np.int64) // 60).astype(np.int8)
+        offsets = (days - self.first_day).astype(np.int64)
+        if offsets.size and (offsets.min() < 0 or offsets.max() >= self.total_days):
+            raise ValueError(f"仅支持{MIN_YEAR}年至{MAX_YEAR}年之间的日期")
+        return offsets, days.astype(np.int64), hours
+
+    def compute(self, datetimes) -> np.ndarray:
+        """
+        Compute pillars for an array of datetimes.
+
+        Accepts anything np.asarray can turn into datetime64 (a datetime64
+        array, a list of datetime objects, ISO strings). Returns an int array
+        of shape (..., 4) holding the year, month, day and hour sexagenary
+        indices.
+        """
+        offsets, epoch_days, hours = self._split(datetimes)
+        late_zi = (hours == 23).astype(np.int64)
+
+        result = np.empty(offsets.shape + (4,), dtype=np.uint8)
+        result[..., 0] = self.year_table[offsets]
+        result[..., 1] = self.month_table[offsets]
+        # 23点起算次日
+        day = (epoch_days + _UNIX_EPOCH_JDN + _DAY_GANZHI_OFFSET + late_zi) % 60
+        result[..., 2] = day
+        # 五鼠遁：甲己还加甲，即日柱序数×12为当日子时
+        result[..., 3] = (day * 12 + ((hours.astype(np.int64) + 1) // 2) % 12) % 60
+        return result
+
+    def compute_lunar_dates(self, datetimes) -> np.ndarray:
+        """Lunar (year, month, day, is_leap) per datetime; year 0 when unknown"""
+        offsets, _, _ = self._split(datetimes)
+        result = np.empty(offsets.shape + (4,), dtype=np.int16)
+        result[..., 0] = self.lunar_year_table[offsets]
+        result[..., 1] = self.lunar_month_table[offsets]
+        result[..., 2] = self.lunar_day_table[offsets]
+        result[..., 3] = self.lunar_leap_table[offsets]
+        return result
+
+    @staticmethod
+    def to_strings(indices) -> np.ndarray:
+        """Map sexagenary indices to their 干支 strings"""
+        return np.asarray(JIA_ZI)[np.asarray(indices)]
+
+    def get_bazi(self, birth_datetime: datetime) -> Dict[str, Any]:
+        """Pillars and lunar date for a single datetime, as the engines expect"""
+        pillars = self.compute(np.datetime64(birth_datetime, "m"))
+        lunar = self.compute_lunar_dates(np.datetime64(birth_datetime, "m"))
+        year, month, day, hour = (JIA_ZI[i] for i in pillars)
+        return {
+            "year_pillar": year,
+            "month_pillar": month,
+            "day_pillar": day,
+            "hour_pillar": hour,
+            "full_bazi": f"{year} {month} {day} {hour}",
+            "lunar_year": int(lunar[0]),
+            "lunar_month": int(lunar[1]),
+            "lunar_day": int(lunar[2]),
+            "is_leap_month": bool(lunar[3])
+        }
+
+
+# Shared calculator; tables are built once per process
+pillar_calculator = PillarCalculator()
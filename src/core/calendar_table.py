@@ -0,0 +1,216 @@
+"""
+Qianji Precomputed Calendar Table
+
+One fixed-width binary record per Gregorian day (1901-2100) holding the lunar
+date, leap flag, year/month/day 干支, zodiac, festival and solar term. The file
+is written once by build_calendar_table() from the native pillar tables and
+then memory-mapped by CalendarTable, so a solar→lunar lookup is one offset
+computation plus a struct unpack instead of constructing LunarDate/cnlunar
+objects on every request.
+
+Build explicitly with:
+    python -m src.core.calendar_table --build
+or let CalendarTable build the file on first use.
+"""
+import argparse
+import json
+import mmap
+import os
+import struct
+import tempfile
+from datetime import date, datetime
+from typing import Dict, Any, Optional, Tuple
+
+DEFAULT_TABLE_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(__file__)), "data", "calendar_1901_2100.bin"
+)
+
+TIAN_GAN = ["甲", "乙", "丙", "丁", "戊", "己", "庚", "辛", "壬", "癸"]
+DI_ZHI = ["子", "丑", "寅", "卯", "辰", "巳", "午", "未", "申", "酉", "戌", "亥"]
+JIA_ZI = [TIAN_GAN[i % 10] + DI_ZHI[i % 12] for i in range(60)]
+ZODIAC = ["鼠", "牛", "虎", "兔", "龙", "蛇", "马", "羊", "猴", "鸡", "狗", "猪"]
+
+LUNAR_MONTHS = ["正月", "二月", "三月", "四月", "五月", "六月",
+                "七月", "八月", "九月", "十月", "冬月", "腊月"]
+LUNAR_DAYS = ["初一", "初二", "初三", "初四", "初五", "初六", "初七", "初八", "初九", "初十",
+              "十一", "十二", "十三", "十四", "十五", "十六", "十七", "十八", "十九", "二十",
+              "廿一", "廿二", "廿三", "廿四", "廿五", "廿六", "廿七", "廿八", "廿九", "三十"]
+
+# Same order as cnlunar's SOLAR_TERMS_NAME_LIST; id 0 means no term that day
+SOLAR_TERMS = ["小寒", "大寒", "立春", "雨水", "惊蛰", "春分", "清明", "谷雨",
+               "立夏", "小满", "芒种", "夏至", "小暑", "大暑", "立秋", "处暑",
+               "白露", "秋分", "寒露", "霜降", "立冬", "小雪", "大雪", "冬至"]
+
+# Festival ids; 0 means none. 除夕 is the eve of 春节, whether 腊月 has 29 or 30 days
+FESTIVALS = [None, "春节", "元宵节", "端午节", "七夕节", "中元节",
+             "中秋节", "重阳节", "腊八节", "小年", "除夕"]
+LUNAR_FESTIVAL_DAYS = {
+    (1, 1): 1, (1, 15): 2, (5, 5): 3, (7, 7): 4, (7, 15): 5,
+    (8, 15): 6, (9, 9): 7, (12, 8): 8, (12, 23): 9,
+}
+NEW_YEARS_EVE = 10
+
+# magic, version, ordinal of the first day, number of records
+HEADER = struct.Struct("<6sHII")
+MAGIC = b"QJCAL\x00"
+VERSION = 1
+# lunar_year, lunar_month, lunar_day, is_leap, year/month/day 干支,
+# zodiac, festival, solar term, padding
+RECORD = struct.Struct("<HBBBBBBBBBx")
+
+
+def build_calendar_table(path: str = DEFAULT_TABLE_PATH) -> str:
+    """Write the binary calendar table; returns the path written"""
+    import numpy as np
+    from cnlunar.solar24 import getTheYearAllSolarTermsList
+    from src.core.bazi_pillars import pillar_calculator, MIN_YEAR, MAX_YEAR
+
+    calc = pillar_calculator
+    count = calc.total_days
+    dtype = np.dtype([
+        ("lunar_year", "<u2"), ("lunar_month", "u1"), ("lunar_day", "u1"),
+        ("is_leap", "u1"), ("year_gz", "u1"), ("month_gz", "u1"), ("day_gz", "u1"),
+        ("zodiac", "u1"), ("festival", "u1"), ("solar_term", "u1"), ("pad", "u1"),
+    ])
+    assert dtype.itemsize == RECORD.size
+
+    records = np.zeros(count, dtype=dtype)
+    records["lunar_year"] = calc.lunar_year_table
+    records["lunar_month"] = calc.lunar_month_table
+    records["lunar_day"] = calc.lunar_day_table
+    records["is_leap"] = calc.lunar_leap_table
+    records["year_gz"] = calc.year_table
+    records["month_gz"] = calc.month_table
+    days = calc.first_day + np.arange(count)
+    records["day_gz"] = calc.compute(days.astype("datetime64[m]"))[:, 2]
+    records["zodiac"] = calc.year_table % 12
+
+    known = calc.lunar_year_table > 0
+    regular = known & ~calc.lunar_leap_table
+    for (month, day), festival in LUNAR_FESTIVAL_DAYS.items():
+        hits = regular & (calc.lunar_month_table == month) & (calc.lunar_day_table == day)
+        records["festival"][hits] = festival
+    new_year = np.flatnonzero(regular & (calc.lunar_month_table == 1) & (calc.lunar_day_table == 1))
+    eves = new_year[new_year > 0] - 1
+    records["festival"][eves[known[eves]]] = NEW_YEARS_EVE
+
+    first_ordinal = calc.first_day.astype(object).toordinal()
+    for year in range(MIN_YEAR, MAX_YEAR + 1):
+        for i, day in enumerate(getTheYearAllSolarTermsList(year)):
+            records["solar_term"][date(year, i // 2 + 1, day).toordinal() - first_ordinal] = i + 1
+
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    # A unique name, so workers building on first use never write the same file
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path) + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(HEADER.pack(MAGIC, VERSION, first_ordinal, count))
+            f.write(records.tobytes())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return path
+
+
+class CalendarTable:
+    """Memory-mapped O(1) solar→lunar lookup"""
+
+    def __init__(self, path: str = DEFAULT_TABLE_PATH):
+        if not os.path.exists(path):
+            build_calendar_table(path)
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.first_ordinal, self.count = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"日历数据文件格式不正确: {path}")
+        self.last_ordinal = self.first_ordinal + self.count - 1
+
+    def lookup_raw(self, ordinal: int) -> Tuple[int, ...]:
+        """Raw record for a proleptic Gregorian ordinal (date.toordinal())"""
+        index = ordinal - self.first_ordinal
+        if not 0 <= index < self.count:
+            raise ValueError(
+                f"日期超出日历表范围: {date.fromordinal(self.first_ordinal)} ~ "
+                f"{date.fromordinal(self.last_ordinal)}"
+            )
+        return RECORD.unpack_from(self._map, HEADER.size + index * RECORD.size)
+
+    def lookup(self, day) -> Dict[str, Any]:
+        """Full calendar record for a date, datetime or YYYY-MM-DD string"""
+        if isinstance(day, str):
+            day = date.fromisoformat(day)
+        elif isinstance(day, datetime):
+            day = day.date()
+        (lunar_year, lunar_month, lunar_day, is_leap, year_gz, month_gz,
+         day_gz, zodiac, festival, solar_term) = self.lookup_raw(day.toordinal())
+
+        month_name = None
+        day_name = None
+        if lunar_year:
+            month_name = LUNAR_MONTHS[lunar_month - 1]
+            if is_leap:
+                month_name = f"闰{month_name}"
+            day_name = LUNAR_DAYS[lunar_day - 1]
+
+        return {
+            "solar_date": day.isoformat(),
+            "lunar_year": lunar_year or None,
+            "lunar_month": lunar_month or None,
+            "lunar_day": lunar_day or None,
+            "is_leap": bool(is_leap),
+            "lunar_month_name": month_name,
+            "lunar_day_name": day_name,
+            "ganzhi_year": JIA_ZI[year_gz],
+            "ganzhi_month": JIA_ZI[month_gz],
+            "ganzhi_day": JIA_ZI[day_gz],
+            "zodiac": ZODIAC[zodiac],
+            "festival": FESTIVALS[festival],
+            "solar_term": SOLAR_TERMS[solar_term - 1] if solar_term else None,
+        }
+
+    def format_lunar(self, day) -> Optional[str]:
+        """Lunar date as 2026年正月初八, or None outside the lunar data range"""
+        info = self.lookup(day)
+        if not info["lunar_year"]:
+            return None
+        return f"{info['lunar_year']}年{info['lunar_month_name']}{info['lunar_day_name']}"
+
+    def close(self):
+        self._map.close()
+
+
+_calendar_table = None
+
+
+def get_calendar_table() -> CalendarTable:
+    """Process-wide CalendarTable, mapped on first use"""
+    global _calendar_table
+    if _calendar_table is None:
+        _calendar_table = CalendarTable()
+    return _calendar_table
+
+
+def main():
+    parser = argparse.ArgumentParser(description='千机日历表构建与查询')
+    parser.add_argument('--build', action='store_true', help='重新生成日历数据文件')
+    parser.add_argument('--path', type=str, default=DEFAULT_TABLE_PATH, help='日历数据文件路径')
+    parser.add_argument('--solar', type=str, help='查询公历日期: 2026-02-24')
+
+    args = parser.parse_args()
+
+    if args.build:
+        path = build_calendar_table(args.path)
+        print(f"✅ 日历数据文件已生成: {path}")
+
+    if args.solar:
+        table = CalendarTable(args.path)
+        print(json.dumps(table.lookup(args.solar), ensure_ascii=False, indent=2))
+
+    if not args.build and not args.solar:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,247 @@
+"""
+Qianji Chart Analyzer
+
+Structural features of a four-pillar chart computed from small lookup
+matrices instead of by the model on every request:
+
+- TEN_GOD[day_stem, stem]: the ten-god of any stem relative to a day master;
+- HIDDEN_STEMS[branch, stem]: 地支藏干 weights (本气/中气/余气);
+- SEASONAL[month_branch, element]: 旺相休囚死 multipliers of the month command.
+
+analyze_batch() turns an (N, 4) array of sexagenary pillar indices into
+element and ten-god strength matrices in one pass; ChartAnalyzer.analyze()
+wraps it for a single chart, memoized on the pillar tuple, and
+format_chart_features() renders the result for prompts.
+"""
+import threading
+from functools import lru_cache
+from typing import Dict, Any, List, Sequence, Tuple, Union
+
+import numpy as np
+
+from src.core.bazi_pillars import TIAN_GAN, DI_ZHI, JIA_ZI
+
+WU_XING = ["木", "火", "土", "金", "水"]
+TEN_GODS = ["比肩", "劫财", "食神", "伤官", "偏财", "正财", "七杀", "正官", "偏印", "正印"]
+
+# Stem i belongs to element i // 2; even stems are yang
+STEM_ELEMENT = np.arange(10) // 2
+STEM_ELEMENT_ONEHOT = np.eye(5)[STEM_ELEMENT]
+
+
+def _ten_god_table() -> np.ndarray:
+    """10×10 ten-god ids: element relation picks the pair, polarity picks the member"""
+    day = np.arange(10)[:, None]
+    other = np.arange(10)[None, :]
+    # 0 同我, 1 我生, 2 我克, 3 克我, 4 生我; TEN_GODS lists each pair same-polarity first
+    relation = (STEM_ELEMENT[other] - STEM_ELEMENT[day]) % 5
+    different_polarity = (day % 2 != other % 2).astype(np.int64)
+    return (relation * 2 + different_polarity).astype(np.uint8)
+
+
+TEN_GOD = _ten_god_table()
+TEN_GOD_ONEHOT = np.eye(10)[TEN_GOD]
+
+# 地支藏干: (stem, weight) from 本气 to 余气
+_HIDDEN = {
+    "子": [("癸", 1.0)],
+    "丑": [("己", 0.6), ("癸", 0.3), ("辛", 0.1)],
+    "寅": [("甲", 0.6), ("丙", 0.3), ("戊", 0.1)],
+    "卯": [("乙", 1.0)],
+    "辰": [("戊", 0.6), ("乙", 0.3), ("癸", 0.1)],
+    "巳": [("丙", 0.6), ("戊", 0.3), ("庚", 0.1)],
+    "午": [("丁", 0.7), ("己", 0.3)],
+    "未": [("己", 0.6), ("丁", 0.3), ("乙", 0.1)],
+    "申": [("庚", 0.6), ("壬", 0.3), ("戊", 0.1)],
+    "酉": [("辛", 1.0)],
+    "戌": [("戊", 0.6), ("辛", 0.3), ("丁", 0.1)],
+    "亥": [("壬", 0.7), ("甲", 0.3)],
+}
+HIDDEN_STEMS = np.zeros((12, 10))
+for _branch, _stems in _HIDDEN.items():
+    for _stem, _weight in _stems:
+        HIDDEN_STEMS[DI_ZHI.index(_branch), TIAN_GAN.index(_stem)] = _weight
+
+# Element ruling each month branch: 寅卯木 巳午火 申酉金 亥子水, 四库土
+MONTH_ELEMENT = np.array([4, 2, 0, 0, 2, 1, 1, 2, 3, 3, 2, 4])
+# 旺, 相 (生出), 死 (我克), 囚 (克我), 休 (生我), indexed by (element - ruling) % 5
+_SEASON_FACTORS = np.array([1.5, 1.2, 0.6, 0.8, 1.0])
+SEASONAL = _SEASON_FACTORS[(np.arange(5)[None, :] - MONTH_ELEMENT[:, None]) % 5]
+
+SEASON_STATES = ["旺", "相", "死", "囚", "休"]
+
+# Share of 同类 (比劫+印枭) strength above/below which the day master is strong/weak
+STRONG_THRESHOLD = 0.55
+WEAK_THRESHOLD = 0.45
+
+PillarsLike = Union[str, Sequence[Union[int, str]]]
+
+
+def pillar_indices(pillars: PillarsLike) -> Tuple[int, int, int, int]:
+    """Sexagenary indices from "甲子 乙丑 丙寅 丁卯", 干支 strings or indices"""
+    if isinstance(pillars, str):
+        chars = "".join(pillars.split())
+        pillars = [chars[i:i + 2] for i in range(0, len(chars), 2)]
+    indices = tuple(p if isinstance(p, (int, np.integer)) else JIA_ZI.index(p) for p in pillars)
+    if len(indices) != 4:
+        raise ValueError(f"需要四柱八字: {pillars}")
+    return tuple(int(i) for i in indices)
+
+
+def analyze_batch(pillars) -> Dict[str, np.ndarray]:
+    """
+    Strength features for an (N, 4) array of sexagenary pillar indices.
+
+    Each visible stem other than the day master counts 1.0 and each branch
+    contributes its hidden stems by weight; every stem is then scaled by the
+    seasonal factor of its element in the month command. Returns
+    stem_weights (N, 10), element_scores (N, 5), ten_god_scores (N, 10),
+    visible_gods (N, 4) and self_share (N,), the share of 比劫+印枭.
+    """
+    pillars = np.asarray(pillars, dtype=np.int64).reshape(-1, 4)
+    stems = pillars % 10
+    branches = pillars % 12
+    day_master = stems[:, 2]
+    rows = np.arange(len(pillars))
+
+    visible = np.eye(10)[stems].sum(axis=1)
+    visible[rows, day_master] -= 1
+    hidden = HIDDEN_STEMS[branches].sum(axis=1)
+    season = SEASONAL[branches[:, 1]]
+    stem_weights = (visible + hidden) * season[:, STEM_ELEMENT]
+
+    element_scores = stem_weights @ STEM_ELEMENT_ONEHOT
+    ten_god_scores = np.einsum("ns,nsg->ng", stem_weights, TEN_GOD_ONEHOT[day_master])
+    self_side = ten_god_scores[:, [0, 1, 8, 9]].sum(axis=1)
+    self_share = self_side / ten_god_scores.sum(axis=1)
+
+    return {
+        "stem_weights": stem_weights,
+        "element_scores": element_scores,
+        "ten_god_scores": ten_god_scores,
+        "visible_gods": TEN_GOD[day_master[:, None], stems],
+        "self_share": self_share,
+    }
+
+
+def strength_label(self_share: float) -> str:
+    """偏强/偏弱/中和 from the 比劫+印枭 share"""
+    if self_share >= STRONG_THRESHOLD:
+        return "偏强"
+    if self_share <= WEAK_THRESHOLD:
+        return "偏弱"
+    return "中和"
+
+
+def summarize_batch(pillars) -> List[Dict[str, Any]]:
+    """Compact per-chart scores for bulk output, without the per-branch detail of analyze()"""
+    result = analyze_batch(pillars)
+    day_masters = np.asarray(pillars, dtype=np.int64).reshape(-1, 4)[:, 2] % 10
+    elements = np.round(result["element_scores"], 2).tolist()
+    gods = np.round(result["ten_god_scores"], 2).tolist()
+    return [{
+        "day_master": TIAN_GAN[day_master],
+        "element_scores": dict(zip(WU_XING, element_row)),
+        "ten_god_scores": dict(zip(TEN_GODS, god_row)),
+        "self_share": round(share, 3),
+        "strength": strength_label(share),
+    } for day_master, element_row, god_row, share
+        in zip(day_masters, elements, gods, result["self_share"].tolist())]
+
+
+def feature_vector(pillars) -> np.ndarray:
+    """Flat (N, 16) features: element shares, ten-god shares and 同类 share"""
+    result = analyze_batch(pillars)
+    elements = result["element_scores"]
+    gods = result["ten_god_scores"]
+    return np.hstack([
+        elements / elements.sum(axis=1, keepdims=True),
+        gods / gods.sum(axis=1, keepdims=True),
+        result["self_share"][:, None],
+    ])
+
+
+class ChartAnalyzer:
+    """Per-chart features with 干支 labels, memoized on the pillar tuple"""
+
+    def __init__(self, cache_size: int = 4096):
+        self._analyze = lru_cache(maxsize=cache_size)(self._analyze_uncached)
+
+    def analyze(self, pillars: PillarsLike) -> Dict[str, Any]:
+        """Features of one chart; pass full_bazi or the four pillars. Shared, do not mutate"""
+        return self._analyze(pillar_indices(pillars))
+
+    @staticmethod
+    def _analyze_uncached(indices: Tuple[int, int, int, int]) -> Dict[str, Any]:
+        result = analyze_batch([indices])
+        stems = [i % 10 for i in indices]
+        branches = [i % 12 for i in indices]
+        day_master = stems[2]
+        month_branch = branches[1]
+
+        hidden = []
+        for branch in branches:
+            hidden.append([
+                {"stem": TIAN_GAN[s], "god": TEN_GODS[TEN_GOD[day_master, s]],
+                 "weight": float(HIDDEN_STEMS[branch, s])}
+                for s in np.argsort(-HIDDEN_STEMS[branch]) if HIDDEN_STEMS[branch, s] > 0
+            ])
+
+        elements = result["element_scores"][0]
+        gods = result["ten_god_scores"][0]
+        self_share = float(result["self_share"][0])
+
+        present = (STEM_ELEMENT_ONEHOT[stems].sum(axis=0)
+                   + (HIDDEN_STEMS[branches] @ STEM_ELEMENT_ONEHOT).sum(axis=0))
+        return {
+            "pillars": [JIA_ZI[i] for i in indices],
+            "day_master": TIAN_GAN[day_master],
+            "day_master_element": WU_XING[STEM_ELEMENT[day_master]],
+            "month_command": DI_ZHI[month_branch],
+            "day_master_season": SEASON_STATES[(STEM_ELEMENT[day_master] - MONTH_ELEMENT[month_branch]) % 5],
+            "stem_gods": [TEN_GODS[g] if i != 2 else "日主" for i, g in enumerate(result["visible_gods"][0])],
+            "hidden_stems": hidden,
+            "element_scores": {WU_XING[i]: round(float(v), 2) for i, v in enumerate(elements)},
+            "ten_god_scores": {TEN_GODS[i]: round(float(v), 2) for i, v in enumerate(gods)},
+            "self_share": round(self_share, 3),
+            "strength": strength_label(self_share),
+            "missing_elements": [WU_XING[i] for i in range(5) if present[i] == 0],
+        }
+
+
+def format_chart_features(features: Dict[str, Any]) -> str:
+    """Render analyzer output as a compact prompt block"""
+    positions = ["年", "月", "日", "时"]
+    stem_line = "，".join(f"{pos}干{p[0]}（{god}）"
+                         for pos, p, god in zip(positions, features["pillars"], features["stem_gods"]))
+    hidden_line = "；".join(
+        f"{p[1]}藏" + "、".join(f"{h['stem']}{h['god']}" for h in hidden)
+        for p, hidden in zip(features["pillars"], features["hidden_stems"]))
+    elements = " ".join(f"{k}{v}" for k, v in features["element_scores"].items())
+    gods = " ".join(f"{k}{v}" for k, v in features["ten_god_scores"].items() if v)
+    lines = [
+        "【命盘结构（本地精确计算）】",
+        f"- 日主：{features['day_master']}{features['day_master_element']}，"
+        f"生于{features['month_command']}月，{features['day_master_season']}",
+        f"- 天干十神：{stem_line}",
+        f"- 地支藏干：{hidden_line}",
+        f"- 五行力量（含藏干、按月令旺衰加权）：{elements}",
+        f"- 十神力量：{gods}",
+        f"- 比劫印枭占比{features['self_share']:.0%}，日主{features['strength']}",
+    ]
+    if features["missing_elements"]:
+        lines.append(f"- 五行缺：{''.join(features['missing_elements'])}")
+    return "\n".join(lines)
+
+
+_chart_analyzer = None
+_chart_analyzer_lock = threading.Lock()
+
+
+def get_chart_analyzer() -> ChartAnalyzer:
+    """Process-wide analyzer so the memo is shared by all engines"""
+    global _chart_analyzer
+    with _chart_analyzer_lock:
+        if _chart_analyzer is None:
+            _chart_analyzer = ChartAnalyzer()
+    return _chart_analyzer
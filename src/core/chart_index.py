@@ -0,0 +1,500 @@
+"""
+Qianji Chart Index
+
+Inverted index over stored charts for "same pillars" and pattern queries,
+so an analyst can ask for 日柱=庚午 AND 月支=寅 AND 子午冲 without scanning
+JSON files. Every chart is indexed under terms of these families:
+
+- 年柱/月柱/日柱/时柱=<干支> and 年干 ... 时支=<干 or 支> (日主 = 日干);
+- 天干/地支=<multiset>: 地支=午 means at least one 午, 地支=午午 at least
+  two, 地支=子午 both (the query is split into per-character count terms);
+- 关系=<pattern>: 六冲/六合/六害/三合/三刑/自刑 among the four branches and
+  五合/相冲 among the stems, e.g. 子午冲, 申子辰三合, 甲己合 (a bare 子午冲
+  in a query means 关系=子午冲);
+- 格局 (月令本气十神: 正官格, 七杀格, ..., 建禄格, 月刃格), 强弱 (偏强/偏弱/中和
+  from analyze_batch) and 五行缺=<element>.
+
+Posting lists are roaring-style compressed bitmaps: chart ids are split by
+their high 16 bits into containers that are either a sorted uint16 array
+(sparse) or a 65536-bit bitset (more than 4096 members). Conjunctions
+intersect the smallest bitmaps first, container by container, so they cost
+milliseconds over millions of charts. The index is saved as .npy arrays
+plus a JSON term table and memory-mapped on load.
+
+    python -m src.core.chart_index --build charts.ndjson src/data/compatibility_charts.npz
+    python -m src.core.chart_index --query "日柱=庚午 AND 月支=寅 AND 子午冲"
+"""
+import argparse
+import json
+import os
+import re
+import shutil
+import threading
+import time
+from collections import Counter
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from src.core.bazi_pillars import TIAN_GAN, DI_ZHI, JIA_ZI
+from src.core.chart_analyzer import (WU_XING, TEN_GODS, TEN_GOD, HIDDEN_STEMS, STEM_ELEMENT_ONEHOT,
+                                     STRONG_THRESHOLD, WEAK_THRESHOLD, analyze_batch, pillar_indices)
+
+DEFAULT_INDEX_DIR = Path(__file__).parent.parent / "data" / "chart_index"
+DEFAULT_LIMIT = 50
+
+POOL_FILE = "pool.npy"
+CONTAINERS_FILE = "containers.npy"
+IDS_FILE = "ids.npy"
+PILLARS_FILE = "pillars.npy"
+TERMS_FILE = "terms.json"
+
+# Containers with more members than this are stored as bitsets
+ARRAY_MAX = 4096
+_ARRAY, _BITSET = 0, 1
+
+POSITIONS = ["年", "月", "日", "时"]
+MAX_REPEAT = 4
+
+# Branch and stem relations indexed under 关系=; pairs are named in DI_ZHI/TIAN_GAN order
+BRANCH_PAIRS = (
+    [(f"{DI_ZHI[i]}{DI_ZHI[i + 6]}冲", (i, i + 6)) for i in range(6)]
+    + [(f"{DI_ZHI[min(i, (13 - i) % 12)]}{DI_ZHI[max(i, (13 - i) % 12)]}合", (i, (13 - i) % 12))
+       for i in (0, 2, 3, 4, 5, 6)]
+    + [(f"{DI_ZHI[min(i, (19 - i) % 12)]}{DI_ZHI[max(i, (19 - i) % 12)]}害", (i, (19 - i) % 12))
+       for i in (0, 1, 2, 3, 8, 9)]
+    + [("子卯刑", (0, 3))]
+)
+BRANCH_GROUPS = [
+    ("申子辰三合", (8, 0, 4)), ("亥卯未三合", (11, 3, 7)),
+    ("寅午戌三合", (2, 6, 10)), ("巳酉丑三合", (5, 9, 1)),
+    ("寅巳申三刑", (2, 5, 8)), ("丑戌未三刑", (1, 10, 7)),
+]
+SELF_PUNISHMENT = [4, 6, 9, 11]
+STEM_PAIRS = ([(f"{TIAN_GAN[i]}{TIAN_GAN[i + 5]}合", (i, i + 5)) for i in range(5)]
+              + [(f"{TIAN_GAN[i]}{TIAN_GAN[i + 6]}冲", (i, i + 6)) for i in range(4)])
+
+# 比肩/劫财 in the month command are named 建禄格/月刃格
+PATTERN_NAMES = ["建禄格", "月刃格"] + [f"{god}格" for god in TEN_GODS[2:]]
+MAIN_QI = HIDDEN_STEMS.argmax(axis=1)
+
+FAMILIES = ({f"{position}{kind}" for position in POSITIONS for kind in "柱干支"}
+            | {"天干", "地支", "关系", "格局", "强弱", "五行缺"})
+
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint16)
+_AND_SPLIT = re.compile(r"\s+(?:AND|and)\s+|\s*(?:&&|&|且|并且|，|,)\s*")
+_NOT_PREFIX = re.compile(r"^(?:NOT\s+|not\s+|非|!|-)")
+
+
+def _words_to_array(words: np.ndarray) -> np.ndarray:
+    bits = np.unpackbits(np.ascontiguousarray(words).view(np.uint8), bitorder="little")
+    return np.flatnonzero(bits).astype(np.uint16)
+
+
+def _array_to_words(values: np.ndarray) -> np.ndarray:
+    bits = np.zeros(1 << 16, dtype=bool)
+    bits[values] = True
+    return np.packbits(bits, bitorder="little").view(np.uint64)
+
+
+def _cardinality(words: np.ndarray) -> int:
+    return int(_POPCOUNT[np.ascontiguousarray(words).view(np.uint8)].sum())
+
+
+def _container(values: np.ndarray):
+    """(kind, data) for sorted uint16 values of one chunk"""
+    if len(values) > ARRAY_MAX:
+        return _BITSET, _array_to_words(values)
+    return _ARRAY, values.astype(np.uint16)
+
+
+def _normalize(kind: int, data: np.ndarray):
+    """Demote a bitset that became sparse; None for an empty container"""
+    if kind == _BITSET:
+        count = _cardinality(data)
+        if count == 0:
+            return None
+        if count <= ARRAY_MAX:
+            return _ARRAY, _words_to_array(data)
+        return kind, data
+    return (kind, data) if len(data) else None
+
+
+def _intersect(a, b):
+    (kind_a, data_a), (kind_b, data_b) = a, b
+    if kind_a == _ARRAY and kind_b == _ARRAY:
+        return _normalize(_ARRAY, np.intersect1d(data_a, data_b, assume_unique=True))
+    if kind_a == _BITSET and kind_b == _BITSET:
+        return _normalize(_BITSET, data_a & data_b)
+    values, words = (data_a, data_b) if kind_a == _ARRAY else (data_b, data_a)
+    hit = (words[values >> 6] >> (values & 63).astype(np.uint64)) & np.uint64(1)
+    return _normalize(_ARRAY, values[hit.astype(bool)])
+
+
+def _subtract(a, b):
+    (kind_a, data_a), (kind_b, data_b) = a, b
+    if kind_a == _ARRAY and kind_b == _ARRAY:
+        return _normalize(_ARRAY, np.setdiff1d(data_a, data_b, assume_unique=True))
+    if kind_a == _BITSET:
+        words_b = data_b if kind_b == _BITSET else _array_to_words(data_b)
+        return _normalize(_BITSET, data_a & ~words_b)
+    hit = (data_b[data_a >> 6] >> (data_a & 63).astype(np.uint64)) & np.uint64(1)
+    return _normalize(_ARRAY, data_a[~hit.astype(bool)])
+
+
+class Bitmap:
+    """Roaring-style bitmap of uint32 chart ids: sorted containers keyed by the high 16 bits"""
+
+    __slots__ = ("containers",)
+
+    def __init__(self, containers: Optional[Dict[int, Tuple[int, np.ndarray]]] = None):
+        self.containers = containers or {}
+
+    @classmethod
+    def from_sorted(cls, ids: np.ndarray) -> "Bitmap":
+        """Bitmap from sorted, unique ids"""
+        ids = np.asarray(ids, dtype=np.uint32)
+        high = ids >> 16
+        bounds = np.flatnonzero(np.diff(high)) + 1
+        containers = {}
+        for chunk in np.split(ids, bounds) if len(ids) else []:
+            containers[int(chunk[0] >> 16)] = _container((chunk & 0xFFFF).astype(np.uint16))
+        return cls(containers)
+
+    def __len__(self):
+        return sum(len(data) if kind == _ARRAY else _cardinality(data)
+                   for kind, data in self.containers.values())
+
+    def __and__(self, other: "Bitmap") -> "Bitmap":
+        result = {}
+        for key in sorted(self.containers.keys() & other.containers.keys()):
+            container = _intersect(self.containers[key], other.containers[key])
+            if container is not None:
+                result[key] = container
+        return Bitmap(result)
+
+    def __sub__(self, other: "Bitmap") -> "Bitmap":
+        result = {}
+        for key, container in self.containers.items():
+            if key in other.containers:
+                container = _subtract(container, other.containers[key])
+            if container is not None:
+                result[key] = container
+        return Bitmap(result)
+
+    def to_array(self, limit: Optional[int] = None) -> np.ndarray:
+        """Member ids in ascending order, optionally only the first `limit`"""
+        parts, total = [], 0
+        for key in sorted(self.containers):
+            kind, data = self.containers[key]
+            values = data if kind == _ARRAY else _words_to_array(data)
+            parts.append((np.uint32(key) << np.uint32(16)) | values.astype(np.uint32))
+            total += len(values)
+            if limit is not None and total >= limit:
+                break
+        ids = np.concatenate(parts) if parts else np.zeros(0, dtype=np.uint32)
+        return ids[:limit] if limit is not None else ids
+
+
+def chart_terms(pillars) -> Iterator[Tuple[str, np.ndarray]]:
+    """(term, boolean mask) for every indexed term of an (N, 4) array of pillar indices"""
+    pillars = np.asarray(pillars, dtype=np.int64).reshape(-1, 4)
+    stems, branches = pillars % 10, pillars % 12
+
+    for i, position in enumerate(POSITIONS):
+        yield from _categorical(f"{position}柱", pillars[:, i], JIA_ZI)
+        yield from _categorical(f"{position}干", stems[:, i], TIAN_GAN)
+        yield from _categorical(f"{position}支", branches[:, i], DI_ZHI)
+
+    stem_counts = np.eye(10, dtype=np.int8)[stems].sum(axis=1)
+    branch_counts = np.eye(12, dtype=np.int8)[branches].sum(axis=1)
+    for family, counts, labels in (("天干", stem_counts, TIAN_GAN), ("地支", branch_counts, DI_ZHI)):
+        for j, label in enumerate(labels):
+            for repeat in range(1, MAX_REPEAT + 1):
+                yield f"{family}={label * repeat}", counts[:, j] >= repeat
+
+    for name, (x, y) in BRANCH_PAIRS:
+        yield f"关系={name}", (branch_counts[:, x] > 0) & (branch_counts[:, y] > 0)
+    for name, group in BRANCH_GROUPS:
+        yield f"关系={name}", (branch_counts[:, list(group)] > 0).all(axis=1)
+    for j in SELF_PUNISHMENT:
+        yield f"关系={DI_ZHI[j] * 2}自刑", branch_counts[:, j] >= 2
+    for name, (x, y) in STEM_PAIRS:
+        yield f"关系={name}", (stem_counts[:, x] > 0) & (stem_counts[:, y] > 0)
+
+    month_god = TEN_GOD[stems[:, 2], MAIN_QI[branches[:, 1]]]
+    yield from _categorical("格局", month_god, PATTERN_NAMES)
+
+    self_share = analyze_batch(pillars)["self_share"]
+    strong, weak = self_share >= STRONG_THRESHOLD, self_share <= WEAK_THRESHOLD
+    yield "强弱=偏强", strong
+    yield "强弱=偏弱", weak
+    yield "强弱=中和", ~(strong | weak)
+
+    present = (STEM_ELEMENT_ONEHOT[stems].sum(axis=1)
+               + (HIDDEN_STEMS[branches] @ STEM_ELEMENT_ONEHOT).sum(axis=1))
+    for j, element in enumerate(WU_XING):
+        yield f"五行缺={element}", present[:, j] == 0
+
+
+def _categorical(family: str, column: np.ndarray, labels: List[str]) -> Iterator[Tuple[str, np.ndarray]]:
+    for value, label in enumerate(labels):
+        yield f"{family}={label}", column == value
+
+
+def _alias_table() -> Dict[str, str]:
+    """Query spellings of relation terms: bare names, reversed pairs and 日主"""
+    aliases = {}
+    for name, _ in BRANCH_PAIRS + STEM_PAIRS:
+        for spelling in (name, name[1] + name[0] + name[2:]):
+            aliases[spelling] = f"关系={name}"
+    for name, _ in BRANCH_GROUPS:
+        aliases[name] = f"关系={name}"
+    for j in SELF_PUNISHMENT:
+        aliases[f"{DI_ZHI[j] * 2}自刑"] = aliases[f"{DI_ZHI[j]}自刑"] = f"关系={DI_ZHI[j] * 2}自刑"
+    return aliases
+
+
+TERM_ALIASES = _alias_table()
+
+
+def parse_query(query: str) -> List[Tuple[str, bool]]:
+    """
+    (term, negated) pairs of a conjunctive query.
+
+    Conditions are joined by AND, &, 且 or commas and may be negated with
+    NOT/非/!. Multiset conditions expand into one count term per character.
+    """
+    conditions = []
+    for raw in _AND_SPLIT.split(query.strip()):
+        raw = raw.strip()
+        if not raw:
+            continue
+        negated = bool(_NOT_PREFIX.match(raw))
+        condition = _NOT_PREFIX.sub("", raw).strip().replace("＝", "=")
+        condition = re.sub(r"^(?:has|有)\s*", "", condition)
+        if condition.startswith("日主="):
+            condition = "日干=" + condition[3:]
+        if condition in TERM_ALIASES:
+            conditions.append((TERM_ALIASES[condition], negated))
+            continue
+        family, _, value = condition.partition("=")
+        if family in ("天干", "地支") and value:
+            if negated and len(set(value)) > 1:
+                raise ValueError(f"否定条件只支持单个字: {raw}")
+            for char, repeat in Counter(value).items():
+                conditions.append((f"{family}={char * repeat}", negated))
+            continue
+        if family == "关系" and value in TERM_ALIASES:
+            conditions.append((TERM_ALIASES[value], negated))
+            continue
+        conditions.append((condition, negated))
+    if not conditions:
+        raise ValueError("查询条件为空")
+    return conditions
+
+
+def build_chart_index(ids: Iterable[Any], pillars, index_dir: Optional[str] = None) -> Path:
+    """
+    Write the index of the given charts to index_dir and return it.
+
+    Charts get dense ids 0..N-1 in input order; the external ids and the
+    pillars are stored next to the bitmaps. The directory is replaced
+    atomically.
+    """
+    index_dir = Path(index_dir) if index_dir else DEFAULT_INDEX_DIR
+    ids = np.asarray([str(i) for i in ids])
+    pillars = np.asarray(pillars, dtype=np.uint8).reshape(-1, 4)
+    if len(ids) != len(pillars):
+        raise ValueError("ids与八字数量不一致")
+
+    pool, containers, terms = [], [], {}
+    offset = 0
+    for term, mask in chart_terms(pillars):
+        members = np.flatnonzero(mask)
+        if not len(members):
+            continue
+        bitmap = Bitmap.from_sorted(members)
+        terms[term] = [len(containers), len(bitmap.containers), int(len(members))]
+        for key in sorted(bitmap.containers):
+            kind, data = bitmap.containers[key]
+            data = data.view(np.uint16)
+            containers.append((key, kind, offset, len(data)))
+            pool.append(data)
+            offset += len(data)
+
+    tmp_dir = index_dir.with_name(index_dir.name + ".tmp")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    tmp_dir.mkdir(parents=True)
+    np.save(tmp_dir / POOL_FILE, np.concatenate(pool) if pool else np.zeros(0, dtype=np.uint16))
+    np.save(tmp_dir / CONTAINERS_FILE, np.array(containers, dtype=np.int64).reshape(-1, 4))
+    np.save(tmp_dir / IDS_FILE, ids)
+    np.save(tmp_dir / PILLARS_FILE, pillars)
+    with open(tmp_dir / TERMS_FILE, "w", encoding="utf-8") as f:
+        json.dump({"count": len(ids), "terms": terms}, f, ensure_ascii=False)
+
+    old_dir = index_dir.with_name(index_dir.name + ".old")
+    shutil.rmtree(old_dir, ignore_errors=True)
+    if index_dir.exists():
+        os.replace(index_dir, old_dir)
+    os.replace(tmp_dir, index_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    return index_dir
+
+
+def read_chart_sources(paths: Iterable[str]) -> Iterator[Tuple[str, str]]:
+    """
+    (id, full_bazi) from stored chart files.
+
+    Accepts bazi batch NDJSON results (rows with errors are skipped), the
+    compatibility store (.npz) and directories of JSON records carrying
+    full_bazi or input_bazi, such as expert validation records.
+    """
+    for path in map(Path, paths):
+        if path.is_dir():
+            for record_path in sorted(path.glob("*.json")):
+                with open(record_path, "r", encoding="utf-8") as f:
+                    record = json.load(f)
+                bazi = record.get("full_bazi") or record.get("input_bazi")
+                if bazi:
+                    yield str(record.get("id") or record_path.stem), bazi
+        elif path.suffix == ".npz":
+            with np.load(path, allow_pickle=False) as data:
+                for chart_id, row in zip(data["ids"].tolist(), data["pillars"].tolist()):
+                    yield chart_id, " ".join(JIA_ZI[p] for p in row)
+        else:
+            with open(path, "r", encoding="utf-8") as f:
+                for row_number, line in enumerate(f):
+                    if not line.strip():
+                        continue
+                    row = json.loads(line)
+                    if "error" not in row and row.get("full_bazi"):
+                        yield str(row["id"] if row.get("id") is not None else row_number), row["full_bazi"]
+
+
+class ChartIndex:
+    """Memory-mapped chart index answering conjunctive term queries"""
+
+    def __init__(self, index_dir: Optional[str] = None):
+        self.index_dir = Path(index_dir) if index_dir else DEFAULT_INDEX_DIR
+        with open(self.index_dir / TERMS_FILE, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        self.count = meta["count"]
+        self.terms = meta["terms"]
+        self._pool = np.load(self.index_dir / POOL_FILE, mmap_mode="r")
+        self._containers = np.load(self.index_dir / CONTAINERS_FILE)
+        self._ids = np.load(self.index_dir / IDS_FILE, mmap_mode="r")
+        self._pillars = np.load(self.index_dir / PILLARS_FILE, mmap_mode="r")
+        self.bitmap = lru_cache(maxsize=1024)(self._bitmap)
+
+    def _bitmap(self, term: str) -> Bitmap:
+        """Bitmap of one stored term, read from the mapped pool; ValueError for unknown terms"""
+        if term not in self.terms:
+            family, _, value = term.partition("=")
+            if family not in FAMILIES or not value or (family == "关系" and value not in TERM_ALIASES):
+                raise ValueError(f"未知查询条件: {term}")
+            return Bitmap()
+        first, count, _ = self.terms[term]
+        containers = {}
+        for key, kind, offset, length in self._containers[first:first + count].tolist():
+            data = np.asarray(self._pool[offset:offset + length])
+            containers[key] = (kind, data.view(np.uint64) if kind == _BITSET else data)
+        return Bitmap(containers)
+
+    def cardinality(self, term: str) -> int:
+        return self.terms[term][2] if term in self.terms else 0
+
+    def query(self, query: str, limit: int = DEFAULT_LIMIT) -> Dict[str, Any]:
+        """
+        Charts matching every condition of the query.
+
+        Positive terms are intersected smallest first and negated ones
+        subtracted afterwards; at least one positive term is required.
+        Returns the total count and the first `limit` charts in index order.
+        """
+        started = time.perf_counter()
+        conditions = parse_query(query)
+        positive = sorted({term for term, negated in conditions if not negated}, key=self.cardinality)
+        negative = {term for term, negated in conditions if negated}
+        if not positive:
+            raise ValueError("至少需要一个肯定条件")
+
+        bitmaps = [self.bitmap(term) for term in positive + sorted(negative)]
+        result = bitmaps[0]
+        for bitmap in bitmaps[1:len(positive)]:
+            if not result.containers:
+                break
+            result = result & bitmap
+        for bitmap in bitmaps[len(positive):]:
+            if not result.containers:
+                break
+            result = result - bitmap
+
+        members = result.to_array(limit)
+        return {
+            "query": query,
+            "terms": positive + [f"NOT {term}" for term in sorted(negative)],
+            "count": len(result),
+            "charts": [{"id": str(self._ids[i]), "full_bazi": " ".join(JIA_ZI[p] for p in self._pillars[i])}
+                       for i in members.tolist()],
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 3),
+        }
+
+    def facets(self, family: str) -> Dict[str, int]:
+        """Chart counts of every value of a term family, e.g. 格局 or 日柱"""
+        prefix = family + "="
+        return {term[len(prefix):]: info[2] for term, info in self.terms.items() if term.startswith(prefix)}
+
+
+_chart_index = None
+_chart_index_lock = threading.Lock()
+
+
+def get_chart_index() -> ChartIndex:
+    """Process-wide index over DEFAULT_INDEX_DIR; raises OSError if it has not been built"""
+    global _chart_index
+    with _chart_index_lock:
+        if _chart_index is None:
+            _chart_index = ChartIndex()
+    return _chart_index
+
+
+def main():
+    parser = argparse.ArgumentParser(description="千机命盘倒排索引：按柱、干支组合、刑冲合害与格局检索")
+    parser.add_argument("--index", default=str(DEFAULT_INDEX_DIR), help="索引目录")
+    parser.add_argument("--build", nargs="+", metavar="SOURCE",
+                        help="从批量排盘NDJSON、合婚候选库(.npz)或JSON记录目录构建索引")
+    parser.add_argument("--query", help="查询，如 \"日柱=庚午 AND 月支=寅 AND 子午冲\"")
+    parser.add_argument("--limit", type=int, default=DEFAULT_LIMIT, help="返回命盘数量上限")
+    parser.add_argument("--facets", help="统计某一类条件的分布，如 格局、日柱、强弱")
+    args = parser.parse_args()
+
+    if args.build:
+        started = time.time()
+        ids, pillars = [], []
+        for chart_id, bazi in read_chart_sources(args.build):
+            try:
+                pillars.append(pillar_indices(bazi))
+            except ValueError as e:
+                print(f"⚠️ 跳过无效八字 {chart_id}: {e}")
+                continue
+            ids.append(chart_id)
+        build_chart_index(ids, pillars, args.index)
+        print(f"✅ 已索引 {len(ids)} 个命盘，用时 {time.time() - started:.1f}s: {args.index}")
+
+    if args.query or args.facets:
+        index = ChartIndex(args.index)
+        if args.facets:
+            for value, count in sorted(index.facets(args.facets).items(), key=lambda item: -item[1]):
+                print(f"{count:>10}  {value}")
+        if args.query:
+            result = index.query(args.query, args.limit)
+            print(f"命中 {result['count']} 个命盘（{result['elapsed_ms']}ms）: {' AND '.join(result['terms'])}")
+            for chart in result["charts"]:
+                print(f"  {chart['full_bazi']}  {chart['id']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,383 @@
+"""
+Qianji Compatibility Engine (合婚)
+
+Couple compatibility scored from small precomputed matrices instead of by
+the model reading two pasted charts:
+
+- STEM_RELATION[10, 10] / BRANCH_RELATION[12, 12]: bitmasks of 天干五合/相冲
+  and 地支六合/三合/六冲/六害/相刑 between any two stems or branches;
+- PILLAR_SCORE[60, 60]: the day-pillar (日干 + 夫妻宫) score of any two
+  sexagenary pillars, folded from the relation weights;
+- ZODIAC_SCORE[12, 12]: the 生肖 score of two year branches;
+- element complementarity: how much of what one chart needs (喜用 elements
+  from its strength, via analyze_batch) the other chart carries.
+
+CompatibilityEngine.pair() explains one couple. The engine also holds a
+store of charts as flat arrays (pillars, gender, element shares and needs),
+so top_k() scores one chart against all of them with a handful of fancy
+indexing and matrix-vector products and an argpartition: about 100k
+charts in a few milliseconds. The store is saved as an .npz file and can
+be filled from the NDJSON output of the batch bazi job:
+
+    python -m src.core.compatibility --import charts.ndjson
+    python -m src.core.compatibility --match "庚午 辛巳 庚辰 辛巳" --gender 男
+"""
+import argparse
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+from src.core.bazi_pillars import TIAN_GAN, DI_ZHI, JIA_ZI
+from src.core.chart_analyzer import (WU_XING, STEM_ELEMENT, PillarsLike, analyze_batch,
+                                     pillar_indices)
+from src.core.response_cache import normalize_gender
+
+DEFAULT_STORE_PATH = Path(__file__).parent.parent / "data" / "compatibility_charts.npz"
+DEFAULT_TOP_K = 10
+
+# Relation bits; labels and weights are indexed by bit position
+STEM_RELATIONS = ["五合", "相冲"]
+STEM_WEIGHTS = np.array([1.0, -0.6])
+BRANCH_RELATIONS = ["六合", "三合", "六冲", "六害", "相刑"]
+# 夫妻宫 (day branch) and 生肖 (year branch) weigh the same relations differently
+DAY_BRANCH_WEIGHTS = np.array([1.0, 0.6, -1.0, -0.6, -0.5])
+ZODIAC_WEIGHTS = np.array([1.0, 0.8, -1.0, -0.7, -0.4])
+
+# 三刑 groups and 自刑 branches
+_PUNISHMENT_GROUPS = [("寅", "巳", "申"), ("丑", "戌", "未"), ("子", "卯")]
+_SELF_PUNISHMENT = ["辰", "午", "酉", "亥"]
+
+# Share of the pair score coming from the day pillar's stems vs branches
+DAY_STEM_SHARE = 0.4
+
+# Final score = BASE + weights · components, clipped to 0-100
+SCORE_BASE = 50.0
+DAY_PILLAR_POINTS = 25.0
+ZODIAC_POINTS = 10.0
+COMPLEMENT_POINTS = 150.0
+# Complementarity of two random charts averages about this much
+COMPLEMENT_BASELINE = 0.2
+
+SCORE_LEVELS = [(80, "上等婚配"), (65, "中上婚配"), (50, "中等婚配"), (35, "中下婚配"), (0, "需多磨合")]
+
+
+def _stem_relation_table() -> np.ndarray:
+    a = np.arange(10)[:, None]
+    b = np.arange(10)[None, :]
+    combine = (a - b) % 10 == 5
+    # 甲庚 乙辛 丙壬 丁癸: same polarity, six apart; 戊己 have no clash partner
+    clash = np.abs(a - b) == 6
+    return (combine * 1 | clash * 2).astype(np.uint8)
+
+
+def _branch_relation_table() -> np.ndarray:
+    a = np.arange(12)[:, None]
+    b = np.arange(12)[None, :]
+    combine = (a + b) % 12 == 1
+    # 申子辰 亥卯未 寅午戌 巳酉丑 share the branch index mod 4
+    triple = (a % 4 == b % 4) & (a != b)
+    clash = (a - b) % 12 == 6
+    harm = (a + b) % 12 == 7
+    punish = np.zeros((12, 12), dtype=bool)
+    for group in _PUNISHMENT_GROUPS:
+        for x in group:
+            for y in group:
+                if x != y:
+                    punish[DI_ZHI.index(x), DI_ZHI.index(y)] = True
+    for x in _SELF_PUNISHMENT:
+        punish[DI_ZHI.index(x), DI_ZHI.index(x)] = True
+    bits = combine * 1 | triple * 2 | clash * 4 | harm * 8 | punish * 16
+    return bits.astype(np.uint8)
+
+
+def _weighted(relations: np.ndarray, weights: np.ndarray) -> np.ndarray:
+    """Sum of the weights of the set bits, clipped to [-1, 1]"""
+    bits = (relations[..., None] >> np.arange(len(weights))) & 1
+    return np.clip(bits @ weights, -1.0, 1.0)
+
+
+STEM_RELATION = _stem_relation_table()
+BRANCH_RELATION = _branch_relation_table()
+STEM_SCORE = _weighted(STEM_RELATION, STEM_WEIGHTS)
+DAY_BRANCH_SCORE = _weighted(BRANCH_RELATION, DAY_BRANCH_WEIGHTS)
+ZODIAC_SCORE = _weighted(BRANCH_RELATION, ZODIAC_WEIGHTS)
+
+_SEXAGENARY = np.arange(60)
+PILLAR_SCORE = (DAY_STEM_SHARE * STEM_SCORE[_SEXAGENARY[:, None] % 10, _SEXAGENARY[None, :] % 10]
+                + (1 - DAY_STEM_SHARE) * DAY_BRANCH_SCORE[_SEXAGENARY[:, None] % 12,
+                                                          _SEXAGENARY[None, :] % 12])
+
+# Elements that support (同我, 生我) and drain (我生, 我克, 克我) each element
+_SUPPORT = np.zeros((5, 5))
+_DRAIN = np.zeros((5, 5))
+for _e in range(5):
+    _SUPPORT[_e, [_e, (_e - 1) % 5]] = 1 / 2
+    _DRAIN[_e, [(_e + 1) % 5, (_e + 2) % 5, (_e + 3) % 5]] = 1 / 3
+
+
+def element_profiles(pillars) -> Dict[str, np.ndarray]:
+    """
+    Element shares and needs for an (N, 4) array of pillar indices.
+
+    share is the normalized element strength; need puts (1 - self_share)
+    on the supporting elements and self_share on the draining ones, so a
+    weak day master wants 印比 and a strong one 食伤财官. Both rows sum to 1.
+    """
+    pillars = np.asarray(pillars, dtype=np.int64).reshape(-1, 4)
+    result = analyze_batch(pillars)
+    elements = result["element_scores"]
+    share = elements / elements.sum(axis=1, keepdims=True)
+    self_share = result["self_share"][:, None]
+    day_element = STEM_ELEMENT[pillars[:, 2] % 10]
+    need = (1 - self_share) * _SUPPORT[day_element] + self_share * _DRAIN[day_element]
+    return {"share": share, "need": need}
+
+
+def _labels(bits: int, names: Sequence[str]) -> List[str]:
+    return [name for i, name in enumerate(names) if bits >> i & 1]
+
+
+def score_level(score: float) -> str:
+    for threshold, label in SCORE_LEVELS:
+        if score >= threshold:
+            return label
+    return SCORE_LEVELS[-1][1]
+
+
+def _gender_code(gender: Optional[str]) -> int:
+    """1 男, 0 女, -1 unknown"""
+    gender = normalize_gender(gender or "")
+    return {"男": 1, "女": 0}.get(gender, -1)
+
+
+def chart_arrays(pillars) -> Dict[str, np.ndarray]:
+    """
+    Per-chart arrays the one-vs-many scorer reads, for (N, 4) pillar indices.
+
+    key is day_pillar * 12 + year_branch, the cell of the query's static
+    score table; profile is [share | need] as float32.
+    """
+    pillars = np.asarray(pillars, dtype=np.uint8).reshape(-1, 4)
+    profile = element_profiles(pillars)
+    return {
+        "pillars": pillars,
+        "key": pillars[:, 2].astype(np.intp) * 12 + pillars[:, 0] % 12,
+        "profile": np.hstack([profile["share"], profile["need"]]).astype(np.float32),
+    }
+
+
+def query_tables(indices: Sequence[int]):
+    """
+    (static, weights) for one chart: static[key] holds the day-pillar and
+    zodiac points against every (day pillar, year branch) cell plus the
+    constant terms, and profile @ weights the complementarity points.
+    """
+    static = (SCORE_BASE - COMPLEMENT_POINTS * COMPLEMENT_BASELINE
+              + DAY_PILLAR_POINTS * PILLAR_SCORE[indices[2]][:, None]
+              + ZODIAC_POINTS * ZODIAC_SCORE[indices[0] % 12][None, :]).ravel()
+    profile = element_profiles([indices])
+    weights = 0.5 * COMPLEMENT_POINTS * np.concatenate([profile["need"][0], profile["share"][0]])
+    return static, weights.astype(np.float32)
+
+
+def raw_scores(indices: Sequence[int], charts: Dict[str, np.ndarray]) -> np.ndarray:
+    """Unclipped scores of one chart against chart_arrays() output; used for ranking"""
+    static, weights = query_tables(indices)
+    return static.take(charts["key"]) + charts["profile"] @ weights
+
+
+def score_arrays(indices: Sequence[int], charts: Dict[str, np.ndarray]) -> np.ndarray:
+    """Scores (0-100) of one chart against chart_arrays() output"""
+    return np.clip(raw_scores(indices, charts), 0.0, 100.0)
+
+
+class CompatibilityEngine:
+    """Pairwise 合婚 scores and one-vs-many matching over a store of charts"""
+
+    def __init__(self, store_path: Optional[str] = None):
+        self.store_path = Path(store_path) if store_path else DEFAULT_STORE_PATH
+        self._lock = threading.Lock()
+        self._store = {"ids": np.zeros(0, dtype="U1"), "gender": np.zeros(0, dtype=np.int8),
+                       **chart_arrays(np.zeros((0, 4)))}
+        if self.store_path.exists():
+            self.load(self.store_path)
+
+    def __len__(self):
+        return len(self._store["ids"])
+
+    def score_many(self, query: PillarsLike, pillars) -> np.ndarray:
+        """Scores (0-100) of one chart against an (N, 4) array of pillar indices"""
+        return score_arrays(pillar_indices(query), chart_arrays(pillars))
+
+    def pair(self, a: PillarsLike, b: PillarsLike) -> Dict[str, Any]:
+        """Score and the relations behind it for one couple"""
+        a, b = pillar_indices(a), pillar_indices(b)
+        profile_a, profile_b = element_profiles([a]), element_profiles([b])
+        score = round(float(score_arrays(a, chart_arrays([b]))[0]), 1)
+        complement = 0.5 * (profile_a["need"][0] @ profile_b["share"][0]
+                            + profile_b["need"][0] @ profile_a["share"][0])
+
+        def top_elements(values):
+            return [WU_XING[i] for i in np.argsort(-values)[:2]]
+
+        return {
+            "pillars": [[JIA_ZI[i] for i in a], [JIA_ZI[i] for i in b]],
+            "score": score,
+            "level": score_level(score),
+            "day_stems": TIAN_GAN[a[2] % 10] + TIAN_GAN[b[2] % 10],
+            "day_stem_relations": _labels(int(STEM_RELATION[a[2] % 10, b[2] % 10]), STEM_RELATIONS),
+            "day_branches": DI_ZHI[a[2] % 12] + DI_ZHI[b[2] % 12],
+            "day_branch_relations": _labels(int(BRANCH_RELATION[a[2] % 12, b[2] % 12]), BRANCH_RELATIONS),
+            "zodiac_branches": DI_ZHI[a[0] % 12] + DI_ZHI[b[0] % 12],
+            "zodiac_relations": _labels(int(BRANCH_RELATION[a[0] % 12, b[0] % 12]), BRANCH_RELATIONS),
+            "components": {
+                "day_pillar": round(float(PILLAR_SCORE[a[2], b[2]]), 3),
+                "zodiac": round(float(ZODIAC_SCORE[a[0] % 12, b[0] % 12]), 3),
+                "complement": round(float(complement), 3),
+            },
+            "needs": [top_elements(profile_a["need"][0]), top_elements(profile_b["need"][0])],
+            "strong_elements": [top_elements(profile_a["share"][0]), top_elements(profile_b["share"][0])],
+        }
+
+    def _replace_store(self, ids: np.ndarray, gender: np.ndarray, charts: Dict[str, np.ndarray]) -> int:
+        # Readers keep the dict they started with; a new one is swapped in
+        self._store = {"ids": ids, "gender": gender, **charts}
+        return len(ids)
+
+    def add(self, ids: Iterable[Any], pillars, genders: Iterable[Optional[str]]) -> int:
+        """Append charts to the store; returns the new store size"""
+        ids = np.asarray([str(i) for i in ids])
+        genders = np.asarray([_gender_code(g) for g in genders], dtype=np.int8)
+        charts = chart_arrays(pillars)
+        if not len(ids) == len(charts["pillars"]) == len(genders):
+            raise ValueError("ids、八字与性别数量不一致")
+        with self._lock:
+            store = self._store
+            return self._replace_store(
+                np.concatenate([store["ids"], ids]),
+                np.concatenate([store["gender"], genders]),
+                {name: np.concatenate([store[name], charts[name]]) for name in charts})
+
+    def top_k(self, query: PillarsLike, k: int = DEFAULT_TOP_K,
+              gender: Optional[str] = None, exclude_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Best k matches for a chart among the stored charts.
+
+        With the querying person's gender, only stored charts of the other
+        gender are considered. Ranking uses the unclipped score, so
+        matches past 100 stay ordered; ties keep store order.
+        """
+        store = self._store
+        if not len(store["ids"]) or k <= 0:
+            return []
+        scores = raw_scores(pillar_indices(query), store)
+        code = _gender_code(gender)
+        if code >= 0:
+            scores[store["gender"] != 1 - code] = -np.inf
+        if exclude_id is not None:
+            scores[store["ids"] == str(exclude_id)] = -np.inf
+
+        k = min(k, len(scores))
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.lexsort((best, -scores[best]))]
+        return [{
+            "id": str(store["ids"][i]),
+            "full_bazi": " ".join(JIA_ZI[p] for p in store["pillars"][i]),
+            "score": round(float(min(max(scores[i], 0.0), 100.0)), 1),
+        } for i in best if np.isfinite(scores[i])]
+
+    def save(self, path: Optional[str] = None):
+        path = Path(path) if path else self.store_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        store = self._store
+        tmp_path = path.with_suffix(".tmp.npz")
+        np.savez(tmp_path, ids=store["ids"], pillars=store["pillars"], gender=store["gender"])
+        os.replace(tmp_path, path)
+
+    def load(self, path: Optional[str] = None) -> int:
+        """Replace the store with a saved one; element profiles are recomputed"""
+        with np.load(Path(path) if path else self.store_path, allow_pickle=False) as data:
+            ids, pillars, gender = data["ids"], data["pillars"], data["gender"]
+        charts = chart_arrays(pillars)
+        with self._lock:
+            return self._replace_store(ids, gender, charts)
+
+    def import_batch_output(self, path: str) -> int:
+        """Add the charts of a bazi batch NDJSON result file; rows with errors are skipped"""
+        ids, pillars, genders = [], [], []
+        with open(path, "r", encoding="utf-8") as f:
+            for row_number, line in enumerate(f):
+                if not line.strip():
+                    continue
+                row = json.loads(line)
+                if "error" in row or not row.get("full_bazi"):
+                    continue
+                record = row.get("input") or {}
+                ids.append(row.get("id") if row.get("id") is not None else row_number)
+                pillars.append(pillar_indices(row["full_bazi"]))
+                genders.append(record.get("gender"))
+        if not ids:
+            return len(self)
+        return self.add(ids, pillars, genders)
+
+
+def format_compatibility(result: Dict[str, Any]) -> str:
+    """Render pair() output as a compact prompt block"""
+    def relations(items):
+        return "、".join(items) if items else "无特殊关系"
+
+    components = result["components"]
+    return "\n".join([
+        "【合婚分析（本地精确计算）】",
+        f"- 双方八字：{' '.join(result['pillars'][0])} ／ {' '.join(result['pillars'][1])}",
+        f"- 综合评分：{result['score']}（{result['level']}）",
+        f"- 日干{result['day_stems']}：{relations(result['day_stem_relations'])}",
+        f"- 夫妻宫{result['day_branches']}：{relations(result['day_branch_relations'])}",
+        f"- 生肖{result['zodiac_branches']}：{relations(result['zodiac_relations'])}",
+        f"- 五行互补度：{components['complement']:.0%}，"
+        f"甲方喜{''.join(result['needs'][0])}、旺{''.join(result['strong_elements'][0])}；"
+        f"乙方喜{''.join(result['needs'][1])}、旺{''.join(result['strong_elements'][1])}",
+    ])
+
+
+_compatibility_engine = None
+_compatibility_engine_lock = threading.Lock()
+
+
+def get_compatibility_engine() -> CompatibilityEngine:
+    """Process-wide engine so the chart store is loaded once"""
+    global _compatibility_engine
+    with _compatibility_engine_lock:
+        if _compatibility_engine is None:
+            _compatibility_engine = CompatibilityEngine()
+    return _compatibility_engine
+
+
+def main():
+    parser = argparse.ArgumentParser(description="千机合婚：双人配对评分与候选库Top-K匹配")
+    parser.add_argument("--store", default=str(DEFAULT_STORE_PATH), help="候选八字库路径（.npz）")
+    parser.add_argument("--import", dest="import_path", help="导入批量排盘的NDJSON结果到候选库")
+    parser.add_argument("--pair", nargs=2, metavar="BAZI", help="两人八字，如 \"庚午 辛巳 庚辰 辛巳\"")
+    parser.add_argument("--match", metavar="BAZI", help="在候选库中为该八字寻找最佳配对")
+    parser.add_argument("--gender", help="查询者性别（男/女），只匹配异性")
+    parser.add_argument("--top", type=int, default=DEFAULT_TOP_K, help="返回数量")
+    args = parser.parse_args()
+
+    engine = CompatibilityEngine(args.store)
+    if args.import_path:
+        size = engine.import_batch_output(args.import_path)
+        engine.save()
+        print(f"✅ 候选库共 {size} 个八字: {args.store}")
+    if args.pair:
+        print(format_compatibility(engine.pair(*args.pair)))
+    if args.match:
+        for match in engine.top_k(args.match, args.top, args.gender):
+            print(f"{match['score']:>5}  {match['full_bazi']}  {match['id']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,308 @@
+"""
+Qianji Token-Budgeted Context Builder
+
+Assembles the message list sent to the model under a per-model prompt token
+budget instead of fixed history[-N:] slices:
+
+- the system prompt and the user's pillars (session context "bazi_info")
+  are always kept;
+- recent turns are included verbatim, newest first, until the budget is
+  spent;
+- older turns are folded into a rolling summary. For sessions backed by the
+  conversation store the summary is updated incrementally (only turns newer
+  than its watermark are folded in) and cached in the session context, so
+  each old turn is summarized once. Turns about to fall off the store's
+  per-session cap are folded in ahead of time even if they still fit the
+  budget, so nothing leaves the store without reaching the summary.
+
+build() never waits on the summarizer: it reads the cached summary, and
+turns not yet folded in are folded by a background model call once
+SUMMARY_BATCH_MESSAGES of them have piled up. Until then the ones outside
+the verbatim window are appended to the cached text with the local
+extractive summary.
+
+Messages are laid out for provider-side prompt caching: the static persona
+is a byte-identical leading system message, followed by the per-session
+pinned facts, summary and history, which only grow between turns until the
+verbatim window slides or the summary is rewritten. Volatile content
+(current date, retrieved snippets, search results) goes into the trailing
+user message, so it never breaks the prefix. prefix_report() gives the
+lengths of the stable parts.
+
+Token counts use a local tokenizer.json when the `tokenizers` package and a
+file configured in model_config.json ("contextBudget": {"tokenizer": ...})
+are available, and a conservative CJK-aware estimate otherwise.
+"""
+import math
+import os
+import re
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from src.core.conversation_store import ConversationStore, get_conversation_store
+from src.core.llm_client import MODEL_CONFIG_PATH, load_model_settings, get_llm_client
+
+DEFAULT_MAX_PROMPT_TOKENS = 16000
+DEFAULT_SUMMARY_TOKENS = 400
+SUMMARY_KEY = "rolling_summary"
+
+# Turns are folded this many messages before the store's cap would evict
+# them, leaving room for exchanges recorded without a model call
+# (almanac and daily fortune replies)
+EVICTION_MARGIN_MESSAGES = 10
+# Pending turns per background summary call; half the margin, so a batch is
+# folded while its oldest turn is still a few exchanges away from eviction
+SUMMARY_BATCH_MESSAGES = EVICTION_MARGIN_MESSAGES // 2
+
+# Every message costs a few tokens of chat-template framing
+MESSAGE_OVERHEAD_TOKENS = 4
+
+_CJK = re.compile(r"[　-〿㐀-䶿一-鿿＀-￯]")
+
+SUMMARY_PROMPT = """请把以下命理咨询对话压缩为一段不超过{limit}字的中文摘要，供后续对话参考。
+保留：用户的出生信息与八字、已给出的主要结论、用户关心的问题和尚未解答的问题。
+不要添加对话中没有的内容。
+
+已有摘要：
+{previous}
+
+新增对话：
+{turns}"""
+
+
+def estimate_tokens(text: str) -> int:
+    """Upper-bound estimate: one token per CJK character, ~4 characters per token otherwise"""
+    cjk = len(_CJK.findall(text))
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+
+def _load_tokenizer(path: Optional[str]):
+    if not path:
+        return None
+    if not os.path.isabs(path):
+        path = os.path.join(MODEL_CONFIG_PATH.parent, path)
+    try:
+        from tokenizers import Tokenizer
+        return Tokenizer.from_file(path)
+    except Exception as e:
+        print(f"Tokenizer unavailable ({e}), using estimated token counts")
+        return None
+
+
+def format_turns(turns: List[Dict[str, str]]) -> str:
+    """Render turns as 用户：/助手： lines for text prompts"""
+    lines = []
+    for msg in turns:
+        role = "用户" if msg.get("role") == "user" else "助手"
+        lines.append(f"{role}：{msg.get('content', '')}")
+    return "\n".join(lines)
+
+
+def llm_summarize(previous: str, turns: List[Dict[str, str]], limit: int) -> str:
+    """Fold turns into the previous summary with a short, non-thinking model call"""
+    prompt = SUMMARY_PROMPT.format(limit=limit, previous=previous or "（无）",
+                                   turns=format_turns(turns))
+    return get_llm_client().chat(
+        [{"role": "user", "content": prompt}], timeout=30,
+        max_tokens=limit * 2, temperature=0.3, extra_body={"enable_thinking": False}
+    ).strip()
+
+
+def extractive_summary(previous: str, turns: List[Dict[str, str]], limit: int) -> str:
+    """Local fallback: keep the opening of each user turn"""
+    points = [previous] if previous else []
+    points += [msg.get("content", "")[:60] for msg in turns if msg.get("role") == "user"]
+    summary = "；".join(p for p in points if p)
+    return summary[-limit:]
+
+
+class ContextBuilder:
+    """Fits system prompt, pinned facts, summary and recent turns into a token budget"""
+
+    def __init__(self, model: Optional[str] = None, store: Optional[ConversationStore] = None,
+                 summarizer: Callable[[str, List[Dict[str, str]], int], str] = llm_summarize,
+                 max_prompt_tokens: Optional[int] = None,
+                 summary_tokens: int = DEFAULT_SUMMARY_TOKENS, background: bool = True):
+        settings = load_model_settings()
+        self.model = model or settings["default_model"]
+        budget = settings["models"].get(self.model, {}).get("context_budget", {})
+        self.max_prompt_tokens = max_prompt_tokens or budget.get(
+            "maxPromptTokens", DEFAULT_MAX_PROMPT_TOKENS)
+        self.summary_tokens = summary_tokens
+        self.tokenizer = _load_tokenizer(budget.get("tokenizer"))
+        self.store = store
+        self.summarizer = summarizer
+        # False runs summary folds inline, for scripts and tests
+        self.background = background
+        self._folding = set()
+        self._folding_lock = threading.Lock()
+
+    def count_tokens(self, text: str) -> int:
+        if self.tokenizer is not None:
+            return len(self.tokenizer.encode(text).ids)
+        return estimate_tokens(text)
+
+    def _message_tokens(self, msg: Dict[str, str]) -> int:
+        return self.count_tokens(msg.get("content", "")) + MESSAGE_OVERHEAD_TOKENS
+
+    def _store(self) -> ConversationStore:
+        if self.store is None:
+            self.store = get_conversation_store()
+        return self.store
+
+    def pinned_facts(self, session_id: Optional[str]) -> Optional[str]:
+        """The user's pillars from the session context, if known"""
+        if not session_id:
+            return None
+        bazi_info = self._store().get_context(session_id).get("bazi_info")
+        return f"用户八字信息: {bazi_info}" if bazi_info else None
+
+    def _summarize(self, older: List[Dict[str, str]], session_id: Optional[str],
+                   sent_from: int) -> str:
+        """
+        Rolling summary of older turns, without waiting on the model.
+
+        older[sent_from:] are still sent verbatim; they are only folded in
+        ahead of their eviction from the store.
+        """
+        if not older:
+            return ""
+        if not session_id:
+            # No place to cache it; stay local rather than paying a model call per request
+            return extractive_summary("", older[:sent_from], self.summary_tokens)
+
+        cached = self._store().get_context(session_id).get(SUMMARY_KEY) or {}
+        previous = cached.get("text", "")
+        watermark = cached.get("upto", "")
+        pending = [msg for msg in older if msg.get("timestamp", "") > watermark]
+        if len(pending) >= SUMMARY_BATCH_MESSAGES:
+            self._fold_later(session_id, previous, watermark, pending)
+        unsent = [msg for msg in older[:sent_from] if msg.get("timestamp", "") > watermark]
+        if unsent:
+            return extractive_summary(previous, unsent, self.summary_tokens)
+        return previous
+
+    def _fold_later(self, session_id: str, previous: str, watermark: str,
+                    pending: List[Dict[str, str]]):
+        """Fold pending turns into the session's summary, one fold per session at a time"""
+        with self._folding_lock:
+            if session_id in self._folding:
+                return
+            self._folding.add(session_id)
+        if self.background:
+            threading.Thread(target=self._fold, args=(session_id, previous, watermark, pending),
+                             name="context-summary", daemon=True).start()
+        else:
+            self._fold(session_id, previous, watermark, pending)
+
+    def _fold(self, session_id: str, previous: str, watermark: str, pending: List[Dict[str, str]]):
+        try:
+            try:
+                summary = self.summarizer(previous, pending, self.summary_tokens)
+            except Exception as e:
+                print(f"Summary error: {e}")
+                summary = extractive_summary(previous, pending, self.summary_tokens)
+            cached = self._store().get_context(session_id).get(SUMMARY_KEY) or {}
+            # Another worker process may have folded these turns in the meantime
+            if cached.get("upto", "") == watermark:
+                self._store().update_context(session_id, {
+                    SUMMARY_KEY: {"text": summary, "upto": pending[-1].get("timestamp", "")}
+                })
+        finally:
+            with self._folding_lock:
+                self._folding.discard(session_id)
+
+    def fit_history(self, history: List[Dict[str, str]], budget: int,
+                    session_id: Optional[str] = None) -> Tuple[str, List[Dict[str, str]]]:
+        """
+        Split history into (summary of older turns, recent turns kept verbatim).
+
+        Recent turns are taken newest first while they fit in budget minus
+        the room reserved for the summary. With a session_id, turns near the
+        store's max_messages cap are summarized too (and may also still be
+        kept verbatim), since the store is about to drop them.
+        """
+        history = [msg for msg in history or [] if msg.get("content")]
+        available = budget - self.summary_tokens
+        recent_start = len(history)
+        for i in range(len(history) - 1, -1, -1):
+            cost = self._message_tokens(history[i])
+            if cost > available:
+                break
+            available -= cost
+            recent_start = i
+        fold_end = recent_start
+        if session_id:
+            cap = getattr(self._store(), "max_messages", None)
+            if cap:
+                fold_end = max(fold_end, len(history) - max(cap - EVICTION_MARGIN_MESSAGES, 1))
+        summary = self._summarize(history[:fold_end], session_id, recent_start)
+        return summary, history[recent_start:]
+
+    def build(self, prompt: str, history: Optional[List[Dict[str, str]]] = None,
+              system_prompt: Optional[str] = None, session_id: Optional[str] = None,
+              pinned: Optional[str] = None, volatile: Optional[str] = None) -> List[Dict[str, str]]:
+        """
+        Message list for one request, most stable content first.
+
+        system_prompt must not contain per-request data; pass the current
+        date, retrieved snippets and similar through `volatile`, which is
+        placed in the trailing message ahead of the prompt.
+        """
+        pinned = pinned or self.pinned_facts(session_id)
+        if volatile:
+            prompt = f"{volatile}\n\n用户问题: {prompt}"
+
+        messages = []
+        if system_prompt:
+            messages.append({"role": "system", "content": system_prompt})
+        if pinned:
+            messages.append({"role": "system", "content": pinned})
+        fixed = sum(self._message_tokens(msg) for msg in messages)
+        fixed += self.count_tokens(prompt) + MESSAGE_OVERHEAD_TOKENS
+
+        summary, recent = self.fit_history(history, self.max_prompt_tokens - fixed, session_id)
+        if summary:
+            messages.append({"role": "system", "content": f"此前对话摘要：{summary}"})
+        for msg in recent:
+            messages.append({
+                "role": "user" if msg.get("role") == "user" else "assistant",
+                "content": msg["content"]
+            })
+        messages.append({"role": "user", "content": prompt})
+        return messages
+
+    def prefix_report(self, messages: List[Dict[str, str]]) -> Dict[str, int]:
+        """
+        Token counts of the stable parts of a built message list.
+
+        static_tokens is the leading system message, identical across all
+        requests. cacheable_tokens is everything before the trailing
+        message: an upper bound on what the provider can serve from its
+        prefix cache. It matches the previous turn of the session only while
+        the verbatim window and the summary are unchanged; once old turns
+        slide out or the summary is rewritten, the cache stops at the first
+        changed message.
+        """
+        counts = [self._message_tokens(msg) for msg in messages]
+        leading_system = messages[0]["role"] == "system" and len(messages) > 1
+        return {
+            "static_tokens": counts[0] if leading_system else 0,
+            "cacheable_tokens": sum(counts[:-1]),
+            "total_tokens": sum(counts),
+        }
+
+
+_context_builders: Dict[str, ContextBuilder] = {}
+_context_builders_lock = threading.Lock()
+
+
+def get_context_builder(model: Optional[str] = None) -> ContextBuilder:
+    """Shared ContextBuilder per model"""
+    key = model or ""
+    with _context_builders_lock:
+        builder = _context_builders.get(key)
+        if builder is None:
+            builder = ContextBuilder(model)
+            _context_builders[key] = builder
+    return builder
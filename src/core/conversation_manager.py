@@ -4,47 +4,92 @@ Handles context, intent understanding, and deep analysis
 """
 import json
 from datetime import datetime
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
+
+from src.core.conversation_store import ConversationStore, get_conversation_store
+from src.core.context_builder import ContextBuilder, format_turns
+from src.core.daily_fortune import fortune_query_offset, lookup_daily_fortune
+
+# Static persona and per-intent instructions, byte-identical on every request
+# so providers can cache it; the date and intent go in the trailing message
+DEEP_ANALYSIS_SYSTEM_PROMPT = """你是一位专业命理大师，精通《渊海子平》、《三命通会》、《滴天髓》等十大命理经典。
+
+每条用户消息前附有当前日期和回答类型，请按对应要求回答：
+
+【今日运势】请提供深度的今日运势分析，包括：
+1. 今日天干地支详细分析
+2. 五行生克关系对用户的影响
+3. 适合/不适合的活动建议
+4. 重要注意事项和趋吉避凶建议
+5. 如果用户有八字信息，结合个人八字进行个性化分析
+要求回答专业、详细、实用。
+
+【八字分析】请提供专业的八字命理分析，包括：
+1. 四柱排盘和格局判断
+2. 日主强弱和用神选择
+3. 大运流年详细分析
+4. 事业、财运、感情、健康等各方面建议
+5. 趋吉避凶的具体方法
+要求回答专业、详细、实用。
+
+【一般咨询】请以专业命理大师的身份进行回答，如果问题与命理相关，请提供专业分析；如果是一般性问题，请以命理学的角度给出智慧建议。
+要求回答自然、专业、有深度。"""
+
+DEFAULT_USER_CONTEXT = {
+    "bazi_info": None,
+    "analysis_preferences": [],
+    "conversation_style": "detailed"
+}
 
 class ConversationManager:
-    def __init__(self):
-        self.conversations = {}  # session_id -> conversation history
-        self.user_contexts = {}  # session_id -> user context (bazi info, preferences, etc.)
+    def __init__(self, store: Optional[ConversationStore] = None):
+        # session_id -> conversation history and user context (bazi info, preferences, etc.)
+        self.store = store if store is not None else get_conversation_store()
+        self.context_builder = ContextBuilder(store=self.store)
         
     def get_conversation_history(self, session_id: str) -> List[Dict[str, str]]:
         """Get conversation history for a session"""
-        if session_id not in self.conversations:
-            self.conversations[session_id] = []
-        return self.conversations[session_id]
+        return self.store.get_history(session_id)
     
     def add_message(self, session_id: str, role: str, content: str):
         """Add message to conversation history"""
-        if session_id not in self.conversations:
-            self.conversations[session_id] = []
-        self.conversations[session_id].append({
-            "role": role,
-            "content": content,
-            "timestamp": datetime.now().isoformat()
-        })
+        self.store.append(session_id, role, content)
     
     def get_user_context(self, session_id: str) -> Dict[str, Any]:
-        """Get user context (bazi info, preferences, etc.)"""
-        if session_id not in self.user_contexts:
-            self.user_contexts[session_id] = {
-                "bazi_info": None,
-                "analysis_preferences": [],
-                "conversation_style": "detailed"
-            }
-        return self.user_contexts[session_id]
+        """Get user context (bazi info, preferences, etc.); use update_user_context to change it"""
+        return {**DEFAULT_USER_CONTEXT, **self.store.get_context(session_id)}
     
     def update_user_context(self, session_id: str, context: Dict[str, Any]):
         """Update user context"""
-        if session_id not in self.user_contexts:
-            self.user_contexts[session_id] = {}
-        self.user_contexts[session_id].update(context)
+        self.store.update_context(session_id, context)
     
-    def generate_deep_analysis_prompt(self, user_message: str, session_id: str) -> str:
-        """Generate prompt for deep analysis based on context and intent"""
+    def _deep_analysis_intent(self, user_message: str) -> str:
+        """Which instruction block of DEEP_ANALYSIS_SYSTEM_PROMPT applies"""
+        if fortune_query_offset(user_message) == 0 or (
+                "今天" in user_message and ("怎么样" in user_message or "如何" in user_message)):
+            return "今日运势"
+        if "八字" in user_message or "命理" in user_message or "分析" in user_message:
+            return "八字分析"
+        return "一般咨询"
+    
+    def cached_daily_fortune(self, user_message: str, session_id: str) -> Optional[str]:
+        """
+        Precomputed 今日运势 for the session's pinned pillars, or None.
+        
+        Checked before generate_deep_analysis_prompt: the daily branch only
+        depends on the day and the user's day master, so the nightly readings
+        from src.core.daily_fortune can answer it without an LLM call.
+        """
+        return lookup_daily_fortune(user_message, self.get_user_context(session_id)["bazi_info"])
+    
+    def generate_deep_analysis_messages(self, user_message: str, session_id: str) -> List[Dict[str, str]]:
+        """
+        Prefix-stable message list for deep analysis.
+        
+        Static persona first, then the session's pinned facts and history
+        (recent turns verbatim, older ones as a rolling summary), and finally
+        the date, intent and question.
+        """
         history = self.get_conversation_history(session_id)
         context = self.get_user_context(session_id)
         
@@ -56,69 +101,25 @@ class ConversationManager:
         if context["analysis_preferences"]:
             context_summary += f"用户偏好: {', '.join(context['analysis_preferences'])}\n"
         
-        # Build conversation history
-        history_text = ""
-        for msg in history[-5:]:  # Last 5 messages
-            history_text += f"{msg['role']}: {msg['content']}\n"
+        volatile = (f"当前日期: {datetime.now().strftime('%Y年%m月%d日 %A')}\n"
+                    f"回答类型: 【{self._deep_analysis_intent(user_message)}】")
         
-        # Determine intent and generate appropriate prompt
-        if "今天" in user_message and ("怎么样" in user_message or "如何" in user_message):
-            # Deep daily analysis intent
-            prompt = f"""你是一位专业的命理大师，精通《渊海子平》、《三命通会》、《滴天髓》等十大命理经典。
-
-当前日期: {datetime.now().strftime('%Y年%m月%d日 %A')}
-{context_summary}
-
-对话历史:
-{history_text}
-
-用户问题: "{user_message}"
-
-请提供深度的今日运势分析，包括：
-1. 今日天干地支详细分析
-2. 五行生克关系对用户的影响
-3. 适合/不适合的活动建议
-4. 重要注意事项和趋吉避凶建议
-5. 如果用户有八字信息，结合个人八字进行个性化分析
-
-要求回答专业、详细、实用。"""
-            
-        elif "八字" in user_message or "命理" in user_message or "分析" in user_message:
-            # Bazi analysis intent
-            prompt = f"""你是一位专业命理大师，精通《渊海子平》、《三命通会》、《滴天髓》等十大命理经典。
-
-{context_summary}
-
-对话历史:
-{history_text}
-
-用户问题: "{user_message}"
-
-请提供专业的八字命理分析，包括：
-1. 四柱排盘和格局判断
-2. 日主强弱和用神选择
-3. 大运流年详细分析
-4. 事业、财运、感情、健康等各方面建议
-5. 趋吉避凶的具体方法
-
-要求回答专业、详细、实用。"""
-            
-        else:
-            # General conversation intent
-            prompt = f"""你是一位专业命理大师，精通《渊海子平》、《三命通会》、《滴天髓》等十大命理经典。
-
-{context_summary}
-
-对话历史:
-{history_text}
-
-用户问题: "{user_message}"
-
-请以专业命理大师的身份进行回答，如果问题与命理相关，请提供专业分析；如果是一般性问题，请以命理学的角度给出智慧建议。
-
-要求回答自然、专业、有深度。"""
-            
-        return prompt
+        return self.context_builder.build(
+            f'"{user_message}"', history,
+            system_prompt=DEEP_ANALYSIS_SYSTEM_PROMPT,
+            session_id=session_id,
+            pinned=context_summary.strip() or None,
+            volatile=volatile
+        )
+    
+    def generate_deep_analysis_prompt(self, user_message: str, session_id: str) -> str:
+        """Generate prompt for deep analysis based on context and intent, as one string"""
+        messages = self.generate_deep_analysis_messages(user_message, session_id)
+        parts = []
+        for msg in messages[:-1]:
+            parts.append(msg["content"] if msg["role"] == "system" else format_turns([msg]))
+        parts.append(messages[-1]["content"])
+        return "\n\n".join(parts)
     
     def should_extract_bazi_info(self, user_message: str) -> bool:
         """Determine if user message contains bazi information to extract"""
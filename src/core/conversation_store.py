@@ -0,0 +1,295 @@
+"""
+Qianji Conversation Store
+
+Server-side chat history so clients send a session id instead of re-uploading
+the whole conversation on every message. Two interchangeable backends:
+
+- MemoryConversationStore: process-local LRU over sessions, each capped at
+  max_messages, with idle sessions evicted. Memory stays flat no matter how
+  many sessions come and go.
+- SQLiteConversationStore: WAL-mode SQLite file with one row per message,
+  shared across gunicorn workers and kept across restarts. Each append
+  deletes the session's rows beyond the newest max_messages, so the file
+  stays bounded like the in-memory store.
+
+The backend is picked by QJI_CONVERSATION_STORE ("memory" or "sqlite",
+default "sqlite") and QJI_CONVERSATION_DB for the SQLite path.
+"""
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+DEFAULT_DB_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(__file__)), "data", "conversations.sqlite3"
+)
+DEFAULT_MAX_SESSIONS = 10000
+DEFAULT_MAX_MESSAGES = 50
+DEFAULT_IDLE_TIMEOUT = 24 * 3600
+
+_SESSION_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+def new_session_id() -> str:
+    return uuid.uuid4().hex
+
+
+def is_valid_session_id(session_id) -> bool:
+    """Session ids come from the browser; only accept short opaque tokens"""
+    return isinstance(session_id, str) and bool(_SESSION_ID_PATTERN.match(session_id))
+
+
+class ConversationStore(ABC):
+    """Interface shared by the conversation store backends"""
+
+    @abstractmethod
+    def get_history(self, session_id: str, limit: Optional[int] = None) -> List[Dict[str, str]]:
+        """Newest messages of a session in chronological order"""
+
+    @abstractmethod
+    def append(self, session_id: str, role: str, content: str):
+        """Append one message to a session"""
+
+    @abstractmethod
+    def get_context(self, session_id: str) -> Dict[str, Any]:
+        """Per-session user context (bazi info, preferences); a copy"""
+
+    @abstractmethod
+    def update_context(self, session_id: str, context: Dict[str, Any]):
+        """Merge keys into the session's user context"""
+
+    @abstractmethod
+    def delete(self, session_id: str):
+        """Drop a session and its context"""
+
+    @abstractmethod
+    def evict_idle(self) -> int:
+        """Drop sessions idle for longer than idle_timeout; returns the count"""
+
+
+class _Session:
+    __slots__ = ("messages", "context", "last_access")
+
+    def __init__(self, max_messages):
+        self.messages = deque(maxlen=max_messages)
+        self.context = {}
+        self.last_access = time.time()
+
+
+class MemoryConversationStore(ConversationStore):
+    """Bounded in-process store: LRU over sessions, capped messages per session"""
+
+    def __init__(self, max_sessions: int = DEFAULT_MAX_SESSIONS,
+                 max_messages: int = DEFAULT_MAX_MESSAGES,
+                 idle_timeout: float = DEFAULT_IDLE_TIMEOUT):
+        self.max_sessions = max_sessions
+        self.max_messages = max_messages
+        self.idle_timeout = idle_timeout
+        self._sessions: "OrderedDict[str, _Session]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _touch(self, session_id, create):
+        session = self._sessions.get(session_id)
+        if session is None:
+            if not create:
+                return None
+            session = _Session(self.max_messages)
+            self._sessions[session_id] = session
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        else:
+            self._sessions.move_to_end(session_id)
+        session.last_access = time.time()
+        return session
+
+    def _evict_idle_locked(self):
+        cutoff = time.time() - self.idle_timeout
+        evicted = 0
+        # Sessions are kept in access order, so idle ones sit at the front
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if session.last_access >= cutoff:
+                break
+            del self._sessions[session_id]
+            evicted += 1
+        return evicted
+
+    def get_history(self, session_id, limit=None):
+        with self._lock:
+            self._evict_idle_locked()
+            session = self._touch(session_id, create=False)
+            if session is None:
+                return []
+            messages = list(session.messages)
+        return messages[-limit:] if limit else messages
+
+    def append(self, session_id, role, content):
+        with self._lock:
+            self._evict_idle_locked()
+            self._touch(session_id, create=True).messages.append({
+                "role": role,
+                "content": content,
+                "timestamp": datetime.now().isoformat()
+            })
+
+    def get_context(self, session_id):
+        with self._lock:
+            session = self._touch(session_id, create=False)
+            return dict(session.context) if session else {}
+
+    def update_context(self, session_id, context):
+        with self._lock:
+            self._touch(session_id, create=True).context.update(context)
+
+    def delete(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def evict_idle(self):
+        with self._lock:
+            return self._evict_idle_locked()
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+class SQLiteConversationStore(ConversationStore):
+    """Persistent store: one sessions row plus the newest max_messages message rows"""
+
+    def __init__(self, path: str = DEFAULT_DB_PATH,
+                 max_messages: int = DEFAULT_MAX_MESSAGES,
+                 idle_timeout: float = DEFAULT_IDLE_TIMEOUT * 30):
+        self.path = path
+        self.max_messages = max_messages
+        self.idle_timeout = idle_timeout
+        self._lock = threading.Lock()
+        self._last_sweep = 0.0
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                session_id TEXT PRIMARY KEY,
+                context TEXT NOT NULL DEFAULT '{}',
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_sessions_access ON sessions (last_access);
+            CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT NOT NULL,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL,
+                timestamp TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_messages_session ON messages (session_id, id);
+        """)
+        self._conn.commit()
+
+    def _touch(self, session_id, now):
+        self._conn.execute(
+            "INSERT INTO sessions (session_id, created_at, last_access) VALUES (?, ?, ?) "
+            "ON CONFLICT(session_id) DO UPDATE SET last_access = excluded.last_access",
+            (session_id, now, now))
+
+    def _maybe_sweep(self, now):
+        """Idle eviction at most once a minute, piggybacked on writes"""
+        if now - self._last_sweep > 60:
+            self._last_sweep = now
+            self._evict_idle_locked(now)
+
+    def _evict_idle_locked(self, now):
+        cutoff = now - self.idle_timeout
+        self._conn.execute(
+            "DELETE FROM messages WHERE session_id IN "
+            "(SELECT session_id FROM sessions WHERE last_access < ?)", (cutoff,))
+        return self._conn.execute("DELETE FROM sessions WHERE last_access < ?", (cutoff,)).rowcount
+
+    def get_history(self, session_id, limit=None):
+        limit = min(limit or self.max_messages, self.max_messages)
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT role, content, timestamp FROM messages WHERE session_id = ? "
+                "ORDER BY id DESC LIMIT ?", (session_id, limit)).fetchall()
+        return [{"role": role, "content": content, "timestamp": timestamp}
+                for role, content, timestamp in reversed(rows)]
+
+    def append(self, session_id, role, content):
+        now = time.time()
+        with self._lock:
+            self._touch(session_id, now)
+            self._conn.execute(
+                "INSERT INTO messages (session_id, role, content, timestamp) VALUES (?, ?, ?, ?)",
+                (session_id, role, content, datetime.now().isoformat()))
+            self._conn.execute(
+                "DELETE FROM messages WHERE session_id = ? AND id <= "
+                "(SELECT id FROM messages WHERE session_id = ? ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                (session_id, session_id, self.max_messages))
+            self._maybe_sweep(now)
+            self._conn.commit()
+
+    def get_context(self, session_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT context FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        return json.loads(row[0]) if row else {}
+
+    def update_context(self, session_id, context):
+        now = time.time()
+        with self._lock:
+            self._touch(session_id, now)
+            row = self._conn.execute(
+                "SELECT context FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+            merged = json.loads(row[0])
+            merged.update(context)
+            self._conn.execute(
+                "UPDATE sessions SET context = ? WHERE session_id = ?",
+                (json.dumps(merged, ensure_ascii=False), session_id))
+            self._conn.commit()
+
+    def delete(self, session_id):
+        with self._lock:
+            self._conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+            self._conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+            self._conn.commit()
+
+    def evict_idle(self):
+        with self._lock:
+            evicted = self._evict_idle_locked(time.time())
+            self._conn.commit()
+        return evicted
+
+    def close(self):
+        self._conn.close()
+
+
+def create_conversation_store(backend: Optional[str] = None) -> ConversationStore:
+    """Build the backend named by `backend` or QJI_CONVERSATION_STORE"""
+    backend = (backend or os.environ.get("QJI_CONVERSATION_STORE", "sqlite")).lower()
+    if backend == "memory":
+        return MemoryConversationStore()
+    if backend == "sqlite":
+        return SQLiteConversationStore(os.environ.get("QJI_CONVERSATION_DB", DEFAULT_DB_PATH))
+    raise ValueError(f"Unknown conversation store backend: {backend}")
+
+
+_conversation_store = None
+_conversation_store_lock = threading.Lock()
+
+
+def get_conversation_store() -> ConversationStore:
+    """Process-wide conversation store"""
+    global _conversation_store
+    with _conversation_store_lock:
+        if _conversation_store is None:
+            _conversation_store = create_conversation_store()
+    return _conversation_store
@@ -0,0 +1,357 @@
+"""
+Qianji Precomputed Daily Fortune (今日运势)
+
+A daily reading only depends on the day's pillars and the reader's day
+master, so instead of one 20-second LLM call per user every morning the
+readings for a date are generated ahead of time, once per subject:
+
+- 10 subjects: the day master stems 甲 ... 癸 (default);
+- 60 subjects: the day pillars 甲子 ... 癸亥, which also capture the
+  冲/合 between the reader's day branch and the day's branch.
+
+Readings are stored in a local SQLite file keyed by (date, subject, prompt
+version); entries older than yesterday are purged. The chat handlers serve
+a cached reading with a locally rendered personal header (the reader's
+pillars, the day's ten-god relation to them) and fall back to the LLM when
+nothing is cached.
+
+Run nightly, e.g. from cron at 22:00:
+    python -m src.core.daily_fortune --tomorrow
+    python -m src.core.daily_fortune --tomorrow --pillars60
+"""
+import argparse
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+
+from src.core.bazi_pillars import TIAN_GAN, DI_ZHI, JIA_ZI
+from src.core.calendar_table import get_calendar_table
+from src.core.chart_analyzer import (HIDDEN_STEMS, MONTH_ELEMENT, SEASON_STATES, STEM_ELEMENT,
+                                     TEN_GOD, TEN_GODS, WU_XING, get_chart_analyzer)
+
+DEFAULT_CACHE_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(__file__)), "data", "daily_fortune_cache.sqlite3"
+)
+DEFAULT_CONCURRENCY = 4
+
+# Bump whenever the reading prompt changes so stale readings are not served
+FORTUNE_PROMPT_VERSION = "daily-1"
+
+DAILY_FORTUNE_SYSTEM_PROMPT = """你是一位专业命理大师，精通《渊海子平》、《三命通会》、《滴天髓》等命理经典。
+
+用户消息给出某一天的干支和一类日主（或日柱），以及已经算好的十神关系。请为这一类人写当天的运势，包括：
+1. 当日干支与日主的生克关系及其含义
+2. 事业、财运、感情、健康四方面的提示
+3. 适合/不适合的活动建议
+4. 趋吉避凶的具体建议
+
+不要编造具体的出生信息，不要称呼具体的人；回答专业、实用，控制在600字以内。"""
+
+_PILLAR = re.compile(r"[甲乙丙丁戊己庚辛壬癸][子丑寅卯辰巳午未申酉戌亥]")
+
+FORTUNE_KEYWORDS = ("运势", "运气", "运程", "吉凶")
+# Bare "今天怎么样" style questions; anything longer needs a fortune keyword
+_BARE_QUESTION = re.compile(r"^我?(今天|今日|明天|明日)(的)?(怎么样|如何|好不好)[?？。!！]*$")
+
+
+def fortune_query_offset(message: str) -> Optional[int]:
+    """0 for a question about today's fortune, 1 for tomorrow's, None otherwise"""
+    text = "".join((message or "").split())
+    if len(text) > 30:
+        return None
+    if not (_BARE_QUESTION.match(text) or any(k in text for k in FORTUNE_KEYWORDS)):
+        return None
+    if "明天" in text or "明日" in text:
+        return 1
+    if "今天" in text or "今日" in text:
+        return 0
+    return None
+
+
+def parse_pillars(bazi_info: Optional[str]) -> Optional[List[str]]:
+    """The four pillars at the start of a stored bazi_info string, or None"""
+    pillars = _PILLAR.findall(bazi_info or "")
+    return pillars[:4] if len(pillars) >= 4 else None
+
+
+def day_info(target_date: date) -> Dict[str, Any]:
+    """Calendar record of the date from the mmap table"""
+    return get_calendar_table().lookup(target_date)
+
+
+def branch_relation(branch: str, other: str) -> Optional[str]:
+    """六冲/六合 between two branches, or None"""
+    a, b = DI_ZHI.index(branch), DI_ZHI.index(other)
+    if (a - b) % 12 == 6:
+        return "六冲"
+    if (a + b) % 12 == 1:
+        return "六合"
+    return None
+
+
+def subject_facts(info: Dict[str, Any], subject: str) -> List[str]:
+    """Locally computed relations between the day and a day master (or day pillar)"""
+    day_master = TIAN_GAN.index(subject[0])
+    day_stem = TIAN_GAN.index(info["ganzhi_day"][0])
+    day_branch = DI_ZHI.index(info["ganzhi_day"][1])
+    month_branch = DI_ZHI.index(info["ganzhi_month"][1])
+    hidden = "、".join(f"{TIAN_GAN[s]}{TEN_GODS[TEN_GOD[day_master, s]]}"
+                      for s in HIDDEN_STEMS[day_branch].argsort()[::-1] if HIDDEN_STEMS[day_branch, s] > 0)
+    season = SEASON_STATES[(STEM_ELEMENT[day_master] - MONTH_ELEMENT[month_branch]) % 5]
+    facts = [
+        f"日主：{subject[0]}{WU_XING[STEM_ELEMENT[day_master]]}，当令{season}",
+        f"当日天干{TIAN_GAN[day_stem]}为日主之{TEN_GODS[TEN_GOD[day_master, day_stem]]}",
+        f"当日地支{DI_ZHI[day_branch]}藏干：{hidden}",
+    ]
+    if len(subject) == 2:
+        relation = branch_relation(subject[1], DI_ZHI[day_branch])
+        facts.append(f"日柱{subject}，日支{subject[1]}与当日地支{DI_ZHI[day_branch]}"
+                     f"{relation or '无冲合'}")
+    return facts
+
+
+def build_fortune_prompt(target_date: date, subject: str) -> str:
+    """User message for one subject's reading; depends only on the date and subject"""
+    info = day_info(target_date)
+    lunar = f"{info['lunar_year']}年{info['lunar_month_name']}{info['lunar_day_name']}"
+    term = f"，当日交{info['solar_term']}" if info["solar_term"] else ""
+    facts = "\n".join(f"- {fact}" for fact in subject_facts(info, subject))
+    kind = f"日柱为{subject}的人" if len(subject) == 2 else f"日主为{subject}的人"
+    return f"""日期：{target_date.isoformat()}（农历{lunar}{term}）
+干支：{info['ganzhi_year']}年 {info['ganzhi_month']}月 {info['ganzhi_day']}日
+
+【十神关系（本地精确计算）】
+{facts}
+
+请为{kind}写出这一天的运势。"""
+
+
+class DailyFortuneCache:
+    """SQLite store of precomputed readings per (date, subject, version)"""
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS daily_fortunes (
+                day TEXT NOT NULL,
+                subject TEXT NOT NULL,
+                template_version TEXT NOT NULL,
+                day_pillar TEXT NOT NULL,
+                reading TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (day, subject, template_version)
+            )
+        """)
+        self._conn.commit()
+        self._purged_before = None
+
+    def _purge_old_days(self):
+        """Drop readings from before yesterday; runs once per date change"""
+        cutoff = (date.today() - timedelta(days=1)).isoformat()
+        if cutoff == self._purged_before:
+            return
+        self._conn.execute("DELETE FROM daily_fortunes WHERE day < ?", (cutoff,))
+        self._conn.commit()
+        self._purged_before = cutoff
+
+    def get(self, target_date: date, subjects: List[str],
+            template_version: str = FORTUNE_PROMPT_VERSION) -> Optional[Dict[str, str]]:
+        """{"subject", "day_pillar", "reading"} for the first subject with a reading"""
+        if not subjects:
+            return None
+        placeholders = ",".join("?" * len(subjects))
+        with self._lock:
+            rows = dict((row[0], row[1:]) for row in self._conn.execute(
+                f"SELECT subject, day_pillar, reading FROM daily_fortunes WHERE day = ? "
+                f"AND template_version = ? AND subject IN ({placeholders})",
+                (target_date.isoformat(), template_version, *subjects)))
+            for subject in subjects:
+                if subject in rows:
+                    self.hits += 1
+                    day_pillar, reading = rows[subject]
+                    return {"subject": subject, "day_pillar": day_pillar, "reading": reading}
+            self.misses += 1
+            return None
+
+    def put(self, target_date: date, subject: str, day_pillar: str, reading: str,
+            template_version: str = FORTUNE_PROMPT_VERSION):
+        with self._lock:
+            self._purge_old_days()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO daily_fortunes (day, subject, template_version, day_pillar, "
+                "reading, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (target_date.isoformat(), subject, template_version, day_pillar, reading, time.time()))
+            self._conn.commit()
+
+    def subjects(self, target_date: date, template_version: str = FORTUNE_PROMPT_VERSION) -> List[str]:
+        """Subjects that already have a reading for the date"""
+        with self._lock:
+            return [row[0] for row in self._conn.execute(
+                "SELECT subject FROM daily_fortunes WHERE day = ? AND template_version = ?",
+                (target_date.isoformat(), template_version))]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM daily_fortunes").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "entries": entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def close(self):
+        self._conn.close()
+
+
+def default_generate(prompt: str) -> str:
+    """One reading from Qwen Max with the static daily-fortune system prompt"""
+    from src.core.independent_qwen import call_qwen_max_api
+    return call_qwen_max_api(prompt, [], None, DAILY_FORTUNE_SYSTEM_PROMPT)
+
+
+def precompute_daily_fortunes(target_date: date, pillars60: bool = False,
+                              generate: Optional[Callable[[str], str]] = None,
+                              cache: Optional["DailyFortuneCache"] = None,
+                              concurrency: int = DEFAULT_CONCURRENCY,
+                              force: bool = False) -> Dict[str, Any]:
+    """
+    Generate and store the readings of a date for every day master (or day pillar).
+
+    Subjects that already have a reading are skipped unless force is set, so
+    a failed or interrupted run can simply be repeated. Failed generations
+    (API fallback messages) are not stored.
+    """
+    from src.core.independent_qwen import is_api_error
+
+    generate = generate or default_generate
+    cache = cache or get_daily_fortune_cache()
+    day_pillar = day_info(target_date)["ganzhi_day"]
+    subjects = JIA_ZI if pillars60 else TIAN_GAN
+    done = set() if force else set(cache.subjects(target_date))
+    todo = [subject for subject in subjects if subject not in done]
+
+    def run(subject):
+        try:
+            reading = generate(build_fortune_prompt(target_date, subject))
+        except Exception as e:
+            print(f"运势生成失败 {target_date} {subject}: {e}")
+            return False
+        if not reading or is_api_error(reading):
+            print(f"运势生成失败 {target_date} {subject}: {(reading or '')[:50]}")
+            return False
+        cache.put(target_date, subject, day_pillar, reading)
+        return True
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        results = list(executor.map(run, todo))
+
+    return {
+        "date": target_date.isoformat(),
+        "day_pillar": day_pillar,
+        "generated": sum(results),
+        "failed": len(results) - sum(results),
+        "skipped": len(subjects) - len(todo),
+    }
+
+
+def personalize(entry: Dict[str, str], pillars: List[str], target_date: date) -> str:
+    """Cached reading behind a header rendered from the reader's own chart"""
+    info = day_info(target_date)
+    day_master = TIAN_GAN.index(pillars[2][0])
+    day_stem = TIAN_GAN.index(info["ganzhi_day"][0])
+    features = get_chart_analyzer().analyze(pillars)
+    lunar = f"农历{info['lunar_month_name']}{info['lunar_day_name']}" if info["lunar_year"] else ""
+    relation = branch_relation(pillars[2][1], info["ganzhi_day"][1])
+    lines = [
+        f"**{target_date.year}年{target_date.month}月{target_date.day}日运势**"
+        f"（{lunar}，{info['ganzhi_day']}日）",
+        f"- 您的八字：{' '.join(pillars)}，日主{features['day_master']}{features['day_master_element']}"
+        f"（{features['strength']}）",
+        f"- 当日天干{info['ganzhi_day'][0]}为您的{TEN_GODS[TEN_GOD[day_master, day_stem]]}",
+    ]
+    if relation:
+        lines.append(f"- 当日地支{info['ganzhi_day'][1]}与您的日支{pillars[2][1]}{relation}")
+    return "\n".join(lines) + "\n\n" + entry["reading"]
+
+
+def lookup_daily_fortune(message: str, bazi_info: Optional[str],
+                         cache: Optional["DailyFortuneCache"] = None,
+                         today: Optional[date] = None) -> Optional[str]:
+    """
+    Fast path for "今天运势怎么样": a personalized precomputed reading, or None.
+
+    Needs the reader's pillars (bazi_info as pinned in the session context)
+    and a reading stored for their day pillar or day master; otherwise the
+    caller goes on to the LLM as before.
+    """
+    offset = fortune_query_offset(message)
+    pillars = parse_pillars(bazi_info)
+    if offset is None or pillars is None:
+        return None
+    target_date = (today or date.today()) + timedelta(days=offset)
+    try:
+        entry = (cache or get_daily_fortune_cache()).get(target_date, [pillars[2], pillars[2][0]])
+        if entry is None:
+            return None
+        return personalize(entry, pillars, target_date)
+    except Exception as e:
+        print(f"今日运势缓存读取错误: {e}")
+        return None
+
+
+_daily_fortune_cache = None
+_daily_fortune_cache_lock = threading.Lock()
+
+
+def get_daily_fortune_cache() -> DailyFortuneCache:
+    """Process-wide cache instance"""
+    global _daily_fortune_cache
+    with _daily_fortune_cache_lock:
+        if _daily_fortune_cache is None:
+            _daily_fortune_cache = DailyFortuneCache()
+    return _daily_fortune_cache
+
+
+def main():
+    parser = argparse.ArgumentParser(description='千机每日运势预生成')
+    parser.add_argument('--date', type=str, help='生成指定日期的运势: 2026-02-24')
+    parser.add_argument('--tomorrow', action='store_true', help='生成明天的运势（定时任务使用）')
+    parser.add_argument('--pillars60', action='store_true', help='按六十日柱生成（默认按十个日主）')
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY, help='并发调用模型的数量')
+    parser.add_argument('--force', action='store_true', help='重新生成已有的运势')
+
+    args = parser.parse_args()
+
+    if args.date:
+        target_date = date.fromisoformat(args.date)
+    elif args.tomorrow:
+        target_date = date.today() + timedelta(days=1)
+    else:
+        parser.print_help()
+        return
+
+    started = datetime.now()
+    result = precompute_daily_fortunes(target_date, args.pillars60,
+                                       concurrency=args.concurrency, force=args.force)
+    result["seconds"] = round((datetime.now() - started).total_seconds(), 1)
+    print(json.dumps(result, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,193 @@
+"""
+Qianji Date Context Provider
+
+One local source for "what day is it": solar and lunar date, 干支 of the
+year/month/day/hour, zodiac, solar terms, festivals and the day's 冲煞, all
+read from the mmap calendar table and the native pillar tables. It replaces
+the web searches (and the snippets matched against hard-coded dates) the
+date validators used to run on every message mentioning 今天 or 日期.
+
+Day-level fields are memoized per date and the full context per minute, so
+a burst of requests costs one calendar lookup.
+"""
+import threading
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+from typing import Any, Dict, Optional
+
+from src.core.almanac import day_clash
+from src.core.bazi_pillars import pillar_calculator
+from src.core.calendar_table import get_calendar_table
+
+WEEKDAYS = ["星期一", "星期二", "星期三", "星期四", "星期五", "星期六", "星期日"]
+
+SOLAR_FESTIVALS = {
+    (1, 1): "元旦", (2, 14): "情人节", (3, 8): "妇女节", (3, 12): "植树节",
+    (5, 1): "劳动节", (5, 4): "青年节", (6, 1): "儿童节", (7, 1): "建党节",
+    (8, 1): "建军节", (9, 10): "教师节", (10, 1): "国庆节", (12, 25): "圣诞节",
+}
+
+# Messages mentioning any of these get the date context in their prompt
+DATE_KEYWORDS = ['今天', '今日', '现在', '当前', '日期', '日子', '几号', '星期',
+                 '农历', '阴历', '阳历', '公历', '黄历', '万年历', '日历']
+
+# Messages with these are answered from the calendar instead of the model, so
+# only unambiguous date questions: 现在/当前 also open "我现在适合换工作吗"
+DATE_QUESTION_KEYWORDS = ['今天', '日期', '农历', '阳历', '公历', '黄历', '日子', '几号', '星期']
+
+# Longest first so 大后天 is not read as 后天
+_RELATIVE_DAYS = [("大后天", 3), ("大前天", -3), ("前天", -2), ("昨天", -1), ("昨日", -1),
+                  ("后天", 2), ("明天", 1), ("明日", 1), ("今天", 0), ("今日", 0)]
+
+# A solar term is never more than 16 days away
+_TERM_SEARCH_DAYS = 17
+
+
+def relative_day_offset(message: str) -> int:
+    """Day offset named in the message (明天 → 1, 昨天 → -1), 0 if none"""
+    for word, offset in _RELATIVE_DAYS:
+        if word in message:
+            return offset
+    return 0
+
+
+class DateContextProvider:
+    """Local calendar facts for any moment, memoized per day and per minute"""
+
+    def __init__(self, calendar_table=None):
+        self.calendar_table = calendar_table or get_calendar_table()
+        self.day_fields = lru_cache(maxsize=64)(self._day_fields)
+        self._lock = threading.Lock()
+        self._memo_minute = None
+        self._memo = None
+
+    def _day_fields(self, day: date) -> Dict[str, Any]:
+        record = self.calendar_table.lookup(day)
+        festivals = [f for f in (SOLAR_FESTIVALS.get((day.month, day.day)), record["festival"]) if f]
+        next_term = None
+        for offset in range(1, _TERM_SEARCH_DAYS):
+            later = day + timedelta(days=offset)
+            term = self.calendar_table.lookup(later)["solar_term"]
+            if term:
+                next_term = {"name": term, "date": later.isoformat(), "days": offset}
+                break
+        lunar = None
+        if record["lunar_year"]:
+            lunar = f"{record['ganzhi_year']}年{record['lunar_month_name']}{record['lunar_day_name']}"
+        return {
+            "solar_date": day.isoformat(),
+            "gregorian": f"{day.year}年{day.month:02d}月{day.day:02d}日",
+            "weekday": WEEKDAYS[day.weekday()],
+            "lunar": lunar,
+            "lunar_year": record["lunar_year"],
+            "lunar_month": record["lunar_month"],
+            "lunar_day": record["lunar_day"],
+            "is_leap_month": record["is_leap"],
+            "zodiac": record["zodiac"],
+            "ganzhi_year": record["ganzhi_year"],
+            "ganzhi_month": record["ganzhi_month"],
+            "ganzhi_day": record["ganzhi_day"],
+            "solar_term": record["solar_term"],
+            "next_solar_term": next_term,
+            "festivals": festivals,
+            **day_clash(record["ganzhi_day"]),
+        }
+
+    def get(self, now: Optional[datetime] = None) -> Dict[str, Any]:
+        """
+        Date context for a moment (default: now).
+
+        Day fields plus year/month/day/hour/minute and the moment's four
+        pillars (23:00 already counts as the next day's 子时, as in the
+        bazi engines). Shared between callers within the minute; do not mutate.
+        """
+        minute = (now or datetime.now()).replace(second=0, microsecond=0)
+        with self._lock:
+            if minute == self._memo_minute:
+                return self._memo
+
+        bazi = pillar_calculator.get_bazi(minute)
+        context = {
+            **self.day_fields(minute.date()),
+            "year": minute.year,
+            "month": minute.month,
+            "day": minute.day,
+            "hour": minute.hour,
+            "minute": minute.minute,
+            "time": minute.strftime("%H:%M"),
+            "hour_pillar": bazi["hour_pillar"],
+            "full_bazi": bazi["full_bazi"],
+        }
+        with self._lock:
+            self._memo_minute, self._memo = minute, context
+        return context
+
+    @staticmethod
+    def is_date_query(message: str) -> bool:
+        """A date question to answer directly with answer()"""
+        return any(keyword in message for keyword in DATE_QUESTION_KEYWORDS)
+
+    @staticmethod
+    def mentions_date(message: str) -> bool:
+        """A message whose prompt should carry format_context()"""
+        return any(keyword in message for keyword in DATE_KEYWORDS)
+
+    def format_context(self, now: Optional[datetime] = None) -> str:
+        """Prompt block with the current date facts"""
+        ctx = self.get(now)
+        lines = ["【本地万年历日期信息】",
+                 f"- 公历：{ctx['gregorian']}（{ctx['weekday']}） {ctx['time']}"]
+        if ctx["lunar"]:
+            lines.append(f"- 农历：{ctx['lunar']}（{ctx['zodiac']}年）")
+        lines.append(f"- 干支：{ctx['full_bazi']}（年 月 日 时）")
+        lines.append(self._term_line(ctx))
+        if ctx["festivals"]:
+            lines.append(f"- 节日：{'、'.join(ctx['festivals'])}")
+        lines.append(f"- 冲煞：冲{ctx['clash_zodiac']}（{ctx['clash_pillar']}）煞{ctx['sha_direction']}")
+        return "\n".join(lines)
+
+    @staticmethod
+    def _term_line(ctx: Dict[str, Any]) -> str:
+        term = f"今日{ctx['solar_term']}，" if ctx["solar_term"] else ""
+        upcoming = ctx["next_solar_term"]
+        if upcoming:
+            return (f"- 节气：{term}下一个节气{upcoming['name']}"
+                    f"（{upcoming['date']}，{upcoming['days']}天后）")
+        return f"- 节气：{term}".rstrip("，")
+
+    def answer(self, message: str, now: Optional[datetime] = None) -> str:
+        """Direct reply to a date question, for 今天/明天/昨天 and the like"""
+        now = now or datetime.now()
+        offset = relative_day_offset(message)
+        label = {0: "今天", 1: "明天", 2: "后天", 3: "大后天", -1: "昨天", -2: "前天", -3: "大前天"}[offset]
+        if offset:
+            ctx = self.day_fields(now.date() + timedelta(days=offset))
+        else:
+            ctx = self.get(now)
+
+        lines = [f"{label}是公历{ctx['gregorian']}，{ctx['weekday']}。"]
+        if ctx["lunar"]:
+            lines.append(f"农历{ctx['lunar']}，{ctx['zodiac']}年。")
+        lines.append(f"干支：{ctx['ganzhi_year']}年 {ctx['ganzhi_month']}月 {ctx['ganzhi_day']}日。")
+        if ctx["festivals"]:
+            lines.append(f"节日：{'、'.join(ctx['festivals'])}。")
+        if ctx["solar_term"]:
+            lines.append(f"{label}交{ctx['solar_term']}。")
+        elif ctx["next_solar_term"]:
+            upcoming = ctx["next_solar_term"]
+            lines.append(f"下一个节气是{upcoming['name']}（{upcoming['date']}）。")
+        lines.append(f"冲{ctx['clash_zodiac']}（{ctx['clash_pillar']}）煞{ctx['sha_direction']}。")
+        return "\n".join(lines)
+
+
+_date_context_provider = None
+_date_context_provider_lock = threading.Lock()
+
+
+def get_date_context_provider() -> DateContextProvider:
+    """Process-wide provider so the memo is shared by all engines and validators"""
+    global _date_context_provider
+    with _date_context_provider_lock:
+        if _date_context_provider is None:
+            _date_context_provider = DateContextProvider()
+    return _date_context_provider
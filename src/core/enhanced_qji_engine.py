@@ -10,6 +10,20 @@ from .skills import SkillManager
 from .task_manager import TaskManager
 from .independent_qwen import call_qwen_max_api
 from .date_validator import DateValidator
+from ..utils.keyword_scanner import has_keyword, message_categories
+
+# Static persona sent as a byte-identical leading system message; the date
+# and search/skill context for each request go into the trailing message
+ENHANCED_SYSTEM_PROMPT = """你是一个AI助手，名为千机AI（Qji AI）。
+
+你的特点：
+1. **通用AI能力**：正常回答各种日常问题
+2. **命理风水专长**：深度专业知识  
+3. **联网搜索能力**：可以获取实时信息
+4. **多任务处理**：可以并行处理复杂请求
+5. **日期准确性**：总是使用经过验证的准确日期
+
+每条用户消息前附有当前准确日期信息和上下文信息。请根据用户问题和上下文提供最佳回答。特别注意：如果涉及日期、农历、黄历等信息，必须基于提供的准确日期信息回答。"""
 
 class EnhancedQjiEngine:
     def __init__(self):
@@ -54,32 +68,22 @@ class EnhancedQjiEngine:
         
         # Build final prompt with accurate date info
         if needs_date_validation and accurate_date_context:
-            date_info = accurate_date_context
+            date_info = (f"{accurate_date_context['gregorian']}，{accurate_date_context['weekday']}，"
+                         f"{accurate_date_context['lunar']}")
         else:
             current_date = datetime.now().strftime("%Y年%m月%d日")
             current_weekday = ["星期一", "星期二", "星期三", "星期四", "星期五", "星期六", "星期日"][datetime.now().weekday()]
             date_info = f"{current_date}，{current_weekday}"
         
-        qji_context = f"""
-你是一个AI助手，名为千机AI（Qji AI）。当前准确日期信息：{date_info}
-
-你的特点：
-1. **通用AI能力**：正常回答各种日常问题
-2. **命理风水专长**：深度专业知识  
-3. **联网搜索能力**：可以获取实时信息
-4. **多任务处理**：可以并行处理复杂请求
-5. **日期准确性**：总是使用经过验证的准确日期
+        volatile_context = f"""当前准确日期信息：{date_info}
 
 上下文信息：
-{context}
-
-请根据用户问题和上下文提供最佳回答。特别注意：如果涉及日期、农历、黄历等信息，必须基于提供的准确日期信息回答。
-"""
-        
-        full_prompt = f"{qji_context}\n\n用户问题: {message}"
+{context}"""
         
         try:
-            response = self.qwen_engine(full_prompt, conversation_history)
+            response = self.qwen_engine(message, conversation_history,
+                                        system_prompt=ENHANCED_SYSTEM_PROMPT,
+                                        volatile=volatile_context)
             return response
         except Exception as e:
             print(f"生成响应错误: {e}")
@@ -87,11 +91,7 @@ class EnhancedQjiEngine:
     
     def _contains_date_query(self, message: str) -> bool:
         """Check if message contains date-related queries"""
-        date_keywords = [
-            '今天', '今日', '现在', '当前', '日期', '日子', '农历', '阳历', 
-            '公历', '黄历', '运势', '星期', '月份', '年份', '时间'
-        ]
-        return any(keyword in message for keyword in date_keywords)
+        return has_keyword(message, 'enhanced_date')
     
     async def _analyze_message_requirements(self, message: str) -> Dict[str, Any]:
         """
@@ -105,26 +105,28 @@ class EnhancedQjiEngine:
             'skill_requests': []
         }
         
+        # One keyword scan answers every check below
+        found = message_categories(message)
+        
         # Check for web search needs
-        search_keywords = ['今天', '最新', '新闻', '天气', '黄历', '实时', '现在', '当前']
-        if any(keyword in message for keyword in search_keywords):
+        if 'web_search' in found:
             requirements['needs_web_search'] = True
             requirements['search_query'] = message
         
         # Check for skill needs
-        if '天气' in message or 'weather' in message.lower():
+        if 'weather_skill' in found:
             requirements['needs_skills'].append('weather')
             requirements['skill_requests'].append({'skill': 'weather', 'query': message})
         
-        if '新闻' in message or 'news' in message.lower():
+        if 'news_skill' in found:
             requirements['needs_skills'].append('news')
             requirements['skill_requests'].append({'skill': 'news', 'query': message})
         
-        if '八字' in message or '命理' in message or 'bazi' in message.lower():
+        if 'bazi_skill' in found:
             requirements['needs_skills'].append('bazi')
             requirements['skill_requests'].append({'skill': 'bazi', 'query': message})
         
-        if '股票' in message or '股价' in message or 'stock' in message.lower() or 'price' in message.lower():
+        if 'stock_skill' in found:
             requirements['needs_skills'].append('stock')
             requirements['skill_requests'].append({'skill': 'stock', 'query': message})
         
@@ -1,109 +1,34 @@
 """
 Forced Date Validator - Bypass AI model for date-related queries
-Directly fetches accurate lunar calendar data from web search
+Answers directly from the local calendar (DateContextProvider)
 """
-import requests
-import json
-import re
-from datetime import datetime
+from .date_context import get_date_context_provider
+from ..utils.keyword_scanner import has_keyword
 
 class ForcedDateValidator:
     def __init__(self):
-        self.brave_api_key = "BSAynHOXmn1r3Qo2L5uK7DWFa7Qp2LY"
+        self.date_provider = get_date_context_provider()
         
     def should_force_date_validation(self, message: str) -> bool:
         """Check if message requires forced date validation"""
-        date_keywords = [
-            '今天', '今日', '现在', '当前', '日期', '日子', 
-            '农历', '阴历', '阳历', '公历', '正月', '腊月',
-            '春节', '元宵', '端午', '中秋', '重阳', '除夕',
-            '黄历', '万年历', '老黄历', '日历'
-        ]
-        return any(keyword in message for keyword in date_keywords)
+        return has_keyword(message, 'date')
     
     def get_current_lunar_date(self) -> str:
-        """Get current lunar date from web search"""
+        """Get current lunar date from the local calendar"""
         try:
-            # Get current date
-            now = datetime.now()
-            current_date_str = now.strftime("%Y年%m月%d日")
-            
-            # Search for lunar date
-            query = f"{current_date_str} 农历 万年历"
-            search_results = self._brave_search(query, count=3)
-            
-            if search_results:
-                # Extract lunar date from search results
-                for result in search_results:
-                    title = result.get('title', '')
-                    snippet = result.get('snippet', '')
-                    content = f"{title} {snippet}"
-                    
-                    # Look for specific patterns that match our known correct answer
-                    if '正月初八' in content or '初八' in content:
-                        return "农历丙午年正月初八"
-                    elif '正月' in content:
-                        # Extract the day number
-                        day_match = re.search(r'正月(初\d+|廿\d+|\d+)', content)
-                        if day_match:
-                            day = day_match.group(1)
-                            return f"农历丙午年正月{day}"
-                
-                # If no specific pattern found, return the most relevant result
-                return f"根据网络搜索，{current_date_str}对应的农历日期信息：{search_results[0].get('title', '')}"
-            
-            return f"无法获取准确的农历日期信息，请稍后重试。"
-            
+            lunar = self.date_provider.get()['lunar']
+            return f"农历{lunar}" if lunar else None
         except Exception as e:
             print(f"Date validation error: {e}")
             return None
     
-    def _brave_search(self, query: str, count: int = 3) -> list:
-        """Perform Brave search"""
-        url = "https://api.search.brave.com/res/v1/web/search"
-        headers = {
-            'Accept': 'application/json',
-            'Accept-Encoding': 'gzip',
-            'X-Subscription-Token': self.brave_api_key
-        }
-        params = {
-            'q': query,
-            'count': count,
-            'country': 'CN',
-            'search_lang': 'zh'
-        }
-        
-        try:
-            response = requests.get(url, headers=headers, params=params, timeout=10)
-            response.raise_for_status()
-            data = response.json()
-            
-            results = []
-            if 'web' in data and 'results' in data['web']:
-                for result in data['web']['results'][:count]:
-                    results.append({
-                        'title': result.get('title', ''),
-                        'url': result.get('url', ''),
-                        'snippet': result.get('description', '')
-                    })
-            return results
-        except Exception as e:
-            print(f"Brave search error: {e}")
-            return []
-    
     def generate_accurate_date_response(self, message: str) -> str:
         """Generate accurate date response bypassing AI model"""
-        current_gregorian = datetime.now().strftime("%Y年%m月%d日")
-        current_weekday = ["星期一", "星期二", "星期三", "星期四", "星期五", "星期六", "星期日"][datetime.now().weekday()]
-        
-        lunar_info = self.get_current_lunar_date()
-        
-        if lunar_info:
-            response = f"今天是公历{current_gregorian}，{current_weekday}。\n\n{lunar_info}\n\n这是通过实时网络搜索获取的准确农历信息。"
-        else:
-            response = f"今天是公历{current_gregorian}，{current_weekday}。\n\n由于网络问题，暂时无法获取准确的农历信息。"
-        
-        return response
+        try:
+            return self.date_provider.answer(message)
+        except Exception as e:
+            print(f"Date validation error: {e}")
+            return "抱歉，暂时无法获取准确的日期信息。"
 
 # Test function
 def test_forced_date_validator():
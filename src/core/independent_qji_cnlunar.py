@@ -1,7 +1,7 @@
 """
 Independent Qji Engine with CNLunar Integration for Accurate Bazi Calculation
 """
-from datetime import datetime
+from datetime import datetime, timedelta
 import sys
 import os
 
@@ -12,15 +12,61 @@ sys.path.insert(0, project_root)
 try:
     from lunardate import LunarDate
     from cnlunar import Lunar
+    from src.core.bazi_pillars import pillar_calculator
+    from src.core.calendar_table import get_calendar_table
+    from src.core.luck_pillars import luck_calculator, format_timeline
+    from src.core.chart_analyzer import get_chart_analyzer, format_chart_features
+    from src.data.knowledge_graph import format_chart_relations
+    from src.core.true_solar_time import true_solar_time
+    from src.core.almanac import get_almanac, is_almanac_query, format_almanac
+    from src.core.date_context import relative_day_offset
     cnlunar_available = True
 except ImportError:
     print("警告: 未安装农历库，将使用基础日期功能")
     LunarDate = None
     Lunar = None
+    pillar_calculator = None
+    luck_calculator = None
     cnlunar_available = False
 
 # Import Qwen Max API
-from src.core.independent_qwen import call_qwen_max_api
+from src.core.independent_qwen import call_qwen_max_api, stream_qwen_max_api, is_api_error, APIErrorMessage
+from src.core.response_cache import get_bazi_response_cache, normalize_gender
+from src.data.classics_index import retrieve_classics_context, classics_index_version
+from src.data.classical_cases import retrieve_case_context, case_database_version
+
+BIRTH_FORMAT_ERROR = "出生日期或时间格式错误，请使用 YYYY-MM-DD 和 HH:MM 格式。"
+
+# Static persona, byte-identical on every request so providers can cache it;
+# the current date is appended to each user message by _build_chat_context
+CHAT_SYSTEM_PROMPT = """你是一个AI助手，名为千机AI（Qji AI）。
+
+你具备以下特点：
+
+1. **通用AI能力**：你可以正常回答各种日常问题，进行自然对话，就像Qwen Max一样
+2. **命理风水专长**：你在命理学、风水学、八字分析方面有深度专业知识
+3. **智能判断**：根据用户的问题类型，自动调整回答风格
+
+**重要提示：**
+- 每条用户消息前都附有当前的真实日期、时间和农历信息
+- 请确保所有日期相关的回答都基于该真实日期信息
+- 如果提供了真实农历日期，请优先使用该信息进行命理分析
+
+**命理专业知识来源：**
+用户消息前可能附有从《渊海子平》、《三命通会》、《滴天髓》等命理经典中检索到的原文段落（【经典原文参考】）。回答命理问题时请以这些原文为依据并注明出处；没有提供的原文不要杜撰引文。
+
+**回答策略：**
+- 如果用户问的是日常问题（如天气、新闻、科技、生活等），像普通AI一样正常回答
+- 如果用户问的是命理、风水、八字、运势等问题，展现你的专业深度
+- 如果用户的问题涉及日期，请务必使用上述真实日期信息
+
+**对话风格：**
+- 自然、友好、专业
+- 避免过度推销命理服务
+- 尊重用户的兴趣和需求"""
+
+# Bump whenever the bazi prompt changes so cached analyses are not reused
+BAZI_PROMPT_VERSION = "cnlunar-7"
 
 class IndependentQjiCnlunarEngine:
     def __init__(self):
@@ -61,16 +107,16 @@ class IndependentQjiCnlunarEngine:
         # Try to get lunar date and bazi if libraries are available
         if cnlunar_available:
             try:
-                lunar_obj = Lunar(now)
-                lunar_str = f"{lunar_obj.lunarYear}年{self._get_lunar_month_name(lunar_obj.lunarMonth)}{self._get_lunar_day_name(lunar_obj.lunarDay)}"
+                bazi = pillar_calculator.get_bazi(now)
+                lunar_str = get_calendar_table().format_lunar(now)
                 
                 # Get accurate bazi information
                 bazi_info = {
-                    "year_pillar": lunar_obj.year8Char,
-                    "month_pillar": lunar_obj.month8Char,
-                    "day_pillar": lunar_obj.day8Char,
-                    "hour_pillar": self._get_hour_pillar(now.hour, lunar_obj.day8Char[0]),
-                    "full_bazi": f"{lunar_obj.year8Char} {lunar_obj.month8Char} {lunar_obj.day8Char} {self._get_hour_pillar(now.hour, lunar_obj.day8Char[0])}"
+                    "year_pillar": bazi["year_pillar"],
+                    "month_pillar": bazi["month_pillar"],
+                    "day_pillar": bazi["day_pillar"],
+                    "hour_pillar": bazi["hour_pillar"],
+                    "full_bazi": bazi["full_bazi"]
                 }
                 
                 result["lunar_info"] = lunar_str
@@ -111,7 +157,8 @@ class IndependentQjiCnlunarEngine:
         # 地支：子、丑、寅、卯、辰、巳、午、未、申、酉、戌、亥
         
         # 五鼠遁口诀
-        gan_index = {"甲": 0, "乙": 0, "丙": 2, "丁": 2, "戊": 4, "己": 4, "庚": 6, "辛": 6, "壬": 8, "癸": 8}
+        # 甲己还加甲，乙庚丙作初，丙辛从戊起，丁壬庚子居，戊癸何方发，壬子是真途
+        gan_index = {"甲": 0, "己": 0, "乙": 2, "庚": 2, "丙": 4, "辛": 4, "丁": 6, "壬": 6, "戊": 8, "癸": 8}
         base_gan_index = gan_index.get(day_gan, 0)
         
         # 时辰地支索引 (子=0, 丑=1, ..., 亥=11)
@@ -149,42 +196,43 @@ class IndependentQjiCnlunarEngine:
         
         return f"{heavenly_stems[hour_gan_index]}{earthly_branches[time_index]}"
     
-    def get_accurate_bazi(self, birth_datetime):
-        """Get accurate bazi using CNLunar library"""
+    def get_accurate_bazi(self, birth_datetime, location=None):
+        """
+        Get accurate bazi from the precomputed pillar tables (cnlunar-equivalent)
+        
+        With a location found in the offline gazetteer the wall-clock time is
+        first converted to true solar time; the result then also carries
+        'solar_datetime', 'solar_correction' (minutes) and 'solar_place'.
+        """
         if not cnlunar_available:
             return None
         
         try:
-            lunar_obj = Lunar(birth_datetime)
-            hour = birth_datetime.hour
-            day_gan = lunar_obj.day8Char[0]
-            hour_pillar = self._get_hour_pillar(hour, day_gan)
-            
-            bazi_info = {
-                "year_pillar": lunar_obj.year8Char,
-                "month_pillar": lunar_obj.month8Char,
-                "day_pillar": lunar_obj.day8Char,
-                "hour_pillar": hour_pillar,
-                "full_bazi": f"{lunar_obj.year8Char} {lunar_obj.month8Char} {lunar_obj.day8Char} {hour_pillar}",
-                "lunar_year": lunar_obj.lunarYear,
-                "lunar_month": lunar_obj.lunarMonth,
-                "lunar_day": lunar_obj.lunarDay,
-                "is_leap_month": lunar_obj.isLunarLeapMonth
-            }
-            
-            return bazi_info
-            
+            solar = true_solar_time(birth_datetime, location) if location else None
+            if solar is None:
+                return pillar_calculator.get_bazi(birth_datetime)
+            bazi = pillar_calculator.get_bazi(solar['datetime'])
+            bazi['solar_datetime'] = solar['datetime']
+            bazi['solar_correction'] = solar['correction_minutes']
+            bazi['solar_place'] = solar['place']
+            return bazi
         except Exception as e:
             print(f"八字计算错误: {e}")
             return None
     
-    def generate_response(self, message, conversation_history=None):
-        """
-        Generate response using Qwen Max API with real-time date context
-        """
-        if conversation_history is None:
-            conversation_history = []
+    def get_luck_timeline(self, birth_datetime, gender):
+        """大运 and 流年 from the birth moment, computed locally rather than by the model"""
+        if not cnlunar_available:
+            return None
         
+        try:
+            return luck_calculator.timeline(birth_datetime, normalize_gender(gender) == "男")
+        except Exception as e:
+            print(f"大运计算错误: {e}")
+            return None
+    
+    def _build_chat_context(self, message):
+        """Per-request date context and retrieved classics; sent after the static system prompt"""
         # Get current date info
         date_info = self.get_current_date_info()
         
@@ -196,110 +244,151 @@ class IndependentQjiCnlunarEngine:
         else:
             date_context = f"当前日期是{date_info['solar_date']}（{date_info['weekday']}）。"
         
-        qji_context = f"""
-你是一个AI助手，名为千机AI（Qji AI）。
-
-{date_context}
-
-你具备以下特点：
-
-1. **通用AI能力**：你可以正常回答各种日常问题，进行自然对话，就像Qwen Max一样
-2. **命理风水专长**：你在命理学、风水学、八字分析方面有深度专业知识
-3. **智能判断**：根据用户的问题类型，自动调整回答风格
-
-**重要提示：**
-- 当前年份是{date_info['year']}年
-- 当前时间是{date_info['hour']}点{date_info['minute']}分
-- 请确保所有日期相关的回答都基于上述真实日期信息
-- 如果提供了真实农历日期，请优先使用该信息进行命理分析
-
-**命理专业知识来源：**
-你已经深入学习了《渊海子平》、《三命通会》、《滴天髓》、《子平真诠》、《穷通宝鉴》、《神峰通考》、《李虚中命书》、《千里命稿》、《星平会海》等十大命理经典。
-
-**回答策略：**
-- 如果用户问的是日常问题（如天气、新闻、科技、生活等），像普通AI一样正常回答
-- 如果用户问的是命理、风水、八字、运势等问题，展现你的专业深度
-- 如果用户的问题涉及日期，请务必使用上述真实日期信息
-
-**对话风格：**
-- 自然、友好、专业
-- 避免过度推销命理服务
-- 尊重用户的兴趣和需求
-"""
+        context = f"""{date_context}
+当前年份是{date_info['year']}年，当前时间是{date_info['hour']}点{date_info['minute']}分。"""
         
-        # Combine context with user message
-        full_prompt = f"{qji_context}\n\n用户问题: {message}"
+        if cnlunar_available and is_almanac_query(message):
+            try:
+                day = datetime.now().date() + timedelta(days=relative_day_offset(message))
+                context += f"\n\n{format_almanac(get_almanac().lookup(day))}"
+            except Exception as e:
+                print(f"黄历查询错误: {e}")
+        
+        passages = retrieve_classics_context(message)
+        if passages:
+            context += f"\n\n{passages}"
+        return context
+    
+    def generate_response(self, message, conversation_history=None, session_id=None):
+        """
+        Generate response using Qwen Max API with real-time date context
+        """
+        if conversation_history is None:
+            conversation_history = []
         
         try:
             # Call Qwen Max API with thinking mode enabled
-            response = call_qwen_max_api(full_prompt, conversation_history)
+            response = call_qwen_max_api(message, conversation_history, session_id,
+                                         CHAT_SYSTEM_PROMPT, self._build_chat_context(message))
             return response
         except Exception as e:
             print(f"Qji CNLunar生成响应错误: {e}")
             return "抱歉，处理您的请求时出现了问题。请稍后重试。"
     
-    def analyze_bazi(self, birth_date, birth_time, gender, location):
+    def generate_response_stream(self, message, conversation_history=None, session_id=None):
         """
-        Analyze bazi using CNLunar for accurate calculation, then Qwen Max for analysis
+        Stream the response text as Qwen Max generates it
+        """
+        if conversation_history is None:
+            conversation_history = []
+        
+        try:
+            yield from stream_qwen_max_api(message, conversation_history, session_id,
+                                           CHAT_SYSTEM_PROMPT, self._build_chat_context(message))
+        except Exception as e:
+            print(f"Qji CNLunar流式响应错误: {e}")
+            yield APIErrorMessage("抱歉，处理您的请求时出现了问题。请稍后重试。")
+    
+    def _build_bazi_prompt(self, birth_date, birth_time, gender, location):
+        """
+        Build the bazi analysis prompt from accurately computed pillars.
+        
+        Returns (header, prompt, full_bazi, version), or None if the birth
+        date/time cannot be parsed. The prompt only depends on the pillars,
+        gender, current year and 起运 year so its answer can be cached and
+        shared; version is the cache template version with the 起运 year,
+        the classics index generation and the case database version folded
+        in, so a new index or case extraction never serves stale answers.
+        The personal header (birth date, location, exact 起运 age) is
+        rendered locally and prepended to the answer. full_bazi is None when
+        the pillars could not be computed, in which case the prompt carries
+        the raw birth data and is not cacheable.
         """
         # Parse birth datetime
-        from datetime import datetime
         try:
             birth_datetime = datetime.strptime(f"{birth_date} {birth_time}", "%Y-%m-%d %H:%M")
         except ValueError:
-            return "出生日期或时间格式错误，请使用 YYYY-MM-DD 和 HH:MM 格式。"
+            return None
         
         # Get accurate bazi using CNLunar
-        accurate_bazi = self.get_accurate_bazi(birth_datetime)
+        accurate_bazi = self.get_accurate_bazi(birth_datetime, location)
+        if accurate_bazi and 'solar_datetime' in accurate_bazi:
+            birth_datetime = accurate_bazi['solar_datetime']
+        timeline = self.get_luck_timeline(birth_datetime, gender)
+        date_info = self.get_current_date_info()
         
-        if accurate_bazi:
-            # Use accurate bazi data to generate prompt
-            current_date_info = self.get_current_date_info()
-            current_context = f"当前公历日期：{current_date_info['solar_date']}（{current_date_info['weekday']}）"
-            if current_date_info.get('lunar_info'):
-                current_context += f"\n当前农历日期：{current_date_info['lunar_info']}"
+        if accurate_bazi and timeline:
+            # Classics passages for this day master and month; deterministic per chart, so cacheable
+            passages = retrieve_classics_context(
+                f"{accurate_bazi['day_pillar'][0]}日主生于{accurate_bazi['month_pillar'][1]}月 日主强弱 格局 用神")
+            # Nearest 命例 from the classics, so precedents cited are real ones
+            cases = retrieve_case_context(accurate_bazi['full_bazi'], normalize_gender(gender))
             
             # Determine lunar month name
             lunar_month_name = self._get_lunar_month_name(accurate_bazi['lunar_month'])
             if accurate_bazi['is_leap_month']:
                 lunar_month_name = f"闰{lunar_month_name}"
             
-            prompt = f"""
-{current_context}
-
-我已经通过专业八字计算库（CNLunar）准确计算出您的八字信息：
-
-**基本信息**：
+            header = f"""**基本信息**：
 - 公历出生：{birth_date} {birth_time}
 - 农历出生：{accurate_bazi['lunar_year']}年{lunar_month_name}{self._get_lunar_day_name(accurate_bazi['lunar_day'])}
 - 性别：{gender}
 - 出生地：{location}
+{self._format_solar_time(accurate_bazi)}
 
 **八字排盘（经专业库准确计算）**：
 - 年柱：{accurate_bazi['year_pillar']}
+- 月柱：{accurate_bazi['month_pillar']}
+- 日柱：{accurate_bazi['day_pillar']}
+- 时柱：{accurate_bazi['hour_pillar']}
+- 完整八字：{accurate_bazi['full_bazi']}
+- 起运：{timeline['start_age'][0]}岁{timeline['start_age'][1]}个月（{timeline['start_date']}），大运{timeline['direction']}
+"""
+            
+            prompt = f"""
+当前流年：{date_info['year']}年
+
+我已经通过专业八字计算库（CNLunar）准确计算出八字信息：
+
+- 性别：{gender}
+- 年柱：{accurate_bazi['year_pillar']}
 - 月柱：{accurate_bazi['month_pillar']}  
 - 日柱：{accurate_bazi['day_pillar']}
 - 时柱：{accurate_bazi['hour_pillar']}
 - 完整八字：{accurate_bazi['full_bazi']}
 
-请基于以上准确的八字信息，结合十大命理经典的理论，为我提供详细的专业分析：
+{format_chart_features(get_chart_analyzer().analyze(accurate_bazi['full_bazi']))}
+
+{format_chart_relations(accurate_bazi['full_bazi'])}
+
+{format_timeline(timeline, date_info['year'])}
+
+{passages}
+
+{cases}
+
+请基于以上准确的八字信息，结合所附命理经典原文，为我提供详细的专业分析（引用古籍命例时只引用上面附出的命例，不要杜撰）：
 
-1. **日主强弱分析**：分析日主在八字中的旺衰状态
+1. **日主强弱分析**：依据上面的命盘结构（十神、藏干、五行力量已算好，无需重新推算）分析日主旺衰
 2. **格局判断**：确定具体的命格类型（正官格、七杀格、财格等）
 3. **用神选择**：根据格局和日主强弱确定用神
-4. **大运流年**：分析当前大运和近期流年走势
+4. **大运流年**：依据上面的大运排盘，解读当前大运和{date_info['year']}年流年走势（大运已精确排定，无需重新推算）
 5. **人生建议**：提供事业、财运、感情、健康等方面的具体建议
 
 请确保分析的专业性和准确性。
 """
-        else:
-            # Fallback to standard prompt if CNLunar not available
-            date_info = self.get_current_date_info()
-            current_date_info = f"当前公历日期：{date_info['solar_date']}（{date_info['weekday']}）"
-            if date_info.get('lunar_info'):
-                current_date_info += f"\n当前农历日期：{date_info['lunar_info']}"
-            
-            prompt = f"""
+            start_year = timeline['luck_pillars'][0]['start_year']
+            # Passages and cases are part of the prompt, so their sources are part of the version
+            version = (f"{BAZI_PROMPT_VERSION}/{start_year}/"
+                       f"{classics_index_version()}/{case_database_version()}")
+            return header, prompt, accurate_bazi['full_bazi'], version
+        
+        # Fallback to standard prompt if CNLunar not available
+        current_date_info = f"当前公历日期：{date_info['solar_date']}（{date_info['weekday']}）"
+        if date_info.get('lunar_info'):
+            current_date_info += f"\n当前农历日期：{date_info['lunar_info']}"
+        
+        prompt = f"""
 {current_date_info}
 
 请为我详细分析这个八字：
@@ -317,13 +406,79 @@ class IndependentQjiCnlunarEngine:
 
 请基于十大命理经典的理论进行专业分析，并确保八字排盘的准确性。
 """
+        return "", prompt, None, None
+    
+    @staticmethod
+    def _format_solar_time(bazi):
+        """Header line describing the true solar time correction, if one was applied"""
+        if 'solar_datetime' not in bazi:
+            return "- 真太阳时：未识别出生地，按北京时间排盘"
+        place = bazi['solar_place']
+        direction = "东经" if place.longitude >= 0 else "西经"
+        return (f"- 真太阳时：{bazi['solar_datetime'].strftime('%Y-%m-%d %H:%M')}"
+                f"（{place.name}，{direction}{abs(place.longitude):.2f}°，校正{bazi['solar_correction']:+d}分钟）")
+    
+    def analyze_bazi(self, birth_date, birth_time, gender, location):
+        """
+        Analyze bazi using CNLunar for accurate calculation, then Qwen Max for analysis
+        
+        Analyses are cached per (pillars, gender, 流年, template version).
+        """
+        request = self._build_bazi_prompt(birth_date, birth_time, gender, location)
+        if request is None:
+            return BIRTH_FORMAT_ERROR
+        header, prompt, full_bazi, version = request
         
         try:
-            response = call_qwen_max_api(prompt, [])
-            return response
+            if full_bazi is None:
+                return call_qwen_max_api(prompt, [])
+            analysis = get_bazi_response_cache().get_or_generate(
+                full_bazi, gender, datetime.now().year, version,
+                lambda: call_qwen_max_api(prompt, []), is_api_error
+            )
+            return f"{header}\n{analysis}"
         except Exception as e:
             print(f"八字分析错误: {e}")
             return "抱歉，八字分析时出现了问题。请稍后重试。"
+    
+    def analyze_bazi_stream(self, birth_date, birth_time, gender, location):
+        """
+        Stream the bazi analysis text as Qwen Max generates it
+        
+        Cache hits are sent in one piece; a stream is stored only if it
+        completed without a fallback message.
+        """
+        request = self._build_bazi_prompt(birth_date, birth_time, gender, location)
+        if request is None:
+            yield BIRTH_FORMAT_ERROR
+            return
+        header, prompt, full_bazi, version = request
+        
+        try:
+            if full_bazi is None:
+                yield from stream_qwen_max_api(prompt, [])
+                return
+            
+            cache = get_bazi_response_cache()
+            year = datetime.now().year
+            yield f"{header}\n"
+            cached = cache.get(full_bazi, gender, year, version)
+            if cached is not None:
+                yield cached
+                return
+            
+            parts = []
+            failed = False
+            for chunk in stream_qwen_max_api(prompt, []):
+                failed = failed or is_api_error(chunk)
+                parts.append(chunk)
+                yield chunk
+            analysis = "".join(parts)
+            if analysis and not failed:
+                cache.put(full_bazi, gender, year, version, analysis)
+        except Exception as e:
+            print(f"八字分析错误: {e}")
+            yield APIErrorMessage("抱歉，八字分析时出现了问题。请稍后重试。")
 
 # Test function
 def test_qji_cnlunar_engine():
@@ -53,7 +53,7 @@ class IndependentQjiEngine:
         # Get current date context
         date_context = self.get_current_date_context()
         
-        # If date validation needed, get real lunar date from web search
+        # If date validation needed, get the lunar date from the local calendar
         if needs_date_validation:
             try:
                 real_lunar_date = self.date_handler.get_real_lunar_date()
@@ -17,8 +17,20 @@ except ImportError:
     LunarDate = None
     Lunar = None
 
+from src.core.bazi_pillars import pillar_calculator
+from src.core.calendar_table import get_calendar_table
+from src.core.chart_analyzer import get_chart_analyzer, format_chart_features
+from src.core.response_cache import get_bazi_response_cache
+from src.data.classics_index import retrieve_classics_context
+
+# Told to the model when retrieval finds nothing, instead of claiming it read the classics
+NO_PASSAGES_NOTE = "本次未检索到相关经典原文，请勿杜撰经典引文。"
+
 # Import Qwen Max API
-from src.core.independent_qwen import call_qwen_max_api
+from src.core.independent_qwen import call_qwen_max_api, is_api_error
+
+# Bump whenever the bazi prompt changes so cached analyses are not reused
+BAZI_PROMPT_VERSION = "fixed-bazi-3"
 
 # Import authoritative bazi validator
 try:
@@ -68,10 +80,7 @@ class IndependentQjiFixedBaziEngine:
         # Try to get lunar date if libraries are available
         if self.use_lunar:
             try:
-                lunar_date = LunarDate.fromSolarDate(now.year, now.month, now.day)
-                lunar_str = f"{lunar_date.year}年{self._get_lunar_month_name(lunar_date.month)}{self._get_lunar_day_name(lunar_date.day)}"
-                if hasattr(lunar_date, 'isLeapMonth') and lunar_date.isLeapMonth:
-                    lunar_str = f"{lunar_date.year}年闰{self._get_lunar_month_name(lunar_date.month)}{self._get_lunar_day_name(lunar_date.day)}"
+                lunar_str = get_calendar_table().format_lunar(now)
                 
                 result["lunar_info"] = lunar_str
             except Exception as e:
@@ -110,8 +119,15 @@ class IndependentQjiFixedBaziEngine:
             if validated_data:
                 return validated_data
         
-        # If no validated data available, return None to indicate need for manual calculation
-        return None
+        # Otherwise compute the pillars locally
+        try:
+            birth_datetime = datetime.strptime(f"{birth_date} {birth_time}", "%Y-%m-%d %H:%M")
+            bazi = pillar_calculator.get_bazi(birth_datetime)
+        except ValueError:
+            # Unparseable or out-of-range date: let the model work from the raw input
+            return None
+        bazi['lunar_date'] = get_calendar_table().format_lunar(birth_datetime) or "未知"
+        return bazi
     
     def generate_response(self, message, conversation_history=None):
         """
@@ -146,8 +162,8 @@ class IndependentQjiFixedBaziEngine:
 - 请确保所有日期相关的回答都基于上述真实日期信息
 - 如果提供了真实农历日期，请优先使用该信息进行命理分析
 
-**命理专业知识来源：**
-你已经深入学习了《渊海子平》、《三命通会》、《滴天髓》、《子平真诠》、《穷通宝鉴》、《神峰通考》、《李虚中命书》、《千里命稿》、《星平会海》等十大命理经典。
+**命理专业知识来源（从命理经典中检索的原文，回答时请以此为依据并注明出处）：**
+{retrieve_classics_context(message) or NO_PASSAGES_NOTE}
 
 **回答策略：**
 - 如果用户问的是日常问题（如天气、新闻、科技、生活等），像普通AI一样正常回答
@@ -179,18 +195,11 @@ class IndependentQjiFixedBaziEngine:
         authoritative_bazi = self.validate_and_get_bazi(birth_date, birth_time)
         
         if authoritative_bazi:
-            # Use authoritative data to generate prompt
-            current_date_info = self.get_current_date_info()
-            current_context = f"当前公历日期：{current_date_info['solar_date']}（{current_date_info['weekday']}）"
-            if current_date_info.get('lunar_info'):
-                current_context += f"\n当前农历日期：{current_date_info['lunar_info']}"
+            date_info = self.get_current_date_info()
+            full_bazi = authoritative_bazi['full_bazi']
             
-            prompt = f"""
-{current_context}
-
-我已经通过权威万年历验证了您的八字信息：
-
-**基本信息**：
+            # Personal details stay out of the prompt so the analysis can be shared
+            header = f"""**基本信息**：
 - 公历出生：{birth_date} {birth_time}
 - 农历出生：{authoritative_bazi['lunar_date']}
 - 性别：{gender}
@@ -198,29 +207,56 @@ class IndependentQjiFixedBaziEngine:
 
 **八字排盘（经权威验证）**：
 - 年柱：{authoritative_bazi['year_pillar']}
+- 月柱：{authoritative_bazi['month_pillar']}
+- 日柱：{authoritative_bazi['day_pillar']}
+- 时柱：{authoritative_bazi['hour_pillar']}
+- 完整八字：{full_bazi}
+"""
+            
+            prompt = f"""
+当前流年：{date_info['year']}年
+
+我已经通过权威万年历验证了八字信息：
+
+- 性别：{gender}
+- 年柱：{authoritative_bazi['year_pillar']}
 - 月柱：{authoritative_bazi['month_pillar']}  
 - 日柱：{authoritative_bazi['day_pillar']}
-- 时柱：{authoritative_bazi.get('hour_pillar', '需根据具体时间确定')}
-- 完整八字：{authoritative_bazi.get('full_bazi', '待确认')}
+- 时柱：{authoritative_bazi['hour_pillar']}
+- 完整八字：{full_bazi}
+
+{format_chart_features(get_chart_analyzer().analyze(full_bazi))}
 
-请基于以上准确的八字信息，结合十大命理经典的理论，为我提供详细的专业分析：
+{retrieve_classics_context(f"{authoritative_bazi['day_pillar'][0]}日主生于{authoritative_bazi['month_pillar'][1]}月 日主强弱 格局 用神") or NO_PASSAGES_NOTE}
 
-1. **日主强弱分析**：分析日主在八字中的旺衰状态
+请基于以上准确的八字信息，结合所附命理经典原文，为我提供详细的专业分析：
+
+1. **日主强弱分析**：依据上面的命盘结构（十神、藏干、五行力量已算好，无需重新推算）分析日主旺衰
 2. **格局判断**：确定具体的命格类型（正官格、七杀格、财格等）
 3. **用神选择**：根据格局和日主强弱确定用神
-4. **大运流年**：分析当前大运和近期流年走势
+4. **大运流年**：分析当前大运和{date_info['year']}年流年走势
 5. **人生建议**：提供事业、财运、感情、健康等方面的具体建议
 
 请确保分析的专业性和准确性。
 """
-        else:
-            # Fallback to standard prompt if no authoritative data
-            date_info = self.get_current_date_info()
-            current_date_info = f"当前公历日期：{date_info['solar_date']}（{date_info['weekday']}）"
-            if date_info.get('lunar_info'):
-                current_date_info += f"\n当前农历日期：{date_info['lunar_info']}"
             
-            prompt = f"""
+            try:
+                analysis = get_bazi_response_cache().get_or_generate(
+                    full_bazi, gender, date_info['year'], BAZI_PROMPT_VERSION,
+                    lambda: call_qwen_max_api(prompt, []), is_api_error
+                )
+                return f"{header}\n{analysis}"
+            except Exception as e:
+                print(f"八字分析错误: {e}")
+                return "抱歉，八字分析时出现了问题。请稍后重试。"
+        
+        # Fallback to standard prompt if the pillars could not be computed
+        date_info = self.get_current_date_info()
+        current_date_info = f"当前公历日期：{date_info['solar_date']}（{date_info['weekday']}）"
+        if date_info.get('lunar_info'):
+            current_date_info += f"\n当前农历日期：{date_info['lunar_info']}"
+        
+        prompt = f"""
 {current_date_info}
 
 请为我详细分析这个八字：
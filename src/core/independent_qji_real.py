@@ -17,8 +17,20 @@ except ImportError:
     LunarDate = None
     Lunar = None
 
+from src.core.bazi_pillars import pillar_calculator
+from src.core.calendar_table import get_calendar_table
+from src.core.chart_analyzer import get_chart_analyzer, format_chart_features
+from src.core.response_cache import get_bazi_response_cache
+from src.data.classics_index import retrieve_classics_context
+
+# Told to the model when retrieval finds nothing, instead of claiming it read the classics
+NO_PASSAGES_NOTE = "本次未检索到相关经典原文，请勿杜撰经典引文。"
+
 # Import Qwen Max API
-from src.core.independent_qwen import call_qwen_max_api
+from src.core.independent_qwen import call_qwen_max_api, is_api_error
+
+# Bump whenever the bazi prompt changes so cached analyses are not reused
+BAZI_PROMPT_VERSION = "real-3"
 
 class IndependentQjiEngine:
     def __init__(self):
@@ -52,10 +64,7 @@ class IndependentQjiEngine:
         # Try to get lunar date if libraries are available
         if self.use_lunar:
             try:
-                lunar_date = LunarDate.fromSolarDate(now.year, now.month, now.day)
-                lunar_str = f"{lunar_date.year}年{self._get_lunar_month_name(lunar_date.month)}{self._get_lunar_day_name(lunar_date.day)}"
-                if hasattr(lunar_date, 'isLeapMonth') and lunar_date.isLeapMonth:
-                    lunar_str = f"{lunar_date.year}年闰{self._get_lunar_month_name(lunar_date.month)}{self._get_lunar_day_name(lunar_date.day)}"
+                lunar_str = get_calendar_table().format_lunar(now)
                 
                 result["lunar_info"] = lunar_str
             except Exception as e:
@@ -119,8 +128,8 @@ class IndependentQjiEngine:
 - 请确保所有日期相关的回答都基于上述真实日期信息
 - 如果提供了真实农历日期，请优先使用该信息进行命理分析
 
-**命理专业知识来源：**
-你已经深入学习了《渊海子平》、《三命通会》、《滴天髓》、《子平真诠》、《穷通宝鉴》、《神峰通考》、《李虚中命书》、《千里命稿》、《星平会海》等十大命理经典。
+**命理专业知识来源（从命理经典中检索的原文，回答时请以此为依据并注明出处）：**
+{retrieve_classics_context(message) or NO_PASSAGES_NOTE}
 
 **回答策略：**
 - 如果用户问的是日常问题（如天气、新闻、科技、生活等），像普通AI一样正常回答
@@ -151,6 +160,52 @@ class IndependentQjiEngine:
         # Get current date context with real lunar date
         date_info = self.get_current_date_info()
         
+        try:
+            birth_datetime = datetime.strptime(f"{birth_date} {birth_time}", "%Y-%m-%d %H:%M")
+            bazi = pillar_calculator.get_bazi(birth_datetime)
+        except ValueError:
+            bazi = None
+        
+        if bazi:
+            # Pillars are computed locally; the prompt carries no personal details
+            # so the analysis is cached per (pillars, gender, 流年)
+            header = f"""**基本信息**：
+- 出生时间: {birth_date} {birth_time}
+- 性别: {gender}
+- 出生地点: {location}
+- 四柱八字: {bazi['full_bazi']}
+"""
+            
+            prompt = f"""
+当前流年：{date_info['year']}年
+
+请为我详细分析这个八字：
+- 性别: {gender}
+- 四柱八字: {bazi['full_bazi']}（年柱 月柱 日柱 时柱）
+
+{format_chart_features(get_chart_analyzer().analyze(bazi['full_bazi']))}
+
+需要包含以下内容：
+1. 日主强弱分析（以上命盘结构已算好，无需重新推算十神藏干）
+2. 格局判断和用神选择
+3. 大运流年分析（基于当前年份{date_info['year']}）
+4. 具体的人生建议（事业、财运、感情、健康）
+
+{retrieve_classics_context(f"{bazi['day_pillar'][0]}日主生于{bazi['month_pillar'][1]}月 日主强弱 格局 用神") or NO_PASSAGES_NOTE}
+
+请基于以上命理经典原文进行专业分析。
+"""
+            
+            try:
+                analysis = get_bazi_response_cache().get_or_generate(
+                    bazi['full_bazi'], gender, date_info['year'], BAZI_PROMPT_VERSION,
+                    lambda: call_qwen_max_api(prompt, []), is_api_error
+                )
+                return f"{header}\n{analysis}"
+            except Exception as e:
+                print(f"八字分析错误: {e}")
+                return "抱歉，八字分析时出现了问题。请稍后重试。"
+        
         current_date_info = f"当前公历日期：{date_info['solar_date']}（{date_info['weekday']}）"
         if date_info.get('lunar_info'):
             current_date_info += f"\n当前农历日期：{date_info['lunar_info']}"
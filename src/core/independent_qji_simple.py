@@ -18,6 +18,8 @@ except ImportError:
     LunarDate = None
     Lunar = None
 
+from src.core.calendar_table import get_calendar_table
+
 class IndependentQjiEngine:
     def __init__(self):
         """Initialize Qji Simple engine with real-time date handling"""
@@ -48,10 +50,7 @@ class IndependentQjiEngine:
         # Try to get lunar date if libraries are available
         if self.use_lunar:
             try:
-                lunar_date = LunarDate.fromSolarDate(now.year, now.month, now.day)
-                lunar_str = f"{lunar_date.year}年{self._get_lunar_month_name(lunar_date.month)}{self._get_lunar_day_name(lunar_date.day)}"
-                if hasattr(lunar_date, 'isLeapMonth') and lunar_date.isLeapMonth:
-                    lunar_str = f"{lunar_date.year}年闰{self._get_lunar_month_name(lunar_date.month)}{self._get_lunar_day_name(lunar_date.day)}"
+                lunar_str = get_calendar_table().format_lunar(now)
                 
                 result["lunar_info"] = lunar_str
             except Exception as e:
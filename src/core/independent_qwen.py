@@ -2,9 +2,15 @@
 Independent Qwen Max API Integration for Qianji AI with Thinking Mode
 """
 import os
-import requests
-import json
 from pathlib import Path
+import sys
+
+# Add project root to path
+project_root = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
+sys.path.insert(0, project_root)
+
+from src.core.llm_client import get_llm_client, iter_sse_content, LLMError
+from src.core.context_builder import get_context_builder
 
 # Get API key from environment variable or .env file
 def get_qwen_api_key():
@@ -30,60 +36,91 @@ def get_qwen_api_key():
 API_KEY = get_qwen_api_key()
 BASE_URL = "https://coding-intl.dashscope.aliyuncs.com/v1"
 
-def call_qwen_max_api(prompt, conversation_history=None):
-    """
-    Call Qwen Max API with thinking mode enabled
+MODEL = "qwen3-max-2026-01-23"
+
+# Every fallback message starts with this; callers use it to avoid caching failures
+API_ERROR_PREFIX = "抱歉，AI服务暂时不可用"
+
+class APIErrorMessage(str):
     """
-    if conversation_history is None:
-        conversation_history = []
+    A fallback message in place of (or after part of) a reply.
     
-    # Build messages
-    messages = []
-    for msg in conversation_history:
-        messages.append({
-            "role": "user" if msg["role"] == "user" else "assistant",
-            "content": msg["content"]
-        })
+    A stream that fails midway has already yielded part of the answer, so
+    the joined text does not start with API_ERROR_PREFIX; the type of the
+    last chunk is what tells a failed stream from a finished one.
+    """
+
+# Enable thinking mode as per the configuration you provided
+GENERATION_PARAMS = {
+    "max_tokens": 2048,
+    "temperature": 0.7,
+    "extra_body": {
+        "enable_thinking": True
+    }
+}
+
+def build_request_messages(prompt, conversation_history=None, session_id=None,
+                           system_prompt=None, volatile=None):
+    """Budgeted, prefix-stable message list; logs how much of it is cacheable"""
+    builder = get_context_builder(MODEL)
+    messages = builder.build(prompt, conversation_history, system_prompt=system_prompt,
+                             session_id=session_id, volatile=volatile)
+    report = builder.prefix_report(messages)
+    print(f"Prompt prefix: static {report['static_tokens']}, "
+          f"cacheable up to {report['cacheable_tokens']}/{report['total_tokens']} tokens")
+    return messages
+
+def call_qwen_max_api(prompt, conversation_history=None, session_id=None,
+                      system_prompt=None, volatile=None):
+    """
+    Call Qwen Max API with thinking mode enabled
     
-    messages.append({
-        "role": "user",
-        "content": prompt
-    })
+    History is fitted into the model's prompt budget; with a session_id the
+    user's pillars stay pinned and older turns are folded into the session's
+    rolling summary. system_prompt must be static text so it forms a cacheable
+    prefix; per-request context such as the current date goes in `volatile`.
+    """
+    messages = build_request_messages(prompt, conversation_history, session_id,
+                                      system_prompt, volatile)
     
-    headers = {
-        "Authorization": f"Bearer {API_KEY}",
-        "Content-Type": "application/json"
-    }
+    try:
+        return get_llm_client().chat(
+            messages, model=MODEL, api_key=API_KEY, timeout=60, **GENERATION_PARAMS
+        )
+    except LLMError as e:
+        print(f"API Error: {e.status} - {e.body}")
+        return APIErrorMessage(f"{API_ERROR_PREFIX} (错误代码: {e.status})，请稍后重试。")
+    except Exception as e:
+        print(f"API Exception: {e}")
+        return APIErrorMessage(f"{API_ERROR_PREFIX}，请稍后重试。")
+
+def stream_qwen_max_api(prompt, conversation_history=None, session_id=None,
+                        system_prompt=None, volatile=None):
+    """
+    Stream Qwen Max API output as it is generated.
     
-    # Enable thinking mode as per the configuration you provided
-    data = {
-        "model": "qwen3-max-2026-01-23",
-        "messages": messages,
-        "max_tokens": 2048,
-        "temperature": 0.7,
-        "extra_body": {
-            "enable_thinking": True
-        }
-    }
+    Generator yielding text fragments; on failure, possibly after some
+    fragments, yields an APIErrorMessage apology matching what
+    call_qwen_max_api returns. Consumers that store the reply must check
+    each fragment with is_api_error, not just the joined text.
+    """
+    messages = build_request_messages(prompt, conversation_history, session_id,
+                                      system_prompt, volatile)
     
     try:
-        response = requests.post(
-            f"{BASE_URL}/chat/completions",
-            headers=headers,
-            json=data,
-            timeout=60
+        yield from get_llm_client().stream(
+            messages, model=MODEL, api_key=API_KEY, timeout=60, **GENERATION_PARAMS
         )
-        
-        if response.status_code == 200:
-            result = response.json()
-            return result['choices'][0]['message']['content']
-        else:
-            print(f"API Error: {response.status_code} - {response.text}")
-            return f"抱歉，AI服务暂时不可用 (错误代码: {response.status_code})，请稍后重试。"
-            
+    except LLMError as e:
+        print(f"API Error: {e.status} - {e.body}")
+        yield APIErrorMessage(f"{API_ERROR_PREFIX} (错误代码: {e.status})，请稍后重试。")
     except Exception as e:
         print(f"API Exception: {e}")
-        return "抱歉，AI服务暂时不可用，请稍后重试。"
+        yield APIErrorMessage(f"{API_ERROR_PREFIX}，请稍后重试。")
+
+def is_api_error(response):
+    """True if the text (or stream fragment) is one of the fallback messages above"""
+    return isinstance(response, APIErrorMessage) or response.startswith(API_ERROR_PREFIX)
 
 # Test function
 def test_qwen_api():
@@ -6,15 +6,14 @@ import re
 from datetime import datetime
 from typing import Dict, List, Tuple
 
+from ..utils.keyword_scanner import KEYWORD_SETS, has_keyword, message_categories
+
+LUNAR_MONTH_DAY = re.compile(r'[正腊]月.*?\d+')
+
 class IntelligentDecisionEngine:
     def __init__(self):
         # Keywords that indicate need for real-time information
-        self.real_time_keywords = [
-            '今天', '今日', '现在', '当前', '最新', '实时', '最近', '刚刚',
-            '新闻', '天气', '股价', '股票', '汇率', '疫情', '事件',
-            '农历', '阴历', '黄历', '万年历', '老黄历', '日历',
-            '几号', '星期几', '时间', '日期', '日子'
-        ]
+        self.real_time_keywords = KEYWORD_SETS['realtime']
         
         # Keywords that indicate static knowledge
         self.static_knowledge_keywords = [
@@ -71,44 +70,27 @@ class IntelligentDecisionEngine:
     
     def _has_real_time_indicators(self, message: str) -> bool:
         """Check if message contains real-time indicators"""
-        message_lower = message.lower()
-        return any(keyword in message_lower for keyword in self.real_time_keywords)
+        return has_keyword(message, 'realtime')
     
     def _is_date_or_calendar_query(self, message: str) -> bool:
         """Check if query involves date/calendar calculations"""
-        date_patterns = [
-            r'今天.*?农历',
-            r'农历.*?今天', 
-            r'几月几日',
-            r'正月.*?\d+',
-            r'腊月.*?\d+',
-            r'黄历',
-            r'万年历',
-            r'老黄历',
-            r'日历',
-            r'几号',
-            r'星期几'
-        ]
-        
-        for pattern in date_patterns:
-            if re.search(pattern, message):
-                return True
-        return False
+        found = message_categories(message)
+        if 'calendar' in found or {'today', 'lunar'} <= found:
+            return True
+        # Only the month-plus-number forms still need a pattern
+        return bool(LUNAR_MONTH_DAY.search(message))
     
     def _is_financial_query(self, message: str) -> bool:
         """Check if query involves financial data"""
-        financial_keywords = ['股票', '股价', '汇率', '基金', '投资', '理财', '银行', '利率']
-        return any(keyword in message for keyword in financial_keywords)
+        return has_keyword(message, 'finance')
     
     def _is_weather_query(self, message: str) -> bool:
         """Check if query involves weather"""
-        weather_keywords = ['天气', '气温', '温度', '下雨', '晴天', '预报', '气候']
-        return any(keyword in message for keyword in weather_keywords)
+        return has_keyword(message, 'weather')
     
     def _is_news_query(self, message: str) -> bool:
         """Check if query involves news/current events"""
-        news_keywords = ['新闻', '最新消息', '头条', '事件', '发生', '最近', '刚刚']
-        return any(keyword in message for keyword in news_keywords)
+        return has_keyword(message, 'current_events')
     
     def _likely_low_confidence(self, message: str) -> bool:
         """Check if query likely requires external verification"""
@@ -0,0 +1,406 @@
+"""
+Qianji Shared LLM Client
+
+One pooled, keep-alive aiohttp client for every DashScope chat-completions
+call. All HTTP I/O runs on a dedicated event loop thread that owns one
+aiohttp session per upstream host, so the TLS handshake is paid once per
+pooled connection instead of once per message, and outbound concurrency is
+bounded both per model and per host.
+
+Pool sizes come from model_config.json: each provider entry may carry
+"connectionPool": {"maxConnections": N}, and the top-level "llmClient"
+section sets host-wide limits. Callers get both sync (chat, stream) and
+async (achat, astream) entry points regardless of which thread or event
+loop they run on.
+
+Identical requests are coalesced (single-flight): while a call is in flight,
+another call with the same model, messages, params and key joins it instead
+of going upstream, and every caller gets the same response or the same
+stream (late joiners are first replayed the deltas already received). The
+entry is dropped the moment the call finishes, so nothing is ever served
+from a finished call. When every caller of a flight has gone away the
+upstream request is cancelled. "llmClient": {"coalesceRequests": false}
+turns this off.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import queue
+import threading
+from pathlib import Path
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional
+from urllib.parse import urlparse
+
+import aiohttp
+
+MODEL_CONFIG_PATH = Path(__file__).parent.parent.parent / "model_config.json"
+DEFAULT_BASE_URL = "https://coding-intl.dashscope.aliyuncs.com/v1"
+DEFAULT_MODEL = "qwen3-max-2026-01-23"
+DEFAULT_MAX_CONNECTIONS = 8
+DEFAULT_MAX_CONNECTIONS_PER_HOST = 32
+DEFAULT_KEEPALIVE_TIMEOUT = 60
+DEFAULT_COALESCE_REQUESTS = True
+
+_STREAM_END = object()
+
+
+class LLMError(Exception):
+    """Non-200 response from the upstream chat-completions API"""
+
+    def __init__(self, status: int, body: str):
+        super().__init__(f"LLM API error {status}: {body[:200]}")
+        self.status = status
+        self.body = body
+
+
+def load_model_settings(config_path: Path = MODEL_CONFIG_PATH) -> Dict[str, Any]:
+    """Read per-model endpoints and pool sizes from model_config.json"""
+    try:
+        with open(config_path, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+    except Exception as e:
+        print(f"Error loading model config: {e}")
+        config = {}
+
+    client_config = config.get("llmClient", {})
+    models = {}
+    for provider in config.get("modelProviders", {}).values():
+        for entry in provider:
+            pool = entry.get("connectionPool", {})
+            models[entry["id"]] = {
+                "base_url": entry.get("baseUrl", DEFAULT_BASE_URL).rstrip("/"),
+                "env_key": entry.get("envKey"),
+                "max_connections": pool.get(
+                    "maxConnections",
+                    client_config.get("defaultMaxConnections", DEFAULT_MAX_CONNECTIONS)
+                ),
+                "context_budget": entry.get("contextBudget", {}),
+            }
+
+    return {
+        "default_model": config.get("model", {}).get("name", DEFAULT_MODEL),
+        "max_connections_per_host": client_config.get(
+            "maxConnectionsPerHost", DEFAULT_MAX_CONNECTIONS_PER_HOST),
+        "keepalive_timeout": client_config.get("keepaliveTimeout", DEFAULT_KEEPALIVE_TIMEOUT),
+        "coalesce_requests": client_config.get("coalesceRequests", DEFAULT_COALESCE_REQUESTS),
+        "models": models,
+    }
+
+
+class _Flight:
+    """One upstream call shared by the identical requests made while it runs"""
+
+    def __init__(self):
+        self.task: Optional[asyncio.Task] = None
+        self.waiters = 0
+        # Stream deltas so far, replayed to callers that join mid-stream
+        self.chunks: List[str] = []
+        self.subscribers: List[Callable[[str], None]] = []
+
+    def emit(self, content: str):
+        self.chunks.append(content)
+        for subscriber in list(self.subscribers):
+            subscriber(content)
+
+
+class LLMClient:
+    """Pooled chat-completions client with sync and async entry points"""
+
+    def __init__(self, config_path: Path = MODEL_CONFIG_PATH):
+        settings = load_model_settings(config_path)
+        self.default_model = settings["default_model"]
+        self.max_connections_per_host = settings["max_connections_per_host"]
+        self.keepalive_timeout = settings["keepalive_timeout"]
+        self.coalesce_requests = settings["coalesce_requests"]
+        self.models = settings["models"]
+        # Calls that joined an in-flight identical request instead of going upstream
+        self.coalesced = 0
+        self._flights: Dict[str, _Flight] = {}
+
+        self._sessions: Dict[str, aiohttp.ClientSession] = {}
+        self._model_limits: Dict[str, asyncio.Semaphore] = {}
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self._loop.run_forever, name="llm-client", daemon=True)
+        self._thread.start()
+
+    # ---- internals (run on the client loop) ----
+
+    def _model_settings(self, model: str) -> Dict[str, Any]:
+        return self.models.get(model, {
+            "base_url": DEFAULT_BASE_URL,
+            "env_key": None,
+            "max_connections": DEFAULT_MAX_CONNECTIONS,
+            "context_budget": {},
+        })
+
+    def _session_for(self, base_url: str) -> aiohttp.ClientSession:
+        host = urlparse(base_url).netloc
+        session = self._sessions.get(host)
+        if session is None or session.closed:
+            connector = aiohttp.TCPConnector(
+                limit_per_host=self.max_connections_per_host,
+                keepalive_timeout=self.keepalive_timeout,
+            )
+            session = aiohttp.ClientSession(connector=connector)
+            self._sessions[host] = session
+        return session
+
+    def _limit_for(self, model: str) -> asyncio.Semaphore:
+        limit = self._model_limits.get(model)
+        if limit is None:
+            limit = asyncio.Semaphore(self._model_settings(model)["max_connections"])
+            self._model_limits[model] = limit
+        return limit
+
+    def _prepare(self, messages, model, api_key, params, stream):
+        model = model or self.default_model
+        settings = self._model_settings(model)
+        if api_key is None and settings["env_key"]:
+            api_key = os.environ.get(settings["env_key"])
+        headers = {
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json"
+        }
+        payload = {"model": model, "messages": messages, **params}
+        if stream:
+            payload["stream"] = True
+        return model, f"{settings['base_url']}/chat/completions", headers, payload
+
+    def _flight_key(self, kind, messages, model, api_key, params) -> str:
+        body = json.dumps([kind, model or self.default_model, messages, params],
+                          sort_keys=True, ensure_ascii=False, default=str)
+        digest = hashlib.sha256(body.encode("utf-8"))
+        digest.update(hashlib.sha256((api_key or "").encode("utf-8")).digest())
+        return digest.hexdigest()
+
+    async def _join(self, key, start, subscriber=None):
+        """
+        Await the in-flight call for key, starting it with start(flight) if
+        there is none. A cancelled caller leaves the flight; the last one to
+        leave cancels the upstream call.
+        """
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = _Flight()
+            flight.task = self._loop.create_task(start(flight))
+            self._flights[key] = flight
+
+            def finished(_):
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+
+            flight.task.add_done_callback(finished)
+        else:
+            self.coalesced += 1
+
+        flight.waiters += 1
+        if subscriber is not None:
+            for content in flight.chunks:
+                subscriber(content)
+            flight.subscribers.append(subscriber)
+        try:
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            if subscriber is not None:
+                flight.subscribers.remove(subscriber)
+            if flight.waiters == 0 and not flight.task.done():
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+                flight.task.cancel()
+
+    async def _complete(self, messages, model, api_key, timeout, params):
+        """Upstream completion, shared with identical in-flight requests; do not mutate the result"""
+        if not self.coalesce_requests:
+            return await self._complete_upstream(messages, model, api_key, timeout, params)
+        key = self._flight_key("complete", messages, model, api_key, params)
+        return await self._join(
+            key, lambda flight: self._complete_upstream(messages, model, api_key, timeout, params))
+
+    async def _stream(self, messages, model, api_key, timeout, params, emit):
+        """Upstream stream, shared with identical in-flight requests"""
+        if not self.coalesce_requests:
+            return await self._stream_upstream(messages, model, api_key, timeout, params, emit)
+        key = self._flight_key("stream", messages, model, api_key, params)
+        await self._join(
+            key, lambda flight: self._stream_upstream(messages, model, api_key, timeout, params, flight.emit),
+            subscriber=emit)
+
+    async def _complete_upstream(self, messages, model, api_key, timeout, params):
+        model, url, headers, payload = self._prepare(messages, model, api_key, params, False)
+        session = self._session_for(url)
+        async with self._limit_for(model):
+            async with session.post(url, headers=headers, json=payload,
+                                    timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+                if response.status != 200:
+                    raise LLMError(response.status, await response.text())
+                return await response.json(content_type=None)
+
+    async def _stream_upstream(self, messages, model, api_key, timeout, params, emit):
+        """Read the SSE response and hand every content delta to emit()"""
+        model, url, headers, payload = self._prepare(messages, model, api_key, params, True)
+        session = self._session_for(url)
+        async with self._limit_for(model):
+            client_timeout = aiohttp.ClientTimeout(sock_connect=10, sock_read=timeout)
+            async with session.post(url, headers=headers, json=payload,
+                                    timeout=client_timeout) as response:
+                if response.status != 200:
+                    raise LLMError(response.status, await response.text())
+                async for raw_line in response.content:
+                    line = raw_line.decode("utf-8").rstrip("\r\n")
+                    for content in iter_sse_content([line]):
+                        emit(content)
+                    if line.strip() == "data: [DONE]":
+                        break
+
+    def _submit(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    # ---- sync entry points ----
+
+    def complete(self, messages: List[Dict[str, str]], model: Optional[str] = None,
+                 api_key: Optional[str] = None, timeout: float = 60, **params) -> Dict[str, Any]:
+        """Blocking chat-completions call; returns the decoded JSON response"""
+        return self._submit(self._complete(messages, model, api_key, timeout, params)).result()
+
+    def chat(self, messages: List[Dict[str, str]], model: Optional[str] = None,
+             api_key: Optional[str] = None, timeout: float = 60, **params) -> str:
+        """Blocking call returning only the assistant message content"""
+        result = self.complete(messages, model, api_key, timeout, **params)
+        return result['choices'][0]['message']['content']
+
+    def stream(self, messages: List[Dict[str, str]], model: Optional[str] = None,
+               api_key: Optional[str] = None, timeout: float = 60, **params) -> Iterator[str]:
+        """Generator of content deltas; closing it cancels the upstream request"""
+        chunks = queue.Queue()
+
+        async def produce():
+            try:
+                await self._stream(messages, model, api_key, timeout, params, chunks.put)
+            except BaseException as e:
+                chunks.put(e)
+                raise
+            finally:
+                chunks.put(_STREAM_END)
+
+        future = self._submit(produce())
+        try:
+            while True:
+                item = chunks.get()
+                if item is _STREAM_END:
+                    break
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            future.cancel()
+
+    # ---- async entry points (usable from any event loop) ----
+
+    async def acomplete(self, messages: List[Dict[str, str]], model: Optional[str] = None,
+                        api_key: Optional[str] = None, timeout: float = 60,
+                        **params) -> Dict[str, Any]:
+        future = self._submit(self._complete(messages, model, api_key, timeout, params))
+        return await asyncio.wrap_future(future)
+
+    async def achat(self, messages: List[Dict[str, str]], model: Optional[str] = None,
+                    api_key: Optional[str] = None, timeout: float = 60, **params) -> str:
+        result = await self.acomplete(messages, model, api_key, timeout, **params)
+        return result['choices'][0]['message']['content']
+
+    async def astream(self, messages: List[Dict[str, str]], model: Optional[str] = None,
+                      api_key: Optional[str] = None, timeout: float = 60,
+                      **params) -> AsyncIterator[str]:
+        caller_loop = asyncio.get_running_loop()
+        chunks: asyncio.Queue = asyncio.Queue()
+
+        def emit(item):
+            caller_loop.call_soon_threadsafe(chunks.put_nowait, item)
+
+        async def produce():
+            try:
+                await self._stream(messages, model, api_key, timeout, params, emit)
+            except BaseException as e:
+                emit(e)
+                raise
+            finally:
+                emit(_STREAM_END)
+
+        future = self._submit(produce())
+        try:
+            while True:
+                item = await chunks.get()
+                if item is _STREAM_END:
+                    break
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            future.cancel()
+
+    def close(self):
+        """Close pooled connections and stop the client loop"""
+        async def close_sessions():
+            for session in self._sessions.values():
+                await session.close()
+            self._sessions.clear()
+
+        self._submit(close_sessions()).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+
+def iter_sse_content(lines):
+    """
+    Parse a chat-completions SSE stream into content deltas.
+    
+    `lines` is an iterable of decoded lines; yields each non-empty
+    choices[0].delta.content until the [DONE] sentinel.
+    """
+    for line in lines:
+        if not line or not line.startswith("data:"):
+            continue
+        payload = line[len("data:"):].strip()
+        if payload == "[DONE]":
+            break
+        try:
+            chunk = json.loads(payload)
+        except json.JSONDecodeError:
+            print(f"SSE parse error: {payload[:100]}")
+            continue
+        choices = chunk.get("choices") or []
+        if not choices:
+            continue
+        content = (choices[0].get("delta") or {}).get("content")
+        if content:
+            yield content
+
+
+def build_messages(prompt: str, conversation_history: Optional[List[Dict[str, str]]] = None,
+                   system_prompt: Optional[str] = None) -> List[Dict[str, str]]:
+    """Standard message list: optional system prompt, history, then the prompt"""
+    messages = []
+    if system_prompt:
+        messages.append({"role": "system", "content": system_prompt})
+    for msg in conversation_history or []:
+        messages.append({
+            "role": "user" if msg.get("role") == "user" else "assistant",
+            "content": msg.get("content", "")
+        })
+    messages.append({"role": "user", "content": prompt})
+    return messages
+
+
+_llm_client = None
+_llm_client_lock = threading.Lock()
+
+
+def get_llm_client() -> LLMClient:
+    """Process-wide LLMClient shared by all engines"""
+    global _llm_client
+    with _llm_client_lock:
+        if _llm_client is None:
+            _llm_client = LLMClient()
+    return _llm_client
@@ -0,0 +1,225 @@
+"""
+Qianji Luck Pillar (大运) and Annual Pillar (流年) Timeline
+
+Deterministic 大运/流年 computation so the LLM only has to interpret a table
+instead of deriving start ages and pillar sequences itself:
+
+- direction: 阳年男、阴年女顺行，阴年男、阳年女逆行 (by the year stem);
+- start age: the distance from birth to the next 节 (forward) or the
+  previous 节 (backward), three days counting as one year (一日折四个月,
+  一时辰折十日);
+- ten luck pillars stepping from the month pillar in that direction;
+- the 流年 and 流月 pillars of any span of years.
+
+节 moments come from a low-precision solar longitude series (accurate to a
+quarter of an hour or so), solved once per process for every year the
+pillar tables cover. Each moment is clamped into the day cnlunar assigns to
+that 节, so the timeline always agrees with the month pillar from
+PillarCalculator. Everything works on arrays: a batch of charts and a
+hundred-year span is a handful of NumPy operations.
+"""
+from datetime import datetime
+from typing import Dict, Any, Optional
+
+import numpy as np
+from cnlunar.solar24 import getTheYearAllSolarTermsList
+
+from src.core.bazi_pillars import JIA_ZI, MIN_YEAR, MAX_YEAR, pillar_calculator, _MONTH_BASE_YEAR
+
+LUCK_PILLAR_COUNT = 10
+
+# 小寒, 立春, 惊蛰 ... 大雪: the twelve 节 in calendar order, by solar longitude
+_JIE_LONGITUDES = (285 + 30 * np.arange(12)) % 360
+# Rough day of year of each 节, the starting point for the solver
+_JIE_GUESS_DOY = np.array([5, 34, 64, 94, 125, 156, 187, 219, 250, 281, 311, 340])
+
+# Beijing time is UTC+8; tables are kept in local days since 1970-01-01
+_UTC_OFFSET_DAYS = 8 / 24
+_UNIX_EPOCH_JD = 2440587.5
+_TROPICAL_YEAR = 365.2422
+
+_MINUTES_PER_DAY = 1440
+
+
+def solar_longitude(local_days: np.ndarray) -> np.ndarray:
+    """Apparent solar longitude in degrees for Beijing local days since the Unix epoch"""
+    jd = np.asarray(local_days, dtype=np.float64) - _UTC_OFFSET_DAYS + _UNIX_EPOCH_JD
+    t = (jd - 2451545.0) / 36525
+    mean_longitude = 280.46646 + 36000.76983 * t + 0.0003032 * t * t
+    anomaly = np.radians(357.52911 + 35999.05029 * t - 0.0001537 * t * t)
+    center = ((1.914602 - 0.004817 * t - 0.000014 * t * t) * np.sin(anomaly)
+              + (0.019993 - 0.000101 * t) * np.sin(2 * anomaly)
+              + 0.000289 * np.sin(3 * anomaly))
+    omega = np.radians(125.04 - 1934.136 * t)
+    return (mean_longitude + center - 0.00569 - 0.00478 * np.sin(omega)) % 360
+
+
+def _build_jie_table():
+    """Local moments (fractional days since epoch) of every 节 from MIN_YEAR-1 to MAX_YEAR+1"""
+    years = np.arange(MIN_YEAR - 1, MAX_YEAR + 2)
+    year_start = (years - 1970).astype("datetime64[Y]").astype("datetime64[D]").astype(np.float64)[:, None]
+    moments = year_start + _JIE_GUESS_DOY + 0.5
+    for _ in range(5):
+        error = (_JIE_LONGITUDES - solar_longitude(moments) + 180) % 360 - 180
+        moments = moments + error / (360 / _TROPICAL_YEAR)
+
+    # Keep each 节 on the day cnlunar (and so the month pillar) puts it
+    for row, year in enumerate(years):
+        if MIN_YEAR <= year <= MAX_YEAR:
+            terms = getTheYearAllSolarTermsList(int(year))
+            days = np.array([
+                (np.datetime64(f"{year}-{month + 1:02d}-{terms[2 * month]:02d}", "D")
+                 - np.datetime64("1970-01-01", "D")).astype(np.int64)
+                for month in range(12)
+            ], dtype=np.float64)
+            moments[row] = np.clip(moments[row], days, days + 1 - 1 / _MINUTES_PER_DAY)
+    return moments.ravel()
+
+
+class LuckCalculator:
+    """Vectorized 大运/流年 calculator for births in 1901-2100"""
+
+    def __init__(self, calculator=pillar_calculator):
+        self.calculator = calculator
+        self.jie_moments = _build_jie_table()
+        self.jie_days = np.floor(self.jie_moments).astype(np.int64)
+
+    def compute(self, datetimes, is_male) -> Dict[str, np.ndarray]:
+        """
+        Luck pillars for an array of birth datetimes and matching genders.
+
+        Returns arrays: pillars (..., 4) as from PillarCalculator.compute,
+        direction (+1 顺行 / -1 逆行), start_days (distance to the 节 in
+        days), start_years (age at 起运 in years), start_date (datetime64[D]
+        of 起运) and luck (..., 10) sexagenary indices of the luck pillars.
+        """
+        moments = np.asarray(datetimes, dtype="datetime64[m]")
+        pillars = self.calculator.compute(moments)
+        birth = moments.astype(np.int64) / _MINUTES_PER_DAY
+        birth_day = np.floor(birth).astype(np.int64)
+
+        yang_year = pillars[..., 0] % 2 == 0
+        direction = np.where(yang_year == np.asarray(is_male, dtype=bool), 1, -1)
+
+        # 节 on the birth day count as passed, like the month pillar
+        passed = np.searchsorted(self.jie_days, birth_day, side="right")
+        next_jie = self.jie_moments[passed]
+        previous_jie = self.jie_moments[passed - 1]
+        start_days = np.where(direction > 0, next_jie - birth, birth - previous_jie).clip(min=0)
+        start_years = start_days / 3
+
+        start_date = (birth + start_years * _TROPICAL_YEAR).astype(np.int64).astype("datetime64[D]")
+        steps = np.arange(1, LUCK_PILLAR_COUNT + 1)
+        luck = (pillars[..., 1, None].astype(np.int64) + direction[..., None] * steps) % 60
+
+        return {
+            "pillars": pillars,
+            "direction": direction,
+            "start_days": start_days,
+            "start_years": start_years,
+            "start_date": start_date,
+            "luck": luck.astype(np.uint8),
+        }
+
+    @staticmethod
+    def annual_pillars(start_year: int, end_year: int) -> Dict[str, np.ndarray]:
+        """
+        流年 and 流月 pillars for start_year..end_year inclusive.
+
+        months[i] holds the twelve month pillars of years[i] from 寅月 to
+        丑月 (the last one falls in January of the following year).
+        """
+        years = np.arange(start_year, end_year + 1)
+        first_month = (years - _MONTH_BASE_YEAR) * 12 + 2
+        return {
+            "years": years,
+            "year_pillars": ((years - 4) % 60).astype(np.uint8),
+            "months": ((first_month[:, None] + np.arange(12)) % 60).astype(np.uint8),
+        }
+
+    @staticmethod
+    def luck_index(start_date, years) -> np.ndarray:
+        """
+        Which luck pillar (0-9) rules each year, -1 before 起运.
+
+        Luck pillars are counted from the Gregorian year of 起运, so the
+        result has shape start_date.shape + years.shape.
+        """
+        start_year = np.asarray(start_date, dtype="datetime64[Y]").astype(np.int64) + 1970
+        elapsed = np.asarray(years)[None, :] - start_year.reshape(-1, 1)
+        index = np.where(elapsed >= 0, elapsed // 10, -1)
+        index = np.minimum(index, LUCK_PILLAR_COUNT - 1)
+        return index.reshape(np.shape(start_year) + np.shape(years))
+
+    def timeline(self, birth_datetime: datetime, is_male: bool,
+                 start_year: Optional[int] = None, end_year: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Full timeline for one chart with 干支 strings.
+
+        The 流年 span defaults to the ten luck pillars from birth onward.
+        """
+        result = self.compute(np.datetime64(birth_datetime, "m"), is_male)
+        start_date = result["start_date"].item()
+        start_months = int(round(float(result["start_days"]) * 4))
+        start_age = (start_months // 12, start_months % 12)
+
+        luck = []
+        for i, pillar in enumerate(result["luck"]):
+            first = start_date.year + 10 * i
+            luck.append({
+                "pillar": JIA_ZI[pillar],
+                "start_year": first,
+                "end_year": first + 9,
+                # 虚岁
+                "start_age": first - birth_datetime.year + 1,
+            })
+
+        start_year = start_year or birth_datetime.year
+        end_year = end_year or start_date.year + 10 * LUCK_PILLAR_COUNT - 1
+        annual = self.annual_pillars(start_year, end_year)
+        index = self.luck_index(result["start_date"], annual["years"])
+        years = [{
+            "year": int(year),
+            "pillar": JIA_ZI[pillar],
+            "luck_pillar": luck[i]["pillar"] if i >= 0 else None,
+            "months": [JIA_ZI[m] for m in months_row],
+        } for year, pillar, i, months_row in zip(annual["years"], annual["year_pillars"],
+                                                 index, annual["months"])]
+
+        return {
+            "direction": "顺行" if result["direction"] > 0 else "逆行",
+            "start_age": start_age,
+            "start_date": start_date.isoformat(),
+            "luck_pillars": luck,
+            "years": years,
+        }
+
+
+def format_timeline(timeline: Dict[str, Any], current_year: int, years_ahead: int = 4) -> str:
+    """
+    Render the luck pillars, the current 大运 and the coming 流年 for a prompt.
+
+    Only the 起运 year enters the text (not the exact date), so two births in
+    the same 时辰 normally produce the same table.
+    """
+    luck = timeline["luck_pillars"]
+    lines = ["【大运排盘（已按节气精确计算）】",
+             f"- 大运{timeline['direction']}，{luck[0]['start_year']}年起运",
+             "- 十步大运：" + "，".join(
+                 f"{p['pillar']}（{p['start_year']}-{p['end_year']}年，{p['start_age']}岁起）" for p in luck)]
+
+    by_year = {entry["year"]: entry for entry in timeline["years"]}
+    current = by_year.get(current_year)
+    if current:
+        lines.append(f"- {current_year}年流年{current['pillar']}，所行大运："
+                     f"{current['luck_pillar'] or '尚未起运'}")
+        lines.append("- 本年流月（寅月至丑月）：" + " ".join(current["months"]))
+    ahead = [by_year[y] for y in range(current_year + 1, current_year + 1 + years_ahead) if y in by_year]
+    if ahead:
+        lines.append("- 未来流年：" + "，".join(
+            f"{e['year']}{e['pillar']}（{e['luck_pillar'] or '未起运'}运）" for e in ahead))
+    return "\n".join(lines)
+
+
+# Shared calculator; 节 moments are solved once per process
+luck_calculator = LuckCalculator()
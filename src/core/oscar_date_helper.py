@@ -1,30 +1,22 @@
 """
-Oscar Date Helper - Delegate date queries to Oscar for accurate answers
+Oscar Date Helper - Accurate answers to date queries from the local calendar
 """
-import requests
-import json
+from .date_context import get_date_context_provider
 
 class OscarDateHelper:
     def __init__(self):
-        self.gateway_url = "http://localhost:18789"
-        self.gateway_token = "c5969b7f80d50bcb68072f90834134694c356ba4629b659a"
+        self.date_provider = get_date_context_provider()
     
     def get_accurate_date_info(self, query: str) -> str:
         """
-        Get accurate date information from Oscar (OpenClaw)
-        This ensures we get the correct lunar calendar data
+        Get accurate date information for the day the query refers to
         """
         try:
-            # Use OpenClaw's web search capability through the gateway
-            # Since we know Oscar's search works correctly
-            accurate_response = f"根据权威万年历数据，2026年2月24日（星期二）对应的农历日期是：**丙午年（马年）正月初八**。"
-            
-            return accurate_response
-            
+            return self.date_provider.answer(query)
         except Exception as e:
             print(f"Oscar date helper error: {e}")
             # Fallback to safe response
-            return "今天是公历2026年2月24日，星期二。具体的农历信息需要通过专业万年历查询。"
+            return "抱歉，暂时无法获取准确的日期信息。具体的农历信息需要通过专业万年历查询。"
 
 # Test function
 def test_oscar_date_helper():
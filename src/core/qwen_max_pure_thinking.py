@@ -4,9 +4,15 @@ Completely relies on Qwen Max's native reasoning and search decision capabilitie
 No external rules or interventions - let the model think and decide autonomously
 """
 import os
-import requests
 import json
 from pathlib import Path
+import sys
+
+# Add project root to path
+project_root = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
+sys.path.insert(0, project_root)
+
+from src.core.llm_client import get_llm_client, build_messages, LLMError
 
 def get_qwen_api_key():
     """Get Qwen API key from config"""
@@ -35,47 +41,28 @@ def call_qwen_max_pure_thinking(prompt, conversation_history=None):
     if not api_key:
         return "API key not configured"
     
-    try:
-        url = "https://coding-intl.dashscope.aliyuncs.com/v1/chat/completions"
-        headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json"
-        }
-        
-        # Prepare messages
-        messages = []
-        if conversation_history:
-            for msg in conversation_history:
-                messages.append({
-                    "role": "user" if msg.get("role") == "user" else "assistant",
-                    "content": msg.get("content", "")
-                })
-        
-        messages.append({"role": "user", "content": prompt})
-        
-        # Pure thinking mode - let Qwen Max decide everything autonomously
-        data = {
-            "model": "qwen3-max-2026-01-23",
-            "messages": messages,
-            "max_tokens": 4096,  # Higher tokens for complex reasoning
-            "temperature": 0.7,
-            "enable_search": True,  # Enable search capability
-            "search_strategy": "auto",  # Let model decide search strategy
-            "generationConfig": {
-                "extra_body": {
-                    "enable_thinking": True  # Enable full reasoning capability
-                }
+    messages = build_messages(prompt, conversation_history)
+    
+    # Pure thinking mode - let Qwen Max decide everything autonomously
+    params = {
+        "max_tokens": 4096,  # Higher tokens for complex reasoning
+        "temperature": 0.7,
+        "enable_search": True,  # Enable search capability
+        "search_strategy": "auto",  # Let model decide search strategy
+        "generationConfig": {
+            "extra_body": {
+                "enable_thinking": True  # Enable full reasoning capability
             }
         }
-        
-        response = requests.post(url, headers=headers, json=data, timeout=120)  # Longer timeout for complex reasoning
-        if response.status_code == 200:
-            result = response.json()
-            return result['choices'][0]['message']['content']
-        else:
-            print(f"API error: {response.status_code} - {response.text}")
-            return "API call failed"
-            
+    }
+    
+    try:
+        return get_llm_client().chat(
+            messages, model="qwen3-max-2026-01-23", api_key=api_key, timeout=120, **params
+        )
+    except LLMError as e:
+        print(f"API error: {e.status} - {e.body}")
+        return "API call failed"
     except Exception as e:
         print(f"Qwen API call failed: {e}")
         return "API call failed"
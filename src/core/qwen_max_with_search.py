@@ -3,9 +3,15 @@ Qwen Max API with Native Web Search Integration
 Uses Alibaba Cloud DashScope's built-in search capability
 """
 import os
-import requests
 import json
 from pathlib import Path
+import sys
+
+# Add project root to path
+project_root = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
+sys.path.insert(0, project_root)
+
+from src.core.llm_client import get_llm_client, build_messages, LLMError
 
 def get_qwen_api_key():
     """Get Qwen API key from config"""
@@ -26,42 +32,23 @@ def call_qwen_max_with_search(prompt, conversation_history=None, enable_search=T
     if not api_key:
         return "API key not configured"
     
+    messages = build_messages(prompt, conversation_history)
+    
+    # Enable native web search
+    params = {
+        "max_tokens": 2048,
+        "temperature": 0.7,
+        "enable_search": enable_search,
+        "search_strategy": "max"  # Use comprehensive search strategy
+    }
+    
     try:
-        url = "https://coding-intl.dashscope.aliyuncs.com/v1/chat/completions"
-        headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json"
-        }
-        
-        # Prepare messages
-        messages = []
-        if conversation_history:
-            for msg in conversation_history:
-                messages.append({
-                    "role": "user" if msg.get("role") == "user" else "assistant",
-                    "content": msg.get("content", "")
-                })
-        
-        messages.append({"role": "user", "content": prompt})
-        
-        # Enable native web search
-        data = {
-            "model": "qwen3-max-2026-01-23",
-            "messages": messages,
-            "max_tokens": 2048,
-            "temperature": 0.7,
-            "enable_search": enable_search,
-            "search_strategy": "max"  # Use comprehensive search strategy
-        }
-        
-        response = requests.post(url, headers=headers, json=data, timeout=60)
-        if response.status_code == 200:
-            result = response.json()
-            return result['choices'][0]['message']['content']
-        else:
-            print(f"API error: {response.status_code} - {response.text}")
-            return "API call failed"
-            
+        return get_llm_client().chat(
+            messages, model="qwen3-max-2026-01-23", api_key=api_key, timeout=60, **params
+        )
+    except LLMError as e:
+        print(f"API error: {e.status} - {e.body}")
+        return "API call failed"
     except Exception as e:
         print(f"Qwen API call failed: {e}")
         return "API call failed"
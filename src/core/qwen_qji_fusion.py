@@ -12,7 +12,12 @@ from datetime import datetime
 project_root = Path(__file__).parent.parent.parent
 sys.path.insert(0, str(project_root))
 
-from src.core.real_qwen_api import call_qwen_max_api
+from src.core.llm_client import get_llm_client, build_messages
+from src.core.context_builder import get_context_builder, format_turns
+from src.data.classics_index import retrieve_classics_context
+
+# Tokens reserved for the persona and instructions of the enhanced prompt
+PROMPT_TEMPLATE_TOKENS = 600
 
 class QwenQjiFusionEngine:
     def __init__(self):
@@ -57,11 +62,13 @@ class QwenQjiFusionEngine:
         enhanced_prompt = self._create_enhanced_prompt(message, conversation_history)
         
         try:
-            # Call Qwen Max API with enhanced prompt
-            response = call_qwen_max_api(
-                prompt=enhanced_prompt,
+            # Call Qwen Max API with enhanced prompt through the shared pooled client
+            response = get_llm_client().chat(
+                build_messages(enhanced_prompt),
+                model="qwen3-max-2026-01-23",
                 api_key=self.qwen_api_key,
-                base_url=self.qwen_base_url
+                max_tokens=2048,
+                temperature=0.7
             )
             return response
         except Exception as e:
@@ -77,8 +84,9 @@ class QwenQjiFusionEngine:
         current_weekday = ["星期一", "星期二", "星期三", "星期四", "星期五", "星期六", "星期日"][now.weekday()]
         
         # Build context
-        context = f"""你是一个专业的命理AI助手，名为千机AI（Qji AI）。你已经深入学习了以下十大命理经典：
-{', '.join(self.qji_knowledge['bazi_classics'])}
+        passages = retrieve_classics_context(message)
+        context = f"""你是一个专业的命理AI助手，名为千机AI（Qji AI）。以下是从命理经典中检索到的相关原文，回答时请以此为依据并注明出处，不要杜撰引文：
+{passages or '（本次未检索到相关原文）'}
 
 你的回答必须：
 1. 专业、准确、深入
@@ -93,11 +101,14 @@ class QwenQjiFusionEngine:
 """
         
         if conversation_history:
+            builder = get_context_builder("qwen3-max-2026-01-23")
+            budget = builder.max_prompt_tokens - PROMPT_TEMPLATE_TOKENS - builder.count_tokens(message)
+            summary, recent = builder.fit_history(conversation_history, budget)
             context += "\n对话历史：\n"
-            for msg in conversation_history[-3:]:  # Last 3 messages
-                role = "用户" if msg.get("role") == "user" else "助手"
-                content = msg.get("content", "")
-                context += f"{role}：{content}\n"
+            if summary:
+                context += f"（较早对话摘要）{summary}\n"
+            if recent:
+                context += format_turns(recent) + "\n"
         
         return context
     
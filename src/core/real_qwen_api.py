@@ -2,9 +2,15 @@
 Real Qwen Max API Integration for Qianji AI with Web Search Enabled
 """
 import os
-import requests
 import json
 from pathlib import Path
+import sys
+
+# Add project root to path
+project_root = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
+sys.path.insert(0, project_root)
+
+from src.core.llm_client import get_llm_client, build_messages, LLMError
 
 # Get API key from environment or config
 def get_qwen_api_key():
@@ -27,45 +33,26 @@ def call_qwen_max_api(prompt, conversation_history=None, enable_search=True):
         # Fallback to smart template
         return generate_smart_response(prompt)
     
+    messages = build_messages(prompt, conversation_history)
+    
+    params = {
+        "max_tokens": 2048,
+        "temperature": 0.7
+    }
+    
+    # Enable web search for queries that need real-time information
+    if enable_search:
+        params["enable_search"] = True
+        # Optional: set search strategy for more comprehensive results
+        params["search_strategy"] = "max"  # Use comprehensive search strategy
+    
     try:
-        url = "https://coding-intl.dashscope.aliyuncs.com/v1/chat/completions"
-        headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json"
-        }
-        
-        # Prepare messages
-        messages = []
-        if conversation_history:
-            for msg in conversation_history:
-                messages.append({
-                    "role": "user" if msg.get("role") == "user" else "assistant",
-                    "content": msg.get("content", "")
-                })
-        
-        messages.append({"role": "user", "content": prompt})
-        
-        data = {
-            "model": "qwen3-max-2026-01-23",
-            "messages": messages,
-            "max_tokens": 2048,
-            "temperature": 0.7
-        }
-        
-        # Enable web search for queries that need real-time information
-        if enable_search:
-            data["enable_search"] = True
-            # Optional: set search strategy for more comprehensive results
-            data["search_strategy"] = "max"  # Use comprehensive search strategy
-        
-        response = requests.post(url, headers=headers, json=data, timeout=60)  # Increased timeout for search
-        if response.status_code == 200:
-            result = response.json()
-            return result['choices'][0]['message']['content']
-        else:
-            print(f"API error: {response.status_code} - {response.text}")
-            return generate_smart_response(prompt)
-            
+        return get_llm_client().chat(
+            messages, model="qwen3-max-2026-01-23", api_key=api_key, timeout=60, **params
+        )
+    except LLMError as e:
+        print(f"API error: {e.status} - {e.body}")
+        return generate_smart_response(prompt)
     except Exception as e:
         print(f"Qwen API call failed: {e}")
         return generate_smart_response(prompt)
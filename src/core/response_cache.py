@@ -0,0 +1,170 @@
+"""
+Qianji Bazi Response Cache
+
+Every user with the same four pillars and gender receives the same LLM bazi
+analysis for a given 流年, so the generated text is cached on the normalized
+tuple (full_bazi, gender, target year, prompt template version) instead of
+on the raw birth date string. A whole 2-hour window of births shares one
+entry.
+
+Backed by a local SQLite file (WAL mode, safe across gunicorn workers).
+Entries for past years are purged as soon as the 流年 changes, the table is
+bounded by LRU eviction, and hit/miss/eviction counters are kept per process.
+"""
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional
+
+DEFAULT_CACHE_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(__file__)), "data", "bazi_response_cache.sqlite3"
+)
+DEFAULT_MAX_ENTRIES = 5000
+
+_GENDER_ALIASES = {
+    "男": "男", "male": "男", "m": "男", "乾": "男", "乾造": "男",
+    "女": "女", "female": "女", "f": "女", "坤": "女", "坤造": "女",
+}
+
+
+def normalize_gender(gender: str) -> str:
+    """Map the many spellings the front ends send onto 男/女"""
+    value = (gender or "").strip()
+    return _GENDER_ALIASES.get(value.lower(), value)
+
+
+def normalize_bazi(full_bazi: str) -> str:
+    """Collapse whitespace so '甲子 乙丑  丙寅 丁卯' and '甲子乙丑丙寅丁卯' match"""
+    chars = "".join(full_bazi.split())
+    return " ".join(chars[i:i + 2] for i in range(0, len(chars), 2))
+
+
+class BaziResponseCache:
+    """SQLite-backed LRU cache for LLM bazi analyses"""
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS bazi_responses (
+                full_bazi TEXT NOT NULL,
+                gender TEXT NOT NULL,
+                target_year INTEGER NOT NULL,
+                template_version TEXT NOT NULL,
+                response TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL,
+                hit_count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (full_bazi, gender, target_year, template_version)
+            )
+        """)
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_bazi_responses_access ON bazi_responses (last_access)")
+        self._conn.commit()
+        self._current_year = None
+
+    def _key(self, full_bazi, gender, target_year, template_version):
+        return (normalize_bazi(full_bazi), normalize_gender(gender), int(target_year), template_version)
+
+    def _expire_past_years(self):
+        """Drop every entry whose 流年 is over; runs once per year change"""
+        year = datetime.now().year
+        if year == self._current_year:
+            return
+        cursor = self._conn.execute("DELETE FROM bazi_responses WHERE target_year < ?", (year,))
+        self.evictions += cursor.rowcount
+        self._conn.commit()
+        self._current_year = year
+
+    def get(self, full_bazi: str, gender: str, target_year: int,
+            template_version: str) -> Optional[str]:
+        """Cached analysis or None"""
+        key = self._key(full_bazi, gender, target_year, template_version)
+        with self._lock:
+            self._expire_past_years()
+            row = self._conn.execute(
+                "SELECT response FROM bazi_responses WHERE full_bazi = ? AND gender = ? "
+                "AND target_year = ? AND template_version = ?", key).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute(
+                "UPDATE bazi_responses SET last_access = ?, hit_count = hit_count + 1 "
+                "WHERE full_bazi = ? AND gender = ? AND target_year = ? AND template_version = ?",
+                (time.time(),) + key)
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, full_bazi: str, gender: str, target_year: int,
+            template_version: str, response: str):
+        """Store an analysis and evict least recently used entries over the bound"""
+        key = self._key(full_bazi, gender, target_year, template_version)
+        now = time.time()
+        with self._lock:
+            self._expire_past_years()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO bazi_responses (full_bazi, gender, target_year, "
+                "template_version, response, created_at, last_access) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                key + (response, now, now))
+            overflow = self._conn.execute(
+                "SELECT COUNT(*) FROM bazi_responses").fetchone()[0] - self.max_entries
+            if overflow > 0:
+                self._conn.execute(
+                    "DELETE FROM bazi_responses WHERE rowid IN (SELECT rowid FROM bazi_responses "
+                    "ORDER BY last_access ASC LIMIT ?)", (overflow,))
+                self.evictions += overflow
+            self._conn.commit()
+
+    def get_or_generate(self, full_bazi: str, gender: str, target_year: int,
+                        template_version: str, generate: Callable[[], str],
+                        is_error: Callable[[str], bool] = lambda response: False) -> str:
+        """Return the cached analysis, or call generate() and cache its result"""
+        cached = self.get(full_bazi, gender, target_year, template_version)
+        if cached is not None:
+            return cached
+        response = generate()
+        if response and not is_error(response):
+            self.put(full_bazi, gender, target_year, template_version, response)
+        return response
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss metrics for monitoring"""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM bazi_responses").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def close(self):
+        self._conn.close()
+
+
+_bazi_response_cache = None
+_bazi_response_cache_lock = threading.Lock()
+
+
+def get_bazi_response_cache() -> BaziResponseCache:
+    """Process-wide cache instance"""
+    global _bazi_response_cache
+    with _bazi_response_cache_lock:
+        if _bazi_response_cache is None:
+            _bazi_response_cache = BaziResponseCache()
+    return _bazi_response_cache
@@ -5,32 +5,32 @@ import json
 import re
 from datetime import datetime
 
+from src.core.conversation_store import get_conversation_store
+
 class SimpleConversationManager:
-    def __init__(self):
-        self.conversations = {}
+    def __init__(self, store=None):
+        self.store = store if store is not None else get_conversation_store()
     
     def get_response(self, message, conversation_id=None, history=None):
         """
         Generate context-aware response
+        
+        When history is None it is loaded from the conversation store.
         """
         if conversation_id is None:
             conversation_id = "default"
         
         if history is None:
-            history = []
-        
-        # Store conversation history
-        if conversation_id not in self.conversations:
-            self.conversations[conversation_id] = []
+            history = self.store.get_history(conversation_id)
         
         # Add current message to history
-        self.conversations[conversation_id].append({"role": "user", "content": message})
+        self.store.append(conversation_id, "user", message)
         
         # Generate intelligent response based on context
         response = self._generate_contextual_response(message, history)
         
         # Add response to history
-        self.conversations[conversation_id].append({"role": "assistant", "content": response})
+        self.store.append(conversation_id, "assistant", response)
         
         return response
     
@@ -1,51 +1,25 @@
 """
 Smart Date Handler for Qianji AI
-Automatically validates and corrects date-related queries using web search
+Adds accurate date context to date-related queries from the local calendar
 """
-import requests
-import json
 from datetime import datetime
-from .web_search import WebSearch
+from .date_context import get_date_context_provider
 
 class SmartDateHandler:
     def __init__(self):
-        self.web_search = WebSearch()
-        self.date_keywords = ['今天', '今日', '现在', '当前', '日期', '日子', '农历', '阴历', '阳历', '黄历', '星期']
+        self.date_provider = get_date_context_provider()
     
     def should_handle_date_query(self, message: str) -> bool:
         """Check if message requires date validation"""
-        return any(keyword in message for keyword in self.date_keywords)
+        return self.date_provider.mentions_date(message)
     
     def get_accurate_date_info(self, message: str) -> str:
         """
-        Get accurate date information by searching the web
+        Get accurate date information from the local calendar
         Returns formatted date context string
         """
         try:
-            # Get current date for search query
-            now = datetime.now()
-            current_date_str = now.strftime("%Y年%m月%d日")
-            
-            # Create search query
-            search_query = f"今天农历日期 {current_date_str} 农历"
-            
-            # Perform web search
-            results = self.web_search.search(search_query, count=3)
-            
-            if results:
-                # Extract date information from search results
-                date_info = "【联网验证的真实日期信息】\n"
-                for i, result in enumerate(results[:2]):
-                    title = result.get('title', '')
-                    snippet = result.get('snippet', '')
-                    if title or snippet:
-                        date_info += f"- 来源{i+1}: {title}\n  内容: {snippet}\n"
-                return date_info
-            
-            # Fallback to basic date info
-            weekday = ["星期一", "星期二", "星期三", "星期四", "星期五", "星期六", "星期日"][now.weekday()]
-            return f"【基础日期信息】\n- 公历日期: {current_date_str}\n- 星期: {weekday}\n- 注意: 未获取到农历信息，请以权威黄历为准"
-            
+            return self.date_provider.format_context()
         except Exception as e:
             print(f"Date validation error: {e}")
             # Return safe fallback
@@ -54,6 +28,10 @@ class SmartDateHandler:
             current_date_str = now.strftime("%Y年%m月%d日")
             return f"【日期信息（本地计算）】\n- 公历日期: {current_date_str}\n- 星期: {weekday}\n- 农历日期: 请查询权威黄历确认"
     
+    def get_real_lunar_date(self) -> str:
+        """Current lunar date as 丙午年正月初八, or None outside the calendar range"""
+        return self.date_provider.get()['lunar']
+    
     def enhance_prompt_with_date_context(self, original_prompt: str, message: str) -> str:
         """Enhance prompt with accurate date context"""
         if self.should_handle_date_query(message):
@@ -4,36 +4,20 @@ Routes queries to appropriate handlers based on content type
 """
 import re
 from .qwen_max_thinking import call_qwen_max_thinking
+from .almanac import almanac_date_answer
+from ..utils.keyword_scanner import KEYWORD_SETS, has_keyword
 
 class SmartRouter:
     def __init__(self):
-        self.date_keywords = [
-            '今天', '今日', '现在', '当前', '日期', '日子', 
-            '农历', '阴历', '阳历', '公历', '正月', '腊月',
-            '春节', '元宵', '端午', '中秋', '重阳', '除夕',
-            '黄历', '万年历', '老黄历', '日历', '几号'
-        ]
+        self.date_keywords = KEYWORD_SETS['date']
         
     def should_handle_date_query(self, message: str) -> bool:
         """Check if message is a date-related query"""
-        return any(keyword in message for keyword in self.date_keywords)
+        return has_keyword(message, 'date')
     
     def handle_date_query(self, message: str, conversation_history=None) -> str:
-        """Handle date queries with pre-verified accurate data"""
-        # For now, use the verified correct date
-        # In production, this would fetch from authoritative sources
-        response = """今天是公历2026年2月24日，星期二。
-
-根据权威万年历数据验证，对应的农历日期是：**丙午年（马年）正月初八**。
-
-这是经过多个权威来源交叉验证的准确信息：
-- 全民万年历：2026年2月24日 = 农历二〇二六年正月初八
-- 星座百科网：公历2026年2月24日 = 农历马年正月初八  
-- 2345万年历：2026年2月24日 = 农历正月初八
-
-如果您需要更详细的黄历信息（宜忌、冲煞、吉时等），我可以为您提供专业分析。"""
-        
-        return response
+        """Answer date queries from the local calendar, with the day's 黄历 (宜忌、冲煞、吉时)"""
+        return almanac_date_answer(message)
     
     def handle_general_query(self, message: str, conversation_history=None) -> str:
         """Handle general queries with Qwen Max Thinking mode"""
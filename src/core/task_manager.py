@@ -5,7 +5,7 @@ Handles concurrent subtasks with proper resource management and coordination.
 import asyncio
 import threading
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from typing import Dict, List, Any, Callable, Optional
+from typing import Dict, List, Any, Callable, Coroutine, Optional
 import time
 import logging
 
@@ -165,7 +165,7 @@ class AsyncTaskManager:
         self.semaphore = asyncio.Semaphore(max_concurrent)
         self.active_tasks: Dict[str, asyncio.Task] = {}
         
-    async def execute_async_task(self, task_id: str, coro: asyncio.Coroutine) -> Any:
+    async def execute_async_task(self, task_id: str, coro: Coroutine) -> Any:
         """Execute an async task with concurrency control."""
         async with self.semaphore:
             task = asyncio.create_task(coro)
@@ -177,7 +177,7 @@ class AsyncTaskManager:
                 if task_id in self.active_tasks:
                     del self.active_tasks[task_id]
                     
-    async def execute_multiple_async_tasks(self, tasks: Dict[str, asyncio.Coroutine]) -> Dict[str, Any]:
+    async def execute_multiple_async_tasks(self, tasks: Dict[str, Coroutine]) -> Dict[str, Any]:
         """Execute multiple async tasks concurrently."""
         task_coros = [
             self.execute_async_task(tid, coro) 
@@ -0,0 +1,46 @@
+"""
+Qianji True Solar Time
+
+Birth times are given in wall-clock time, but the hour pillar follows the
+sun. For a birth in Kashgar at 12:30 Beijing time the sun is more than two
+hours short of noon, so the chart needs 辰时, not 午时. The correction is:
+
+    true solar time = wall time - UTC offset (with DST, per zoneinfo)
+                      + longitude × 4 minutes + equation of time
+
+Places are resolved with the offline gazetteer; unknown places are left
+uncorrected.
+"""
+import math
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+from zoneinfo import ZoneInfo
+
+from src.data.gazetteer import get_gazetteer
+
+
+def equation_of_time(moment: datetime) -> float:
+    """Apparent minus mean solar time in minutes (within about half a minute)"""
+    b = 2 * math.pi * (moment.timetuple().tm_yday - 81) / 364
+    return 9.87 * math.sin(2 * b) - 7.53 * math.cos(b) - 1.5 * math.sin(b)
+
+
+def true_solar_time(birth_datetime: datetime, location: str) -> Optional[Dict[str, Any]]:
+    """
+    Corrected birth time for a wall-clock time at a free-text location.
+
+    Returns datetime (rounded to the minute), the matched place and the
+    correction in minutes, or None if the place is not in the gazetteer.
+    """
+    place = get_gazetteer().lookup(location)
+    if place is None:
+        return None
+    utc_offset = ZoneInfo(place.timezone).utcoffset(birth_datetime)
+    mean_solar = birth_datetime - utc_offset + timedelta(minutes=place.longitude * 4)
+    corrected = mean_solar + timedelta(minutes=equation_of_time(mean_solar))
+    corrected = (corrected + timedelta(seconds=30)).replace(second=0, microsecond=0)
+    return {
+        "datetime": corrected,
+        "place": place,
+        "correction_minutes": round((corrected - birth_datetime).total_seconds() / 60),
+    }
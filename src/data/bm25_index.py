@@ -0,0 +1,153 @@
+"""
+Qianji BM25 Index
+
+Lexical retrieval for classical Chinese, where exact terms such as 伤官见官
+or 杀印相生 matter more than paraphrase. Text is cut into runs of CJK
+ideographs and ASCII letters/digits (punctuation breaks a run), and every
+character bigram and trigram of a run is a term. A term is packed into one
+int64 from its code points (21 bits each), so the vocabulary is a sorted
+integer array and needs no string table.
+
+Postings are built with one lexsort over all (term, doc) pairs and stored as
+flat NumPy arrays: terms (V,), offsets (V+1,), docs (P,) int32 and tfs (P,)
+uint16, plus doc_lengths (N,). save() writes them as .npy files that load()
+memory-maps, so workers share the pages. A query looks up its few terms
+with searchsorted and adds their BM25 weights into a score vector.
+"""
+import os
+from pathlib import Path
+from typing import List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+K1 = 1.2
+B = 0.75
+FILES = ("terms", "offsets", "docs", "tfs", "doc_lengths")
+
+
+def _token_mask(codes: np.ndarray) -> np.ndarray:
+    """Characters that belong to a term: CJK ideographs and ASCII letters/digits"""
+    return (((codes >= 0x4E00) & (codes <= 0x9FFF))
+            | ((codes >= 0x3400) & (codes <= 0x4DBF))
+            | ((codes >= 0xF900) & (codes <= 0xFAFF))
+            | ((codes >= 0x20000) & (codes <= 0x2FFFF))
+            | ((codes >= 0x30) & (codes <= 0x39))
+            | ((codes >= 0x61) & (codes <= 0x7A)))
+
+
+def _terms_at(codes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """(bigram and trigram codes, their start positions) of a code point array"""
+    if len(codes) < 2:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    valid = _token_mask(codes)
+    pair = valid[:-1] & valid[1:]
+    bigrams = (codes[:-1] << 42 | codes[1:] << 21)[pair]
+    triple = pair[:-1] & valid[2:]
+    trigrams = (codes[:-2] << 42 | codes[1:-1] << 21 | codes[2:])[triple]
+    return np.concatenate([bigrams, trigrams]), np.concatenate([np.flatnonzero(pair), np.flatnonzero(triple)])
+
+
+def _code_points(text: str) -> np.ndarray:
+    """Code points with ASCII folded to lower case; one per character, so positions hold"""
+    codes = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32).astype(np.int64)
+    codes[(codes >= 0x41) & (codes <= 0x5A)] += 0x20
+    return codes
+
+
+def text_terms(text: str) -> np.ndarray:
+    """Bigram and trigram codes of a text, repeats kept"""
+    return _terms_at(_code_points(text))[0]
+
+
+def term_text(term: int) -> str:
+    """The characters of a packed term, for debugging"""
+    return "".join(chr(c) for c in (term >> 42, (term >> 21) & 0x1FFFFF, term & 0x1FFFFF) if c)
+
+
+class BM25Index:
+    """Okapi BM25 over character n-grams with NumPy posting lists"""
+
+    def __init__(self, terms: np.ndarray, offsets: np.ndarray, docs: np.ndarray,
+                 tfs: np.ndarray, doc_lengths: np.ndarray):
+        self.terms = terms
+        self.offsets = offsets
+        self.docs = docs
+        self.tfs = tfs
+        self.doc_lengths = doc_lengths
+        self.doc_count = len(doc_lengths)
+        self.average_length = float(doc_lengths.mean()) if self.doc_count else 0.0
+        # Per-document BM25 length normalization, computed once
+        self._norm = (K1 * (1 - B + B * doc_lengths / (self.average_length or 1))).astype(np.float32)
+
+    @classmethod
+    def build(cls, texts: Sequence[str]) -> "BM25Index":
+        # One pass over all texts joined by newlines, which no term spans
+        lengths_chars = np.array([len(text) + 1 for text in texts], dtype=np.int64)
+        doc_starts = np.cumsum(lengths_chars) - lengths_chars
+        all_terms, positions = _terms_at(_code_points("\n".join(texts)))
+        all_docs = (np.searchsorted(doc_starts, positions, side="right") - 1).astype(np.int32)
+        lengths = np.bincount(all_docs, minlength=len(texts)).astype(np.float32)
+        if not len(all_terms):
+            empty = np.zeros(0, dtype=np.int64)
+            return cls(empty, np.zeros(1, dtype=np.int64), empty.astype(np.int32),
+                       empty.astype(np.uint16), lengths)
+
+        order = np.lexsort((all_docs, all_terms))
+        all_terms, all_docs = all_terms[order], all_docs[order]
+        starts = np.flatnonzero(np.r_[True, (all_terms[1:] != all_terms[:-1]) | (all_docs[1:] != all_docs[:-1])])
+        tfs = np.diff(np.r_[starts, len(all_terms)])
+        pair_terms = all_terms[starts]
+        term_starts = np.flatnonzero(np.r_[True, pair_terms[1:] != pair_terms[:-1]])
+        return cls(pair_terms[term_starts], np.r_[term_starts, len(pair_terms)].astype(np.int64),
+                   all_docs[starts], np.minimum(tfs, np.iinfo(np.uint16).max).astype(np.uint16), lengths)
+
+    def save(self, directory: Union[str, Path], prefix: str = "bm25_"):
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        for name in FILES:
+            tmp_path = directory / f"{prefix}{name}.tmp.npy"
+            np.save(tmp_path, getattr(self, name))
+            os.replace(tmp_path, directory / f"{prefix}{name}.npy")
+
+    @classmethod
+    def exists(cls, directory: Union[str, Path], prefix: str = "bm25_") -> bool:
+        return all((Path(directory) / f"{prefix}{name}.npy").exists() for name in FILES)
+
+    @classmethod
+    def load(cls, directory: Union[str, Path], prefix: str = "bm25_") -> "BM25Index":
+        arrays = [np.load(Path(directory) / f"{prefix}{name}.npy", mmap_mode="r") for name in FILES]
+        return cls(*arrays)
+
+    def _postings(self, term: int) -> Tuple[np.ndarray, np.ndarray]:
+        i = int(np.searchsorted(self.terms, term))
+        if i == len(self.terms) or self.terms[i] != term:
+            return self.docs[:0], self.tfs[:0]
+        start, end = int(self.offsets[i]), int(self.offsets[i + 1])
+        return self.docs[start:end], self.tfs[start:end]
+
+    def scores(self, query: str) -> np.ndarray:
+        """BM25 score of every document; zero where no query term occurs"""
+        scores = np.zeros(self.doc_count, dtype=np.float32)
+        terms, counts = np.unique(text_terms(query), return_counts=True)
+        for term, count in zip(terms.tolist(), counts.tolist()):
+            docs, tfs = self._postings(term)
+            if not len(docs):
+                continue
+            idf = np.log(1 + (self.doc_count - len(docs) + 0.5) / (len(docs) + 0.5))
+            tfs = tfs.astype(np.float32)
+            # Each doc appears once per term, so plain fancy-index addition is safe
+            scores[docs] += count * idf * tfs * (K1 + 1) / (tfs + self._norm[docs])
+        return scores
+
+    def search(self, query: str, k: int, alive: Optional[np.ndarray] = None) -> List[Tuple[int, float]]:
+        """(doc, score) of the k best matching documents, best first"""
+        scores = self.scores(query)
+        if alive is not None:
+            scores[~alive] = 0
+        hits = np.flatnonzero(scores > 0)
+        if not len(hits) or k <= 0:
+            return []
+        k = min(k, len(hits))
+        top = hits[np.argpartition(-scores[hits], k - 1)[:k]]
+        top = top[np.lexsort((top, -scores[top]))]
+        return [(int(doc), float(scores[doc])) for doc in top]
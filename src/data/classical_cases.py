@@ -0,0 +1,539 @@
+"""
+Qianji Classical Case Database
+
+Structured 命例 from the classics. The extractor streams a book with
+classical_stream, recognizes four-pillar sequences in the notations the
+classics use:
+
+    乾造：庚午 辛巳 庚辰 辛巳          (spaces, 、 or ， between pillars)
+    丁亥年 庚戌月 己巳日 庚午时        (年/月/日/时 suffixes)
+    庚　辛　庚　辛                      (stems over branches on two lines)
+    午　巳　辰　巳
+
+and normalizes each one to the sexagenary index tuple pillar_calculator
+computes. A sequence only counts as a chart if its month stem follows from
+the year stem (五虎遁) and its hour stem from the day stem (五鼠遁), which
+rejects 六十甲子 listings and other runs of 干支. Each case is linked to the
+commentary that follows it, up to the next case or section, with byte
+offsets into the source for ClassicalTextStore.
+
+Cases live in SQLite (WAL) indexed by pillars, day master + month command
+and strength, with the chart_analyzer feature vector of each case.
+nearest() ranks every case against a chart in one vectorized pass over
+arrays cached from the table, so prompts can cite real precedent:
+
+    python -m src.data.classical_cases --update
+    python -m src.data.classical_cases --query "庚午 辛巳 庚辰 辛巳" -k 3
+"""
+import argparse
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Union
+
+import numpy as np
+
+from src.core.bazi_pillars import TIAN_GAN, DI_ZHI, JIA_ZI
+from src.core.chart_analyzer import PillarsLike, analyze_batch, feature_vector, pillar_indices, strength_label
+from src.utils.classical_stream import DEFAULT_CLASSICS_DIR, iter_lines
+
+DEFAULT_DB_PATH = Path(__file__).parent / "classical_cases.sqlite3"
+DEFAULT_TOP_K = 3
+MAX_COMMENTARY_CHARS = 400
+MAX_LABEL_CHARS = 24
+
+POSITIONS = ["年", "月", "日", "时"]
+# Similarity: same pillar per position, same day master, same month command, feature cosine
+POSITION_WEIGHTS = np.array([0.5, 1.5, 2.0, 0.75], dtype=np.float32)
+DAY_MASTER_WEIGHT = 1.0
+MONTH_COMMAND_WEIGHT = 1.0
+FEATURE_WEIGHT = 2.0
+
+_STEMS = "".join(TIAN_GAN)
+_BRANCHES = "".join(DI_ZHI)
+_SEP = r"[\s　、，,·/|；;]*"
+_PILLAR = rf"([{_STEMS}][{_BRANCHES}])"
+INLINE_CHART = re.compile(
+    rf"{_PILLAR}年?{_SEP}{_PILLAR}月?{_SEP}{_PILLAR}日?{_SEP}{_PILLAR}[时時]?")
+STACKED_STEMS = re.compile(rf"^\s*([{_STEMS}])[\s　]*([{_STEMS}])[\s　]*([{_STEMS}])[\s　]*([{_STEMS}])\s*$")
+STACKED_BRANCHES = re.compile(rf"^\s*([{_BRANCHES}])[\s　]*([{_BRANCHES}])[\s　]*([{_BRANCHES}])[\s　]*([{_BRANCHES}])\s*$")
+GENDER_MARKERS = [("乾造", "男"), ("坤造", "女"), ("男命", "男"), ("女命", "女"), ("男造", "男"), ("女造", "女")]
+
+
+def sexagenary(stem: int, branch: int) -> Optional[int]:
+    """Index in the 60 cycle, or None for a stem/branch pair of opposite polarity"""
+    if stem % 2 != branch % 2:
+        return None
+    return (6 * stem - 5 * branch) % 60
+
+
+def is_consistent_chart(indices: Sequence[int]) -> bool:
+    """
+    Month stem by 五虎遁 from the year stem, hour stem by 五鼠遁 from the day stem.
+
+    Between 立春 and 春节 the year pillar depends on the convention (the
+    engine changes it at 春节), so in the 子/丑/寅 months the month stem may
+    also follow the neighbouring year.
+    """
+    year, month, day, hour = indices
+    years = [year % 10]
+    if month % 12 in (0, 1, 2):
+        years += [(year - 1) % 10, (year + 1) % 10]
+    month_stems = [(y % 5 * 2 + 2 + (month % 12 - 2) % 12) % 10 for y in years]
+    hour_stem = ((day % 10) % 5 * 2 + hour % 12) % 10
+    return month % 10 in month_stems and hour % 10 == hour_stem
+
+
+def _chart(stems: Sequence[str], branches: Sequence[str]) -> Optional[tuple]:
+    indices = tuple(sexagenary(_STEMS.index(s), _BRANCHES.index(b)) for s, b in zip(stems, branches))
+    if None in indices or not is_consistent_chart(indices):
+        return None
+    return indices
+
+
+def _gender(text: str) -> Optional[str]:
+    found = [(text.rfind(marker), gender) for marker, gender in GENDER_MARKERS if marker in text]
+    return max(found)[1] if found else None
+
+
+def _split_intro(text: str):
+    """(commentary before it, label) of the text leading up to a chart, e.g. "…木旺。又一造：" """
+    text = text.rstrip("：:，,、　 \t")
+    cut = max(text.rfind(mark) for mark in "。；;！？!?，,") + 1
+    return text[:cut], text[cut:].strip()[-MAX_LABEL_CHARS:]
+
+
+def extract_cases(source_file: Union[str, Path], source: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Cases in a classical text, in reading order.
+
+    Each case has its pillars (sexagenary indices and 干支), the book title
+    and section heading it appears under, a label (the text introducing it
+    on its line), the gender if marked 乾造/坤造, the commentary that
+    follows it and the byte range from the chart to the end of that
+    commentary.
+    """
+    source = source or Path(source_file).stem
+    title, heading = source, ""
+    case = None
+
+    def close():
+        nonlocal case
+        if case is not None:
+            parts = case.pop("parts")
+            case["commentary"] = "\n".join(text for text, _ in parts)
+            case["byte_end"] = parts[-1][1] if parts else case["byte_end"]
+            done, case = case, None
+            return done
+        return None
+
+    def open_case(indices, start, end, intro, intro_line=None):
+        nonlocal case
+        # A line that only introduces this chart is not commentary on the one before
+        if case is not None and intro_line is not None and case["parts"] \
+                and case["parts"][-1][1] == intro_line.end:
+            case["parts"].pop()
+        closed = close()
+        label = _split_intro(intro)[1]
+        case = {
+            "source": source, "title": title, "heading": heading,
+            "pillars": list(indices), "full_bazi": " ".join(JIA_ZI[i] for i in indices),
+            "label": label, "gender": _gender(label),
+            "parts": [], "byte_start": start, "byte_end": end,
+        }
+        return closed
+
+    def comment(text, end):
+        text = text.strip().lstrip("，,、：:；;。　 ")
+        if case is None or not text:
+            return
+        used = sum(len(part) for part, _ in case["parts"])
+        if used < MAX_COMMENTARY_CHARS:
+            case["parts"].append((text[:MAX_COMMENTARY_CHARS - used], end))
+
+    def byte_at(line, char_offset):
+        return line.start + len(line.text[:char_offset].encode("utf-8"))
+
+    previous = None
+    stems_line = None
+    for line in iter_lines(source_file):
+        text = line.text
+        stripped = text.strip()
+        if stripped.startswith("#"):
+            closed = close()
+            if closed:
+                yield closed
+            if stripped.startswith("## "):
+                heading = stripped[3:].strip()
+            elif stripped.startswith("# "):
+                title, heading = stripped[2:].strip(), ""
+            previous = stems_line = None
+            continue
+
+        # A line of four stems may be the top half of a stacked chart
+        if stems_line is not None:
+            branches = STACKED_BRANCHES.match(text)
+            indices = _chart(STACKED_STEMS.match(stems_line.text).groups(), branches.groups()) if branches else None
+            if indices:
+                closed = open_case(indices, stems_line.start, line.end,
+                                   previous.text if previous else "", previous)
+                if closed:
+                    yield closed
+                previous, stems_line = line, None
+                continue
+            comment(stems_line.text, stems_line.end)
+            previous, stems_line = stems_line, None
+        if STACKED_STEMS.match(text):
+            stems_line = line
+            continue
+
+        offset = 0
+        for match in INLINE_CHART.finditer(text):
+            pillars = match.groups()
+            indices = _chart([p[0] for p in pillars], [p[1] for p in pillars])
+            if indices is None:
+                continue
+            before = text[offset:match.start()]
+            head = _split_intro(before)[0]
+            comment(head, byte_at(line, offset + len(head)))
+            if before.strip() or offset:
+                closed = open_case(indices, byte_at(line, match.start()), byte_at(line, match.end()), before)
+            else:
+                closed = open_case(indices, byte_at(line, match.start()), byte_at(line, match.end()),
+                                   previous.text if previous else "", previous)
+            if closed:
+                yield closed
+            offset = match.end()
+        comment(text[offset:], line.end)
+        previous = line
+
+    if stems_line is not None:
+        comment(stems_line.text, stems_line.end)
+    closed = close()
+    if closed:
+        yield closed
+
+
+class CaseDatabase:
+    """
+    SQLite store of extracted cases with a vectorized nearest-case search.
+
+    Books are tracked by content hash, so update() re-extracts only books
+    that changed. The pillar and feature arrays used by nearest() are cached
+    and reloaded when this or another process writes to the table.
+    """
+
+    def __init__(self, path: Union[str, Path] = DEFAULT_DB_PATH):
+        self.path = str(path)
+        self._lock = threading.Lock()
+        self._arrays = None
+        self._arrays_version = None
+
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=10)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS books (
+                source TEXT PRIMARY KEY,
+                content_hash TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS cases (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                source TEXT NOT NULL,
+                title TEXT NOT NULL,
+                heading TEXT NOT NULL,
+                label TEXT NOT NULL,
+                gender TEXT,
+                year INTEGER NOT NULL,
+                month INTEGER NOT NULL,
+                day INTEGER NOT NULL,
+                hour INTEGER NOT NULL,
+                day_master INTEGER NOT NULL,
+                month_command INTEGER NOT NULL,
+                strength TEXT NOT NULL,
+                self_share REAL NOT NULL,
+                features BLOB NOT NULL,
+                commentary TEXT NOT NULL,
+                byte_start INTEGER NOT NULL,
+                byte_end INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_cases_pillars ON cases (day, month, year, hour);
+            CREATE INDEX IF NOT EXISTS idx_cases_frame ON cases (day_master, month_command, strength);
+            CREATE INDEX IF NOT EXISTS idx_cases_source ON cases (source);
+        """)
+        self._conn.commit()
+
+    @staticmethod
+    def _case_rows(cases: Sequence[Dict[str, Any]]) -> List[tuple]:
+        """Table rows of extracted cases, with strength and feature vectors computed"""
+        if not cases:
+            return []
+        pillars = np.array([case["pillars"] for case in cases], dtype=np.int64)
+        features = feature_vector(pillars).astype(np.float32)
+        shares = analyze_batch(pillars)["self_share"]
+        rows = [(
+            case["source"], case["title"], case["heading"], case["label"], case.get("gender"),
+            *map(int, chart), int(chart[2] % 10), int(chart[1] % 12),
+            strength_label(float(share)), float(share), vector.tobytes(),
+            case["commentary"], case["byte_start"], case["byte_end"],
+        ) for case, chart, vector, share in zip(cases, pillars, features, shares)]
+        return rows
+
+    def _insert_rows(self, rows: List[tuple]):
+        """Insert case rows in the open transaction; caller holds the lock and commits"""
+        self._conn.executemany(
+            "INSERT INTO cases (source, title, heading, label, gender, year, month, day, hour, "
+            "day_master, month_command, strength, self_share, features, commentary, byte_start, byte_end) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def add_cases(self, cases: Sequence[Dict[str, Any]]) -> int:
+        """Insert extracted cases; returns how many were added"""
+        rows = self._case_rows(cases)
+        if not rows:
+            return 0
+        with self._lock:
+            self._insert_rows(rows)
+            self._conn.commit()
+            self._arrays = None
+        return len(rows)
+
+    def update(self, classics_dir: Union[str, Path] = DEFAULT_CLASSICS_DIR) -> Dict[str, int]:
+        """Re-extract books that are new or changed and drop cases of removed ones"""
+        stats = {"books": 0, "cases": 0, "removed": 0}
+        with self._lock:
+            known = dict(self._conn.execute("SELECT source, content_hash FROM books").fetchall())
+        present = set()
+        for file_path in sorted(Path(classics_dir).glob("*.md")):
+            source = file_path.stem
+            present.add(source)
+            digest = hashlib.sha1()
+            with open(file_path, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(block)
+            if known.get(source) == digest.hexdigest():
+                continue
+            try:
+                rows = self._case_rows(list(extract_cases(file_path, source)))
+            except UnicodeDecodeError as e:
+                print(f"命例提取失败 {file_path}: {e}")
+                continue
+            # Old cases, new cases and the book hash change together, so a
+            # crash midway leaves the book stale and it is re-extracted next time
+            with self._lock:
+                try:
+                    removed = self._conn.execute("DELETE FROM cases WHERE source = ?", (source,)).rowcount
+                    self._insert_rows(rows)
+                    self._conn.execute("INSERT OR REPLACE INTO books (source, content_hash) VALUES (?, ?)",
+                                       (source, digest.hexdigest()))
+                    self._conn.commit()
+                except BaseException:
+                    self._conn.rollback()
+                    raise
+                self._arrays = None
+            stats["removed"] += removed
+            stats["cases"] += len(rows)
+            stats["books"] += 1
+        with self._lock:
+            for source in set(known) - present:
+                stats["removed"] += self._conn.execute("DELETE FROM cases WHERE source = ?", (source,)).rowcount
+                self._conn.execute("DELETE FROM books WHERE source = ?", (source,))
+            self._conn.commit()
+            self._arrays = None
+        return stats
+
+    def version(self) -> str:
+        """Short hash of the extracted books' content hashes; changes whenever update() changes the cases"""
+        with self._lock:
+            books = self._conn.execute("SELECT source, content_hash FROM books ORDER BY source").fetchall()
+        digest = hashlib.sha1("\n".join(f"{source} {content_hash}" for source, content_hash in books).encode("utf-8"))
+        return digest.hexdigest()[:12]
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM cases").fetchone()[0]
+
+    @staticmethod
+    def _row(row) -> Dict[str, Any]:
+        pillars = [row["year"], row["month"], row["day"], row["hour"]]
+        return {
+            "id": row["id"], "source": row["source"], "title": row["title"], "heading": row["heading"],
+            "label": row["label"], "gender": row["gender"],
+            "pillars": [JIA_ZI[i] for i in pillars], "full_bazi": " ".join(JIA_ZI[i] for i in pillars),
+            "strength": row["strength"], "commentary": row["commentary"],
+            "byte_start": row["byte_start"], "byte_end": row["byte_end"],
+        }
+
+    def find_exact(self, pillars: PillarsLike) -> List[Dict[str, Any]]:
+        """Cases with exactly these four pillars"""
+        year, month, day, hour = pillar_indices(pillars)
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM cases WHERE day = ? AND month = ? AND year = ? AND hour = ? ORDER BY id",
+                (day, month, year, hour)).fetchall()
+        return [self._row(row) for row in rows]
+
+    def find_frame(self, day_master: str, month_command: str, strength: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Cases of one day master born in one month command, e.g. 庚 + 巳, optionally by strength"""
+        sql = "SELECT * FROM cases WHERE day_master = ? AND month_command = ?"
+        args = [TIAN_GAN.index(day_master), DI_ZHI.index(month_command)]
+        if strength:
+            sql += " AND strength = ?"
+            args.append(strength)
+        with self._lock:
+            rows = self._conn.execute(sql + " ORDER BY id", args).fetchall()
+        return [self._row(row) for row in rows]
+
+    def _load_arrays(self):
+        """(ids, pillars, unit features, genders), reloaded after any write"""
+        with self._lock:
+            version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+            if self._arrays is None or self._arrays_version != version:
+                rows = self._conn.execute(
+                    "SELECT id, year, month, day, hour, gender, features FROM cases ORDER BY id").fetchall()
+                ids = np.array([row[0] for row in rows], dtype=np.int64)
+                pillars = np.array([row[1:5] for row in rows], dtype=np.int16).reshape(-1, 4)
+                genders = np.array([{"男": 1, "女": 2}.get(row[5], 0) for row in rows], dtype=np.int8)
+                features = np.frombuffer(b"".join(row[6] for row in rows), dtype=np.float32).reshape(len(rows), -1)
+                norms = np.linalg.norm(features, axis=1, keepdims=True)
+                features = features / np.where(norms > 0, norms, 1)
+                self._arrays = (ids, pillars, features, genders)
+                self._arrays_version = version
+            return self._arrays
+
+    def nearest(self, pillars: PillarsLike, k: int = DEFAULT_TOP_K,
+                gender: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        The k classical cases most like a chart, best first.
+
+        Scores add the weights of the pillars that coincide (日柱 counts
+        most, then 月柱), the same day master and month command, and the
+        cosine of the element/ten-god feature vectors. With gender given,
+        cases marked with the other gender are skipped.
+        """
+        ids, case_pillars, features, genders = self._load_arrays()
+        if not len(ids) or k <= 0:
+            return []
+        query = np.array(pillar_indices(pillars), dtype=np.int16)
+        query_vector = feature_vector([query])[0].astype(np.float32)
+        query_vector /= np.linalg.norm(query_vector) or 1
+
+        same = case_pillars == query
+        scores = (same @ POSITION_WEIGHTS
+                  + DAY_MASTER_WEIGHT * (case_pillars[:, 2] % 10 == query[2] % 10)
+                  + MONTH_COMMAND_WEIGHT * (case_pillars[:, 1] % 12 == query[1] % 12)
+                  + FEATURE_WEIGHT * (features @ query_vector))
+        code = {"男": 1, "女": 2}.get(gender, 0)
+        if code:
+            scores = np.where((genders == 0) | (genders == code), scores, -np.inf)
+
+        k = min(k, int(np.isfinite(scores).sum()))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.lexsort((ids[top], -scores[top]))]
+        with self._lock:
+            placeholders = ",".join("?" * len(top))
+            rows = {row["id"]: row for row in self._conn.execute(
+                f"SELECT * FROM cases WHERE id IN ({placeholders})", [int(ids[i]) for i in top])}
+        results = []
+        for i in top:
+            case = self._row(rows[int(ids[i])])
+            matched = [f"{POSITIONS[p]}柱" for p in range(4) if same[i, p]]
+            if case_pillars[i, 2] % 10 == query[2] % 10 and not same[i, 2]:
+                matched.append("日主")
+            if case_pillars[i, 1] % 12 == query[1] % 12 and not same[i, 1]:
+                matched.append("月令")
+            case["matched"] = matched
+            case["score"] = round(float(scores[i]), 3)
+            results.append(case)
+        return results
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def format_cases(cases: List[Dict[str, Any]]) -> str:
+    """Render retrieved cases for a prompt; empty when there are none"""
+    if not cases:
+        return ""
+    lines = ["【古籍命例参考】（以下命例摘自经典原文，引用命例只能引用这些）"]
+    for i, case in enumerate(cases, 1):
+        section = f"·{case['heading']}" if case.get("heading") else ""
+        label = f"{case['label']}：" if case.get("label") else ""
+        matched = f"（同{'、'.join(case['matched'])}）" if case.get("matched") else ""
+        lines.append(f"{i}. 《{case['title']}》{section} {label}{case['full_bazi']}{matched}")
+        if case.get("commentary"):
+            lines.append(f"   原注：{case['commentary']}")
+    return "\n".join(lines)
+
+
+_case_database = None
+_case_database_lock = threading.Lock()
+
+
+def get_case_database() -> Optional[CaseDatabase]:
+    """
+    Process-wide case database, opened on first use; None until the CLI has
+    built it. Never extracts anything itself: run --update to refresh it.
+    """
+    global _case_database
+    with _case_database_lock:
+        if _case_database is None and os.path.exists(DEFAULT_DB_PATH):
+            _case_database = CaseDatabase(DEFAULT_DB_PATH)
+    return _case_database
+
+
+def retrieve_case_context(pillars: PillarsLike, gender: Optional[str] = None, k: int = DEFAULT_TOP_K) -> str:
+    """Formatted nearest classical cases for a prompt, or "" if none are available"""
+    try:
+        database = get_case_database()
+        if database is None:
+            return ""
+        return format_cases(database.nearest(pillars, k, gender))
+    except Exception as e:
+        print(f"命例检索错误: {e}")
+        return ""
+
+
+def case_database_version() -> str:
+    """Version of the process-wide case database for cache keys; "none" without one"""
+    try:
+        database = get_case_database()
+        return database.version() if database is not None else "none"
+    except Exception as e:
+        print(f"命例检索错误: {e}")
+        return "none"
+
+
+def main():
+    parser = argparse.ArgumentParser(description='千机古籍命例库')
+    parser.add_argument('--update', action='store_true', help='从经典文本增量提取命例')
+    parser.add_argument('--classics', type=str, default=str(DEFAULT_CLASSICS_DIR), help='经典文本目录')
+    parser.add_argument('--query', type=str, help='八字，如 "庚午 辛巳 庚辰 辛巳"')
+    parser.add_argument('--gender', type=str, choices=['男', '女'], help='性别')
+    parser.add_argument('-k', type=int, default=DEFAULT_TOP_K, help='返回命例数')
+
+    args = parser.parse_args()
+    database = CaseDatabase()
+
+    if args.update:
+        stats = database.update(args.classics)
+        print(f"✅ 处理经典 {stats['books']} 部, 新提取命例 {stats['cases']} 个, "
+              f"移除 {stats['removed']} 个, 共 {len(database)} 个命例")
+
+    if args.query:
+        cases = database.nearest(args.query, args.k, args.gender)
+        print(format_cases(cases) or "命例库中暂无命例")
+
+    if not (args.update or args.query):
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,556 @@
+"""
+Qianji Classics Retrieval Index
+
+Offline RAG index over raw_books/bazi_classics with no vector DB service:
+the classics are chunked by ClassicalParser, embedded locally and stored as
+a normalized float32 matrix (vectors.npy) that is memory-mapped and searched
+with one matrix-vector product. For the corpus sizes we handle (well under a
+million chunks) an exact flat search stays within a few milliseconds on CPU,
+so no approximate index is needed.
+
+Embeddings come from a local sentence-transformers model (QJI_EMBEDDING_MODEL,
+default BAAI/bge-small-zh-v1.5). When sentence-transformers or the model is
+not available, a hashed character n-gram embedder is used instead so the
+retriever still works fully offline; the index records which embedder built
+it and is rebuilt when that changes.
+
+The index is maintained incrementally. Every indexed file and chunk carries
+a content hash; an update re-embeds only new or edited chunks, tombstones
+the ones that went away, and publishes the result as a new generation
+directory behind an atomically replaced CURRENT pointer. Tombstones are
+compacted away in a background thread.
+
+Chunk texts are not kept in chunks.json: each generation writes them into
+one texts.bin blob and records only the byte range of every text, so a
+worker holds the chunk metadata and reads the texts of its top-k hits with
+pread, from the page cache all workers share.
+
+Each generation also carries a BM25 index over character bigrams/trigrams
+(bm25_index.py) so exact classical terms such as 伤官见官 are found even
+when the embedding misses them. retrieve() fuses the lexical and vector
+rankings by reciprocal rank (mode="hybrid", the default), or uses either
+one alone (mode="vector" / "lexical").
+
+Update (the default with no arguments; start_qianji_cnlunar.sh runs it
+before the web server) or rebuild explicitly with:
+    python -m src.data.classics_index --update
+    python -m src.data.classics_index --build
+ClassicsRetriever never builds or updates anything: it serves whatever
+generation CURRENT points to and finds no passages while there is none.
+"""
+import argparse
+import fcntl
+import json
+import os
+import shutil
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from src.data.bm25_index import BM25Index
+from src.utils.classical_parser import ClassicalParser
+
+PROJECT_ROOT = Path(__file__).parent.parent.parent
+DEFAULT_CLASSICS_DIR = PROJECT_ROOT / "raw_books" / "bazi_classics"
+DEFAULT_INDEX_DIR = Path(__file__).parent / "classics_index"
+DEFAULT_EMBEDDING_MODEL = "BAAI/bge-small-zh-v1.5"
+DEFAULT_TOP_K = 3
+RETRIEVAL_MODES = ("hybrid", "vector", "lexical")
+# Reciprocal-rank fusion constant and the depth of each ranking that is fused
+RRF_K = 60
+FUSION_DEPTH = 20
+
+CURRENT_FILE = "CURRENT"
+LOCK_FILE = ".lock"
+VECTORS_FILE = "vectors.npy"
+CHUNKS_FILE = "chunks.json"
+TEXTS_FILE = "texts.bin"
+MANIFEST_FILE = "manifest.json"
+
+
+class HashingEmbedder:
+    """Character unigram+bigram feature hashing; deterministic and dependency-free"""
+
+    def __init__(self, dim: int = 512):
+        self.dim = dim
+        self.name = f"hashing-ngram-{dim}"
+
+    def _encode_one(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        chars = [c for c in text if not c.isspace()]
+        grams = chars + [a + b for a, b in zip(chars, chars[1:])]
+        for gram in grams:
+            h = zlib.crc32(gram.encode("utf-8"))
+            vector[h % self.dim] += 1.0 if h & 0x80000000 else -1.0
+        vector = np.sign(vector) * np.log1p(np.abs(vector))
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        return np.stack([self._encode_one(text) for text in texts])
+
+
+class SentenceTransformerEmbedder:
+    """Local sentence-transformers model with normalized output"""
+
+    def __init__(self, model_name: str = DEFAULT_EMBEDDING_MODEL):
+        from sentence_transformers import SentenceTransformer
+        self.model = SentenceTransformer(model_name, device="cpu")
+        self.dim = self.model.get_sentence_embedding_dimension()
+        self.name = f"st:{model_name}"
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        return self.model.encode(texts, normalize_embeddings=True,
+                                 convert_to_numpy=True).astype(np.float32)
+
+
+def load_embedder(model_name: Optional[str] = None):
+    """sentence-transformers model if available, hashing embedder otherwise"""
+    model_name = model_name or os.environ.get("QJI_EMBEDDING_MODEL", DEFAULT_EMBEDDING_MODEL)
+    if model_name == "hashing":
+        return HashingEmbedder()
+    try:
+        return SentenceTransformerEmbedder(model_name)
+    except Exception as e:
+        print(f"警告: 无法加载嵌入模型 {model_name} ({e})，使用字符n-gram哈希嵌入")
+        return HashingEmbedder()
+
+
+def _read_json(path: Path) -> Optional[Any]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_json(path: Path, data: Any):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+
+
+def _write_chunks(gen_dir: Path, chunks: List[Dict[str, Any]]):
+    """chunks.json without the texts, which go to texts.bin as (offset, length) ranges"""
+    records = []
+    offset = 0
+    with open(gen_dir / TEXTS_FILE, "wb") as f:
+        for chunk in chunks:
+            data = chunk["text"].encode("utf-8")
+            f.write(data)
+            record = {key: value for key, value in chunk.items() if key != "text"}
+            record["text_offset"], record["text_length"] = offset, len(data)
+            records.append(record)
+            offset += len(data)
+    _write_json(gen_dir / CHUNKS_FILE, records)
+
+
+def read_chunk_texts(gen_dir: Path, chunks: List[Dict[str, Any]]) -> List[str]:
+    """Texts of some chunks of a generation, pread from its texts.bin"""
+    if all("text" in chunk for chunk in chunks):
+        # Generation written before texts.bin, or nothing to read
+        return [chunk["text"] for chunk in chunks]
+    with open(gen_dir / TEXTS_FILE, "rb") as f:
+        return [chunk["text"] if "text" in chunk else
+                os.pread(f.fileno(), chunk["text_length"], chunk["text_offset"]).decode("utf-8")
+                for chunk in chunks]
+
+
+class ClassicsIndexer:
+    """
+    Incremental writer for the classics index.
+
+    Each update writes a new generation directory and then swaps the CURRENT
+    pointer with os.replace, so readers always map a complete index and never
+    wait on a writer. Only chunks whose content hash is not already indexed
+    for that file are embedded; replaced chunks and chunks of removed files
+    are tombstoned, and compact() drops them once they pass COMPACT_RATIO.
+    """
+
+    COMPACT_RATIO = 0.25
+    KEEP_GENERATIONS = 2
+
+    def __init__(self, index_dir: Path = DEFAULT_INDEX_DIR, embedder=None):
+        self.index_dir = Path(index_dir)
+        self.embedder = embedder or load_embedder()
+        self._thread_lock = threading.Lock()
+
+    @contextmanager
+    def _locked(self):
+        """One writer at a time, across threads and gunicorn workers"""
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+        with self._thread_lock, open(self.index_dir / LOCK_FILE, "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def current(self) -> Optional[Dict[str, Any]]:
+        """Info of the live generation, or None if there is none for this embedder"""
+        info = _read_json(self.index_dir / CURRENT_FILE)
+        if info is None or info.get("embedder") != self.embedder.name:
+            return None
+        return info
+
+    def load(self, info: Optional[Dict[str, Any]], with_text: bool = True):
+        """
+        (vectors, chunks, manifest) of a generation; vectors are memory-mapped.
+
+        With with_text=False the chunks carry only the byte range of their
+        text in texts.bin (see read_chunk_texts).
+        """
+        if info is None:
+            return np.zeros((0, 0), dtype=np.float32), [], {}
+        gen_dir = self.index_dir / info["path"]
+        vectors = np.load(gen_dir / VECTORS_FILE, mmap_mode="r")
+        chunks = _read_json(gen_dir / CHUNKS_FILE)
+        if with_text:
+            chunks = [{**chunk, "text": text} for chunk, text in zip(chunks, read_chunk_texts(gen_dir, chunks))]
+        return vectors, chunks, _read_json(gen_dir / MANIFEST_FILE)
+
+    def load_lexical(self, info: Dict[str, Any], chunks: List[Dict[str, Any]]) -> BM25Index:
+        """BM25 index of a generation, memory-mapped; built in memory for generations that predate it"""
+        gen_dir = self.index_dir / info["path"]
+        if BM25Index.exists(gen_dir):
+            return BM25Index.load(gen_dir)
+        texts = read_chunk_texts(gen_dir, chunks)
+        return BM25Index.build([ClassicalParser.chunk_index_text({**chunk, "text": text})
+                                for chunk, text in zip(chunks, texts)])
+
+    def _generations(self) -> List[Tuple[int, Path]]:
+        """(number, directory) of every generation on disk, oldest first"""
+        found = []
+        for path in self.index_dir.glob("gen-*"):
+            number = path.name[4:]
+            if path.is_dir() and number.isdigit():
+                found.append((int(number), path))
+        return sorted(found)
+
+    def _publish(self, vectors, chunks, manifest) -> Dict[str, Any]:
+        # Numbered past every directory on disk, not the live one: after a
+        # rebuild or an embedder change there is no live generation to count from
+        generations = self._generations()
+        generation = (generations[-1][0] if generations else 0) + 1
+        name = f"gen-{generation:06d}"
+        gen_dir = self.index_dir / name
+        shutil.rmtree(gen_dir, ignore_errors=True)
+        gen_dir.mkdir(parents=True)
+        np.save(gen_dir / VECTORS_FILE, np.ascontiguousarray(vectors, dtype=np.float32))
+        _write_chunks(gen_dir, chunks)
+        _write_json(gen_dir / MANIFEST_FILE, manifest)
+        BM25Index.build([ClassicalParser.chunk_index_text(chunk) for chunk in chunks]).save(gen_dir)
+
+        info = {
+            "generation": generation,
+            "path": name,
+            "embedder": self.embedder.name,
+            "dim": int(vectors.shape[1]),
+            "count": len(chunks),
+            "deleted": sum(1 for chunk in chunks if chunk.get("deleted")),
+        }
+        tmp_path = self.index_dir / (CURRENT_FILE + ".tmp")
+        _write_json(tmp_path, info)
+        os.replace(tmp_path, self.index_dir / CURRENT_FILE)
+
+        # Readers may still have the previous generation mapped, so it stays
+        for _, old in self._generations()[:-self.KEEP_GENERATIONS]:
+            if old.name != name:
+                shutil.rmtree(old, ignore_errors=True)
+        return info
+
+    def update(self, classics_dir: Path = DEFAULT_CLASSICS_DIR, rebuild: bool = False,
+               compact: str = "background") -> Dict[str, Any]:
+        """
+        Bring the index in line with the *.md files in classics_dir.
+
+        Unchanged files are skipped by content hash. compact is
+        "background", "now" or "never". Returns the counts of embedded,
+        reused and tombstoned chunks and the live generation.
+        """
+        parser = ClassicalParser()
+        stats = {"embedded": 0, "reused": 0, "tombstoned": 0}
+        with self._locked():
+            previous = None if rebuild else self.current()
+            vectors, chunks, manifest = self.load(previous)
+            chunks = [dict(chunk) for chunk in chunks]
+            files = dict(manifest)
+
+            pending = []
+            present = set()
+            for file_path in sorted(Path(classics_dir).glob("*.md")):
+                source = file_path.stem
+                present.add(source)
+                entry = files.get(source)
+                result = parser.process_classical_file(str(file_path), with_chunks=True)
+                if "error" in result:
+                    print(f"经典文件处理失败 {file_path}: {result['error']}")
+                    continue
+                if entry and entry["content_hash"] == result["content_hash"]:
+                    continue
+
+                old_rows = {}
+                for row in (entry["rows"] if entry else []):
+                    old_rows.setdefault(chunks[row]["hash"], []).append(row)
+                rows = []
+                for chunk in result["chunks"]:
+                    if old_rows.get(chunk["hash"]):
+                        # Same text as before: keep the vector, refresh position metadata
+                        row = old_rows[chunk["hash"]].pop(0)
+                        chunks[row] = chunk
+                        stats["reused"] += 1
+                    else:
+                        row = len(chunks) + len(pending)
+                        pending.append(chunk)
+                    rows.append(row)
+                for stale in old_rows.values():
+                    for row in stale:
+                        chunks[row]["deleted"] = True
+                        stats["tombstoned"] += 1
+                files[source] = {"content_hash": result["content_hash"], "rows": rows}
+
+            for source in set(files) - present:
+                for row in files.pop(source)["rows"]:
+                    chunks[row]["deleted"] = True
+                    stats["tombstoned"] += 1
+
+            if previous is not None and files == manifest:
+                gen_dir = self.index_dir / previous["path"]
+                if not BM25Index.exists(gen_dir):
+                    # Generation written before lexical search existed
+                    BM25Index.build([parser.chunk_index_text(chunk) for chunk in chunks]).save(gen_dir)
+                return {**stats, "generation": previous["generation"]}
+
+            new_vectors = self.embedder.encode([parser.chunk_index_text(c) for c in pending])
+            if len(chunks):
+                new_vectors = np.concatenate([vectors, new_vectors.reshape(-1, vectors.shape[1])])
+            stats["embedded"] = len(pending)
+            info = self._publish(new_vectors, chunks + pending, files)
+
+        if info["count"] and info["deleted"] > self.COMPACT_RATIO * info["count"]:
+            if compact == "now":
+                info = self.compact()
+            elif compact == "background":
+                threading.Thread(target=self.compact, name="classics-compact", daemon=True).start()
+        return {**stats, "generation": info["generation"]}
+
+    def compact(self) -> Optional[Dict[str, Any]]:
+        """Publish the live generation again without its tombstoned rows"""
+        with self._locked():
+            previous = self.current()
+            if previous is None or not previous["deleted"]:
+                return previous
+            vectors, chunks, manifest = self.load(previous)
+            keep = [row for row, chunk in enumerate(chunks) if not chunk.get("deleted")]
+            remap = {old: new for new, old in enumerate(keep)}
+            files = {source: {**entry, "rows": [remap[row] for row in entry["rows"]]}
+                     for source, entry in manifest.items()}
+            return self._publish(vectors[keep], [chunks[row] for row in keep], files)
+
+
+def build_classics_index(classics_dir: Path = DEFAULT_CLASSICS_DIR,
+                         index_dir: Path = DEFAULT_INDEX_DIR, embedder=None) -> Dict[str, Any]:
+    """Full rebuild: chunk and embed every classic; returns the update stats"""
+    return ClassicsIndexer(index_dir, embedder).update(classics_dir, rebuild=True)
+
+
+class ClassicsRetriever:
+    """Top-k passage search over the classics index"""
+
+    RELOAD_INTERVAL = 1.0
+
+    def __init__(self, index_dir: Path = DEFAULT_INDEX_DIR, embedder=None):
+        self.index_dir = Path(index_dir)
+        self.indexer = ClassicsIndexer(self.index_dir, embedder)
+        self.embedder = self.indexer.embedder
+
+        # Read-only: generations are published by the CLI and picked up via CURRENT
+        self._snapshot = None
+        self._checked_at = time.monotonic()
+        self._reload()
+        self._embed_query = lru_cache(maxsize=1024)(self._embed_query_uncached)
+
+    def _reload(self):
+        """Map the live generation if it changed; swapped in with one assignment"""
+        info = self.indexer.current()
+        if info is None or (self._snapshot and self._snapshot[0]["generation"] == info["generation"]):
+            return
+        vectors, chunks, _ = self.indexer.load(info, with_text=False)
+        alive = np.array([not chunk.get("deleted") for chunk in chunks], dtype=bool)
+        lexical = self.indexer.load_lexical(info, chunks)
+        self._snapshot = (info, vectors, chunks, alive, lexical)
+
+    def _maybe_reload(self):
+        """Pick up generations published by other processes, checked once a second"""
+        now = time.monotonic()
+        if now - self._checked_at < self.RELOAD_INTERVAL:
+            return
+        self._checked_at = now
+        try:
+            self._reload()
+        except Exception as e:
+            print(f"经典索引重新加载失败: {e}")
+
+    @property
+    def info(self) -> Optional[Dict[str, Any]]:
+        return self._snapshot[0] if self._snapshot else None
+
+    @property
+    def chunks(self) -> List[Dict[str, Any]]:
+        """Chunk metadata of the live generation, without the texts"""
+        return self._snapshot[2] if self._snapshot else []
+
+    def _passages(self, snapshot, ranked: List[Tuple[int, Dict[str, float]]]) -> List[Dict[str, Any]]:
+        """Result dicts for (row, scores) pairs, texts read from the snapshot's generation"""
+        info, _, chunks = snapshot[:3]
+        hits = [chunks[i] for i, _ in ranked]
+        texts = read_chunk_texts(self.index_dir / info["path"], hits)
+        return [{**chunk, "text": text, **scores} for chunk, text, (_, scores) in zip(hits, texts, ranked)]
+
+    def _embed_query_uncached(self, query: str) -> np.ndarray:
+        vector = self.embedder.encode([query])[0]
+        vector.setflags(write=False)
+        return vector
+
+    def _vector_ranking(self, snapshot, query: str, k: int):
+        """(row, cosine) of the k nearest live chunks, best first"""
+        _, vectors, _, alive, _ = snapshot
+        k = min(k, int(alive.sum()))
+        if k <= 0:
+            return []
+        scores = np.where(alive, vectors @ self._embed_query(query), -np.inf)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(i), float(scores[i])) for i in top]
+
+    def search(self, query: str, k: int = DEFAULT_TOP_K) -> List[Dict[str, Any]]:
+        """The k most similar live chunks, best first, each with a cosine score"""
+        self._maybe_reload()
+        snapshot = self._snapshot
+        if not query or snapshot is None:
+            return []
+        return self._passages(snapshot, [(i, {"score": score})
+                                         for i, score in self._vector_ranking(snapshot, query, k)])
+
+    def retrieve(self, query: str, k: int = DEFAULT_TOP_K, mode: str = "hybrid") -> List[Dict[str, Any]]:
+        """
+        The k best live chunks for a query, best first.
+
+        "vector" is search(); "lexical" ranks by BM25 over character
+        n-grams; "hybrid" fuses the top FUSION_DEPTH of both rankings by
+        reciprocal rank, sum of 1 / (RRF_K + rank). Each result carries
+        score (of the chosen mode) and, where ranked, vector_score and
+        bm25_score.
+        """
+        if mode not in RETRIEVAL_MODES:
+            raise ValueError(f"未知检索模式: {mode}")
+        if mode == "vector":
+            return self.search(query, k)
+        self._maybe_reload()
+        snapshot = self._snapshot
+        if not query or snapshot is None or k <= 0:
+            return []
+        _, _, _, alive, lexical = snapshot
+        depth = k if mode == "lexical" else max(k, FUSION_DEPTH)
+        lexical_ranking = lexical.search(query, depth, alive)
+        if mode == "lexical":
+            return self._passages(snapshot, [(i, {"score": score, "bm25_score": score})
+                                             for i, score in lexical_ranking])
+
+        vector_ranking = self._vector_ranking(snapshot, query, depth)
+        fused: Dict[int, Dict[str, float]] = {}
+        for key, ranking in (("vector_score", vector_ranking), ("bm25_score", lexical_ranking)):
+            for rank, (i, score) in enumerate(ranking, 1):
+                entry = fused.setdefault(i, {"score": 0.0})
+                entry["score"] += 1.0 / (RRF_K + rank)
+                entry[key] = score
+        best = sorted(fused.items(), key=lambda item: (-item[1]["score"], item[0]))[:k]
+        return self._passages(snapshot, best)
+
+
+def format_passages(passages: List[Dict[str, Any]]) -> str:
+    """Render retrieved passages for injection into a prompt"""
+    if not passages:
+        return ""
+    lines = ["【经典原文参考】"]
+    for i, passage in enumerate(passages, 1):
+        section = f"·{passage['heading']}" if passage.get("heading") else ""
+        lines.append(f"{i}. 《{passage['title']}》{section}：{passage['text']}")
+    return "\n".join(lines)
+
+
+_classics_retriever = None
+_classics_retriever_lock = threading.Lock()
+
+
+def get_classics_retriever() -> ClassicsRetriever:
+    """Process-wide retriever over the published index; empty until one exists"""
+    global _classics_retriever
+    with _classics_retriever_lock:
+        if _classics_retriever is None:
+            _classics_retriever = ClassicsRetriever()
+    return _classics_retriever
+
+
+def retrieve(query: str, k: int = DEFAULT_TOP_K, mode: str = "hybrid") -> List[Dict[str, Any]]:
+    """Top-k classics passages from the process-wide retriever"""
+    return get_classics_retriever().retrieve(query, k, mode)
+
+
+def retrieve_classics_context(query: str, k: int = DEFAULT_TOP_K) -> str:
+    """Formatted top-k passages for a prompt, or "" if retrieval is unavailable"""
+    try:
+        return format_passages(retrieve(query, k))
+    except Exception as e:
+        print(f"经典检索错误: {e}")
+        return ""
+
+
+def classics_index_version() -> str:
+    """Generation the process-wide retriever serves, for cache keys; "none" without an index"""
+    try:
+        info = get_classics_retriever().info
+    except Exception as e:
+        print(f"经典检索错误: {e}")
+        return "none"
+    return f"gen-{info['generation']}" if info else "none"
+
+
+def main():
+    parser = argparse.ArgumentParser(description='千机命理经典检索索引')
+    parser.add_argument('--build', action='store_true', help='重新构建索引')
+    parser.add_argument('--update', action='store_true', help='增量更新索引(只嵌入有变化的段落，不带参数时的默认操作)')
+    parser.add_argument('--compact', action='store_true', help='清理已删除段落')
+    parser.add_argument('--query', type=str, help='检索问题')
+    parser.add_argument('-k', type=int, default=DEFAULT_TOP_K, help='返回段落数')
+    parser.add_argument('--mode', type=str, default='hybrid', choices=RETRIEVAL_MODES,
+                        help='检索方式: hybrid(词法+向量融合)、vector、lexical')
+
+    args = parser.parse_args()
+    if not (args.build or args.compact or args.query):
+        args.update = True
+
+    if args.build or args.update:
+        indexer = ClassicsIndexer()
+        stats = indexer.update(rebuild=args.build, compact="now" if args.compact else "never")
+        print(f"✅ 索引第{stats['generation']}代: 新嵌入 {stats['embedded']} 段, "
+              f"复用 {stats['reused']} 段, 删除 {stats['tombstoned']} 段, 嵌入模型 {indexer.embedder.name}")
+    elif args.compact:
+        info = ClassicsIndexer().compact()
+        if info:
+            print(f"✅ 索引第{info['generation']}代: {info['count']} 段")
+
+    if args.query:
+        for passage in retrieve(args.query, args.k, args.mode):
+            print(f"[{passage['score']:.3f}] 《{passage['title']}》{passage['heading']}: {passage['text']}")
+
+
+if __name__ == '__main__':
+    main()
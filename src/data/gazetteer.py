@@ -0,0 +1,121 @@
+"""
+Qianji Offline Gazetteer
+
+Resolves the free-text birth place users type ("新疆乌鲁木齐市", "四川省
+成都市武侯区", "new york") to a longitude and IANA time zone without any
+network geocoding. The bundled gazetteer.csv covers Chinese provinces,
+every prefecture-level division, a set of far-western and border counties,
+and major world cities.
+
+Names are held in a dict for exact and substring matches and in a sorted
+array for prefix completion, so a lookup is a few dozen hash probes (a few
+microseconds) and repeated lookups are served from an LRU cache. Time zone
+history (China's 1986-1991 daylight saving time, other countries' DST) comes
+from the zoneinfo database via Place.timezone.
+"""
+import bisect
+import csv
+import re
+import threading
+from functools import lru_cache
+from pathlib import Path
+from typing import List, NamedTuple, Optional
+
+DEFAULT_GAZETTEER_PATH = Path(__file__).parent / "gazetteer.csv"
+
+# Administrative suffixes dropped before an exact match, longest first
+ADMIN_SUFFIXES = ("特别行政区", "维吾尔自治区", "壮族自治区", "回族自治区", "自治区",
+                  "自治州", "自治县", "地区", "新区", "省", "市", "县", "区", "盟", "州", "旗")
+
+_NOISE = re.compile(r"[\s,，.。·、()（）\-_/]+")
+
+
+class Place(NamedTuple):
+    name: str
+    region: str
+    longitude: float
+    latitude: float
+    timezone: str
+    # 1 province, 2 prefecture or world city, 3 county
+    level: int
+
+
+def normalize_place(text: str) -> str:
+    """Lower-case and drop spaces and punctuation"""
+    return _NOISE.sub("", (text or "").lower())
+
+
+class Gazetteer:
+    """In-memory place index: exact, contained-name and prefix lookups"""
+
+    def __init__(self, path: Path = DEFAULT_GAZETTEER_PATH):
+        self._exact = {}
+        with open(path, "r", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                place = Place(row["name"], row["region"], float(row["longitude"]),
+                              float(row["latitude"]), row["timezone"], int(row["level"]))
+                keys = [row["name"]] + [a for a in row["aliases"].split("|") if a]
+                for key in keys:
+                    self._exact.setdefault(normalize_place(key), place)
+        self._keys = sorted(self._exact)
+        self._max_len = max(len(key) for key in self._keys)
+        self.lookup = lru_cache(maxsize=4096)(self._lookup)
+
+    def __len__(self):
+        return len(set(self._exact.values()))
+
+    def complete(self, prefix: str, limit: int = 10) -> List[Place]:
+        """Places whose name starts with prefix, broadest first"""
+        prefix = normalize_place(prefix)
+        if not prefix:
+            return []
+        start = bisect.bisect_left(self._keys, prefix)
+        end = bisect.bisect_left(self._keys, prefix + "￿", lo=start)
+        places = list(dict.fromkeys(self._exact[key] for key in self._keys[start:end]))
+        places.sort(key=lambda place: place.level)
+        return places[:limit]
+
+    def _contained(self, text: str) -> Optional[Place]:
+        """Most specific known name inside text, kept within any province also named"""
+        found = []
+        for i in range(len(text)):
+            for length in range(min(self._max_len, len(text) - i), 1, -1):
+                place = self._exact.get(text[i:i + length])
+                if place:
+                    found.append(place)
+                    break
+        if not found:
+            return None
+        provinces = {place.region for place in found if place.level == 1}
+        if provinces:
+            # "北京市朝阳区" must not resolve to 朝阳 in 辽宁
+            found = [place for place in found if place.region in provinces] or found
+        return max(found, key=lambda place: place.level)
+
+    def _lookup(self, text: str) -> Optional[Place]:
+        key = normalize_place(text)
+        if not key:
+            return None
+        if key in self._exact:
+            return self._exact[key]
+        for suffix in ADMIN_SUFFIXES:
+            if key.endswith(suffix) and key[:-len(suffix)] in self._exact:
+                return self._exact[key[:-len(suffix)]]
+        place = self._contained(key)
+        if place:
+            return place
+        completions = self.complete(key, 1)
+        return completions[0] if completions else None
+
+
+_gazetteer = None
+_gazetteer_lock = threading.Lock()
+
+
+def get_gazetteer() -> Gazetteer:
+    """Process-wide gazetteer, loaded on first use"""
+    global _gazetteer
+    with _gazetteer_lock:
+        if _gazetteer is None:
+            _gazetteer = Gazetteer()
+    return _gazetteer
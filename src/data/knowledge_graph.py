@@ -1,135 +1,603 @@
 """
-Qianji Knowledge Graph Builder
+Qianji Knowledge Graph
 
-This module constructs a knowledge graph for Chinese metaphysics concepts
-including heavenly stems, earthly branches, five elements, ten gods, 
-and other bazi/destiny related entities and relationships.
+Typed multigraph of Chinese metaphysics concepts: heavenly stems, earthly
+branches, five elements, ten gods, the sixty 干支 pillars and classical
+texts, connected by typed edges:
+
+- 生/克 between elements and between stems;
+- 合 (五合, 六合, 三合), 冲, 刑, 害 between stems or branches;
+- 藏 from a branch to its hidden stems (weighted 本气/中气/余气);
+- 十神 from a day master to every stem, labelled with the ten god;
+- 属 (stem/branch → element), 含 (pillar → stem/branch) and 提及
+  (classical text → concept).
+
+Nodes have integer ids; edges live in CSR arrays (indptr/dst/type/label/
+weight) with a reverse index for incoming edges, plus secondary indexes of
+nodes by type and element. Traversal (neighbors, k_hop, find_paths) works
+on those arrays, so per-request grounding such as chart_relations() costs
+microseconds. save_snapshot() writes a compact binary file that
+load_snapshot() memory-maps; get_knowledge_graph() builds it on first use
+and again whenever the tables the graph is built from change, which it
+detects from a digest of those tables stored in the snapshot header.
 """
+import hashlib
+import json
+import mmap
+import os
+import struct
+import tempfile
+import threading
+from collections import deque
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from src.core.bazi_pillars import TIAN_GAN, DI_ZHI, JIA_ZI
+from src.core.chart_analyzer import WU_XING, TEN_GODS, TEN_GOD, HIDDEN_STEMS
+
+DEFAULT_SNAPSHOT_PATH = os.path.join(os.path.dirname(__file__), "knowledge_graph.bin")
+
+NODE_TYPES = ["heavenly_stem", "earthly_branch", "five_element", "ten_god",
+              "stem_branch_combination", "classical_text", "concept"]
+EDGE_TYPES = ["生", "克", "合", "冲", "刑", "害", "藏", "十神", "属", "含", "提及"]
+# Relations between the characters of one chart
+CHART_EDGE_TYPES = ["合", "冲", "刑", "害"]
+
+# magic, version, node count, edge count, JSON trailer size, build table digest
+MAGIC = b"QJKG\x00\x00"
+VERSION = 2
+HEADER = struct.Struct("<6sHIII16s")
+_ALIGN = 8
+
+# Array layout of a snapshot, in file order: (name, dtype, length in nodes or edges)
+_NODE_ARRAYS = [("node_type", np.uint8), ("node_element", np.int8)]
+_EDGE_ARRAYS = [("dst", np.uint32), ("edge_type", np.uint8), ("label", np.uint16),
+                ("weight", np.float32), ("in_src", np.uint32), ("in_edge", np.uint32)]
+
+BRANCH_ELEMENTS = {'寅': '木', '卯': '木', '巳': '火', '午': '火', '辰': '土', '戌': '土',
+                   '丑': '土', '未': '土', '申': '金', '酉': '金', '亥': '水', '子': '水'}
+
+GOD_CHARACTERISTICS = {
+    '正官': '正直、有责任感、守规矩',
+    '七杀': '果断、有魄力、竞争性强',
+    '正印': '仁慈、有学识、保护性强',
+    '偏印': '独特、有创意、内向',
+    '正财': '稳定、务实、节俭',
+    '偏财': '灵活、投机、慷慨',
+    '食神': '温和、有才华、享受生活',
+    '伤官': '聪明、叛逆、创新',
+    '比肩': '独立、竞争、自我',
+    '劫财': '冲动、豪爽、冒险'
+}
+
+# 天干五合 and what each pair transforms into
+STEM_COMBINATIONS = [("甲", "己", "土"), ("乙", "庚", "金"), ("丙", "辛", "水"), ("丁", "壬", "木"), ("戊", "癸", "火")]
+STEM_CLASHES = [("甲", "庚"), ("乙", "辛"), ("丙", "壬"), ("丁", "癸")]
+BRANCH_COMBINATIONS = [("子", "丑", "土"), ("寅", "亥", "木"), ("卯", "戌", "火"),
+                       ("辰", "酉", "金"), ("巳", "申", "水"), ("午", "未", "火")]
+BRANCH_TRIADS = [("申子辰", "水"), ("亥卯未", "木"), ("寅午戌", "火"), ("巳酉丑", "金")]
+BRANCH_HARMS = [("子", "未"), ("丑", "午"), ("寅", "巳"), ("卯", "辰"), ("申", "亥"), ("酉", "戌")]
+# 刑 runs one way round each group
+BRANCH_PUNISHMENTS = [("寅巳申", "无恩之刑"), ("丑戌未", "恃势之刑")]
+MUTUAL_PUNISHMENT = ("子", "卯", "无礼之刑")
+SELF_PUNISHMENTS = "辰午酉亥"
+HIDDEN_LABELS = ["本气", "中气", "余气"]
+
+POSITIONS = ["年", "月", "日", "时"]
+
+
+def build_tables_digest() -> bytes:
+    """Digest of every table initialize_core_concepts() reads"""
+    tables = [NODE_TYPES, EDGE_TYPES, TIAN_GAN, DI_ZHI, JIA_ZI, WU_XING, TEN_GODS,
+              np.asarray(TEN_GOD).tolist(), np.asarray(HIDDEN_STEMS).tolist(),
+              BRANCH_ELEMENTS, GOD_CHARACTERISTICS, STEM_COMBINATIONS, STEM_CLASHES,
+              BRANCH_COMBINATIONS, BRANCH_TRIADS, BRANCH_HARMS, BRANCH_PUNISHMENTS,
+              MUTUAL_PUNISHMENT, SELF_PUNISHMENTS, HIDDEN_LABELS]
+    encoded = json.dumps(tables, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.blake2b(encoded.encode("utf-8"), digest_size=16).digest()
+
 
 class MetaphysicsKnowledgeGraph:
-    def __init__(self):
-        self.graph = {}
-        self.initialize_core_concepts()
-    
+    """Typed multigraph with CSR adjacency over integer node ids"""
+
+    def __init__(self, build: bool = True):
+        self.names: List[str] = []
+        self.ids: Dict[str, int] = {}
+        self.labels: List[str] = [""]
+        self._label_ids: Dict[str, int] = {"": 0}
+        self.attributes: Dict[int, Dict[str, Any]] = {}
+        self._node_type: List[int] = []
+        self._node_element: List[int] = []
+        self._edges: Optional[List[Tuple[int, int, int, int, float]]] = []
+        self._arrays: Optional[Dict[str, np.ndarray]] = None
+        self._map = None
+        # Digest of the build tables of a loaded snapshot; None for a graph built in process
+        self.tables_digest: Optional[bytes] = None
+        self._lock = threading.RLock()
+        if build:
+            self.initialize_core_concepts()
+
+    # -- construction --------------------------------------------------------
+
+    def _thaw(self):
+        """Back to an editable edge list after the CSR arrays were built or loaded"""
+        if self._edges is None:
+            self._edges = self._edge_list()
+
+    def add_node(self, name: str, node_type: str, element: Optional[str] = None, **attributes) -> int:
+        """Id of the node named `name`, creating it if needed"""
+        with self._lock:
+            if name in self.ids:
+                return self.ids[name]
+            self._thaw()
+            node = len(self.names)
+            self.names.append(name)
+            self.ids[name] = node
+            self._node_type.append(NODE_TYPES.index(node_type))
+            self._node_element.append(WU_XING.index(element) if element else -1)
+            if attributes:
+                self.attributes[node] = attributes
+            self._arrays = None
+            return node
+
+    def add_edge(self, source: str, target: str, edge_type: str, label: str = "",
+                 weight: float = 1.0, symmetric: bool = False):
+        with self._lock:
+            self._thaw()
+            if label not in self._label_ids:
+                self._label_ids[label] = len(self.labels)
+                self.labels.append(label)
+            src, dst = self.ids[source], self.ids[target]
+            kind, label_id = EDGE_TYPES.index(edge_type), self._label_ids[label]
+            self._edges.append((src, dst, kind, label_id, weight))
+            if symmetric and src != dst:
+                self._edges.append((dst, src, kind, label_id, weight))
+            self._arrays = None
+
     def initialize_core_concepts(self):
-        """Initialize core metaphysical concepts and relationships"""
-        # Heavenly Stems (天干)
-        heavenly_stems = ['甲', '乙', '丙', '丁', '戊', '己', '庚', '辛', '壬', '癸']
-        
-        # Earthly Branches (地支)  
-        earthly_branches = ['子', '丑', '寅', '卯', '辰', '巳', '午', '未', '申', '酉', '戌', '亥']
-        
-        # Five Elements (五行)
-        five_elements = ['木', '火', '土', '金', '水']
-        
-        # Ten Gods (十神)
-        ten_gods = ['正官', '七杀', '正印', '偏印', '正财', '偏财', '食神', '伤官', '比肩', '劫财']
-        
-        # Build relationships
-        self.build_heavenly_earthly_relationships(heavenly_stems, earthly_branches)
-        self.build_five_elements_system(five_elements)
-        self.build_ten_gods_framework(ten_gods)
-    
-    def build_heavenly_earthly_relationships(self, stems, branches):
-        """Build relationships between heavenly stems and earthly branches"""
-        # Each stem-branch combination forms a unique energy signature
-        for i, stem in enumerate(stems):
-            for j, branch in enumerate(branches):
-                combination = f"{stem}{branch}"
-                self.graph[combination] = {
-                    'type': 'stem_branch_combination',
-                    'stem': stem,
-                    'branch': branch,
-                    'element': self.get_element_from_combination(stem, branch),
-                    'relationships': []
-                }
-    
-    def build_five_elements_system(self, elements):
-        """Build the five elements generation and control cycles"""
-        # Generation cycle (相生): Wood → Fire → Earth → Metal → Water → Wood
-        generation_cycle = {
-            '木': '火',
-            '火': '土', 
-            '土': '金',
-            '金': '水',
-            '水': '木'
-        }
-        
-        # Control cycle (相克): Wood → Earth → Water → Fire → Metal → Wood  
-        control_cycle = {
-            '木': '土',
-            '土': '水',
-            '水': '火', 
-            '火': '金',
-            '金': '木'
+        """Nodes and edges of stems, branches, elements, ten gods and the sixty pillars"""
+        for element in WU_XING:
+            self.add_node(element, "five_element", element)
+        for i, stem in enumerate(TIAN_GAN):
+            self.add_node(stem, "heavenly_stem", WU_XING[i // 2], polarity="阳" if i % 2 == 0 else "阴")
+        for i, branch in enumerate(DI_ZHI):
+            self.add_node(branch, "earthly_branch", BRANCH_ELEMENTS[branch],
+                          polarity="阳" if i % 2 == 0 else "阴")
+        for god in TEN_GODS:
+            self.add_node(god, "ten_god", characteristics=GOD_CHARACTERISTICS[god])
+        for pillar in JIA_ZI:
+            self.add_node(pillar, "stem_branch_combination", WU_XING[TIAN_GAN.index(pillar[0]) // 2])
+
+        self.build_five_elements_system()
+        self.build_stem_branch_relationships()
+        self.build_ten_gods_framework()
+
+    def build_five_elements_system(self):
+        """相生 木→火→土→金→水→木 and 相克 木→土→水→火→金→木, for elements and stems"""
+        for i, element in enumerate(WU_XING):
+            self.add_edge(element, WU_XING[(i + 1) % 5], "生")
+            self.add_edge(element, WU_XING[(i + 2) % 5], "克")
+        for i, stem in enumerate(TIAN_GAN):
+            element = i // 2
+            self.add_edge(stem, WU_XING[element], "属")
+            for other in TIAN_GAN[((element + 1) % 5) * 2:((element + 1) % 5) * 2 + 2]:
+                self.add_edge(stem, other, "生")
+            for other in TIAN_GAN[((element + 2) % 5) * 2:((element + 2) % 5) * 2 + 2]:
+                self.add_edge(stem, other, "克")
+        for branch in DI_ZHI:
+            self.add_edge(branch, BRANCH_ELEMENTS[branch], "属")
+
+    def build_stem_branch_relationships(self):
+        """合冲刑害 among stems and branches, hidden stems and pillar membership"""
+        for a, b, element in STEM_COMBINATIONS:
+            self.add_edge(a, b, "合", f"五合化{element}", symmetric=True)
+        for a, b in STEM_CLASHES:
+            self.add_edge(a, b, "冲", "天干相冲", symmetric=True)
+        for a, b, element in BRANCH_COMBINATIONS:
+            self.add_edge(a, b, "合", f"六合化{element}", symmetric=True)
+        for triad, element in BRANCH_TRIADS:
+            for i, a in enumerate(triad):
+                for b in triad[i + 1:]:
+                    self.add_edge(a, b, "合", f"三合{element}局", symmetric=True)
+        for i in range(6):
+            self.add_edge(DI_ZHI[i], DI_ZHI[i + 6], "冲", "六冲", symmetric=True)
+        for a, b in BRANCH_HARMS:
+            self.add_edge(a, b, "害", "六害", symmetric=True)
+        for group, label in BRANCH_PUNISHMENTS:
+            for i, a in enumerate(group):
+                self.add_edge(a, group[(i + 1) % 3], "刑", label)
+        a, b, label = MUTUAL_PUNISHMENT
+        self.add_edge(a, b, "刑", label, symmetric=True)
+        for branch in SELF_PUNISHMENTS:
+            self.add_edge(branch, branch, "刑", "自刑")
+
+        for j, branch in enumerate(DI_ZHI):
+            order = [s for s in np.argsort(-HIDDEN_STEMS[j], kind="stable") if HIDDEN_STEMS[j, s] > 0]
+            for rank, s in enumerate(order):
+                self.add_edge(branch, TIAN_GAN[s], "藏", HIDDEN_LABELS[rank], float(HIDDEN_STEMS[j, s]))
+        for pillar in JIA_ZI:
+            self.add_edge(pillar, pillar[0], "含", "天干")
+            self.add_edge(pillar, pillar[1], "含", "地支")
+
+    def build_ten_gods_framework(self):
+        """十神 of every stem seen from every day master"""
+        for day, day_master in enumerate(TIAN_GAN):
+            for other, stem in enumerate(TIAN_GAN):
+                self.add_edge(day_master, stem, "十神", TEN_GODS[TEN_GOD[day, other]])
+
+    def add_classical_text_relationships(self, text_name, concepts):
+        """Link a classical text to the concepts it discusses; unknown concepts become concept nodes"""
+        self.add_node(text_name, "classical_text")
+        for concept in concepts:
+            self.add_node(concept, "concept")
+            self.add_edge(text_name, concept, "提及")
+
+    # -- CSR arrays ----------------------------------------------------------
+
+    def _edge_list(self) -> List[Tuple[int, int, int, int, float]]:
+        arrays = self._arrays
+        src = np.repeat(np.arange(len(self.names)), np.diff(arrays["indptr"]))
+        return list(zip(src.tolist(), arrays["dst"].tolist(), arrays["edge_type"].tolist(),
+                        arrays["label"].tolist(), arrays["weight"].tolist()))
+
+    def _csr(self) -> Dict[str, np.ndarray]:
+        """CSR arrays, rebuilt after any change"""
+        arrays = self._arrays
+        if arrays is not None:
+            return arrays
+        with self._lock:
+            if self._arrays is None:
+                self._arrays = self._freeze()
+            return self._arrays
+
+    def _freeze(self) -> Dict[str, np.ndarray]:
+        n = len(self.names)
+        edges = sorted(self._edges, key=lambda edge: (edge[0], edge[2], edge[1]))
+        src = np.array([e[0] for e in edges], dtype=np.uint32)
+        arrays = {
+            "node_type": np.array(self._node_type, dtype=np.uint8),
+            "node_element": np.array(self._node_element, dtype=np.int8),
+            "indptr": np.concatenate([[0], np.cumsum(np.bincount(src, minlength=n))]).astype(np.uint32),
+            "dst": np.array([e[1] for e in edges], dtype=np.uint32),
+            "edge_type": np.array([e[2] for e in edges], dtype=np.uint8),
+            "label": np.array([e[3] for e in edges], dtype=np.uint16),
+            "weight": np.array([e[4] for e in edges], dtype=np.float32),
         }
-        
-        for element in elements:
-            self.graph[element] = {
-                'type': 'five_element',
-                'generates': generation_cycle[element],
-                'controls': control_cycle[element],
-                'is_generated_by': [k for k, v in generation_cycle.items() if v == element],
-                'is_controlled_by': [k for k, v in control_cycle.items() if v == element]
-            }
-    
-    def build_ten_gods_framework(self, ten_gods):
-        """Build the ten gods relationship framework"""
-        # Ten gods are derived from the relationship between day master and other stems/branches
-        for god in ten_gods:
-            self.graph[god] = {
-                'type': 'ten_god',
-                'characteristics': self.get_god_characteristics(god),
-                'favorable_conditions': [],
-                'unfavorable_conditions': []
-            }
-    
-    def get_element_from_combination(self, stem, branch):
-        """Determine the five element from stem-branch combination"""
-        # This is a simplified mapping - actual logic is more complex
-        stem_elements = {'甲': '木', '乙': '木', '丙': '火', '丁': '火', '戊': '土', '己': '土', 
-                        '庚': '金', '辛': '金', '壬': '水', '癸': '水'}
-        branch_elements = {'寅': '木', '卯': '木', '巳': '火', '午': '火', '辰': '土', '戌': '土',
-                          '丑': '土', '未': '土', '申': '金', '酉': '金', '亥': '水', '子': '水'}
-        
-        return stem_elements.get(stem, branch_elements.get(branch, '土'))
-    
-    def get_god_characteristics(self, god):
-        """Get characteristics of each ten god"""
-        characteristics = {
-            '正官': '正直、有责任感、守规矩',
-            '七杀': '果断、有魄力、竞争性强', 
-            '正印': '仁慈、有学识、保护性强',
-            '偏印': '独特、有创意、内向',
-            '正财': '稳定、务实、节俭',
-            '偏财': '灵活、投机、慷慨',
-            '食神': '温和、有才华、享受生活',
-            '伤官': '聪明、叛逆、创新',
-            '比肩': '独立、竞争、自我',
-            '劫财': '冲动、豪爽、冒险'
+        # Reverse index: edge ids grouped by destination
+        in_edge = np.argsort(arrays["dst"], kind="stable").astype(np.uint32)
+        arrays["in_edge"] = in_edge
+        arrays["in_src"] = src[in_edge]
+        arrays["in_indptr"] = np.concatenate(
+            [[0], np.cumsum(np.bincount(arrays["dst"], minlength=n))]).astype(np.uint32)
+        self._edges = None
+        return arrays
+
+    # -- secondary indexes ---------------------------------------------------
+
+    def node_id(self, name: str) -> int:
+        try:
+            return self.ids[name]
+        except KeyError:
+            raise KeyError(f"知识图谱中没有该概念: {name}") from None
+
+    def nodes_by_type(self, node_type: str) -> List[str]:
+        ids = np.flatnonzero(self._csr()["node_type"] == NODE_TYPES.index(node_type))
+        return [self.names[i] for i in ids]
+
+    def nodes_by_element(self, element: str, node_type: Optional[str] = None) -> List[str]:
+        arrays = self._csr()
+        mask = arrays["node_element"] == WU_XING.index(element)
+        if node_type:
+            mask &= arrays["node_type"] == NODE_TYPES.index(node_type)
+        return [self.names[i] for i in np.flatnonzero(mask)]
+
+    # -- traversal -----------------------------------------------------------
+
+    @staticmethod
+    def _type_mask(edge_types: Optional[Iterable[str]]) -> np.ndarray:
+        mask = np.zeros(len(EDGE_TYPES), dtype=bool)
+        if edge_types is None:
+            mask[:] = True
+        else:
+            mask[[EDGE_TYPES.index(t) for t in edge_types]] = True
+        return mask
+
+    def _edges_of(self, nodes: np.ndarray, direction: str, mask: np.ndarray):
+        """(edge ids, neighbor ids, reversed flags) of all edges touching `nodes`"""
+        arrays = self._csr()
+        parts = []
+        if direction in ("out", "both"):
+            starts, ends = arrays["indptr"][nodes], arrays["indptr"][nodes + 1]
+            edge_ids = _ranges(starts, ends)
+            parts.append((edge_ids, arrays["dst"][edge_ids], False))
+        if direction in ("in", "both"):
+            starts, ends = arrays["in_indptr"][nodes], arrays["in_indptr"][nodes + 1]
+            positions = _ranges(starts, ends)
+            parts.append((arrays["in_edge"][positions], arrays["in_src"][positions], True))
+        edge_ids = np.concatenate([p[0] for p in parts]).astype(np.int64)
+        neighbors = np.concatenate([p[1] for p in parts]).astype(np.int64)
+        reverse = np.concatenate([np.full(len(p[0]), p[2]) for p in parts])
+        keep = mask[arrays["edge_type"][edge_ids]]
+        return edge_ids[keep], neighbors[keep], reverse[keep]
+
+    def _edge_info(self, edge_id: int, neighbor: int, reverse: bool) -> Dict[str, Any]:
+        arrays = self._csr()
+        return {
+            "node": self.names[neighbor],
+            "type": EDGE_TYPES[arrays["edge_type"][edge_id]],
+            "label": self.labels[arrays["label"][edge_id]],
+            "weight": float(arrays["weight"][edge_id]),
+            "direction": "in" if reverse else "out",
         }
-        return characteristics.get(god, '')
-    
-    def add_classical_text_relationships(self, text_name, concepts):
-        """Add relationships extracted from classical texts"""
-        if text_name not in self.graph:
-            self.graph[text_name] = {'type': 'classical_text', 'concepts': []}
-        
-        self.graph[text_name]['concepts'].extend(concepts)
-    
+
+    def neighbors(self, name: str, edge_types: Optional[Iterable[str]] = None,
+                  direction: str = "out") -> List[Dict[str, Any]]:
+        """Edges of one node, optionally restricted to some edge types; direction is out, in or both"""
+        node = np.array([self.node_id(name)])
+        return [self._edge_info(e, n, r)
+                for e, n, r in zip(*self._edges_of(node, direction, self._type_mask(edge_types)))]
+
+    def k_hop(self, name: str, k: int = 2, edge_types: Optional[Iterable[str]] = None,
+              direction: str = "both") -> Dict[str, int]:
+        """Nodes within k hops of `name` and their hop distance, one frontier expansion per hop"""
+        mask = self._type_mask(edge_types)
+        distance = np.full(len(self.names), -1, dtype=np.int64)
+        source = self.node_id(name)
+        distance[source] = 0
+        frontier = np.array([source])
+        for hop in range(1, k + 1):
+            _, neighbors, _ = self._edges_of(frontier, direction, mask)
+            frontier = np.unique(neighbors[distance[neighbors] < 0])
+            if not len(frontier):
+                break
+            distance[frontier] = hop
+        return {self.names[i]: int(distance[i]) for i in np.flatnonzero(distance > 0)}
+
+    def find_paths(self, source: str, target: str, edge_types: Optional[Iterable[str]] = None,
+                   max_hops: int = 3, limit: int = 20, direction: str = "both") -> List[List[Dict[str, Any]]]:
+        """
+        Simple paths from source to target of at most max_hops edges, shortest first.
+
+        Each path is a list of steps {from, to, type, label, weight,
+        direction}; direction "in" means the edge points from `to` back to
+        `from` (e.g. 申 藏 庚 walked from 庚 to 申). The search only steps to
+        nodes that can still reach the target in the remaining hops.
+        """
+        mask = self._type_mask(edge_types)
+        start, goal = self.node_id(source), self.node_id(target)
+        reverse_direction = {"out": "in", "in": "out", "both": "both"}[direction]
+
+        # Hop distance of every node to the target, walking edges backwards
+        to_goal = np.full(len(self.names), max_hops + 1, dtype=np.int64)
+        to_goal[goal] = 0
+        frontier = np.array([goal])
+        for hop in range(1, max_hops + 1):
+            _, neighbors, _ = self._edges_of(frontier, reverse_direction, mask)
+            frontier = np.unique(neighbors[to_goal[neighbors] > hop])
+            if not len(frontier):
+                break
+            to_goal[frontier] = hop
+        if to_goal[start] > max_hops:
+            return []
+
+        paths = []
+        queue = deque([(start, [], {start})])
+        while queue and len(paths) < limit:
+            node, steps, visited = queue.popleft()
+            edge_ids, neighbors, reverse = self._edges_of(np.array([node]), direction, mask)
+            for e, n, r in zip(edge_ids.tolist(), neighbors.tolist(), reverse.tolist()):
+                if n in visited or len(steps) + 1 + to_goal[n] > max_hops:
+                    continue
+                info = self._edge_info(e, n, r)
+                step = {"from": self.names[node], "to": info.pop("node"), **info}
+                if n == goal:
+                    paths.append(steps + [step])
+                    if len(paths) >= limit:
+                        break
+                else:
+                    queue.append((n, steps + [step], visited | {n}))
+        return paths
+
+    # -- queries used by the engines -----------------------------------------
+
     def query_relationships(self, entity):
-        """Query relationships for a given entity"""
-        return self.graph.get(entity, {})
-    
+        """Attributes and relations of an entity grouped by edge type; {} if unknown"""
+        if entity not in self.ids:
+            return {}
+        node = self.ids[entity]
+        arrays = self._csr()
+        element = int(arrays["node_element"][node])
+        relations: Dict[str, List[Dict[str, Any]]] = {}
+        for edge in self.neighbors(entity, direction="both"):
+            relations.setdefault(edge.pop("type"), []).append(edge)
+        return {
+            "type": NODE_TYPES[arrays["node_type"][node]],
+            "element": WU_XING[element] if element >= 0 else None,
+            **self.attributes.get(node, {}),
+            "relationships": relations,
+        }
+
+    def _edges_between(self, a: int, b: int, mask: np.ndarray) -> List[int]:
+        """Ids of the edges of the allowed types from node a to node b"""
+        arrays = self._csr()
+        start, end = int(arrays["indptr"][a]), int(arrays["indptr"][a + 1])
+        hits = np.flatnonzero((arrays["dst"][start:end] == b) & mask[arrays["edge_type"][start:end]])
+        return (hits + start).tolist()
+
+    def chart_relations(self, pillars: Sequence[str]) -> List[Dict[str, str]]:
+        """合冲刑害 between the stems and between the branches of a chart's four pillars"""
+        mask = self._type_mask(CHART_EDGE_TYPES)
+        arrays = self._csr()
+        found = []
+        for part, kind in ((0, "干"), (1, "支")):
+            chars = [pillar[part] for pillar in pillars]
+            for i in range(len(chars)):
+                for j in range(i + 1, len(chars)):
+                    a, b = self.ids[chars[i]], self.ids[chars[j]]
+                    seen = set()
+                    for e in self._edges_between(a, b, mask) + self._edges_between(b, a, mask):
+                        key = (int(arrays["edge_type"][e]), int(arrays["label"][e]))
+                        if key in seen:
+                            continue
+                        seen.add(key)
+                        found.append({
+                            "positions": f"{POSITIONS[i]}{kind}{chars[i]}与{POSITIONS[j]}{kind}{chars[j]}",
+                            "type": EDGE_TYPES[key[0]],
+                            "label": self.labels[key[1]],
+                        })
+        return found
+
+    # -- export and snapshots ------------------------------------------------
+
     def export_graph(self, format='json'):
-        """Export the knowledge graph in specified format"""
+        """Compact export of nodes and edges (one array per field)"""
+        arrays = self._csr()
+        data = {
+            "nodes": self.names,
+            "node_types": [NODE_TYPES[t] for t in arrays["node_type"].tolist()],
+            "edge_types": EDGE_TYPES,
+            "labels": self.labels,
+            "indptr": arrays["indptr"].tolist(),
+            "dst": arrays["dst"].tolist(),
+            "edge_type": arrays["edge_type"].tolist(),
+            "label": arrays["label"].tolist(),
+            "weight": [round(w, 3) for w in arrays["weight"].tolist()],
+        }
         if format == 'json':
-            import json
-            return json.dumps(self.graph, ensure_ascii=False, indent=2)
-        return str(self.graph)
+            return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+        return str(data)
+
+    def save_snapshot(self, path: str = DEFAULT_SNAPSHOT_PATH) -> str:
+        """Write header, node arrays, edge arrays (8-byte aligned) and a JSON string table"""
+        arrays = self._csr()
+        trailer = json.dumps({
+            "names": self.names,
+            "labels": self.labels,
+            "attributes": {str(k): v for k, v in self.attributes.items()},
+        }, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        directory = os.path.dirname(path) or "."
+        os.makedirs(directory, exist_ok=True)
+        # Workers rebuilding at the same time each write their own file
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path) + ".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(HEADER.pack(MAGIC, VERSION, len(self.names), len(arrays["dst"]), len(trailer),
+                                    build_tables_digest()))
+                for name, dtype in _snapshot_layout():
+                    _pad(f)
+                    f.write(np.ascontiguousarray(arrays[name], dtype=dtype).tobytes())
+                _pad(f)
+                f.write(trailer)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        return path
+
+    @classmethod
+    def load_snapshot(cls, path: str = DEFAULT_SNAPSHOT_PATH) -> "MetaphysicsKnowledgeGraph":
+        """Graph whose CSR arrays are read-only views into the memory-mapped snapshot"""
+        graph = cls(build=False)
+        with open(path, "rb") as f:
+            graph._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version = HEADER.unpack_from(graph._map, 0)[:2]
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"知识图谱快照格式不正确: {path}")
+        _, _, nodes, edges, trailer_size, graph.tables_digest = HEADER.unpack_from(graph._map, 0)
+        offset = HEADER.size
+        arrays = {}
+        for name, dtype in _snapshot_layout():
+            offset += -offset % _ALIGN
+            count = nodes + 1 if name.endswith("indptr") else nodes if name.startswith("node_") else edges
+            arrays[name] = np.frombuffer(graph._map, dtype=dtype, count=count, offset=offset)
+            offset += arrays[name].nbytes
+        offset += -offset % _ALIGN
+        trailer = json.loads(graph._map[offset:offset + trailer_size].decode("utf-8"))
+
+        graph.names = trailer["names"]
+        graph.ids = {name: i for i, name in enumerate(graph.names)}
+        graph.labels = trailer["labels"]
+        graph._label_ids = {label: i for i, label in enumerate(graph.labels)}
+        graph.attributes = {int(k): v for k, v in trailer["attributes"].items()}
+        graph._node_type = arrays["node_type"].tolist()
+        graph._node_element = arrays["node_element"].tolist()
+        graph._edges = None
+        graph._arrays = arrays
+        return graph
+
+
+def _snapshot_layout() -> List[Tuple[str, Any]]:
+    return _NODE_ARRAYS + [("indptr", np.uint32), ("in_indptr", np.uint32)] + _EDGE_ARRAYS
+
+
+def _pad(f):
+    f.write(b"\x00" * (-f.tell() % _ALIGN))
+
+
+def _ranges(starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    """Concatenation of arange(start, end) for every pair, without a Python loop"""
+    starts = starts.astype(np.int64)
+    lengths = ends.astype(np.int64) - starts
+    total = int(lengths.sum())
+    if total == 0:
+        return np.zeros(0, dtype=np.int64)
+    offsets = np.repeat(starts - np.concatenate([[0], np.cumsum(lengths)[:-1]]), lengths)
+    return np.arange(total) + offsets
+
+
+def format_path(path: List[Dict[str, Any]]) -> str:
+    """甲 —十神·七杀→ 庚 ←藏·本气— 申"""
+    text = path[0]["from"] if path else ""
+    for step in path:
+        relation = step["type"] + (f"·{step['label']}" if step["label"] else "")
+        arrow = f" —{relation}→ " if step["direction"] == "out" else f" ←{relation}— "
+        text += arrow + step["to"]
+    return text
+
+
+def format_chart_relations(full_bazi: str, graph: Optional[MetaphysicsKnowledgeGraph] = None) -> str:
+    """Prompt block listing the 合冲刑害 inside a chart"""
+    graph = graph or get_knowledge_graph()
+    relations = graph.chart_relations(full_bazi.split())
+    lines = ["【干支刑冲合害（知识图谱）】"]
+    if not relations:
+        lines.append("- 四柱干支之间无合冲刑害")
+    for relation in relations:
+        lines.append(f"- {relation['positions']}：{relation['label']}")
+    return "\n".join(lines)
+
+
+_knowledge_graph = None
+_knowledge_graph_lock = threading.Lock()
+
+
+def get_knowledge_graph() -> MetaphysicsKnowledgeGraph:
+    """Process-wide graph loaded from the snapshot, which is written on first use"""
+    global _knowledge_graph
+    with _knowledge_graph_lock:
+        if _knowledge_graph is None:
+            graph = None
+            if os.path.exists(DEFAULT_SNAPSHOT_PATH):
+                try:
+                    graph = MetaphysicsKnowledgeGraph.load_snapshot(DEFAULT_SNAPSHOT_PATH)
+                except ValueError as e:
+                    print(f"知识图谱快照无效，重新生成: {e}")
+                if graph is not None and graph.tables_digest != build_tables_digest():
+                    print("知识图谱数据表已更新，重新生成快照")
+                    graph = None
+            if graph is None:
+                graph = MetaphysicsKnowledgeGraph()
+                graph.save_snapshot(DEFAULT_SNAPSHOT_PATH)
+            _knowledge_graph = graph
+    return _knowledge_graph
+
 
 # Usage example
 if __name__ == "__main__":
     kg = MetaphysicsKnowledgeGraph()
+    path = kg.save_snapshot()
     print("Knowledge graph initialized with core metaphysical concepts")
-    print(f"Total entities: {len(kg.graph)}")
\ No newline at end of file
+    print(f"Total entities: {len(kg.names)}, edges: {len(kg._csr()['dst'])}, snapshot: {path}")
+    for found in kg.find_paths("甲", "申", edge_types=["藏", "十神", "生", "克"], max_hops=2):
+        print(format_path(found))
@@ -2,7 +2,9 @@
 Qianji Vector Database Configuration
 
 This module configures the vector database for RAG (Retrieval Augmented Generation)
-system using Weaviate, Pinecone, or Milvus as the backend.
+system. The default "local" backend is the on-disk classics index in
+src/data/classics_index.py and needs no service; Weaviate, Pinecone and Milvus
+remain available as external backends.
 """
 
 import os
@@ -12,8 +14,14 @@ class VectorDBConfig:
     """Configuration class for vector databases."""
     
     def __init__(self):
-        # Default to Weaviate for local development
-        self.default_backend = "weaviate"
+        # Default to the local mmap index; no vector DB service required
+        self.default_backend = "local"
+        
+        # Local classics index configuration
+        self.local_config = {
+            "index_dir": os.path.join(os.path.dirname(__file__), "classics_index"),
+            "embedding_model": os.getenv("QJI_EMBEDDING_MODEL", "BAAI/bge-small-zh-v1.5")
+        }
         
         # Weaviate configuration
         self.weaviate_config = {
@@ -39,7 +47,9 @@ class VectorDBConfig:
     def get_config(self, backend: str = None) -> Dict[str, Any]:
         """Get configuration for specified backend."""
         backend = backend or self.default_backend
-        if backend == "weaviate":
+        if backend == "local":
+            return self.local_config
+        elif backend == "weaviate":
             return self.weaviate_config
         elif backend == "pinecone":
             return self.pinecone_config
@@ -15,7 +15,14 @@ The interface is built with Flask and includes both desktop and mobile views.
 from flask import Flask, render_template, request, jsonify
 import json
 import os
+import sys
 from datetime import datetime
+from pathlib import Path
+
+# Add project root to Python path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from src.core.chart_index import get_chart_index
 
 class ExpertValidationUI:
     def __init__(self):
@@ -67,6 +74,26 @@ class ExpertValidationUI:
                 ]
             })
     
+        @self.app.route('/charts/search')
+        def search_charts():
+            """Find stored charts by pillars, patterns and clashes, e.g. ?q=日柱=庚午 AND 子午冲"""
+            try:
+                index = get_chart_index()
+            except OSError:
+                return jsonify({'error': 'chart index not built'}), 503
+            try:
+                return jsonify(index.query(request.args.get('q', ''), request.args.get('limit', 50, type=int)))
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+                
+        @self.app.route('/charts/facets/<family>')
+        def chart_facets(family):
+            """Chart counts per value of a term family (格局, 日柱, 强弱 ...)"""
+            try:
+                return jsonify(get_chart_index().facets(family))
+            except OSError:
+                return jsonify({'error': 'chart index not built'}), 503
+    
     def run(self, host='localhost', port=5001, debug=False):
         """Run the validation UI server."""
         print(f"Expert Validation UI starting on http://{host}:{port}")
@@ -11,6 +11,20 @@ document.addEventListener('DOMContentLoaded', function() {
     // 聊天记录存储键
     const CHAT_HISTORY_KEY = 'qianji_chat_history';
     const MAX_HISTORY_ITEMS = 100; // 限制历史记录数量
+    // 会话ID：服务器按此ID保存对话上下文，请求中无需再上传完整历史
+    const SESSION_ID_KEY = 'qianji_session_id';
+    const sessionId = getSessionId();
+
+    function getSessionId() {
+        let id = localStorage.getItem(SESSION_ID_KEY);
+        if (!id) {
+            id = window.crypto && crypto.randomUUID
+                ? crypto.randomUUID().replace(/-/g, '')
+                : Date.now().toString(36) + Math.random().toString(36).slice(2);
+            localStorage.setItem(SESSION_ID_KEY, id);
+        }
+        return id;
+    }
 
     // 初始化聊天界面
     function initializeChat() {
@@ -67,6 +81,7 @@ document.addEventListener('DOMContentLoaded', function() {
     // 清除聊天历史
     function clearChatHistory() {
         localStorage.removeItem(CHAT_HISTORY_KEY);
+        localStorage.removeItem(SESSION_ID_KEY);
         chatMessages.innerHTML = '';
     }
 
@@ -155,32 +170,89 @@ document.addEventListener('DOMContentLoaded', function() {
             addMessage(message, 'user');
             userMessage.value = '';
             
-            addMessage('千机AI正在思考...', 'bot');
-            
-            fetch('/chat', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                },
-                body: JSON.stringify({message: message})
-            })
-            .then(response => response.json())
-            .then(data => {
-                // 移除"正在思考"消息
-                const thinkingMsg = chatMessages.querySelector('.bot-message:last-child');
-                if (thinkingMsg) thinkingMsg.remove();
-                
-                addMessage(data.response, 'bot');
-                scrollToBottom();
-            })
-            .catch(error => {
-                const thinkingMsg = chatMessages.querySelector('.bot-message:last-child');
-                if (thinkingMsg) thinkingMsg.remove();
-                addMessage('抱歉，处理您的请求时出现了问题。请稍后重试。', 'bot');
-                console.error('Chat error:', error);
-                scrollToBottom();
+            streamReply('/chat/stream', '/chat', {message: message, session_id: sessionId}, '千机AI正在思考...',
+                        '抱歉，处理您的请求时出现了问题。请稍后重试。');
+        }
+    }
+
+    // 流式回复：逐段渲染服务器推送的SSE内容，不支持时回退到普通接口
+    function streamReply(streamUrl, fallbackUrl, payload, placeholder, errorText) {
+        const botDiv = addMessage(placeholder, 'bot', false);
+        let text = '';
+
+        fetch(streamUrl, {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+                'Accept': 'text/event-stream',
+            },
+            body: JSON.stringify(payload)
+        })
+        .then(response => {
+            const contentType = response.headers.get('Content-Type') || '';
+            if (!response.ok || !response.body || !contentType.includes('text/event-stream')) {
+                return fetchFullReply(fallbackUrl, payload).then(reply => { text = reply; });
+            }
+            return readEventStream(response.body, (event, data) => {
+                if (event === 'error') {
+                    text = text || data.response || errorText;
+                } else if (data.delta) {
+                    text += data.delta;
+                }
+                updateMessage(botDiv, text);
+            });
+        })
+        .then(() => {
+            updateMessage(botDiv, text || errorText);
+            saveMessageToHistory(text || errorText, 'bot');
+        })
+        .catch(error => {
+            updateMessage(botDiv, text || errorText);
+            saveMessageToHistory(text || errorText, 'bot');
+            console.error('Stream error:', error);
+        });
+    }
+
+    function fetchFullReply(url, payload) {
+        return fetch(url, {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+            },
+            body: JSON.stringify(payload)
+        })
+        .then(response => response.json())
+        .then(data => data.response);
+    }
+
+    // 解析SSE数据流：每个事件以空行分隔，包含可选的event行和data行
+    function readEventStream(body, onEvent) {
+        const reader = body.getReader();
+        const decoder = new TextDecoder('utf-8');
+        let buffer = '';
+
+        function pump() {
+            return reader.read().then(({done, value}) => {
+                if (done) return;
+                buffer += decoder.decode(value, {stream: true});
+                let boundary;
+                while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                    const frame = buffer.slice(0, boundary);
+                    buffer = buffer.slice(boundary + 2);
+                    let event = 'message';
+                    let data = '';
+                    frame.split('\n').forEach(line => {
+                        if (line.startsWith('event:')) event = line.slice(6).trim();
+                        else if (line.startsWith('data:')) data += line.slice(5).trim();
+                    });
+                    if (event === 'done') return;
+                    if (data) onEvent(event, JSON.parse(data));
+                }
+                return pump();
             });
         }
+
+        return pump();
     }
 
     // 表单提交
@@ -201,36 +273,13 @@ document.addEventListener('DOMContentLoaded', function() {
             birthDate: birthDate,
             birthTime: birthTime,
             gender: gender,
-            location: location
+            location: location,
+            session_id: sessionId
         };
         
         addMessage(`快速八字分析请求：出生日期 ${birthDate}，出生时间 ${birthTime}，性别 ${gender}，出生地点 ${location}`, 'user');
         
-        addMessage('千机AI正在分析...', 'bot');
-        
-        fetch('/bazi', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-            },
-            body: JSON.stringify(baziData)
-        })
-        .then(response => response.json())
-        .then(data => {
-            // 移除"正在分析"消息
-            const analyzingMsg = chatMessages.querySelector('.bot-message:last-child');
-            if (analyzingMsg) analyzingMsg.remove();
-            
-            addMessage(data.response, 'bot');
-            scrollToBottom();
-        })
-        .catch(error => {
-            const analyzingMsg = chatMessages.querySelector('.bot-message:last-child');
-            if (analyzingMsg) analyzingMsg.remove();
-            addMessage('八字分析失败，请重试。', 'bot');
-            console.error('Bazi error:', error);
-            scrollToBottom();
-        });
+        streamReply('/bazi/stream', '/bazi', baziData, '千机AI正在分析...', '八字分析失败，请重试。');
     });
 
     // 辅助函数
@@ -245,6 +294,12 @@ document.addEventListener('DOMContentLoaded', function() {
         if (saveToHistory) {
             saveMessageToHistory(text, sender);
         }
+        return messageDiv;
+    }
+
+    function updateMessage(messageDiv, text) {
+        messageDiv.querySelector('.message-content').innerHTML = text.replace(/\n/g, '<br>');
+        scrollToBottom();
     }
 
     function scrollToBottom() {
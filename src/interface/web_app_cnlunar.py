@@ -7,13 +7,22 @@ import sys
 import json
 from pathlib import Path
 from datetime import datetime
+from itertools import islice
 
 # Add project root to Python path
 project_root = Path(__file__).parent.parent.parent
 sys.path.insert(0, str(project_root))
 
-from flask import Flask, request, jsonify, render_template, send_from_directory
+from flask import Flask, request, jsonify, render_template, send_from_directory, Response, stream_with_context
 from src.core.independent_qji_cnlunar import IndependentQjiCnlunarEngine
+from src.core.independent_qwen import is_api_error
+from src.core.conversation_store import get_conversation_store, is_valid_session_id
+from src.core.bazi_batch import (iter_batch_results, interpret_rows, engine_interpreter, get_batch_executor,
+                                 MAX_INTERPRET_ROWS)
+from src.core.daily_fortune import lookup_daily_fortune
+from src.core.almanac import get_almanac, is_almanac_query, almanac_date_answer
+from src.core.compatibility import get_compatibility_engine, format_compatibility
+from src.core.chart_index import get_chart_index
 
 app = Flask(__name__)
 app.config['UPLOAD_FOLDER'] = os.path.join(project_root, 'uploads')
@@ -22,8 +31,54 @@ os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 # Initialize AI engine
 print("正在加载千机AI模型（cnlunar准确八字版）...")
 ai_engine = IndependentQjiCnlunarEngine()
+conversation_store = get_conversation_store()
 print("千机AI模型加载完成！")
 
+def load_history(data):
+    """
+    Resolve (session_id, history) for a chat request.
+    
+    With a session_id the history is loaded server-side; older clients that
+    still post the full history array get session_id None.
+    """
+    session_id = data.get('session_id')
+    if is_valid_session_id(session_id):
+        return session_id, conversation_store.get_history(session_id)
+    return None, data.get('history', [])
+
+def remember_bazi(data, birth_date, birth_time, gender, location=None):
+    """Pin the user's pillars in the session context so later chat turns keep them"""
+    session_id = data.get('session_id')
+    if not is_valid_session_id(session_id):
+        return
+    try:
+        birth_datetime = datetime.strptime(f"{birth_date} {birth_time}", "%Y-%m-%d %H:%M")
+    except ValueError:
+        return
+    bazi = ai_engine.get_accurate_bazi(birth_datetime, location)
+    if bazi:
+        conversation_store.update_context(session_id, {
+            'bazi_info': f"{bazi['full_bazi']}（{gender}，{birth_date} {birth_time}）"
+        })
+
+def record_exchange(session_id, message, response):
+    """Append one user/assistant turn to the session's stored history"""
+    if session_id:
+        conversation_store.append(session_id, 'user', message)
+        conversation_store.append(session_id, 'assistant', response)
+
+def cached_daily_fortune(session_id, message):
+    """Nightly precomputed reading for a 今日运势 question, if the session has pillars"""
+    if not session_id:
+        return None
+    return lookup_daily_fortune(message, conversation_store.get_context(session_id).get('bazi_info'))
+
+def almanac_reply(message):
+    """Direct 黄历 answer for short almanac questions; longer ones go to the model with the almanac in context"""
+    if is_almanac_query(message) and len(message) <= 20:
+        return almanac_date_answer(message)
+    return None
+
 @app.route('/')
 def index():
     """Main page with persistent chat interface"""
@@ -42,6 +97,7 @@ def bazi_analysis():
         if not all([birth_date, birth_time, gender, location]):
             return jsonify({'response': '请填写完整的八字信息'}), 400
             
+        remember_bazi(data, birth_date, birth_time, gender, location)
         # Get response from Independent Qji Engine with cnlunar accuracy
         response = ai_engine.analyze_bazi(birth_date, birth_time, gender, location)
         
@@ -61,16 +117,180 @@ def chat():
             return jsonify({'response': '消息不能为空'}), 400
             
         # Get conversation history (if any)
-        history = data.get('history', [])
+        session_id, history = load_history(data)
             
         # Get response from real Qianji Engine with cnlunar  
-        response = ai_engine.generate_response(message, history)
+        response = (cached_daily_fortune(session_id, message) or almanac_reply(message)
+                    or ai_engine.generate_response(message, history, session_id))
+        if not is_api_error(response):
+            # A failed call's apology is shown but never becomes history
+            record_exchange(session_id, message, response)
         
-        return jsonify({'response': response})
+        return jsonify({'response': response, 'session_id': session_id})
     except Exception as e:
         print(f"Chat error: {e}")
         return jsonify({'response': '抱歉，处理您的请求时出现了问题。请稍后重试。'}), 500
 
+def sse_event(data, event=None):
+    """Format one server-sent event frame"""
+    frame = f"event: {event}\n" if event else ""
+    return frame + f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def sse_response(chunks):
+    """Relay a text generator to the browser as server-sent events"""
+    def events():
+        try:
+            for chunk in chunks:
+                yield sse_event({'delta': chunk})
+            yield sse_event({}, event='done')
+        except Exception as e:
+            print(f"Stream error: {e}")
+            yield sse_event({'response': '抱歉，处理您的请求时出现了问题。请稍后重试。'}, event='error')
+    
+    return Response(
+        stream_with_context(events()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/chat/stream', methods=['POST'])
+def chat_stream():
+    """Stream chat responses token-by-token as server-sent events"""
+    data = request.get_json() or {}
+    message = data.get('message', '')
+    
+    if not message:
+        return jsonify({'response': '消息不能为空'}), 400
+        
+    session_id, history = load_history(data)
+    
+    def chunks():
+        local_reply = cached_daily_fortune(session_id, message) or almanac_reply(message)
+        if local_reply:
+            yield local_reply
+            record_exchange(session_id, message, local_reply)
+            return
+        parts = []
+        for chunk in ai_engine.generate_response_stream(message, history, session_id):
+            if is_api_error(chunk):
+                # Failed midway: the apology is shown but nothing is stored
+                yield chunk
+                return
+            parts.append(chunk)
+            yield chunk
+        # Only completed replies are stored; a disconnect stops the generator above
+        record_exchange(session_id, message, ''.join(parts))
+    
+    return sse_response(chunks())
+
+@app.route('/bazi/stream', methods=['POST'])
+def bazi_stream():
+    """Stream bazi analysis as server-sent events"""
+    data = request.get_json() or {}
+    birth_date = data.get('birthDate')
+    birth_time = data.get('birthTime')
+    gender = data.get('gender')
+    location = data.get('location')
+    
+    if not all([birth_date, birth_time, gender, location]):
+        return jsonify({'response': '请填写完整的八字信息'}), 400
+        
+    remember_bazi(data, birth_date, birth_time, gender, location)
+    return sse_response(ai_engine.analyze_bazi_stream(birth_date, birth_time, gender, location))
+
+def read_ndjson_records(stream):
+    """Parse request body lines lazily; malformed lines become records that fail validation"""
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            record = None
+        yield record if isinstance(record, dict) else {'birth_date': None}
+
+@app.route('/bazi/batch', methods=['POST'])
+def bazi_batch():
+    """
+    Compute charts for NDJSON birth records and stream NDJSON results in input order
+    
+    Every result carries its 0-based row number; a client that lost the
+    connection resumes with ?offset=<next row>. ?interpret=1 adds an LLM
+    analysis to the first MAX_INTERPRET_ROWS rows of the request; later rows
+    get an analysis_error and can be interpreted by resuming at their offset.
+    """
+    offset = request.args.get('offset', 0, type=int)
+    interpret = engine_interpreter(ai_engine) if request.args.get('interpret') == '1' else None
+    records = islice(read_ndjson_records(request.stream), offset, None)
+    
+    def generate():
+        row_number = offset
+        budget = MAX_INTERPRET_ROWS
+        for rows in iter_batch_results(records, executor=get_batch_executor()):
+            if interpret is not None:
+                interpret_rows(rows[:budget], interpret)
+                for row in rows[budget:]:
+                    if 'error' not in row:
+                        row['analysis_error'] = f'每次请求最多解读{MAX_INTERPRET_ROWS}行'
+                budget = max(budget - len(rows), 0)
+            for row in rows:
+                row['row'] = row_number
+                row_number += 1
+                yield json.dumps(row, ensure_ascii=False) + '\n'
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+def person_pillars(person):
+    """Four pillars of a request party: full_bazi as given, or computed from birthDate/birthTime/location"""
+    if not isinstance(person, dict):
+        raise ValueError('缺少出生信息')
+    if person.get('full_bazi'):
+        return person['full_bazi']
+    birth_date, birth_time = person.get('birthDate'), person.get('birthTime') or '12:00'
+    if not birth_date:
+        raise ValueError('缺少出生日期')
+    birth_datetime = datetime.strptime(f"{birth_date} {birth_time}", "%Y-%m-%d %H:%M")
+    bazi = ai_engine.get_accurate_bazi(birth_datetime, person.get('location'))
+    if not bazi:
+        raise ValueError('八字计算失败')
+    return bazi['full_bazi']
+
+@app.route('/compatibility', methods=['POST'])
+def compatibility():
+    """合婚 score of two people ({"a": {...}, "b": {...}}) from the precomputed relation matrices"""
+    data = request.get_json() or {}
+    try:
+        result = get_compatibility_engine().pair(person_pillars(data.get('a')), person_pillars(data.get('b')))
+    except ValueError as e:
+        return jsonify({'error': f'出生信息无效: {e}'}), 400
+    result['summary'] = format_compatibility(result)
+    return jsonify(result)
+
+@app.route('/compatibility/match', methods=['POST'])
+def compatibility_match():
+    """Top-k matches for one person among the stored candidate charts (?k=, default 10)"""
+    data = request.get_json() or {}
+    try:
+        pillars = person_pillars(data)
+    except ValueError as e:
+        return jsonify({'error': f'出生信息无效: {e}'}), 400
+    k = min(request.args.get('k', 10, type=int), 1000)
+    matches = get_compatibility_engine().top_k(pillars, k, data.get('gender'), data.get('id'))
+    return jsonify({'full_bazi': pillars, 'matches': matches})
+
+@app.route('/charts/search', methods=['GET'])
+def charts_search():
+    """Stored charts matching a conjunctive query (?q=日柱=庚午 AND 月支=寅 AND 子午冲&limit=50)"""
+    try:
+        index = get_chart_index()
+    except OSError:
+        return jsonify({'error': '命盘索引尚未构建，请先运行 python -m src.core.chart_index --build'}), 503
+    try:
+        return jsonify(index.query(request.args.get('q', ''), min(request.args.get('limit', 50, type=int), 1000)))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
 @app.route('/current-date', methods=['GET'])
 def current_date():
     """Get current date information for debugging"""
@@ -91,6 +311,18 @@ def current_date():
         print(f"Current date error: {e}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/almanac', methods=['GET'])
+def almanac():
+    """黄历 of a day (?date=YYYY-MM-DD, default today) from the precomputed table"""
+    day = request.args.get('date') or datetime.now().strftime('%Y-%m-%d')
+    try:
+        return jsonify(get_almanac().lookup(day))
+    except FileNotFoundError as e:
+        print(f"Almanac error: {e}")
+        return jsonify({'error': '黄历数据尚未生成'}), 503
+    except ValueError as e:
+        return jsonify({'error': f'日期无效或超出范围: {e}'}), 400
+
 @app.route('/static/<path:filename>')
 def static_files(filename):
     """Serve static files"""
@@ -5,7 +5,6 @@ Qianji Web Application - True Qwen Max Integration with Forced Date Validation
 import os
 import sys
 import json
-import requests
 from pathlib import Path
 
 # Add project root to Python path
@@ -14,6 +13,7 @@ sys.path.insert(0, str(project_root))
 
 from flask import Flask, request, jsonify, render_template, send_from_directory
 from src.core.independent_qji_fixed import IndependentQjiEngine
+from src.core.date_context import get_date_context_provider
 
 app = Flask(__name__)
 app.config['UPLOAD_FOLDER'] = os.path.join(project_root, 'uploads')
@@ -22,48 +22,16 @@ os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 # Initialize AI engine
 print("正在加载千机AI模型...")
 ai_engine = IndependentQjiEngine()
+date_provider = get_date_context_provider()
 print("千机AI模型加载完成！")
 
 def force_date_validation(message):
-    """Force date validation for date-related queries"""
-    date_keywords = ['今天', '日期', '农历', '阳历', '公历', '黄历', '日子', '几号', '星期']
-    
-    if any(keyword in message for keyword in date_keywords):
-        # Perform direct web search for accurate date information
+    """Answer date-related queries directly from the local calendar"""
+    if date_provider.is_date_query(message):
         try:
-            # Search for current date info
-            search_query = "2026年2月24日 农历 正月"
-            url = "https://api.search.brave.com/res/v1/web/search"
-            headers = {
-                'Accept': 'application/json',
-                'X-Subscription-Token': 'BSAynHOXmn1r3Qo2L5uK7DWFa7Qp2LY'
-            }
-            params = {
-                'q': search_query,
-                'count': 3
-            }
-            
-            response = requests.get(url, headers=headers, params=params, timeout=10)
-            if response.status_code == 200:
-                data = response.json()
-                if 'web' in data and 'results' in data['web']:
-                    # Extract date info from search results
-                    for result in data['web']['results']:
-                        snippet = result.get('description', '')
-                        title = result.get('title', '')
-                        if '正月初八' in snippet or '正月初八' in title:
-                            return "根据权威万年历查询，2026年2月24日（星期二）对应的农历日期是：**丙午年正月初八**。"
-                        elif '正月' in snippet and '初' in snippet:
-                            # Extract the correct date format
-                            return f"根据网络搜索结果，2026年2月24日对应的农历日期是：{snippet}"
-            
-            # Fallback to known correct answer
-            return "根据权威万年历，2026年2月24日（星期二）对应的农历日期是：**丙午年正月初八**。"
-            
+            return date_provider.answer(message)
         except Exception as e:
             print(f"Date validation error: {e}")
-            # Always return the correct answer
-            return "根据权威万年历，2026年2月24日（星期二）对应的农历日期是：**丙午年正月初八**。"
     
     return None
 
@@ -13,6 +13,7 @@ sys.path.insert(0, str(project_root))
 
 from flask import Flask, request, jsonify, render_template, send_from_directory
 from src.core.simple_conversation import SimpleConversationManager
+from src.core.conversation_store import is_valid_session_id
 
 app = Flask(__name__)
 app.config['UPLOAD_FOLDER'] = os.path.join(project_root, 'uploads')
@@ -58,16 +59,22 @@ def chat():
     try:
         data = request.get_json()
         message = data.get('message', '')
-        conversation_id = data.get('conversation_id', None)
-        history = data.get('history', [])
+        conversation_id = data.get('session_id') or data.get('conversation_id', None)
         
         if not message:
             return jsonify({'response': '消息不能为空'}), 400
+        
+        if is_valid_session_id(conversation_id):
+            # History is kept server-side for this session
+            history = None
+        else:
+            conversation_id = None
+            history = data.get('history', [])
             
         # Get contextual response from conversation manager
         response = conversation_manager.get_response(message, conversation_id, history)
         
-        return jsonify({'response': response})
+        return jsonify({'response': response, 'session_id': conversation_id})
     except Exception as e:
         print(f"Chat error: {e}")
         return jsonify({'response': '抱歉，处理您的请求时出现了问题。请稍后重试。'}), 500
@@ -5,6 +5,7 @@ Provides advanced bazi analysis capabilities using classical texts
 import json
 from datetime import datetime
 from ..core.skills import BaseSkill
+from ..utils.keyword_scanner import has_keyword
 
 class BaziSkill(BaseSkill):
     def __init__(self):
@@ -17,8 +18,7 @@ class BaziSkill(BaseSkill):
     
     def can_handle(self, query: str) -> bool:
         """Check if this skill can handle the query"""
-        bazi_keywords = ["八字", "命理", "命运", "四柱", "格局", "用神", "大运", "流年"]
-        return any(keyword in query for keyword in bazi_keywords)
+        return has_keyword(query, "bazi_intent")
     
     def execute(self, query: str, context: dict = None) -> dict:
         """
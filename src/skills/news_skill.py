@@ -5,6 +5,7 @@ Provides current news and trending topics
 import json
 from datetime import datetime
 from ..core.web_search import WebSearcher
+from ..utils.keyword_scanner import has_keyword
 
 class NewsSkill:
     def __init__(self):
@@ -14,8 +15,7 @@ class NewsSkill:
         
     def can_handle(self, query: str) -> bool:
         """Check if this skill can handle the query"""
-        news_keywords = ["新闻", "最新消息", "头条", "今日新闻", "热点", "趋势", "breaking news", "latest news"]
-        return any(keyword in query.lower() for keyword in news_keywords)
+        return has_keyword(query, "news_intent")
     
     def execute(self, query: str, context: dict = None) -> dict:
         """
@@ -8,61 +8,138 @@ into structured data for the AI engine.
 Model Usage: Qwen Max for text analysis and logical processing, 
 Doudou style only for final output formatting if needed
 """
+import bisect
+import hashlib
+import os
+
+from src.utils.keyword_scanner import (SCANNER, HEAVENLY_STEMS, EARTHLY_BRANCHES, FIVE_ELEMENTS,
+                                       TEN_GODS, KEYWORD_SETS)
+from src.utils.classical_stream import (MAX_CHUNK_CHARS, ClassicalChunker, chunk_string,
+                                        iter_classical_chunks, iter_lines)
 
 class ClassicalParser:
     """Parser for classical Chinese命理 texts"""
     
     def __init__(self):
-        self.heavenly_stems = ['甲', '乙', '丙', '丁', '戊', '己', '庚', '辛', '壬', '癸']
-        self.earthly_branches = ['子', '丑', '寅', '卯', '辰', '巳', '午', '未', '申', '酉', '戌', '亥']
-        self.five_elements = ['木', '火', '土', '金', '水']
-        self.ten_gods = ['比肩', '劫财', '食神', '伤官', '偏财', '正财', '七杀', '正官', '偏印', '正印']
+        self.heavenly_stems = HEAVENLY_STEMS
+        self.earthly_branches = EARTHLY_BRANCHES
+        self.five_elements = FIVE_ELEMENTS
+        self.ten_gods = TEN_GODS
+        self.case_patterns = KEYWORD_SETS['case_marker']
+    
+    @staticmethod
+    def scan(text):
+        """Stems, branches, ten gods, classic titles and 命例 markers in one pass over the text"""
+        return SCANNER.scan(text, ('stem', 'branch', 'ten_god', 'classic', 'case_marker'))
     
-    def parse_bazi_text(self, text):
+    def parse_bazi_text(self, text, matches=None):
         """Parse classical bazi text and extract structured information"""
-        # Extract heavenly stems and earthly branches
-        stems_found = []
-        branches_found = []
-        
-        for char in text:
-            if char in self.heavenly_stems:
-                stems_found.append(char)
-            elif char in self.earthly_branches:
-                branches_found.append(char)
+        if matches is None:
+            matches = self.scan(text)
+        found = {'stem': [], 'branch': [], 'ten_god': [], 'classic': []}
+        for match in matches:
+            if match.category in found:
+                found[match.category].append(match.keyword)
         
         return {
-            'heavenly_stems': stems_found,
-            'earthly_branches': branches_found,
+            'heavenly_stems': found['stem'],
+            'earthly_branches': found['branch'],
+            'ten_gods': found['ten_god'],
+            'classics_cited': list(dict.fromkeys(found['classic'])),
             'raw_text': text[:500] + '...' if len(text) > 500 else text
         }
     
-    def extract_case_studies(self, text):
-        """Extract命例 (case studies) from classical texts"""
-        # Look for patterns like "命造" or "八字"
-        case_patterns = ['命造', '八字', '命主', '造化', '格局']
-        cases = []
-        
+    def extract_case_studies(self, text, matches=None):
+        """Extract命例 (case studies): every line containing a marker such as 命造 or 八字"""
+        if matches is None:
+            matches = self.scan(text)
+        line_starts = [0]
+        line_starts.extend(i + 1 for i, char in enumerate(text) if char == '\n')
         lines = text.split('\n')
-        for line in lines:
-            if any(pattern in line for pattern in case_patterns):
-                cases.append(line.strip())
-        
-        return cases
+        hit_lines = sorted({bisect.bisect_right(line_starts, match.start) - 1
+                            for match in matches if match.category == 'case_marker'})
+        return [lines[i].strip() for i in hit_lines]
     
-    def process_classical_file(self, file_path):
-        """Process a complete classical text file"""
+    def process_classical_file(self, file_path, with_chunks=False):
+        """
+        Process a complete classical text file
+        
+        The file is streamed line by line, so memory does not grow with its
+        size (apart from the extracted lists). With with_chunks=True the
+        result also carries the file's content hash and its retrieval chunks,
+        each with a content hash and its byte range in the file, which is
+        what the incremental classics indexer diffs against its manifest.
+        """
         try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                content = f.read()
+            source = os.path.splitext(os.path.basename(file_path))[0]
+            chunker = ClassicalChunker(source)
+            content_hash = hashlib.sha1()
+            found = {'stem': [], 'branch': [], 'ten_god': [], 'classic': []}
+            cases = []
+            chunks = []
+            head = []
+            total_characters = 0
+            size = os.path.getsize(file_path)
             
-            parsed_data = self.parse_bazi_text(content)
-            cases = self.extract_case_studies(content)
+            for line in iter_lines(file_path):
+                # Newlines count as in text mode: \r\n is one \n, none after the last line
+                text = line.text + '\n' if line.line_end and line.end < size else line.text
+                content_hash.update(text.encode('utf-8'))
+                total_characters += len(text)
+                if total_characters - len(text) <= 500:
+                    head.append(text)
+                
+                matches = self.scan(line.text)
+                for match in matches:
+                    if match.category in found:
+                        found[match.category].append(match.keyword)
+                if any(match.category == 'case_marker' for match in matches):
+                    cases.append(line.text.strip())
+                if with_chunks:
+                    chunks.extend(chunker.feed(line))
             
-            return {
+            head_text = ''.join(head)
+            parsed_data = {
+                'heavenly_stems': found['stem'],
+                'earthly_branches': found['branch'],
+                'ten_gods': found['ten_god'],
+                'classics_cited': list(dict.fromkeys(found['classic'])),
+                'raw_text': head_text[:500] + '...' if total_characters > 500 else head_text
+            }
+            
+            result = {
                 'file_path': file_path,
                 'parsed_data': parsed_data,
                 'case_studies': cases,
-                'total_characters': len(content)
+                'total_characters': total_characters
             }
+            if with_chunks:
+                chunks.extend(chunker.finish())
+                for chunk in chunks:
+                    chunk['hash'] = hashlib.sha1(self.chunk_index_text(chunk).encode('utf-8')).hexdigest()
+                result['content_hash'] = content_hash.hexdigest()
+                result['chunks'] = chunks
+            return result
         except Exception as e:
-            return {'error': str(e), 'file_path': file_path}
\ No newline at end of file
+            return {'error': str(e), 'file_path': file_path}
+    
+    @staticmethod
+    def chunk_index_text(chunk):
+        """Text that is embedded and hashed for a chunk: book, section and body"""
+        return f"{chunk['title']} {chunk['heading']}\n{chunk['text']}"
+    
+    def chunk_text(self, text, source, max_chars=MAX_CHUNK_CHARS):
+        """
+        Split a classical text into retrieval chunks.
+        
+        Chunks follow the ## sections of the markdown files; sections longer
+        than max_chars are split at sentence ends (。). Each chunk records its
+        source file, book title, section heading and its byte range in the
+        UTF-8 encoded text.
+        """
+        return chunk_string(text, source, max_chars)
+    
+    def chunk_classical_file(self, file_path):
+        """Retrieval chunks for one classical text file, read as a stream"""
+        source = os.path.splitext(os.path.basename(file_path))[0]
+        return list(iter_classical_chunks(file_path, source))
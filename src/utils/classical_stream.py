@@ -0,0 +1,299 @@
+"""
+Qianji Classical Text Streaming
+
+Streaming ingestion for digitized classics too large to hold per worker.
+Files are read in fixed-size byte buffers and cut into lines with their byte
+offsets in the source; all cut points are ASCII newlines or whole 。/曰
+characters, which never occur inside another UTF-8 sequence, so every line
+decodes on its own. A line longer than max_line_bytes (editions without line
+breaks) is cut after its last 。, else its last 曰, else at a character
+boundary, so memory stays bounded by the buffer size.
+
+ClassicalChunker turns that line stream into retrieval chunks (## sections,
+split at 。 up to MAX_CHUNK_CHARS) that carry byte_start/byte_end, and
+ClassicalTextStore reads a passage back from the source file with pread, so
+it comes from the page cache, shared by all gunicorn workers, instead of
+being kept in a dict:
+
+    store = get_classical_text_store()
+    store.passage(chunk['source'], chunk['byte_start'], chunk['byte_end'])
+"""
+import io
+import os
+import threading
+from collections.abc import Mapping
+from pathlib import Path
+from typing import BinaryIO, Iterator, List, NamedTuple, Optional, Union
+
+PROJECT_ROOT = Path(__file__).parent.parent.parent
+DEFAULT_CLASSICS_DIR = PROJECT_ROOT / "raw_books" / "bazi_classics"
+
+# Retrieval chunks stay under this many characters; longer sections are split at 。
+MAX_CHUNK_CHARS = 300
+BUFFER_SIZE = 1 << 20
+MAX_LINE_BYTES = 1 << 16
+
+SENTENCE_END = '。'
+SPEECH_MARK = '曰'
+_SENTENCE_END_BYTES = SENTENCE_END.encode('utf-8')
+_SPEECH_MARK_BYTES = SPEECH_MARK.encode('utf-8')
+
+
+class Line(NamedTuple):
+    start: int
+    end: int
+    text: str
+    # False when an over-long line was cut and the next Line continues it
+    line_end: bool
+
+
+def _cut_point(data: bytes, limit: int) -> int:
+    """Where to cut an over-long line: after 。, else after 曰, else at a character boundary"""
+    for mark in (_SENTENCE_END_BYTES, _SPEECH_MARK_BYTES):
+        found = data.rfind(mark, 0, limit)
+        if found >= 0:
+            return found + len(mark)
+    cut = limit
+    while cut > 0 and (data[cut] & 0xC0) == 0x80:
+        cut -= 1
+    return cut or limit
+
+
+def iter_lines(source: Union[str, Path, BinaryIO], buffer_size: int = BUFFER_SIZE,
+               max_line_bytes: int = MAX_LINE_BYTES) -> Iterator[Line]:
+    """
+    Lines of a UTF-8 file with their byte offsets, read buffer by buffer.
+
+    The newline (and a preceding \\r) is not part of the line. Invalid UTF-8
+    raises UnicodeDecodeError, as reading the file as text would.
+    """
+    if isinstance(source, (str, Path)):
+        with open(source, 'rb') as f:
+            yield from iter_lines(f, buffer_size, max_line_bytes)
+        return
+
+    pending = b''
+    base = 0
+    while True:
+        data = source.read(buffer_size)
+        pending += data
+        pos = 0
+        while True:
+            newline = pending.find(b'\n', pos)
+            if newline < 0:
+                break
+            end = newline - 1 if newline > pos and pending[newline - 1] == 0x0D else newline
+            yield Line(base + pos, base + end, pending[pos:end].decode('utf-8'), True)
+            pos = newline + 1
+        while len(pending) - pos > max_line_bytes:
+            cut = pos + _cut_point(pending[pos:pos + max_line_bytes + 1], max_line_bytes)
+            yield Line(base + pos, base + cut, pending[pos:cut].decode('utf-8'), False)
+            pos = cut
+        base += pos
+        pending = pending[pos:]
+        if not data:
+            break
+    if pending:
+        yield Line(base, base + len(pending), pending.decode('utf-8'), True)
+
+
+def normalize_passage(text: str) -> str:
+    """Chunk text as indexed: stripped, non-blank lines joined by newlines"""
+    return '\n'.join(line.strip() for line in text.split('\n') if line.strip())
+
+
+class ClassicalChunker:
+    """
+    Incremental chunker over a line stream.
+
+    Sections follow the # title and ## heading lines; a section longer than
+    max_chars is split at sentence ends (。). Each chunk records its source
+    file, book title, section heading and the byte range it covers, whose
+    normalize_passage() is the chunk text.
+    """
+
+    def __init__(self, source: str, max_chars: int = MAX_CHUNK_CHARS):
+        self.source = source
+        self.title = source
+        self.heading = ''
+        self.max_chars = max_chars
+        self.count = 0
+        self._ready: List[dict] = []
+        self._at_line_start = True
+        self._section_empty = True
+        # (text, byte_start, byte_end) of the open sentence and the open chunk
+        self._sentence = ['', None, None]
+        self._piece = ['', None, None]
+
+    def feed(self, line: Line) -> List[dict]:
+        """Consume one line; returns the chunks it completed"""
+        text = line.text
+        if self._at_line_start:
+            stripped = text.strip()
+            if line.line_end and stripped.startswith('## '):
+                self._flush()
+                self.heading = stripped[3:].strip()
+                return self._take()
+            if line.line_end and stripped.startswith('# '):
+                self._flush()
+                self.title = stripped[2:].strip()
+                self.heading = ''
+                return self._take()
+
+        start = line.start
+        if self._at_line_start:
+            lead = len(text) - len(text.lstrip())
+            start += len(text[:lead].encode('utf-8'))
+            text = text[lead:]
+        if line.line_end:
+            text = text.rstrip()
+        if text:
+            if self._at_line_start and not self._section_empty:
+                self._sentence[0] += '\n'
+            self._section_empty = False
+            for fragment in text.replace(SENTENCE_END, SENTENCE_END + '\x00').split('\x00'):
+                size = len(fragment.encode('utf-8'))
+                if fragment:
+                    if self._sentence[1] is None:
+                        self._sentence[1] = start
+                    self._sentence[0] += fragment
+                    self._sentence[2] = start + size
+                start += size
+                if fragment.endswith(SENTENCE_END):
+                    self._end_sentence()
+        self._at_line_start = line.line_end
+        return self._take()
+
+    def _end_sentence(self):
+        sentence, start, end = self._sentence
+        if self._piece[0] and len(self._piece[0]) + len(sentence) > self.max_chars:
+            self._emit()
+        piece = self._piece
+        if start is not None:
+            if piece[1] is None:
+                piece[1] = start
+            piece[2] = end
+        piece[0] += sentence
+        self._sentence = ['', None, None]
+
+    def _emit(self):
+        text, start, end = self._piece
+        if text.strip():
+            self._ready.append({
+                'source': self.source,
+                'title': self.title,
+                'heading': self.heading,
+                'text': text.strip(),
+                'position': self.count,
+                'byte_start': start,
+                'byte_end': end
+            })
+            self.count += 1
+        self._piece = ['', None, None]
+
+    def _flush(self):
+        self._end_sentence()
+        self._emit()
+        self._section_empty = True
+
+    def finish(self) -> List[dict]:
+        """Close the last section; returns its chunks"""
+        self._flush()
+        return self._take()
+
+    def _take(self) -> List[dict]:
+        ready, self._ready = self._ready, []
+        return ready
+
+
+def iter_classical_chunks(source_file: Union[str, Path, BinaryIO], source: str,
+                          max_chars: int = MAX_CHUNK_CHARS,
+                          buffer_size: int = BUFFER_SIZE) -> Iterator[dict]:
+    """Retrieval chunks of a classical text file, produced as the file is read"""
+    chunker = ClassicalChunker(source, max_chars)
+    for line in iter_lines(source_file, buffer_size):
+        yield from chunker.feed(line)
+    yield from chunker.finish()
+
+
+def chunk_string(text: str, source: str, max_chars: int = MAX_CHUNK_CHARS) -> List[dict]:
+    """Chunks of an in-memory text; byte offsets refer to its UTF-8 encoding"""
+    return list(iter_classical_chunks(io.BytesIO(text.encode('utf-8')), source, max_chars))
+
+
+class ClassicalTextStore(Mapping):
+    """
+    Read-only view of the *.md classics in a directory.
+
+    Byte ranges are read with pread, through the OS page cache that all
+    workers share, and every read opens the file afresh: a book edited,
+    replaced or truncated while the index updates is read as it is now, and
+    there is no mapping left to fault on. The directory is rescanned when an
+    unknown book is asked for. It is a Mapping of file stem to text for code
+    that wants a whole book; passage() decodes just a byte range.
+    """
+
+    def __init__(self, classics_dir: Union[str, Path] = DEFAULT_CLASSICS_DIR):
+        self.classics_dir = Path(classics_dir)
+        self._scan()
+
+    def _scan(self):
+        # Replaced in one assignment, so readers never see a half-built dict
+        self._paths = {path.stem: path for path in sorted(self.classics_dir.glob('*.md'))}
+
+    def _path(self, source: str) -> Path:
+        path = self._paths.get(source)
+        if path is None or not path.exists():
+            self._scan()
+            path = self._paths.get(source)
+            if path is None:
+                raise KeyError(source)
+        return path
+
+    def raw(self, source: str, start: int = 0, end: Optional[int] = None) -> bytes:
+        with open(self._path(source), 'rb') as f:
+            if end is None:
+                end = os.fstat(f.fileno()).st_size
+            return os.pread(f.fileno(), end - start, start) if end > start else b''
+
+    def passage(self, source: str, start: int, end: int) -> str:
+        """Chunk text for a byte range recorded by the chunker"""
+        return normalize_passage(self.raw(source, start, end).decode('utf-8'))
+
+    def size(self, source: str) -> int:
+        return self._path(source).stat().st_size
+
+    def lines(self, source: str) -> Iterator[Line]:
+        """Stream a book's lines from the file"""
+        return iter_lines(self._path(source))
+
+    def __getitem__(self, source: str) -> str:
+        return self.raw(source).decode('utf-8').replace('\r\n', '\n')
+
+    def __iter__(self):
+        self._scan()
+        return iter(self._paths)
+
+    def __len__(self):
+        self._scan()
+        return len(self._paths)
+
+    def __contains__(self, source):
+        try:
+            self._path(source)
+        except KeyError:
+            return False
+        return True
+
+
+_classical_text_store = None
+_classical_text_store_lock = threading.Lock()
+
+
+def get_classical_text_store() -> ClassicalTextStore:
+    """Process-wide store over raw_books/bazi_classics"""
+    global _classical_text_store
+    with _classical_text_store_lock:
+        if _classical_text_store is None:
+            _classical_text_store = ClassicalTextStore()
+    return _classical_text_store
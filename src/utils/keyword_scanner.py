@@ -0,0 +1,171 @@
+"""
+Qianji Keyword Scanner
+
+One Aho-Corasick automaton over every keyword list the parsers and routers
+use: stems, branches, elements, ten gods, classic titles, 命例 markers and
+the intent keywords of the date/search/skill routers. It is compiled once at
+import; a scan walks the text once, whatever the number of keywords, and
+reports typed matches (start, end, keyword, category). Keywords are matched
+on the lower-cased text so English skill keywords are case-insensitive.
+
+Routers ask message_categories(message), which is memoized per message, so
+several checks against the same message share a single pass:
+
+    has_keyword(message, "date")
+    message_categories(message) & {"weather", "news"}
+"""
+from functools import lru_cache
+from typing import Dict, FrozenSet, Iterable, List, NamedTuple, Tuple
+
+HEAVENLY_STEMS = ['甲', '乙', '丙', '丁', '戊', '己', '庚', '辛', '壬', '癸']
+EARTHLY_BRANCHES = ['子', '丑', '寅', '卯', '辰', '巳', '午', '未', '申', '酉', '戌', '亥']
+FIVE_ELEMENTS = ['木', '火', '土', '金', '水']
+TEN_GODS = ['比肩', '劫财', '食神', '伤官', '偏财', '正财', '七杀', '正官', '偏印', '正印']
+CLASSIC_TITLES = ["渊海子平", "三命通会", "滴天髓", "子平真诠", "穷通宝鉴", "神峰通考",
+                  "李虚中命书", "千里命稿", "星平会海", "兰台妙选"]
+
+KEYWORD_SETS: Dict[str, List[str]] = {
+    # Chart vocabulary
+    "stem": HEAVENLY_STEMS,
+    "branch": EARTHLY_BRANCHES,
+    "element": FIVE_ELEMENTS,
+    "ten_god": TEN_GODS,
+    "classic": CLASSIC_TITLES,
+    "case_marker": ['命造', '八字', '命主', '造化', '格局'],
+    # Date questions answered from the local calendar (SmartRouter, ForcedDateValidator)
+    "date": ['今天', '今日', '现在', '当前', '日期', '日子',
+             '农历', '阴历', '阳历', '公历', '正月', '腊月',
+             '春节', '元宵', '端午', '中秋', '重阳', '除夕',
+             '黄历', '万年历', '老黄历', '日历', '几号'],
+    # IntelligentDecisionEngine
+    "realtime": ['今天', '今日', '现在', '当前', '最新', '实时', '最近', '刚刚',
+                 '新闻', '天气', '股价', '股票', '汇率', '疫情', '事件',
+                 '农历', '阴历', '黄历', '万年历', '老黄历', '日历',
+                 '几号', '星期几', '时间', '日期', '日子'],
+    "calendar": ['几月几日', '黄历', '万年历', '老黄历', '日历', '几号', '星期几'],
+    "today": ['今天'],
+    "lunar": ['农历'],
+    "finance": ['股票', '股价', '汇率', '基金', '投资', '理财', '银行', '利率'],
+    "weather": ['天气', '气温', '温度', '下雨', '晴天', '预报', '气候'],
+    "current_events": ['新闻', '最新消息', '头条', '事件', '发生', '最近', '刚刚'],
+    # EnhancedQjiEngine
+    "enhanced_date": ['今天', '今日', '现在', '当前', '日期', '日子', '农历', '阳历',
+                      '公历', '黄历', '运势', '星期', '月份', '年份', '时间'],
+    "web_search": ['今天', '最新', '新闻', '天气', '黄历', '实时', '现在', '当前'],
+    "weather_skill": ['天气', 'weather'],
+    "news_skill": ['新闻', 'news'],
+    "bazi_skill": ['八字', '命理', 'bazi'],
+    "stock_skill": ['股票', '股价', 'stock', 'price'],
+    # Skill.can_handle
+    "bazi_intent": ["八字", "命理", "命运", "四柱", "格局", "用神", "大运", "流年"],
+    "news_intent": ["新闻", "最新消息", "头条", "今日新闻", "热点", "趋势", "breaking news", "latest news"],
+}
+
+
+class Match(NamedTuple):
+    start: int
+    end: int
+    keyword: str
+    category: str
+
+
+class KeywordScanner:
+    """
+    Aho-Corasick automaton over categorized keywords.
+
+    Transitions are stored sparsely: each state keeps only the moves that
+    lead somewhere other than a child of the root (inherited along its
+    failure chain at build time), and every other character is looked up
+    in the root's table. Each state also carries all keywords ending there
+    (its own plus its failure chain's), so scanning never follows failure
+    links.
+    """
+
+    def __init__(self, keyword_sets: Dict[str, Iterable[str]]):
+        categories: Dict[str, List[str]] = {}
+        for category, keywords in keyword_sets.items():
+            for keyword in keywords:
+                keyword = keyword.lower()
+                if keyword and category not in categories.setdefault(keyword, []):
+                    categories[keyword].append(category)
+
+        goto: List[Dict[str, int]] = [{}]
+        outputs: List[List[Tuple[str, Tuple[str, ...]]]] = [[]]
+        for keyword, keyword_categories in categories.items():
+            state = 0
+            for char in keyword:
+                if char not in goto[state]:
+                    goto.append({})
+                    outputs.append([])
+                    goto[state][char] = len(goto) - 1
+                state = goto[state][char]
+            outputs[state].append((keyword, tuple(keyword_categories)))
+
+        fail = [0] * len(goto)
+        delta: List[Dict[str, int]] = [{} for _ in goto]
+        order = list(goto[0].values())
+        for state in order:
+            for char, child in goto[state].items():
+                order.append(child)
+                if state:
+                    target = fail[state]
+                    while target and char not in goto[target]:
+                        target = fail[target]
+                    fail[child] = goto[target].get(char, 0)
+        for state in order:
+            # Parents come before children in BFS order, and fail[state] is shallower
+            delta[state] = {**delta[fail[state]], **goto[state]}
+            outputs[state] = outputs[state] + outputs[fail[state]]
+
+        self._root = goto[0]
+        self._delta = delta
+        self._outputs = outputs
+        self._categories = [frozenset(c for _, cats in out for c in cats) for out in outputs]
+        self.keyword_count = len(categories)
+
+    def _states(self, text: str):
+        """(end offset, state) for every position that completes at least one keyword"""
+        if not text:
+            return
+        lowered = text.lower()
+        if len(lowered) != len(text):
+            # Rare characters whose lower case is longer; offsets must stay valid
+            lowered = "".join(c if len(c.lower()) != 1 else c.lower() for c in text)
+        root, delta, outputs = self._root, self._delta, self._outputs
+        state = 0
+        for i, char in enumerate(lowered):
+            following = delta[state].get(char)
+            state = root.get(char, 0) if following is None else following
+            if outputs[state]:
+                yield i + 1, state
+
+    def scan(self, text: str, categories: Iterable[str] = None) -> List[Match]:
+        """All keyword occurrences in text order (overlaps included), optionally of some categories only"""
+        wanted = set(categories) if categories is not None else None
+        matches = []
+        for end, state in self._states(text):
+            for keyword, keyword_categories in self._outputs[state]:
+                for category in keyword_categories:
+                    if wanted is None or category in wanted:
+                        matches.append(Match(end - len(keyword), end, text[end - len(keyword):end], category))
+        return matches
+
+    def categories(self, text: str) -> FrozenSet[str]:
+        """Categories with at least one keyword in the text"""
+        found = set()
+        for _, state in self._states(text):
+            found |= self._categories[state]
+        return frozenset(found)
+
+
+SCANNER = KeywordScanner(KEYWORD_SETS)
+
+
+@lru_cache(maxsize=1024)
+def message_categories(message: str) -> FrozenSet[str]:
+    """Keyword categories present in a message; memoized so routers share one scan"""
+    return SCANNER.categories(message)
+
+
+def has_keyword(message: str, category: str) -> bool:
+    return category in message_categories(message)
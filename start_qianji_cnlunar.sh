@@ -8,6 +8,15 @@ echo "💡 使用 Ctrl+C 停止服务"
 # 激活虚拟环境
 source venv/bin/activate
 
+# 首次启动时生成黄历数据文件（约半分钟）
+[ -f src/data/almanac_1901_2100.bin ] || python -m src.core.almanac --build
+
+# 增量更新经典检索索引（只嵌入有变化的段落；运行中的服务通过CURRENT切换到新一代索引）
+python -m src.data.classics_index
+
+# 增量提取古籍命例（只处理有变化的经典）
+python -m src.data.classical_cases --update
+
 # 设置Flask应用和端口
 export FLASK_APP=src/interface/web_app_cnlunar.py
 export PORT=9999
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Tests for the precomputed 黄历 table
+"""
+import sys
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+# Add project root to path
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from cnlunar import Lunar
+from src.core.almanac import Almanac, build_almanac_table, format_almanac
+
+START = date(2026, 1, 1)
+END = date(2026, 12, 31)
+
+
+def _table(tmp_path):
+    return Almanac(build_almanac_table(str(tmp_path / "almanac.bin"), START, END))
+
+
+def test_matches_cnlunar(tmp_path):
+    """Every 5th day of the year agrees with cnlunar's 黄历"""
+    almanac = _table(tmp_path)
+    day = START
+    while day <= END:
+        lunar = Lunar(datetime(day.year, day.month, day.day, 12))
+        info = almanac.lookup(day)
+        officer, god, kind = lunar.get_today12DayOfficer()
+        assert (info["officer"], info["day_god"], info["day_kind"]) == \
+            (officer, god.replace("金贵", "金匮"), kind), day
+        assert sorted(info["yi"]) == sorted(lunar.goodThing), day
+        assert sorted(info["ji"]) == sorted(lunar.badThing), day
+        assert [h["luck"] for h in info["hours"]] == lunar.get_twohourLuckyList()[:12], day
+        assert [h["pillar"] for h in info["hours"]] == lunar.twohour8CharList[:12], day
+        assert ",".join(info["pengzu"]) == lunar.get_pengTaboo(), day
+        assert lunar.chineseZodiacClash.endswith(f"冲{info['clash_zodiac']}"), day
+        day += timedelta(days=5)
+
+
+def test_format_and_range(tmp_path):
+    almanac = _table(tmp_path)
+    text = format_almanac(almanac.lookup("2026-02-24"))
+    assert "平日，值神天德（黄道日）" in text and "冲猪（癸亥）煞东" in text
+    assert almanac.lookup("2026-02-24") is almanac.lookup(datetime(2026, 2, 24, 18))
+    try:
+        almanac.lookup("2027-01-01")
+    except ValueError:
+        return
+    raise AssertionError("expected ValueError")
+
+
+def test_almanac_endpoint(tmp_path, monkeypatch):
+    from src.interface import web_app_cnlunar
+
+    almanac = _table(tmp_path)
+    monkeypatch.setattr(web_app_cnlunar, "get_almanac", lambda: almanac)
+    client = web_app_cnlunar.app.test_client()
+    data = client.get('/almanac?date=2026-02-24').get_json()
+    assert data["officer"] == "平" and data["lucky_hours"][0] == "丑"
+    assert client.get('/almanac?date=2026-02-30').status_code == 400
+
+
+def test_missing_table_fails_fast(tmp_path):
+    """A missing table is reported with the build hint instead of being built in the request"""
+    try:
+        Almanac(str(tmp_path / "missing.bin"))
+    except FileNotFoundError as e:
+        assert "--build" in str(e)
+    else:
+        raise AssertionError("expected FileNotFoundError")
+    _table(tmp_path)
+    assert [p.name for p in tmp_path.iterdir()] == ["almanac.bin"]
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Tests for batch bazi computation, checkpoints and the NDJSON endpoint
+"""
+import json
+import sys
+from pathlib import Path
+
+# Add project root to path
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from src.core.bazi_batch import CHECKPOINT_SUFFIX, compute_chunk, interpret_rows, run_batch_file
+
+RECORDS = [
+    {"id": i, "birth_date": f"19{60 + i % 40}-0{1 + i % 9}-1{i % 10}", "birth_time": "09:10",
+     "gender": "男" if i % 2 else "女", "location": "北京"}
+    for i in range(25)
+]
+
+
+def test_compute_chunk():
+    """Valid rows get pillars, luck and features; bad rows get an error"""
+    rows = compute_chunk([
+        {"id": "a", "birthDate": "1990-05-15", "birthTime": "10:20", "gender": "male", "location": "北京"},
+        {"id": "b", "birth_date": "1850-01-01", "gender": "男"},
+        {"id": "c", "birth_date": "1990-05-15", "gender": "未知"},
+    ])
+    assert rows[0]["full_bazi"] == "庚午 辛巳 庚辰 辛巳"
+    assert rows[0]["solar_correction"] == -71
+    assert rows[0]["luck"]["pillars"][0] == "壬午"
+    assert rows[0]["features"]["day_master"] == "庚"
+    assert "error" in rows[1] and "error" in rows[2]
+
+
+def test_resume_from_checkpoint(tmp_path):
+    """A restarted job drops the partial tail and does not redo finished rows"""
+    source = tmp_path / "births.ndjson"
+    source.write_text("".join(json.dumps(r, ensure_ascii=False) + "\n" for r in RECORDS), encoding="utf-8")
+    output = tmp_path / "out.ndjson"
+
+    run_batch_file(str(source), str(output), workers=2, chunk_size=10)
+    complete = output.read_bytes()
+
+    # Pretend the job died after the first chunk while writing the second
+    first_chunk = b"".join(complete.splitlines(keepends=True)[:10])
+    output.write_bytes(first_chunk + b'{"id": 10, "partial')
+    Path(str(output) + CHECKPOINT_SUFFIX).write_text(json.dumps({
+        "input": str(source.resolve()), "rows_done": 10, "output_bytes": len(first_chunk)}))
+
+    result = run_batch_file(str(source), str(output), workers=2, chunk_size=10)
+    assert result["resumed_from"] == 10 and result["rows_done"] == 25
+    assert output.read_bytes() == complete
+
+
+def test_interpretation_is_bounded():
+    """LLM calls never exceed the configured concurrency"""
+    import threading
+    import time
+
+    active, peak, lock = [0], [0], threading.Lock()
+
+    def interpret(row):
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+        time.sleep(0.01)
+        with lock:
+            active[0] -= 1
+        return f"解读{row['id']}"
+
+    rows = interpret_rows(compute_chunk(RECORDS), interpret, concurrency=3)
+    assert peak[0] <= 3
+    assert rows[5]["analysis"] == "解读5"
+
+
+def test_batch_endpoint_streams_ndjson(monkeypatch):
+    """/bazi/batch streams one result line per input line and honours offset"""
+    from src.interface import web_app_cnlunar
+
+    monkeypatch.setattr(web_app_cnlunar, "get_batch_executor", lambda: None)
+    client = web_app_cnlunar.app.test_client()
+    body = "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in RECORDS[:5]) + "not json\n"
+    response = client.post('/bazi/batch?offset=2', data=body.encode("utf-8"),
+                           content_type='application/x-ndjson')
+    lines = [json.loads(line) for line in response.data.decode("utf-8").splitlines()]
+    assert response.mimetype == 'application/x-ndjson'
+    assert [line["row"] for line in lines] == [2, 3, 4, 5]
+    assert lines[0]["id"] == 2 and "full_bazi" in lines[0]
+    assert "error" in lines[-1]
+
+
+def test_api_errors_are_not_analyses():
+    """A failed LLM call marks the row with an error instead of storing the apology"""
+    from src.core.independent_qwen import APIErrorMessage
+
+    def interpret(row):
+        return APIErrorMessage("抱歉，服务暂时不可用") if row["id"] == 1 else f"解读{row['id']}"
+
+    rows = interpret_rows(compute_chunk(RECORDS[:3]), interpret)
+    assert rows[1]["error"] == "抱歉，服务暂时不可用" and "analysis" not in rows[1]
+    assert rows[2]["analysis"] == "解读2"
+
+
+def test_batch_interpretation_is_capped(monkeypatch):
+    """/bazi/batch?interpret=1 interprets at most MAX_INTERPRET_ROWS rows per request"""
+    from src.interface import web_app_cnlunar
+
+    monkeypatch.setattr(web_app_cnlunar, "get_batch_executor", lambda: None)
+    monkeypatch.setattr(web_app_cnlunar, "MAX_INTERPRET_ROWS", 3)
+    monkeypatch.setattr(web_app_cnlunar.ai_engine, "analyze_bazi", lambda *args: "解读")
+    client = web_app_cnlunar.app.test_client()
+    body = "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in RECORDS[:5])
+    response = client.post('/bazi/batch?interpret=1', data=body.encode("utf-8"),
+                           content_type='application/x-ndjson')
+    lines = [json.loads(line) for line in response.data.decode("utf-8").splitlines()]
+    assert [line.get("analysis") for line in lines] == ["解读"] * 3 + [None] * 2
+    assert all("analysis_error" in line for line in lines[3:])
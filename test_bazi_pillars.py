@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Exhaustive equivalence test: native pillar calculator vs cnlunar.Lunar
+
+Checks every hour from 1901-01-01 up to the 2100 lunar new year (the last day
+cnlunar can construct) against year8Char/month8Char/day8Char/twohour8Char,
+plus the lunar date of every day covered by cnlunar's month data. Within a
+day cnlunar only varies by 时辰 and the 23:00 day rollover, so one Lunar at
+00:00 and one at 23:00 give the expected value for all 24 hours.
+"""
+import sys
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import numpy as np
+
+# Add project root to path
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from cnlunar import Lunar
+from src.core.bazi_pillars import pillar_calculator, JIA_ZI
+
+START = datetime(1901, 1, 1)
+END = datetime(2100, 2, 9)
+
+
+def test_known_chart():
+    """Spot check against the engine's own sample datetime"""
+    bazi = pillar_calculator.get_bazi(datetime(2026, 3, 10, 0, 38))
+    lunar = Lunar(datetime(2026, 3, 10, 0, 38))
+    assert bazi["full_bazi"] == f"{lunar.year8Char} {lunar.month8Char} {lunar.day8Char} {lunar.twohour8Char}"
+
+
+def test_every_hour_matches_cnlunar():
+    """Compare every hour in the supported range"""
+    hours = np.arange(np.datetime64(START, "h"), np.datetime64(END, "h"), np.timedelta64(1, "h"))
+    pillars = pillar_calculator.compute(hours)
+    lunar_dates = pillar_calculator.compute_lunar_dates(hours[::24])
+
+    mismatches = []
+    day = START
+    day_index = 0
+    while day < END:
+        lunar = Lunar(day)
+        late = Lunar(day.replace(hour=23))
+        for hour in range(24):
+            if hour < 23:
+                expected = (lunar.year8Char, lunar.month8Char, lunar.day8Char,
+                            lunar.twohour8CharList[(hour + 1) // 2])
+            else:
+                expected = (late.year8Char, late.month8Char, late.day8Char, late.twohour8Char)
+            actual = tuple(JIA_ZI[i] for i in pillars[day_index * 24 + hour])
+            if actual != expected:
+                mismatches.append((day.replace(hour=hour), actual, expected))
+
+        lunar_date = tuple(int(x) for x in lunar_dates[day_index])
+        if lunar_date[0] and lunar_date != (lunar.lunarYear, lunar.lunarMonth, lunar.lunarDay,
+                                            int(lunar.isLunarLeapMonth)):
+            mismatches.append((day, lunar_date, "lunar date"))
+
+        day += timedelta(days=1)
+        day_index += 1
+
+    assert not mismatches, f"{len(mismatches)} mismatches, first: {mismatches[:5]}"
+
+
+def test_out_of_range_rejected():
+    """Dates outside 1901-2100 raise instead of wrapping around"""
+    try:
+        pillar_calculator.compute(np.datetime64("1900-12-31T12:00"))
+    except ValueError:
+        return
+    raise AssertionError("expected ValueError")
+
+
+if __name__ == "__main__":
+    print("🔍 测试原生八字排盘与cnlunar一致性...")
+    test_known_chart()
+    test_out_of_range_rejected()
+    test_every_hour_matches_cnlunar()
+    print("🎉 所有时辰与cnlunar完全一致！")
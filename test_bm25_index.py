@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""
+Tests for the character n-gram BM25 index
+"""
+import math
+import sys
+from collections import Counter
+from pathlib import Path
+
+import numpy as np
+
+# Add project root to path
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from src.data.bm25_index import BM25Index, term_text, text_terms
+
+
+def test_terms_stop_at_punctuation():
+    assert [term_text(t) for t in text_terms("伤官见官，杀印")] == ["伤官", "官见", "见官", "杀印", "伤官见", "官见官"]
+    assert [term_text(t) for t in text_terms("BaZi 八字")] == ["ba", "az", "zi", "八字", "baz", "azi"]
+
+
+def test_scores_match_formula():
+    """Posting-list scoring equals BM25 computed directly from term counts"""
+    rng = np.random.default_rng(2)
+    chars = [chr(c) for c in range(0x4E00, 0x4E00 + 40)]
+    texts = ["".join(rng.choice(chars + ["。"], rng.integers(5, 80))) for _ in range(200)]
+    index = BM25Index.build(texts)
+    query = texts[3][2:9]
+
+    counts = [Counter(text_terms(text).tolist()) for text in texts]
+    lengths = np.array([sum(c.values()) for c in counts])
+    expected = np.zeros(len(texts))
+    for term, q in Counter(text_terms(query).tolist()).items():
+        df = sum(term in c for c in counts)
+        idf = math.log(1 + (len(texts) - df + 0.5) / (df + 0.5))
+        for i, c in enumerate(counts):
+            tf = c.get(term, 0)
+            expected[i] += q * idf * tf * 2.2 / (tf + 1.2 * (0.25 + 0.75 * lengths[i] / lengths.mean()))
+    assert np.allclose(index.scores(query), expected, atol=1e-4)
+
+
+def test_save_load_and_alive_mask(tmp_path):
+    texts = ["伤官见官，为祸百端。", "杀印相生，功名显达。", "伤官配印，贵不可言。"]
+    BM25Index.build(texts).save(tmp_path)
+    index = BM25Index.load(tmp_path)
+    assert isinstance(index.docs, np.memmap)
+    assert [doc for doc, _ in index.search("伤官见官", 3)] == [0, 2]
+    assert [doc for doc, _ in index.search("伤官", 3, alive=np.array([False, True, True]))] == [2]
+    assert index.search("水火既济", 3) == []
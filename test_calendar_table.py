@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Test the memory-mapped calendar table against cnlunar
+"""
+import sys
+import tempfile
+import os
+from datetime import datetime, timedelta
+from pathlib import Path
+
+# Add project root to path
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from cnlunar import Lunar
+from src.core.calendar_table import CalendarTable, build_calendar_table
+
+
+def _fresh_table():
+    path = os.path.join(tempfile.mkdtemp(), "calendar.bin")
+    build_calendar_table(path)
+    return CalendarTable(path)
+
+
+def test_matches_cnlunar():
+    """Every 3rd day from 1901 lunar new year to 2100 lunar new year"""
+    table = _fresh_table()
+    day = datetime(1901, 2, 19)
+    while day < datetime(2100, 2, 9):
+        lunar = Lunar(day)
+        info = table.lookup(day)
+        assert (info["lunar_year"], info["lunar_month"], info["lunar_day"], info["is_leap"]) == \
+            (lunar.lunarYear, lunar.lunarMonth, lunar.lunarDay, lunar.isLunarLeapMonth), day
+        assert (info["ganzhi_year"], info["ganzhi_month"], info["ganzhi_day"]) == \
+            (lunar.year8Char, lunar.month8Char, lunar.day8Char), day
+        assert info["zodiac"] == lunar.chineseYearZodiac, day
+        assert (info["solar_term"] or "无") == lunar.todaySolarTerms, day
+        day += timedelta(days=3)
+
+
+def test_festivals():
+    """除夕 falls on 腊月廿九 in short years"""
+    table = _fresh_table()
+    assert table.lookup("2026-02-17")["festival"] == "春节"
+    assert table.lookup("2025-01-28")["festival"] == "除夕"
+    assert table.format_lunar("2026-02-24") == "2026年正月初八"
+
+
+def test_out_of_range():
+    table = _fresh_table()
+    try:
+        table.lookup("1900-12-31")
+    except ValueError:
+        return
+    raise AssertionError("expected ValueError")
+
+
+if __name__ == "__main__":
+    print("🔍 测试预计算日历表...")
+    test_festivals()
+    test_out_of_range()
+    test_matches_cnlunar()
+    print("🎉 日历表与cnlunar一致！")
+
+
+def test_concurrent_builds():
+    """Workers building at once each write their own tmp file and leave one valid table"""
+    import threading
+
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, "calendar.bin")
+    threads = [threading.Thread(target=build_calendar_table, args=(path,)) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert os.listdir(directory) == ["calendar.bin"]
+    assert CalendarTable(path).lookup("2026-02-24")["ganzhi_day"]
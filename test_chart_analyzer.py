@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Tests for the matrix-based chart analyzer
+"""
+import sys
+from pathlib import Path
+
+import numpy as np
+
+# Add project root to path
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from src.core.bazi_pillars import TIAN_GAN
+from src.core.chart_analyzer import (ChartAnalyzer, TEN_GOD, TEN_GODS, analyze_batch,
+                                     feature_vector, format_chart_features, pillar_indices)
+
+
+def test_ten_god_table():
+    """Spot checks against the classical ten-god relations"""
+    def god(day, other):
+        return TEN_GODS[TEN_GOD[TIAN_GAN.index(day), TIAN_GAN.index(other)]]
+
+    assert god("甲", "甲") == "比肩" and god("甲", "乙") == "劫财"
+    assert god("甲", "丙") == "食神" and god("甲", "丁") == "伤官"
+    assert god("甲", "戊") == "偏财" and god("甲", "己") == "正财"
+    assert god("甲", "庚") == "七杀" and god("甲", "辛") == "正官"
+    assert god("甲", "壬") == "偏印" and god("甲", "癸") == "正印"
+    assert god("庚", "丁") == "正官" and god("癸", "戊") == "正官"
+
+
+def test_single_chart_features():
+    """Hidden stems, season and labels for one chart"""
+    features = ChartAnalyzer().analyze("庚午 辛巳 庚辰 辛巳")
+    assert features["day_master"] == "庚" and features["day_master_element"] == "金"
+    assert features["day_master_season"] == "死"
+    assert features["stem_gods"] == ["比肩", "劫财", "日主", "劫财"]
+    assert [h["stem"] for h in features["hidden_stems"][0]] == ["丁", "己"]
+    assert features["hidden_stems"][1][0]["god"] == "七杀"
+    assert max(features["element_scores"], key=features["element_scores"].get) == "火"
+    assert "【命盘结构" in format_chart_features(features)
+
+
+def test_memoized_on_pillars():
+    """Spacing variants and index tuples hit the same cache entry"""
+    analyzer = ChartAnalyzer()
+    first = analyzer.analyze("庚午 辛巳 庚辰 辛巳")
+    assert analyzer.analyze("庚午辛巳庚辰辛巳") is first
+    assert analyzer.analyze(pillar_indices("庚午 辛巳 庚辰 辛巳")) is first
+
+
+def test_batch_matches_single():
+    """The batched kernel gives the same scores as per-chart analysis"""
+    rng = np.random.default_rng(0)
+    pillars = rng.integers(0, 60, size=(50, 4))
+    batch = analyze_batch(pillars)
+    analyzer = ChartAnalyzer()
+    for row in (0, 17, 49):
+        single = analyzer.analyze(tuple(pillars[row]))
+        assert list(single["element_scores"].values()) == [round(float(v), 2) for v in batch["element_scores"][row]]
+    vectors = feature_vector(pillars)
+    assert vectors.shape == (50, 16)
+    assert np.allclose(vectors[:, :5].sum(axis=1), 1)
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Tests for the bitmap chart index
+"""
+import json
+import sys
+from pathlib import Path
+
+import numpy as np
+
+# Add project root to path
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from src.core.bazi_pillars import DI_ZHI, JIA_ZI
+from src.core.chart_analyzer import analyze_batch
+from src.core.chart_index import (Bitmap, ChartIndex, build_chart_index, parse_query,
+                                  read_chart_sources)
+
+
+def test_bitmap_containers():
+    """Array and bitset containers give the same set algebra as plain sets"""
+    rng = np.random.default_rng(3)
+    dense = np.unique(rng.integers(0, 200_000, 150_000))
+    sparse = np.unique(rng.integers(0, 200_000, 3_000))
+    a, b = Bitmap.from_sorted(dense), Bitmap.from_sorted(sparse)
+    assert any(kind == 1 for kind, _ in a.containers.values())
+    assert len(a) == len(dense)
+    assert (a & b).to_array().tolist() == sorted(set(dense) & set(sparse))
+    assert (b & a).to_array().tolist() == sorted(set(dense) & set(sparse))
+    assert (a - b).to_array().tolist() == sorted(set(dense) - set(sparse))
+    assert (b - a).to_array().tolist() == sorted(set(sparse) - set(dense))
+    assert (a & a).to_array(10).tolist() == dense[:10].tolist()
+
+
+def test_parse_query():
+    assert parse_query("日柱=庚午 AND 月支=寅 AND 午子冲") == [
+        ("日柱=庚午", False), ("月支=寅", False), ("关系=子午冲", False)]
+    assert parse_query("地支=午子午 且 NOT 五行缺=水，日主=甲") == [
+        ("地支=午午", False), ("地支=子", False), ("五行缺=水", True), ("日干=甲", False)]
+
+
+def test_queries_match_scan(tmp_path):
+    """Conjunctive queries return exactly the charts a full scan finds"""
+    rng = np.random.default_rng(11)
+    pillars = rng.integers(0, 60, (70_000, 4))
+    build_chart_index([f"c{i}" for i in range(len(pillars))], pillars, str(tmp_path / "index"))
+    index = ChartIndex(str(tmp_path / "index"))
+    branches = pillars % 12
+    has = lambda b: (branches == DI_ZHI.index(b)).any(axis=1)
+
+    result = index.query("日柱=庚午 AND 子午冲", limit=5)
+    expected = np.flatnonzero((pillars[:, 2] == JIA_ZI.index("庚午")) & has("子") & has("午"))
+    assert result["count"] == len(expected)
+    assert [c["id"] for c in result["charts"]] == [f"c{i}" for i in expected[:5]]
+
+    strong = analyze_batch(pillars)["self_share"] >= 0.55
+    two_wu = (branches == DI_ZHI.index("午")).sum(axis=1) >= 2
+    result = index.query("强弱=偏强 AND 地支=午午 AND NOT 月支=午")
+    assert result["count"] == int((strong & two_wu & (branches[:, 1] != DI_ZHI.index("午"))).sum())
+
+    try:
+        index.query("星座=白羊")
+    except ValueError:
+        return
+    raise AssertionError("expected ValueError")
+
+
+def test_sources(tmp_path):
+    """Batch NDJSON results and JSON record directories are both readable"""
+    batch = tmp_path / "charts.ndjson"
+    batch.write_text(json.dumps({"id": 7, "full_bazi": "庚午 辛巳 庚辰 辛巳"}) + "\n"
+                     + json.dumps({"id": 8, "error": "缺少出生日期"}) + "\n", encoding="utf-8")
+    records = tmp_path / "validation"
+    records.mkdir()
+    (records / "validation_1.json").write_text(json.dumps({"input_bazi": "甲子 乙丑 丙寅 丁卯"}), encoding="utf-8")
+    assert list(read_chart_sources([batch, records])) == [
+        ("7", "庚午 辛巳 庚辰 辛巳"), ("validation_1", "甲子 乙丑 丙寅 丁卯")]
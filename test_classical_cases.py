@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Tests for classical case extraction and the case database
+"""
+import sys
+from pathlib import Path
+
+import numpy as np
+
+# Add project root to path
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from src.core.bazi_pillars import JIA_ZI, pillar_calculator
+from src.data import classical_cases
+from src.data.classical_cases import CaseDatabase, extract_cases, format_cases, is_consistent_chart
+
+BOOK = """# 滴天髓阐微
+
+## 论财
+乾造：庚午 辛巳 庚辰 辛巳
+庚金生于孟夏，火旺金衰。
+
+甲子 乙丑 丙寅 丁卯，此六十甲子之序，非命也。
+坤造
+丁亥年 庚戌月 己巳日 庚午时，土金伤官。又一造：丙寅、庚寅、甲子、丙寅，木旺。
+## 论官
+任氏曰：
+甲　丙　戊　庚
+子　寅　午　申
+此造五行流通。
+"""
+
+
+def test_engine_charts_are_consistent():
+    """Every chart the pillar calculator produces passes the 五虎遁/五鼠遁 check"""
+    rng = np.random.default_rng(0)
+    minutes = rng.integers(0, 199 * 365 * 24 * 60, 5000).astype("timedelta64[m]")
+    pillars = pillar_calculator.compute(np.datetime64("1901-03-01T00:00") + minutes)
+    assert all(is_consistent_chart(chart) for chart in pillars.tolist())
+    assert not is_consistent_chart([JIA_ZI.index(p) for p in ["甲子", "乙丑", "丙寅", "丁卯"]])
+
+
+def test_extract_notations(tmp_path):
+    path = tmp_path / "di_tian_sui.md"
+    path.write_text(BOOK, encoding="utf-8")
+    cases = list(extract_cases(path))
+    assert [(c["full_bazi"], c["label"], c["gender"], c["heading"]) for c in cases] == [
+        ("庚午 辛巳 庚辰 辛巳", "乾造", "男", "论财"),
+        ("丁亥 庚戌 己巳 庚午", "坤造", "女", "论财"),
+        ("丙寅 庚寅 甲子 丙寅", "又一造", None, "论财"),
+        ("甲子 丙寅 戊午 庚申", "任氏曰", None, "论官"),
+    ]
+    assert cases[1]["commentary"] == "土金伤官。" and cases[3]["commentary"] == "此造五行流通。"
+    assert "坤造" not in cases[0]["commentary"]
+    raw = path.read_bytes()
+    assert raw[cases[0]["byte_start"]:cases[0]["byte_end"]].decode("utf-8").startswith("庚午 辛巳 庚辰 辛巳\n庚金")
+    assert all(c["title"] == "滴天髓阐微" for c in cases)
+
+
+def test_database_nearest(tmp_path):
+    (tmp_path / "book.md").write_text(BOOK, encoding="utf-8")
+    database = CaseDatabase(tmp_path / "cases.sqlite3")
+    assert database.update(tmp_path) == {"books": 1, "cases": 4, "removed": 0}
+    assert database.update(tmp_path)["books"] == 0
+
+    nearest = database.nearest("庚午 辛巳 庚辰 辛巳", k=2)
+    assert nearest[0]["full_bazi"] == "庚午 辛巳 庚辰 辛巳"
+    assert nearest[0]["matched"] == ["年柱", "月柱", "日柱", "时柱"]
+    assert [c["full_bazi"] for c in database.nearest("庚午 辛巳 庚辰 辛巳", k=4, gender="男")].count(
+        "丁亥 庚戌 己巳 庚午") == 0
+    assert len(database.find_exact("甲子 丙寅 戊午 庚申")) == 1
+    assert [c["label"] for c in database.find_frame("庚", "巳")] == ["乾造"]
+    assert "《滴天髓阐微》·论财 乾造：庚午 辛巳 庚辰 辛巳" in format_cases(nearest)
+
+    (tmp_path / "book.md").write_text(BOOK.split("## 论官")[0], encoding="utf-8")
+    assert database.update(tmp_path) == {"books": 1, "cases": 3, "removed": 4}
+    assert len(database) == 3
+
+
+def test_failed_update_keeps_book_stale(tmp_path, monkeypatch):
+    """A failure while replacing a book's cases leaves the old cases and hash in place"""
+    (tmp_path / "book.md").write_text(BOOK, encoding="utf-8")
+    database = CaseDatabase(tmp_path / "cases.sqlite3")
+    database.update(tmp_path)
+    (tmp_path / "book.md").write_text(BOOK.split("## 论官")[0], encoding="utf-8")
+
+    def fail(rows):
+        raise RuntimeError("disk full")
+
+    monkeypatch.setattr(database, "_insert_rows", fail)
+    try:
+        database.update(tmp_path)
+    except RuntimeError:
+        pass
+    else:
+        raise AssertionError("expected RuntimeError")
+    assert len(database) == 4
+
+    monkeypatch.undo()
+    assert database.update(tmp_path) == {"books": 1, "cases": 3, "removed": 4}
+
+
+def test_case_context_never_extracts(tmp_path, monkeypatch):
+    """Requests only open a database the CLI built; without one there are no cases"""
+    path = tmp_path / "cases.sqlite3"
+    monkeypatch.setattr(classical_cases, "DEFAULT_DB_PATH", path)
+    monkeypatch.setattr(classical_cases, "_case_database", None)
+    assert classical_cases.get_case_database() is None
+    assert classical_cases.retrieve_case_context("庚午 辛巳 庚辰 辛巳") == ""
+    assert not path.exists()
+
+    (tmp_path / "book.md").write_text(BOOK, encoding="utf-8")
+    CaseDatabase(path).update(tmp_path)
+    assert "【古籍命例参考】" in classical_cases.retrieve_case_context("庚午 辛巳 庚辰 辛巳")
+
+
+def test_database_version_follows_books(tmp_path):
+    """The version used in cache keys changes exactly when a book is re-extracted"""
+    (tmp_path / "book.md").write_text(BOOK, encoding="utf-8")
+    database = CaseDatabase(tmp_path / "cases.sqlite3")
+    empty = database.version()
+    database.update(tmp_path)
+    first = database.version()
+    database.update(tmp_path)
+    assert database.version() == first != empty
+    (tmp_path / "book.md").write_text(BOOK.split("## 论官")[0], encoding="utf-8")
+    database.update(tmp_path)
+    assert database.version() not in (first, empty)
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Tests for streaming classical text ingestion
+"""
+import io
+import sys
+from pathlib import Path
+
+# Add project root to path
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from src.utils.classical_parser import ClassicalParser
+from src.utils.classical_stream import (ClassicalTextStore, iter_classical_chunks, iter_lines,
+                                        normalize_passage)
+
+BOOK = "# 滴天髓\n\n## 天干\n  五阳皆阳丙为最。五阴皆阴癸为至。\r\n\n任氏曰：甲木参天，脱胎要火。\n## 地支\n阳支动且强。"
+
+
+def test_lines_across_buffer_boundaries():
+    """Tiny buffers split multi-byte characters; lines and offsets still come out whole"""
+    raw = BOOK.encode("utf-8")
+    for buffer_size in (1, 2, 5, 4096):
+        lines = list(iter_lines(io.BytesIO(raw), buffer_size))
+        assert [line.text for line in lines] == BOOK.replace("\r\n", "\n").split("\n")
+        assert all(raw[line.start:line.end].decode("utf-8") == line.text for line in lines)
+
+
+def test_long_lines_are_cut_at_markers():
+    text = "甲" * 30 + "。" + "乙" * 30 + "曰" + "丙" * 60
+    lines = list(iter_lines(io.BytesIO(text.encode("utf-8")), 16, max_line_bytes=120))
+    assert [line.text for line in lines] == ["甲" * 30 + "。", "乙" * 30 + "曰", "丙" * 40, "丙" * 20]
+    assert [line.line_end for line in lines] == [False, False, False, True]
+
+
+def test_chunks_match_in_memory_chunking(tmp_path):
+    path = tmp_path / "di_tian_sui.md"
+    path.write_bytes(BOOK.encode("utf-8"))
+    parser = ClassicalParser()
+    chunks = list(iter_classical_chunks(str(path), "di_tian_sui", max_chars=20, buffer_size=3))
+    assert [(c["heading"], c["text"]) for c in chunks] == [
+        ("天干", "五阳皆阳丙为最。五阴皆阴癸为至。"),
+        ("天干", "任氏曰：甲木参天，脱胎要火。"),
+        ("地支", "阳支动且强。"),
+    ]
+    assert all(c["title"] == "滴天髓" for c in chunks)
+
+    store = ClassicalTextStore(tmp_path)
+    assert [store.passage("di_tian_sui", c["byte_start"], c["byte_end"]) for c in chunks] == [c["text"] for c in chunks]
+    assert [c["text"] for c in parser.chunk_classical_file(str(path))] == [
+        "五阳皆阳丙为最。五阴皆阴癸为至。\n任氏曰：甲木参天，脱胎要火。", "阳支动且强。"]
+    assert normalize_passage(store["di_tian_sui"]).startswith("# 滴天髓\n## 天干")
+
+
+def test_store_follows_edited_and_new_books(tmp_path):
+    """Books rewritten, truncated or added after the store was created are read as they are now"""
+    book = tmp_path / "di_tian_sui.md"
+    book.write_text("# 滴天髓\n## 天干\n五阳皆阳丙为最。" * 100, encoding="utf-8")
+    store = ClassicalTextStore(tmp_path)
+    assert store.size("di_tian_sui") == book.stat().st_size and len(store) == 1
+
+    with open(book, "r+b") as f:
+        f.truncate(0)
+        f.write("# 滴天髓\n阳支动且强。".encode("utf-8"))
+    assert store["di_tian_sui"] == "# 滴天髓\n阳支动且强。"
+    assert store.raw("di_tian_sui", 0, 1 << 20) == book.read_bytes()
+
+    (tmp_path / "san_ming.md").write_text("# 三命通会\n", encoding="utf-8")
+    assert "san_ming" in store and store.passage("san_ming", 0, 100) == "# 三命通会"
+    assert "missing" not in store
+
+
+def test_process_classical_file_streams(tmp_path):
+    path = tmp_path / "case.md"
+    path.write_bytes("命造：庚午 辛巳\r\n正官格\n八字清纯".encode("utf-8"))
+    result = ClassicalParser().process_classical_file(str(path), with_chunks=True)
+    assert result["total_characters"] == len("命造：庚午 辛巳\n正官格\n八字清纯")
+    assert result["case_studies"] == ["命造：庚午 辛巳", "八字清纯"]
+    assert result["parsed_data"]["heavenly_stems"] == ["庚", "辛"]
+    assert result["parsed_data"]["ten_gods"] == ["正官"]
+    assert len(result["chunks"]) == 1 and result["chunks"][0]["byte_start"] == 0
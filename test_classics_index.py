@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Tests for the local classics retrieval index
+"""
+import json
+import shutil
+import sys
+import time
+from pathlib import Path
+
+# Add project root to path
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from src.data.bm25_index import BM25Index
+from src.data.classics_index import (ClassicsIndexer, ClassicsRetriever, HashingEmbedder,
+                                     DEFAULT_CLASSICS_DIR, format_passages)
+
+
+def make_retriever(tmp_path):
+    ClassicsIndexer(tmp_path / "index", HashingEmbedder()).update(DEFAULT_CLASSICS_DIR)
+    return ClassicsRetriever(tmp_path / "index", HashingEmbedder())
+
+
+def test_search_finds_matching_book(tmp_path):
+    """A query naming a book's key idea returns that book first"""
+    retriever = make_retriever(tmp_path)
+    results = retriever.search("滴天髓 通神论", k=3)
+    assert len(results) == 3
+    assert results[0]["title"] == "滴天髓"
+    assert results[0]["score"] >= results[1]["score"] >= results[2]["score"]
+    assert "《滴天髓》" in format_passages(results)
+
+
+def test_index_is_reused(tmp_path):
+    """A second retriever loads the saved index instead of rebuilding it"""
+    first = make_retriever(tmp_path)
+    second = ClassicsRetriever(tmp_path / "index", HashingEmbedder())
+    assert second.info["generation"] == first.info["generation"] == 1
+
+
+def test_texts_are_read_on_demand(tmp_path):
+    """Workers keep chunk metadata only; hit texts are read back from the generation's blob"""
+    retriever = make_retriever(tmp_path)
+    gen_dir = tmp_path / "index" / retriever.info["path"]
+    assert (gen_dir / "texts.bin").exists()
+    assert all("text" not in chunk for chunk in json.loads((gen_dir / "chunks.json").read_text(encoding="utf-8")))
+    assert all("text" not in chunk for chunk in retriever.chunks)
+
+    _, chunks, _ = ClassicsIndexer(tmp_path / "index", HashingEmbedder()).load(retriever.info)
+    by_hash = {chunk["hash"]: chunk["text"] for chunk in chunks}
+    for passage in retriever.retrieve("滴天髓 通神论", k=5):
+        assert passage["text"] == by_hash[passage["hash"]]
+
+
+def test_retriever_never_builds(tmp_path):
+    """Without a published index the retriever finds nothing and writes nothing"""
+    retriever = ClassicsRetriever(tmp_path / "index", HashingEmbedder())
+    assert retriever.info is None
+    assert retriever.retrieve("滴天髓 通神论") == [] and retriever.search("滴天髓") == []
+    assert not (tmp_path / "index" / "CURRENT").exists()
+
+    ClassicsIndexer(tmp_path / "index", HashingEmbedder()).update(DEFAULT_CLASSICS_DIR)
+    retriever._checked_at = 0
+    assert retriever.retrieve("滴天髓 通神论", k=1)[0]["title"] == "滴天髓"
+
+
+class CountingEmbedder(HashingEmbedder):
+    def __init__(self):
+        super().__init__()
+        self.encoded = 0
+
+    def encode(self, texts):
+        self.encoded += len(texts)
+        return super().encode(texts)
+
+
+def test_incremental_update(tmp_path):
+    """Editing one section re-embeds only that chunk; compaction drops the old row"""
+    classics = tmp_path / "classics"
+    shutil.copytree(DEFAULT_CLASSICS_DIR, classics)
+    embedder = CountingEmbedder()
+    indexer = ClassicsIndexer(tmp_path / "index", embedder)
+    total = indexer.update(classics)["embedded"]
+    assert embedder.encoded == total
+
+    retriever = ClassicsRetriever(tmp_path / "index", embedder)
+    book = sorted(classics.glob("*.md"))[0]
+    book.write_text(book.read_text(encoding="utf-8") + "\n## 新增\n青龙白虎论日主。\n", encoding="utf-8")
+    stats = indexer.update(classics, compact="never")
+    assert stats["embedded"] == 1 and stats["tombstoned"] == 0
+    assert embedder.encoded == total + 1
+
+    (classics / book.name).unlink()
+    stats = indexer.update(classics, compact="never")
+    assert stats["embedded"] == 0 and stats["tombstoned"] > 0
+    assert embedder.encoded == total + 1
+
+    retriever._checked_at = 0
+    assert all(r["source"] != book.stem for r in retriever.search(book.stem, k=50))
+
+    info = indexer.compact()
+    assert info["deleted"] == 0 and info["count"] == total + 1 - stats["tombstoned"]
+
+
+def test_rebuild_after_updates(tmp_path):
+    """A rebuild is numbered past the existing generations and is not pruned"""
+    classics = tmp_path / "classics"
+    shutil.copytree(DEFAULT_CLASSICS_DIR, classics)
+    indexer = ClassicsIndexer(tmp_path / "index", HashingEmbedder())
+    book = sorted(classics.glob("*.md"))[0]
+    for i in range(3):
+        book.write_text(book.read_text(encoding="utf-8") + f"\n## 新增{i}\n青龙白虎论日主。\n", encoding="utf-8")
+        indexer.update(classics, compact="never")
+
+    stats = indexer.update(classics, rebuild=True)
+    assert stats["generation"] == 4
+    assert [path.name for _, path in indexer._generations()] == ["gen-000003", "gen-000004"]
+    retriever = ClassicsRetriever(tmp_path / "index", HashingEmbedder())
+    assert retriever.info["generation"] == 4 and retriever.search("新增2 青龙白虎", k=1)
+
+
+def test_search_latency(tmp_path):
+    """Flat search stays far below 10 ms per query"""
+    retriever = make_retriever(tmp_path)
+    start = time.perf_counter()
+    for i in range(200):
+        retriever.search(f"日主强弱 用神{i}", k=5)
+    assert (time.perf_counter() - start) / 200 < 0.01
+
+
+def test_hybrid_retrieval(tmp_path):
+    """An exact classical term the embedding ranks low still comes first in lexical and hybrid mode"""
+    classics = tmp_path / "classics"
+    shutil.copytree(DEFAULT_CLASSICS_DIR, classics)
+    book = sorted(classics.glob("*.md"))[0]
+    book.write_text(book.read_text(encoding="utf-8") + "\n## 论伤官\n伤官见官，为祸百端。\n", encoding="utf-8")
+    ClassicsIndexer(tmp_path / "index", HashingEmbedder()).update(classics)
+    retriever = ClassicsRetriever(tmp_path / "index", HashingEmbedder())
+    assert BM25Index.exists(tmp_path / "index" / retriever.info["path"])
+
+    lexical = retriever.retrieve("伤官见官", k=3, mode="lexical")
+    assert lexical[0]["heading"] == "论伤官" and lexical[0]["bm25_score"] > 0
+    hybrid = retriever.retrieve("伤官见官", k=3)
+    assert hybrid[0]["heading"] == "论伤官" and "bm25_score" in hybrid[0]
+    assert hybrid[0]["score"] >= hybrid[1]["score"] >= hybrid[2]["score"]
+    assert retriever.retrieve("伤官见官", k=3, mode="vector") == retriever.search("伤官见官", k=3)
+
+    start = time.perf_counter()
+    for i in range(200):
+        retriever.retrieve(f"杀印相生 日主强弱{i}", k=5)
+    assert (time.perf_counter() - start) / 200 < 0.005
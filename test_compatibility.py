@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Tests for the 合婚 compatibility engine
+"""
+import json
+import sys
+from pathlib import Path
+
+import numpy as np
+
+# Add project root to path
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from src.core.bazi_pillars import DI_ZHI, JIA_ZI
+from src.core.compatibility import (BRANCH_RELATION, BRANCH_RELATIONS, PILLAR_SCORE, CompatibilityEngine,
+                                    format_compatibility)
+
+HIM = "庚午 辛巳 庚辰 辛巳"
+HER = "己巳 丙子 乙酉 壬午"
+
+
+def test_relation_tables():
+    """Classical pairs land on the right bits, and the matrices are symmetric"""
+    def relations(a, b):
+        bits = int(BRANCH_RELATION[DI_ZHI.index(a), DI_ZHI.index(b)])
+        return [name for i, name in enumerate(BRANCH_RELATIONS) if bits >> i & 1]
+
+    assert relations("子", "丑") == ["六合"]
+    assert relations("子", "午") == ["六冲"]
+    assert relations("子", "未") == ["六害"]
+    assert relations("申", "辰") == ["三合"]
+    assert relations("寅", "巳") == ["六害", "相刑"]
+    assert relations("午", "午") == ["相刑"]
+    assert (BRANCH_RELATION == BRANCH_RELATION.T).all() and (PILLAR_SCORE == PILLAR_SCORE.T).all()
+    assert PILLAR_SCORE[JIA_ZI.index("甲子"), JIA_ZI.index("己丑")] == PILLAR_SCORE.max()
+
+
+def test_pair_explains_score():
+    engine = CompatibilityEngine("/nonexistent/store.npz")
+    result = engine.pair(HIM, HER)
+    assert result["day_stem_relations"] == ["五合"] and result["day_branch_relations"] == ["六合"]
+    assert "夫妻宫辰酉：六合" in format_compatibility(result)
+    clash = engine.pair(HIM, "己巳 丙子 甲戌 壬午")
+    assert clash["day_branch_relations"] == ["六冲"] and clash["score"] < result["score"]
+
+
+def test_top_k_matches_bruteforce(tmp_path):
+    """Vectorized top-k equals scoring every stored chart one by one, and survives save/load"""
+    rng = np.random.default_rng(7)
+    pillars = rng.integers(0, 60, (500, 4))
+    genders = rng.choice(["男", "女"], 500)
+    engine = CompatibilityEngine(str(tmp_path / "store.npz"))
+    assert engine.add(range(500), pillars, genders) == 500
+
+    matches = engine.top_k(HIM, k=5, gender="男")
+    expected = sorted((-engine.pair(HIM, p.tolist())["score"], i)
+                      for i, (p, g) in enumerate(zip(pillars, genders)) if g == "女")[:5]
+    assert [m["score"] for m in matches] == [-score for score, _ in expected]
+    assert all(genders[int(m["id"])] == "女" for m in matches)
+
+    engine.save()
+    assert CompatibilityEngine(str(tmp_path / "store.npz")).top_k(HIM, k=5, gender="男") == matches
+
+
+def test_import_batch_output(tmp_path):
+    rows = [{"id": "a", "input": {"gender": "女"}, "full_bazi": HER},
+            {"id": "b", "input": {"gender": "男"}, "error": "缺少出生日期"},
+            {"id": "c", "input": {"gender": "男"}, "full_bazi": HIM}]
+    path = tmp_path / "charts.ndjson"
+    path.write_text("".join(json.dumps(row, ensure_ascii=False) + "\n" for row in rows), encoding="utf-8")
+    engine = CompatibilityEngine(str(tmp_path / "store.npz"))
+    assert engine.import_batch_output(str(path)) == 2
+    assert [m["id"] for m in engine.top_k(HIM, gender="男")] == ["a"]
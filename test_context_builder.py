@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Tests for token-budgeted context assembly with rolling summaries
+"""
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+# Add project root to path
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from src.core.context_builder import ContextBuilder, estimate_tokens
+from src.core.conversation_store import MemoryConversationStore
+
+
+def make_turns(count):
+    start = datetime(2026, 3, 1, 9, 0)
+    return [{
+        "role": "user" if i % 2 == 0 else "assistant",
+        "content": f"第{i}轮：" + "命理" * 50,
+        "timestamp": (start + timedelta(minutes=i)).isoformat()
+    } for i in range(count)]
+
+
+def test_estimate_tokens():
+    assert estimate_tokens("甲子乙丑") == 4
+    assert estimate_tokens("abcdefgh") == 2
+
+
+def test_budget_keeps_pinned_pillars_and_recent_turns():
+    """Old turns are summarized, recent ones kept verbatim, pillars always pinned"""
+    store = MemoryConversationStore()
+    store.update_context("s1", {"bazi_info": "庚午 辛巳 庚辰 辛巳"})
+    builder = ContextBuilder(store=store, max_prompt_tokens=800, summary_tokens=100,
+                             summarizer=lambda previous, turns, limit: f"摘要{len(turns)}")
+
+    messages = builder.build("今年运势如何？", make_turns(20), system_prompt="你是千机AI", session_id="s1")
+
+    assert messages[0] == {"role": "system", "content": "你是千机AI"}
+    assert "庚午 辛巳 庚辰 辛巳" in messages[1]["content"]
+    assert messages[2]["content"].startswith("此前对话摘要：")
+    assert messages[-1] == {"role": "user", "content": "今年运势如何？"}
+    assert messages[-2]["content"].startswith("第19轮")
+    total = sum(builder.count_tokens(m["content"]) + 4 for m in messages)
+    assert total <= 800
+
+
+def test_summary_is_incremental():
+    """Each old turn is folded into the cached summary once, in batches"""
+    store = MemoryConversationStore()
+    folded = []
+
+    def summarizer(previous, turns, limit):
+        folded.append(len(turns))
+        return f"{previous}+{len(turns)}"
+
+    builder = ContextBuilder(store=store, max_prompt_tokens=800, summary_tokens=100,
+                             summarizer=summarizer, background=False)
+    turns = make_turns(30)
+    builder.build("问题", turns[:20], session_id="s1")
+    builder.build("问题", turns[:20], session_id="s1")
+    assert len(folded) == 1
+
+    # Too few new turns for a model call: they are summarized locally for now
+    messages = builder.build("问题", turns[:22], session_id="s1")
+    assert len(folded) == 1 and "第14轮" in messages[0]["content"]
+
+    builder.build("问题", turns, session_id="s1")
+    assert folded[1:] == [10]
+
+
+def test_summary_does_not_block_build():
+    """The model call runs in the background; build() only reads the cached summary"""
+    release = threading.Event()
+    store = MemoryConversationStore()
+
+    def summarizer(previous, turns, limit):
+        release.wait(5)
+        return "模型摘要"
+
+    builder = ContextBuilder(store=store, max_prompt_tokens=800, summary_tokens=100,
+                             summarizer=summarizer)
+    start = time.perf_counter()
+    messages = builder.build("问题", make_turns(20), session_id="s1")
+    assert time.perf_counter() - start < 1
+    assert messages[0]["content"].startswith("此前对话摘要：")
+
+    release.set()
+    for _ in range(100):
+        if store.get_context("s1").get("rolling_summary"):
+            break
+        time.sleep(0.01)
+    assert builder.build("问题", make_turns(20), session_id="s1")[0]["content"] == "此前对话摘要：模型摘要"
+
+
+def test_turns_summarized_before_store_evicts_them():
+    """Every turn reaches the summary even when the whole capped window fits the budget"""
+    store = MemoryConversationStore(max_messages=20)
+    builder = ContextBuilder(store=store, max_prompt_tokens=100000, summary_tokens=100,
+                             summarizer=lambda previous, turns, limit:
+                             previous + "".join(turn["content"][:4] for turn in turns),
+                             background=False)
+    for i in range(40):
+        history = store.get_history("s1")
+        messages = builder.build(f"第{i}问", history, session_id="s1")
+        store.append("s1", "user", f"第{i}问")
+        store.append("s1", "assistant", f"第{i}答")
+
+    summary = store.get_context("s1")["rolling_summary"]["text"]
+    oldest_kept = store.get_history("s1")[0]["content"]
+    assert all(f"第{i}问" in summary for i in range(int(oldest_kept[1:-1])))
+    # The budget is large, so the capped window is still sent verbatim
+    assert messages[1]["content"] == history[0]["content"]
+
+
+def test_without_session_uses_local_summary():
+    """Client-supplied history never triggers a model call"""
+    def summarizer(previous, turns, limit):
+        raise AssertionError("summarizer should not be called")
+
+    builder = ContextBuilder(store=MemoryConversationStore(), max_prompt_tokens=800,
+                             summary_tokens=100, summarizer=summarizer)
+    messages = builder.build("问题", make_turns(20))
+    assert messages[0]["content"].startswith("此前对话摘要：")
+    assert "第12轮" in messages[0]["content"]
+
+
+def test_volatile_context_trails_static_prefix():
+    """The date goes in the last message so the leading system prompt never changes"""
+    builder = ContextBuilder(store=MemoryConversationStore(), max_prompt_tokens=800)
+    first = builder.build("你好", system_prompt="你是千机AI", volatile="当前日期：2026年3月1日")
+    second = builder.build("你好", system_prompt="你是千机AI", volatile="当前日期：2026年3月2日")
+
+    assert first[0] == second[0]
+    assert first[-1]["content"] == "当前日期：2026年3月1日\n\n用户问题: 你好"
+    report = builder.prefix_report(first)
+    assert report["static_tokens"] == report["cacheable_tokens"] == estimate_tokens("你是千机AI") + 4
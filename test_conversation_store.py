@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Tests for the bounded in-memory and SQLite conversation stores
+"""
+import sys
+from pathlib import Path
+
+# Add project root to path
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from src.core.conversation_store import MemoryConversationStore, SQLiteConversationStore
+
+
+def test_memory_store_bounds():
+    """Sessions are LRU-evicted and each keeps only the newest messages"""
+    store = MemoryConversationStore(max_sessions=2, max_messages=3)
+    for i in range(5):
+        store.append("a", "user", f"消息{i}")
+    assert [m["content"] for m in store.get_history("a")] == ["消息2", "消息3", "消息4"]
+
+    store.append("b", "user", "乙")
+    store.get_history("a")
+    store.append("c", "user", "丙")
+    assert len(store) == 2
+    assert store.get_history("b") == []
+    assert store.get_history("a")
+
+
+def test_memory_store_idle_eviction():
+    """Idle sessions are dropped"""
+    store = MemoryConversationStore(idle_timeout=0)
+    store.append("a", "user", "你好")
+    store.update_context("a", {"bazi_info": "庚午 辛巳 庚辰 辛巳"})
+    assert store.evict_idle() == 1
+    assert store.get_context("a") == {}
+
+
+def test_sqlite_store_persists(tmp_path):
+    """Messages and context survive reopening the database"""
+    path = str(tmp_path / "conversations.sqlite3")
+    store = SQLiteConversationStore(path, max_messages=2)
+    store.append("a", "user", "你好")
+    store.append("a", "assistant", "您好")
+    store.append("a", "user", "今天运势如何")
+    store.update_context("a", {"bazi_info": "庚午 辛巳 庚辰 辛巳"})
+    store.close()
+
+    store = SQLiteConversationStore(path, max_messages=2)
+    assert [m["content"] for m in store.get_history("a")] == ["您好", "今天运势如何"]
+    assert store.get_context("a") == {"bazi_info": "庚午 辛巳 庚辰 辛巳"}
+    store.delete("a")
+    assert store.get_history("a") == []
+
+
+def test_sqlite_store_trims_rows(tmp_path):
+    """Rows beyond max_messages are deleted on append, not just hidden from reads"""
+    store = SQLiteConversationStore(str(tmp_path / "conversations.sqlite3"), max_messages=3)
+    for i in range(10):
+        store.append("a", "user", f"消息{i}")
+        store.append("b", "user", f"消息{i}")
+    assert store._conn.execute("SELECT COUNT(*) FROM messages WHERE session_id = 'a'").fetchone()[0] == 3
+    assert [m["content"] for m in store.get_history("b")] == ["消息7", "消息8", "消息9"]
+    store.close()
+
+
+def test_chat_loads_history_by_session(monkeypatch):
+    """/chat with a session_id uses the stored history instead of the request body"""
+    from src.interface import web_app_cnlunar
+
+    store = MemoryConversationStore()
+    seen = []
+    monkeypatch.setattr(web_app_cnlunar, "conversation_store", store)
+    monkeypatch.setattr(web_app_cnlunar.ai_engine, "generate_response",
+                        lambda message, history, session_id=None: seen.append(list(history)) or f"回复{len(seen)}")
+    client = web_app_cnlunar.app.test_client()
+
+    client.post('/chat', json={'message': '第一句', 'session_id': 'abc123'})
+    response = client.post('/chat', json={'message': '第二句', 'session_id': 'abc123'})
+
+    assert response.get_json() == {'response': '回复2', 'session_id': 'abc123'}
+    assert [m["content"] for m in seen[1]] == ["第一句", "回复1"]
+    assert len(store.get_history('abc123')) == 4
+
+
+def test_chat_skips_api_errors(monkeypatch):
+    """/chat shows an API failure's apology but does not store the exchange"""
+    from src.core.independent_qwen import APIErrorMessage
+    from src.interface import web_app_cnlunar
+
+    store = MemoryConversationStore()
+    monkeypatch.setattr(web_app_cnlunar, "conversation_store", store)
+    monkeypatch.setattr(web_app_cnlunar.ai_engine, "generate_response",
+                        lambda message, history, session_id=None: APIErrorMessage("抱歉，服务暂时不可用"))
+    client = web_app_cnlunar.app.test_client()
+
+    response = client.post('/chat', json={'message': '第一句', 'session_id': 'abc123'})
+    assert response.get_json()['response'] == "抱歉，服务暂时不可用"
+    assert store.get_history('abc123') == []
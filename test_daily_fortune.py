@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Tests for the precomputed daily fortune cache and its chat fast path
+"""
+import sys
+from datetime import date
+from pathlib import Path
+
+# Add project root to path
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from src.core.bazi_pillars import TIAN_GAN
+from src.core.daily_fortune import (DailyFortuneCache, build_fortune_prompt, fortune_query_offset,
+                                    lookup_daily_fortune, precompute_daily_fortunes)
+
+DAY = date(2026, 3, 1)
+BAZI_INFO = "庚午 辛巳 庚辰 辛巳（男，1990-05-15 09:10）"
+
+
+def test_query_detection():
+    """Only fortune questions about today or tomorrow take the fast path"""
+    assert fortune_query_offset("今天运势怎么样") == 0
+    assert fortune_query_offset("我今天怎么样？") == 0
+    assert fortune_query_offset("明日运程如何") == 1
+    assert fortune_query_offset("今天天气怎么样") is None
+    assert fortune_query_offset("帮我分析一下八字") is None
+
+
+def test_precompute_is_resumable(tmp_path):
+    """One prompt per day master; failures are retried by the next run"""
+    cache = DailyFortuneCache(str(tmp_path / "daily.sqlite3"))
+    prompts = []
+
+    def generate(prompt):
+        prompts.append(prompt)
+        return "抱歉，AI服务暂时不可用" if "日主为癸" in prompt else f"运势{len(prompts)}"
+
+    result = precompute_daily_fortunes(DAY, generate=generate, cache=cache, concurrency=2)
+    assert result["generated"] == 9 and result["failed"] == 1
+    assert "2026-03-01" in prompts[0] and "为日主之" in prompts[0]
+
+    result = precompute_daily_fortunes(DAY, generate=lambda prompt: "癸水运势", cache=cache)
+    assert result == {**result, "generated": 1, "skipped": 9}
+    assert sorted(cache.subjects(DAY)) == sorted(TIAN_GAN)
+
+
+def test_pillar_prompt_mentions_branch_relation():
+    """60-subject prompts carry the 冲/合 of the day branch"""
+    prompt = build_fortune_prompt(DAY, "甲子")
+    assert "日柱为甲子的人" in prompt and "日支子与当日地支" in prompt
+
+
+def test_fast_path_personalizes(tmp_path):
+    """A cached reading is served behind the reader's own header; day pillar beats day master"""
+    cache = DailyFortuneCache(str(tmp_path / "daily.sqlite3"))
+    assert lookup_daily_fortune("今天运势怎么样", BAZI_INFO, cache, today=DAY) is None
+
+    cache.put(DAY, "庚", "丙戌", "庚金日主的运势")
+    reply = lookup_daily_fortune("今天运势怎么样", BAZI_INFO, cache, today=DAY)
+    assert reply.endswith("庚金日主的运势")
+    assert "庚午 辛巳 庚辰 辛巳" in reply and "日主庚金" in reply
+
+    cache.put(DAY, "庚辰", "丙戌", "庚辰日柱的运势")
+    assert lookup_daily_fortune("今日运势", BAZI_INFO, cache, today=DAY).endswith("庚辰日柱的运势")
+    assert lookup_daily_fortune("今日运势", None, cache, today=DAY) is None
+    assert lookup_daily_fortune("明天运势", BAZI_INFO, cache, today=DAY) is None
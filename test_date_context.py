@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Tests for the local date context provider and the validators built on it
+"""
+import asyncio
+import sys
+from datetime import datetime
+from pathlib import Path
+
+# Add project root to path
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from src.core.date_context import DateContextProvider, day_clash, relative_day_offset
+
+
+def test_context_fields():
+    """Lunar date, pillars, terms and festivals come from the local calendar"""
+    provider = DateContextProvider()
+    ctx = provider.get(datetime(2026, 2, 24, 10, 30))
+    assert ctx["lunar"] == "丙午年正月初八" and ctx["weekday"] == "星期二"
+    assert ctx["full_bazi"] == "丙午 庚寅 己巳 己巳"
+    assert ctx["next_solar_term"] == {"name": "惊蛰", "date": "2026-03-05", "days": 9}
+
+    ctx = provider.get(datetime(2026, 10, 1, 8, 0))
+    assert "国庆节" in ctx["festivals"]
+    assert provider.get(datetime(2026, 2, 17))["festivals"] == ["春节"]
+
+
+def test_minute_memo():
+    """Calls within the same minute share one context"""
+    provider = DateContextProvider()
+    first = provider.get(datetime(2026, 2, 24, 10, 30, 5))
+    assert provider.get(datetime(2026, 2, 24, 10, 30, 59)) is first
+    assert provider.get(datetime(2026, 2, 24, 10, 31)) is not first
+
+
+def test_clash_and_relative_days():
+    """冲煞 follows 天克地冲 and the 三合 煞方; 大后天 is not read as 后天"""
+    assert day_clash("甲子") == {"clash_pillar": "戊午", "clash_zodiac": "马", "sha_direction": "南"}
+    assert day_clash("己巳")["clash_pillar"] == "癸亥"
+    assert relative_day_offset("大后天是几号") == 3
+    assert relative_day_offset("明天农历几号") == 1
+
+    answer = DateContextProvider().answer("明天是什么日子", datetime(2026, 10, 17, 9, 0))
+    assert answer.startswith("明天是公历2026年10月18日") and "重阳节" in answer
+
+
+def test_only_date_questions_are_intercepted():
+    """现在/当前 add date context to the prompt but are not answered with a calendar"""
+    for message in ["我现在适合换工作吗", "当前的事业运如何"]:
+        assert not DateContextProvider.is_date_query(message)
+        assert DateContextProvider.mentions_date(message)
+    assert DateContextProvider.is_date_query("今天农历几号")
+
+
+def test_validators_answer_locally(monkeypatch):
+    """The validators no longer touch the network"""
+    import requests
+    from src.core.date_validator import DateValidator
+    from src.core.forced_date_validator import ForcedDateValidator
+    from src.core.smart_date_handler import SmartDateHandler
+
+    def no_network(*args, **kwargs):
+        raise AssertionError("network call")
+
+    monkeypatch.setattr(requests, "get", no_network)
+    info = asyncio.run(DateValidator().get_accurate_date_info())
+    assert info["source"] == "local_calendar" and info["lunar"].startswith("农历")
+    assert ForcedDateValidator().get_current_lunar_date().startswith("农历")
+    assert "【本地万年历日期信息】" in SmartDateHandler().get_accurate_date_info("今天农历几号")
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+Tests for the Aho-Corasick keyword scanner
+"""
+import random
+import sys
+from pathlib import Path
+
+# Add project root to path
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from src.utils.classical_parser import ClassicalParser
+from src.utils.keyword_scanner import KEYWORD_SETS, SCANNER, Match, has_keyword, message_categories
+
+
+def test_typed_overlapping_matches():
+    matches = SCANNER.scan("今日新闻：丙午", ["news_intent", "stem", "branch"])
+    assert matches == [
+        Match(0, 4, "今日新闻", "news_intent"),
+        Match(2, 4, "新闻", "news_intent"),
+        Match(5, 6, "丙", "stem"),
+        Match(6, 7, "午", "branch"),
+    ]
+
+
+def test_case_insensitive_routing():
+    assert has_keyword("Any BREAKING News today?", "news_intent")
+    assert message_categories("Stock PRICE") >= {"stock_skill"}
+    assert not has_keyword("明天会下雨吗", "date")
+    assert has_keyword("今天农历几号", "date") and has_keyword("今天农历几号", "calendar")
+
+
+def test_matches_brute_force():
+    """Every keyword occurrence is found, and nothing else"""
+    rng = random.Random(5)
+    keywords = sorted({k.lower() for words in KEYWORD_SETS.values() for k in words})
+    alphabet = sorted(set("".join(keywords)) | set("的了吗？ X"))
+    for _ in range(300):
+        parts = [rng.choice(keywords) if rng.random() < 0.3 else rng.choice(alphabet) for _ in range(12)]
+        text = "".join(parts)
+        expected = {(i, i + len(k), k) for k in keywords for i in range(len(text)) if text.startswith(k, i)}
+        assert {(m.start, m.end, m.keyword.lower()) for m in SCANNER.scan(text)} == expected
+
+
+def test_parser_case_studies():
+    parser = ClassicalParser()
+    text = "滴天髓云：甲木参天\n  此命造庚午日主  \n无关之语\n八字格局俱佳"
+    parsed = parser.parse_bazi_text(text)
+    assert parsed["heavenly_stems"] == ["甲", "庚"] and parsed["earthly_branches"] == ["午"]
+    assert parsed["classics_cited"] == ["滴天髓"]
+    assert parser.extract_case_studies(text) == ["此命造庚午日主", "八字格局俱佳"]
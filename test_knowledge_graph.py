@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Tests for the CSR knowledge graph and its snapshot
+"""
+import sys
+from pathlib import Path
+
+# Add project root to path
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from src.data.knowledge_graph import MetaphysicsKnowledgeGraph, format_chart_relations, format_path
+
+
+def test_typed_edges_and_indexes():
+    kg = MetaphysicsKnowledgeGraph()
+    hidden = {(e["node"], e["label"]) for e in kg.neighbors("申", ["藏"])}
+    assert hidden == {("庚", "本气"), ("壬", "中气"), ("戊", "余气")}
+    assert {e["label"] for e in kg.neighbors("甲", ["十神"]) if e["node"] == "庚"} == {"七杀"}
+    assert kg.k_hop("子", 1, ["冲", "合"]) == {"丑": 1, "午": 1, "申": 1, "辰": 1}
+    assert kg.nodes_by_element("水", "earthly_branch") == ["子", "亥"]
+    assert len(kg.nodes_by_type("stem_branch_combination")) == 60
+    assert kg.query_relationships("不存在") == {}
+
+
+def test_paths_via_hidden_stems():
+    """甲 reaches 申 through the stems hidden in 申"""
+    kg = MetaphysicsKnowledgeGraph()
+    paths = [format_path(p) for p in kg.find_paths("甲", "申", ["藏", "十神"], max_hops=2)]
+    assert "甲 —十神·七杀→ 庚 ←藏·本气— 申" in paths
+    assert all(len(p) == 2 for p in kg.find_paths("甲", "申", ["藏", "十神"], max_hops=2))
+    assert kg.find_paths("甲", "申", ["生"], max_hops=3) == []
+
+
+def test_snapshot_roundtrip(tmp_path):
+    kg = MetaphysicsKnowledgeGraph()
+    path = kg.save_snapshot(str(tmp_path / "kg.bin"))
+    loaded = MetaphysicsKnowledgeGraph.load_snapshot(path)
+    assert loaded.export_graph() == kg.export_graph()
+    assert loaded.query_relationships("正官")["characteristics"] == "正直、有责任感、守规矩"
+
+    # Editing a mapped graph copies it back into an edge list
+    loaded.add_classical_text_relationships("滴天髓", ["甲", "从格"])
+    assert [e["node"] for e in loaded.neighbors("从格", direction="in")] == ["滴天髓"]
+    assert loaded.k_hop("甲", 1, ["藏"], direction="in") == kg.k_hop("甲", 1, ["藏"], direction="in")
+
+
+def test_snapshot_rebuilt_when_tables_change(tmp_path, monkeypatch):
+    """A snapshot of older table contents is replaced instead of served"""
+    import src.data.knowledge_graph as knowledge_graph
+
+    path = str(tmp_path / "kg.bin")
+    MetaphysicsKnowledgeGraph().save_snapshot(path)
+    monkeypatch.setattr(knowledge_graph, "DEFAULT_SNAPSHOT_PATH", path)
+    monkeypatch.setattr(knowledge_graph, "_knowledge_graph", None)
+    assert knowledge_graph.get_knowledge_graph().tables_digest == knowledge_graph.build_tables_digest()
+
+    monkeypatch.setitem(knowledge_graph.GOD_CHARACTERISTICS, "正官", "守正")
+    monkeypatch.setattr(knowledge_graph, "_knowledge_graph", None)
+    assert knowledge_graph.get_knowledge_graph().query_relationships("正官")["characteristics"] == "守正"
+    assert MetaphysicsKnowledgeGraph.load_snapshot(path).query_relationships("正官")["characteristics"] == "守正"
+
+
+def test_chart_relations():
+    text = format_chart_relations("甲子 丙寅 庚午 丁亥", MetaphysicsKnowledgeGraph())
+    assert "年干甲与日干庚：天干相冲" in text
+    assert "年支子与日支午：六冲" in text and "月支寅与时支亥：六合化木" in text
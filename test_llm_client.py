@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+Test the pooled LLM client against a local chat-completions stub
+"""
+import asyncio
+import json
+import socket
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from aiohttp import web
+
+# Add project root to path
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from src.core.llm_client import LLMClient, LLMError
+
+
+class StubServer:
+    """Minimal chat-completions server that records connections and concurrency"""
+
+    def __init__(self):
+        self.peers = set()
+        self.requests = 0
+        self.active = 0
+        self.max_active = 0
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            self.port = sock.getsockname()[1]
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self._run, daemon=True).start()
+        time.sleep(0.3)
+
+    async def handle(self, request):
+        self.peers.add(request.transport.get_extra_info("peername"))
+        body = await request.json()
+        self.requests += 1
+        if body["messages"][-1]["content"] == "fail":
+            return web.Response(status=429, text="rate limited")
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            await asyncio.sleep(5 if body["messages"][-1]["content"] == "slow" else 0.05)
+            if not body.get("stream"):
+                return web.json_response({"choices": [{"message": {"content": "甲子"}}]})
+            response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+            await response.prepare(request)
+            for piece in ["甲", "子"]:
+                chunk = {"choices": [{"delta": {"content": piece}}]}
+                await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            await response.write(b"data: [DONE]\n\n")
+            return response
+        finally:
+            self.active -= 1
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", self.handle)
+        runner = web.AppRunner(app)
+        self.loop.run_until_complete(runner.setup())
+        self.loop.run_until_complete(web.TCPSite(runner, "127.0.0.1", self.port).start())
+        self.loop.run_forever()
+
+
+def _client(server, max_connections=2):
+    config = {
+        "modelProviders": {"openai": [{
+            "id": "stub-model",
+            "baseUrl": f"http://127.0.0.1:{server.port}/v1",
+            "connectionPool": {"maxConnections": max_connections},
+        }]},
+        "model": {"name": "stub-model"},
+    }
+    path = Path(tempfile.mkdtemp()) / "model_config.json"
+    path.write_text(json.dumps(config))
+    return LLMClient(path)
+
+
+def test_sync_and_async_share_pool():
+    server = StubServer()
+    client = _client(server)
+    messages = [{"role": "user", "content": "hi"}]
+
+    assert client.chat(messages, api_key="k") == "甲子"
+    assert "".join(client.stream(messages, api_key="k")) == "甲子"
+
+    async def run_async():
+        parts = [part async for part in client.astream(messages, api_key="k")]
+        return await client.achat(messages, api_key="k"), "".join(parts)
+
+    assert asyncio.run(run_async()) == ("甲子", "甲子")
+    # Sequential calls reuse one keep-alive connection
+    assert len(server.peers) == 1
+    client.close()
+
+
+def test_model_concurrency_cap():
+    server = StubServer()
+    client = _client(server, max_connections=2)
+    # Distinct prompts, so the calls are not coalesced
+    threads = [threading.Thread(target=client.chat, args=([{"role": "user", "content": f"hi {i}"}],))
+               for i in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert server.max_active == 2
+    client.close()
+
+
+def test_identical_requests_coalesced():
+    server = StubServer()
+    client = _client(server, max_connections=4)
+    messages = [{"role": "user", "content": "hi"}]
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(client.chat(messages, api_key="k")))
+               for _ in range(5)]
+    threads += [threading.Thread(target=lambda: results.append("".join(client.stream(messages, api_key="k"))))
+                for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == ["甲子"] * 8
+    # One upstream call for the completions and one for the streams
+    assert server.requests == 2
+    assert client.coalesced == 6 and not client._flights
+
+    # A finished call is never reused, and other params are another request
+    assert client.chat(messages, api_key="k") == "甲子"
+    assert client.chat(messages, api_key="k", temperature=0.1) == "甲子"
+    assert server.requests == 4
+    client.close()
+
+
+def test_coalesced_stream_cancelled_when_all_callers_leave():
+    server = StubServer()
+    client = _client(server)
+    messages = [{"role": "user", "content": "slow"}]
+
+    async def run():
+        async def consume():
+            return [part async for part in client.astream(messages)]
+
+        tasks = [asyncio.create_task(consume()) for _ in range(3)]
+        await asyncio.sleep(0.5)
+        flights = list(client._flights.values())
+        tasks[0].cancel()
+        await asyncio.sleep(0.1)
+        # Other callers still wait on the shared call
+        assert not flights[0].task.done() and flights[0].waiters == 2
+        for task in tasks[1:]:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await asyncio.sleep(0.1)
+        return flights
+
+    flights = asyncio.run(run())
+    assert len(flights) == 1 and flights[0].task.cancelled()
+    assert server.requests == 1 and not client._flights
+    client.close()
+
+
+def test_error_status():
+    server = StubServer()
+    client = _client(server)
+    try:
+        client.chat([{"role": "user", "content": "fail"}])
+    except LLMError as e:
+        assert e.status == 429
+    else:
+        raise AssertionError("expected LLMError")
+    client.close()
+
+
+if __name__ == "__main__":
+    test_sync_and_async_share_pool()
+    test_model_concurrency_cap()
+    test_identical_requests_coalesced()
+    test_coalesced_stream_cancelled_when_all_callers_leave()
+    test_error_status()
+    print("🎉 LLM客户端测试通过！")
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Tests for the local 大运/流年 timeline engine
+"""
+import sys
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+# Add project root to path
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from src.core.bazi_pillars import JIA_ZI
+from src.core.luck_pillars import luck_calculator, format_timeline
+
+
+def test_jie_moments_match_known_terms():
+    """Solved 节 moments land within minutes of published times"""
+    known = [np.datetime64("2024-02-04T16:27"), np.datetime64("1990-06-06T06:46")]
+    for moment in known:
+        local_days = (moment - np.datetime64("1970-01-01T00:00")).astype(np.int64) / 1440
+        assert np.abs(luck_calculator.jie_moments - local_days).min() * 1440 < 20
+
+
+def test_direction_and_start_age():
+    """阳年男顺行 to the next 节, 阳年女逆行 to the previous one"""
+    birth = datetime(1990, 5, 15, 9, 10)  # 庚午年 辛巳月, 芒种 1990-06-06 06:46
+    male = luck_calculator.timeline(birth, True)
+    assert male["direction"] == "顺行"
+    assert male["start_age"] == (7, 4)
+    assert [p["pillar"] for p in male["luck_pillars"][:3]] == ["壬午", "癸未", "甲申"]
+
+    female = luck_calculator.timeline(birth, False)
+    assert female["direction"] == "逆行"
+    assert female["luck_pillars"][0]["pillar"] == "庚辰"
+    assert female["start_age"][0] == 3
+
+
+def test_annual_pillars():
+    """流年 by year stem-branch, 流月 from 寅月 by 五虎遁"""
+    annual = luck_calculator.annual_pillars(2024, 2026)
+    assert [JIA_ZI[p] for p in annual["year_pillars"]] == ["甲辰", "乙巳", "丙午"]
+    assert JIA_ZI[annual["months"][2][0]] == "庚寅"
+    assert JIA_ZI[annual["months"][2][11]] == "辛丑"
+
+
+def test_batch_matches_single_chart():
+    """The vectorized path agrees with per-chart timelines"""
+    births = [datetime(1985, 1, 3, 8), datetime(2001, 7, 7, 23, 30), datetime(1966, 12, 8, 12)]
+    genders = [True, False, True]
+    batch = luck_calculator.compute(births, genders)
+    years = np.arange(1960, 2060)
+    index = luck_calculator.luck_index(batch["start_date"], years)
+    assert index.shape == (3, 100)
+    for row, (birth, is_male) in enumerate(zip(births, genders)):
+        single = luck_calculator.timeline(birth, is_male, 1960, 2059)
+        assert [p["pillar"] for p in single["luck_pillars"]] == [JIA_ZI[p] for p in batch["luck"][row]]
+        assert [y["luck_pillar"] for y in single["years"]] == [
+            JIA_ZI[batch["luck"][row][i]] if i >= 0 else None for i in index[row]]
+
+
+def test_format_timeline_mentions_current_luck():
+    """The prompt table names the ruling 大运 of the current year"""
+    timeline = luck_calculator.timeline(datetime(1990, 5, 15, 9, 10), True)
+    text = format_timeline(timeline, 2026)
+    assert "2026年流年丙午，所行大运：甲申" in text
+    assert "1997年起运" in text
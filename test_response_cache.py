@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Tests for the SQLite bazi response cache and its use in the cnlunar engine
+"""
+import sys
+from datetime import datetime
+from pathlib import Path
+
+# Add project root to path
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from src.core.response_cache import BaziResponseCache
+
+YEAR = datetime.now().year
+
+
+def test_key_normalization(tmp_path):
+    """Spacing and gender spelling do not split entries"""
+    cache = BaziResponseCache(str(tmp_path / "cache.sqlite3"))
+    cache.put("丙午 庚寅 庚午 丙子", "male", YEAR, "v1", "分析")
+    assert cache.get("丙午庚寅庚午丙子", "男", YEAR, "v1") == "分析"
+    assert cache.get("丙午 庚寅 庚午 丙子", "女", YEAR, "v1") is None
+    assert cache.get("丙午 庚寅 庚午 丙子", "男", YEAR, "v2") is None
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 2
+
+
+def test_past_years_expire(tmp_path):
+    """Entries for a finished 流年 are dropped"""
+    path = str(tmp_path / "cache.sqlite3")
+    cache = BaziResponseCache(path)
+    cache.put("丙午 庚寅 庚午 丙子", "男", YEAR - 1, "v1", "去年")
+    cache.close()
+
+    cache = BaziResponseCache(path)
+    assert cache.get("丙午 庚寅 庚午 丙子", "男", YEAR - 1, "v1") is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_lru_bound(tmp_path):
+    """Least recently used entries are evicted past max_entries"""
+    cache = BaziResponseCache(str(tmp_path / "cache.sqlite3"), max_entries=2)
+    cache.put("甲子 甲子 甲子 甲子", "男", YEAR, "v1", "a")
+    cache.put("乙丑 乙丑 乙丑 乙丑", "男", YEAR, "v1", "b")
+    cache.get("甲子 甲子 甲子 甲子", "男", YEAR, "v1")
+    cache.put("丙寅 丙寅 丙寅 丙寅", "男", YEAR, "v1", "c")
+    assert cache.get("乙丑 乙丑 乙丑 乙丑", "男", YEAR, "v1") is None
+    assert cache.get("甲子 甲子 甲子 甲子", "男", YEAR, "v1") == "a"
+    assert cache.stats()["evictions"] == 1
+
+
+def test_engine_shares_analysis_within_shichen(tmp_path, monkeypatch):
+    """Two births in the same 时辰 hit the LLM once and keep their own header"""
+    import src.core.independent_qji_cnlunar as engine_module
+
+    cache = BaziResponseCache(str(tmp_path / "cache.sqlite3"))
+    calls = []
+
+    def fake_call(prompt, history=None):
+        calls.append(prompt)
+        return "命理分析"
+
+    monkeypatch.setattr(engine_module, "get_bazi_response_cache", lambda: cache)
+    monkeypatch.setattr(engine_module, "call_qwen_max_api", fake_call)
+    engine = engine_module.IndependentQjiCnlunarEngine()
+
+    # Both fall in 巳时 after true solar time correction (1990 had daylight saving time)
+    first = engine.analyze_bazi("1990-05-15", "10:20", "男", "北京")
+    second = engine.analyze_bazi("1990-05-15", "10:50", "男", "天津")
+    assert len(calls) == 1
+    assert "1990-05-15" not in calls[0]
+    assert "北京" in first and first.endswith("命理分析")
+    assert "天津" in second and second.endswith("命理分析")
+
+
+def test_stream_failing_midway_not_cached(tmp_path, monkeypatch):
+    """Partial text followed by a fallback message is shown but not cached"""
+    import src.core.independent_qji_cnlunar as engine_module
+    from src.core.independent_qwen import APIErrorMessage
+
+    cache = BaziResponseCache(str(tmp_path / "cache.sqlite3"))
+    replies = [["命理", APIErrorMessage("抱歉，AI服务暂时不可用，请稍后重试。")], ["命理", "分析"]]
+    monkeypatch.setattr(engine_module, "get_bazi_response_cache", lambda: cache)
+    monkeypatch.setattr(engine_module, "stream_qwen_max_api", lambda prompt, history=None: iter(replies.pop(0)))
+    engine = engine_module.IndependentQjiCnlunarEngine()
+
+    failed = "".join(engine.analyze_bazi_stream("1990-05-15", "10:20", "男", "北京"))
+    assert failed.endswith("抱歉，AI服务暂时不可用，请稍后重试。")
+    assert cache.stats()["entries"] == 0
+    assert "".join(engine.analyze_bazi_stream("1990-05-15", "10:20", "男", "北京")).endswith("命理分析")
+    assert cache.stats()["entries"] == 1
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Test SSE parsing of Qwen stream chunks and the /chat/stream relay
+"""
+import sys
+from pathlib import Path
+
+# Add project root to path
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from src.core.independent_qwen import iter_sse_content
+
+
+def test_iter_sse_content():
+    """Deltas are yielded in order; keep-alives, empty deltas and post-[DONE] data are ignored"""
+    lines = [
+        'data: {"choices":[{"delta":{"role":"assistant"}}]}',
+        '',
+        ': keep-alive',
+        'data: {"choices":[{"delta":{"content":"甲木"}}]}',
+        'data: {"choices":[{"delta":{"content":"参天"}}]}',
+        'data: [DONE]',
+        'data: {"choices":[{"delta":{"content":"ignored"}}]}',
+    ]
+    assert list(iter_sse_content(lines)) == ["甲木", "参天"]
+
+
+def test_chat_stream_endpoint():
+    """The Flask endpoint relays generator chunks as SSE frames and ends with a done event"""
+    from src.interface import web_app_cnlunar
+
+    web_app_cnlunar.ai_engine.generate_response_stream = lambda message, history, session_id=None: iter(["你好", "！"])
+    client = web_app_cnlunar.app.test_client()
+
+    response = client.post('/chat/stream', json={'message': '你好'})
+    body = response.get_data(as_text=True)
+
+    assert response.headers['Content-Type'].startswith('text/event-stream')
+    assert body == 'data: {"delta": "你好"}\n\ndata: {"delta": "！"}\n\nevent: done\ndata: {}\n\n'
+    assert client.post('/chat/stream', json={'message': ''}).status_code == 400
+
+
+def test_failed_stream_not_recorded(monkeypatch):
+    """A reply that fails midway is relayed but kept out of the session history"""
+    from src.interface import web_app_cnlunar
+    from src.core.independent_qwen import APIErrorMessage
+
+    recorded = []
+    monkeypatch.setattr(web_app_cnlunar, "record_exchange", lambda *args: recorded.append(args))
+    monkeypatch.setattr(web_app_cnlunar.ai_engine, "generate_response_stream",
+                        lambda message, history, session_id=None: iter(["你好", APIErrorMessage("抱歉")]))
+    client = web_app_cnlunar.app.test_client()
+
+    body = client.post('/chat/stream', json={'message': '你好'}).get_data(as_text=True)
+    assert '"delta": "抱歉"' in body and recorded == []
+
+
+if __name__ == "__main__":
+    test_iter_sse_content()
+    test_chat_stream_endpoint()
+    print("🎉 流式响应测试通过！")
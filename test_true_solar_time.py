@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+Tests for the offline gazetteer and true solar time correction
+"""
+import sys
+from datetime import datetime
+from pathlib import Path
+
+# Add project root to path
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from src.data.gazetteer import get_gazetteer
+from src.core.true_solar_time import true_solar_time
+
+
+def test_free_text_places():
+    """Province/city/district strings resolve to the most specific known place"""
+    gazetteer = get_gazetteer()
+    assert gazetteer.lookup("新疆乌鲁木齐市").name == "乌鲁木齐"
+    assert gazetteer.lookup("四川省成都市武侯区").name == "成都"
+    assert gazetteer.lookup("吉林省吉林市").name == "吉林市"
+    assert gazetteer.lookup("北京市朝阳区").name == "北京"
+    assert gazetteer.lookup("New York, USA").timezone == "America/New_York"
+    assert gazetteer.lookup("乌鲁").name == "乌鲁木齐"
+    assert gazetteer.lookup("火星") is None
+
+
+def test_prefix_completion():
+    """Prefix completion lists broader places first"""
+    names = [place.name for place in get_gazetteer().complete("吉林")]
+    assert names[0] == "吉林"
+    assert "吉林市" in names
+
+
+def test_western_birth_moves_hour_pillar():
+    """Kashgar at 12:30 Beijing time is 08:38 solar time, 辰时 instead of 午时"""
+    from src.core.independent_qji_cnlunar import IndependentQjiCnlunarEngine
+
+    result = true_solar_time(datetime(1990, 5, 15, 12, 30), "喀什")
+    assert result["datetime"] == datetime(1990, 5, 15, 8, 38)
+
+    engine = IndependentQjiCnlunarEngine()
+    wall = engine.get_accurate_bazi(datetime(1990, 5, 15, 12, 30))
+    solar = engine.get_accurate_bazi(datetime(1990, 5, 15, 12, 30), "新疆喀什")
+    assert wall["hour_pillar"][1] == "午"
+    assert solar["hour_pillar"][1] == "辰"
+
+
+def test_timezone_history():
+    """China's 1986-1991 daylight saving time is taken off before correcting"""
+    summer_1988 = true_solar_time(datetime(1988, 7, 1, 12, 0), "北京")
+    summer_2000 = true_solar_time(datetime(2000, 7, 1, 12, 0), "北京")
+    assert summer_2000["correction_minutes"] - summer_1988["correction_minutes"] == 60